@@ -2,6 +2,7 @@ from core import app, db
 import os
 import models
 import utils
+import utils_profiler
 import routes.auth
 import routes.dashboard
 import routes.apartments
@@ -34,6 +35,9 @@ import routes.badges
 import routes.analytics
 import routes.seo
 import routes.sub_payments
+import routes.jobs
+import routes.perf
+import routes.files
 
 
 @app.after_request
@@ -42,19 +46,31 @@ def _track_page_view(response):
     return track_visit(response)
 
 
+_reminders_checked_on = None   # jour déjà vérifié par ce process : plus de requête jusqu'à demain
+
+
 @app.before_request
 def _daily_subscription_reminders():
-    """Envoie les rappels d'expiration d'abonnement une fois par jour."""
+    """Envoie les rappels d'expiration d'abonnement une fois par jour (et programme
+    l'archivage des journaux d'accès)."""
+    global _reminders_checked_on
     from datetime import date
+    today = date.today()
+    if _reminders_checked_on == today:
+        return
     from models import SuperAdminSettings, Organization, Subscription
     from utils_email import send_subscription_reminder
     try:
         settings = SuperAdminSettings.get()
-        today = date.today()
         if settings.last_reminder_check == today:
+            _reminders_checked_on = today
             return  # déjà traité aujourd'hui
         settings.last_reminder_check = today
         db.session.commit()
+        _reminders_checked_on = today
+        # Même passe quotidienne : archivage des vieux mois de journaux d'accès (worker)
+        from utils_jobs import enqueue
+        enqueue('archive', {})
         # Chercher les orgs dont l'abonnement expire dans 7 ou 1 jour
         for sub in Subscription.query.filter(Subscription.end_date.isnot(None)).all():
             days = sub.days_remaining()
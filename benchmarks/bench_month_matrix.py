@@ -0,0 +1,108 @@
+"""
+Grille appartements × mois : sets de chaînes 'YYYY-MM' contre matrice NumPy
+(utils_months), à 50, 500 et 5 000 appartements.
+
+Mesure la partie Python du tableau comptable (hors requête SQL, lignes déjà
+chargées sous la forme renvoyée par chaque requête : (apt, 'YYYY-MM') avant,
+(apt, année, mois, montant) après) : construction de la structure, mois impayés
+depuis la création, grille de 12 mois et totaux par mois. Usage (depuis la racine du dépôt) :
+
+    DATABASE_URL=sqlite:////tmp/bench.db SECRET_KEY=x SUPERADMIN_PASSWORD=... \\
+        python benchmarks/bench_month_matrix.py [années d'historique]
+"""
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import ym_str                                  # noqa: E402
+from utils_months import MonthMatrix, created_ym, ym_of   # noqa: E402
+
+Apt = namedtuple('Apt', 'id created_at monthly_fee')
+
+
+def _dataset(n, years):
+    """n appartements créés sur `years` ans, ~85 % des mois payés : lignes
+    (apt, 'YYYY-MM', montant) et (apt, année, mois, montant)."""
+    rnd = random.Random(n)
+    today_ym = ym_of(date.today())
+    apts, rows, sql_rows = [], [], []
+    for apt_id in range(1, n + 1):
+        start = today_ym - rnd.randint(1, years * 12)
+        y, mo = divmod(start - 1, 12)
+        apts.append(Apt(apt_id, datetime(y, mo + 1, 1), 80.0))
+        for ym in range(start, today_ym + 3):
+            if rnd.random() < 0.85:
+                rows.append((apt_id, ym_str(ym), 80.0))
+                sql_rows.append((apt_id, (ym - 1) // 12, (ym - 1) % 12 + 1, 80.0))
+    return apts, rows, sql_rows
+
+
+def _legacy(apts, rows, grid):
+    """Ancien comportement : sets de mois par appartement, ym_str par mois d'historique."""
+    paid = {}
+    for apt_id, month, _ in rows:
+        paid.setdefault(apt_id, set()).add(month)
+    today_ym = ym_of(date.today())
+    data = []
+    for apt in apts:
+        apt_paid = paid.get(apt.id, set())
+        start_ym = ym_of(apt.created_at)
+        unpaid = sum(1 for ym in range(start_ym, today_ym + 1) if ym_str(ym) not in apt_paid)
+        months = {}
+        for year, month in grid:
+            key = f"{year}-{month:02d}"
+            months[key] = {'paid': key in apt_paid, 'amount': apt.monthly_fee if key in apt_paid else 0}
+        data.append((unpaid, months))
+    totals = {f"{y}-{m:02d}": sum(1 for _, months in data if months[f"{y}-{m:02d}"]['paid'])
+              for y, m in grid}
+    return data, totals
+
+
+def _matrix(apts, rows, grid):
+    today_ym = ym_of(date.today())
+    created = created_ym(apts)
+    first, last = grid[0][0] * 12 + grid[0][1], grid[-1][0] * 12 + grid[-1][1]
+    m = MonthMatrix.from_rows([a.id for a in apts], min(first, int(created.min())),
+                              max(today_ym, last), rows)
+    unpaid = m.unpaid_counts(created, today_ym).tolist()
+    shown = m.cols(first, last)
+    keys = m.keys[shown]
+    data = [(unpaid[i], {k: {'paid': p, 'amount': apt.monthly_fee if p else 0}
+                         for k, p in zip(keys, m.paid[i, shown].tolist())})
+            for i, apt in enumerate(apts)]
+    totals = dict(zip(keys, m.paid_counts()[shown].tolist()))
+    return data, totals
+
+
+def _time(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, result
+
+
+def main():
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    today = date.today()
+    grid = [divmod(ym - 1, 12) for ym in range(ym_of(today) - 8, ym_of(today) + 4)]
+    grid = [(y, mo + 1) for y, mo in grid]
+    print(f"Grille de 12 mois, {years} ans d'historique")
+    for n in (50, 500, 5000):
+        apts, rows, sql_rows = _dataset(n, years)
+        before, ref = _time(_legacy, apts, rows, grid)
+        after, got = _time(_matrix, apts, sql_rows, grid)
+        assert got == ref
+        print(f"  {n:>5} appartements ({len(rows):>7} mois payés) : "
+              f"sets {before:8.1f} ms   matrice {after:8.1f} ms   ×{before / after:4.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Coût du hook after_request utils_analytics.track_visit par requête.
+
+Compare l'ancienne écriture synchrone (add + commit par visite) au tampon en
+mémoire + vidage groupé. Usage (depuis la racine du dépôt) :
+
+    DATABASE_URL=sqlite:////tmp/bench.db SECRET_KEY=x SUPERADMIN_PASSWORD=... \\
+        python benchmarks/bench_track_visit.py [N]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Response  # noqa: E402
+
+import app as _app_module   # noqa: E402,F401
+from core import app, db    # noqa: E402
+from models import SiteVisit  # noqa: E402
+import utils_analytics       # noqa: E402
+
+UA = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Mobile Safari/604.1'
+
+
+def _sync_track(response):
+    """Ancien comportement : la visite est écrite dans la transaction de la requête."""
+    utils_analytics.track_visit(response)
+    utils_analytics.flush_visits()
+    return response
+
+
+def _bench(hook, n):
+    resp = Response('ok')
+    with app.test_request_context('/dashboard?utm_source=bench',
+                                  headers={'User-Agent': UA, 'Cookie': '_sv=abc'}):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            hook(resp)
+        elapsed = time.perf_counter() - t0
+    return elapsed / n * 1e6
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    app.config['ANALYTICS_BACKGROUND_FLUSH'] = False
+    with app.app_context():
+        before = _bench(_sync_track, n)
+        after = _bench(utils_analytics.track_visit, n)
+        t0 = time.perf_counter()
+        written = 0
+        while utils_analytics._buffer:
+            written += utils_analytics.flush_visits()
+        flush = (time.perf_counter() - t0) / max(written, 1) * 1e6
+        SiteVisit.query.filter(SiteVisit.utm_source == 'bench').delete()
+        db.session.commit()
+        backend = db.engine.url.get_backend_name()
+    print(f'{n} visites ({backend})')
+    print(f'  avant  (commit par requête) : {before:8.1f} µs/requête')
+    print(f'  après  (tampon en mémoire)  : {after:8.1f} µs/requête')
+    print(f'  vidage groupé (hors requête): {flush:8.1f} µs/visite')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+"""
+Migrations de schéma versionnées (remplace les blocs try/except de l'ancien init_db).
+
+Au démarrage, models.init_db() lit une seule fois schema_version : si la base est
+à jour, rien d'autre n'est exécuté. Sinon les migrations manquantes sont
+appliquées, dans l'ordre, sous un verrou (pg_advisory_lock sur PostgreSQL,
+verrou de fichier sur SQLite) : plusieurs workers gunicorn qui démarrent en même
+temps n'appliquent jamais deux fois la même migration.
+
+  flask db-migrate            applique les migrations en attente
+  flask db-migrate --status   liste les migrations appliquées / en attente
+
+AUTO_MIGRATE=0 désactive l'application au démarrage (seule la commande migre).
+
+Ajouter une migration : une fonction décorée @migration(<version suivante>, nom),
+idempotente si possible. Une nouvelle table déclarée dans models.py est créée par
+une migration qui appelle db.create_all() (la création n'a plus lieu à chaque
+démarrage). Une migration dont les données ne permettent pas l'application
+lève MigrationDeferred : elle est retentée au prochain démarrage, les suivantes
+sont appliquées sans l'attendre (une migration reportable ne doit donc rien
+apporter dont les suivantes dépendent).
+"""
+import os
+import time
+from contextlib import contextmanager
+
+import click
+from sqlalchemy.exc import DBAPIError
+
+from core import app, db
+from models import SchemaVersion
+
+try:
+    import fcntl
+except ImportError:     # Windows (développement) : pas de verrou inter-process
+    fcntl = None
+
+app.config.setdefault('AUTO_MIGRATE', os.environ.get('AUTO_MIGRATE', '1') != '0')
+
+# Clé arbitraire du verrou consultatif PostgreSQL (partagée par tous les workers)
+PG_LOCK_KEY = 7_401_202
+
+MIGRATIONS = []   # [(version, nom, fonction)] trié par version
+
+
+class MigrationDeferred(Exception):
+    """Migration impossible en l'état des données : retentée au prochain démarrage."""
+
+
+def migration(version, name):
+    def decorator(fn):
+        assert all(v != version for v, _, _ in MIGRATIONS), f"migration {version} en double"
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+# ─── Migrations ──────────────────────────────────────────────────────────────
+
+@migration(1, 'schéma initial (tables + ancien init_db)')
+def _m0001_baseline():
+    from models import legacy_schema_upgrades
+    db.create_all()
+    legacy_schema_upgrades()
+
+
+@migration(2, 'index multi-tenant (clés étrangères)')
+def _m0002_tenant_indexes():
+    # PostgreSQL ne crée PAS d'index sur les clés étrangères → balayage complet sans ça.
+    _create_indexes([
+        "CREATE INDEX IF NOT EXISTS ix_payment_org          ON payment (organization_id)",
+        "CREATE INDEX IF NOT EXISTS ix_payment_apt          ON payment (apartment_id)",
+        "CREATE INDEX IF NOT EXISTS ix_payment_org_month    ON payment (organization_id, month_paid)",
+        "CREATE INDEX IF NOT EXISTS ix_payment_org_date     ON payment (organization_id, payment_date)",
+        "CREATE INDEX IF NOT EXISTS ix_expense_org          ON expense (organization_id)",
+        "CREATE INDEX IF NOT EXISTS ix_expense_org_date     ON expense (organization_id, expense_date)",
+        "CREATE INDEX IF NOT EXISTS ix_misc_org             ON misc_receipt (organization_id)",
+        "CREATE INDEX IF NOT EXISTS ix_apartment_org        ON apartment (organization_id)",
+        "CREATE INDEX IF NOT EXISTS ix_apartment_block      ON apartment (block_id)",
+        "CREATE INDEX IF NOT EXISTS ix_block_org            ON block (organization_id)",
+        'CREATE INDEX IF NOT EXISTS ix_user_org             ON "user" (organization_id)',
+        'CREATE INDEX IF NOT EXISTS ix_user_apt             ON "user" (apartment_id)',
+        "CREATE INDEX IF NOT EXISTS ix_ticket_org           ON ticket (organization_id)",
+        "CREATE INDEX IF NOT EXISTS ix_dm_org               ON direct_message (organization_id)",
+        "CREATE INDEX IF NOT EXISTS ix_announcement_org     ON announcement (organization_id)",
+        "CREATE INDEX IF NOT EXISTS ix_unpaid_alert_org     ON unpaid_alert (organization_id)",
+    ])
+
+
+@migration(3, 'index composites tenant + date / statut')
+def _m0003_composite_indexes():
+    # Mêmes noms que les __table_args__ des modèles (bases créées par create_all)
+    _create_indexes([
+        "CREATE INDEX IF NOT EXISTS ix_misc_org_date ON misc_receipt (organization_id, payment_date)",
+        "CREATE INDEX IF NOT EXISTS ix_ticket_org_status_created ON ticket (organization_id, status, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_ticket_apt ON ticket (apartment_id)",
+        "CREATE INDEX IF NOT EXISTS ix_dm_org_apt_read ON direct_message (organization_id, apartment_id, read_at)",
+        "CREATE INDEX IF NOT EXISTS ix_dm_apt_created ON direct_message (apartment_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_unpaid_alert_apt_date ON unpaid_alert (apartment_id, alert_date)",
+        "CREATE INDEX IF NOT EXISTS ix_push_subscription_user ON push_subscription (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_access_log_org_logged ON access_log (organization_id, logged_at)",
+        "CREATE INDEX IF NOT EXISTS ix_badge_access_log_org_ts ON badge_access_log (organization_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_payment_request_org_status ON payment_request (organization_id, status)",
+    ])
+
+
+@migration(4, 'unicité payment (apartment_id, month_paid)')
+def _m0004_unique_payment_month():
+    # Les doublons éventuels sont des encaissements : signalés, jamais supprimés.
+    with db.engine.begin() as conn:
+        dups = conn.execute(db.text(
+            "SELECT apartment_id, month_paid, COUNT(*) FROM payment "
+            "GROUP BY apartment_id, month_paid HAVING COUNT(*) > 1"
+        )).fetchall()
+        if dups:
+            raise MigrationDeferred(
+                f"{len(dups)} doublon(s) (apartment_id, month_paid) à corriger, "
+                f"ex. {[tuple(d[:2]) for d in dups[:5]]}")
+        conn.execute(db.text("CREATE UNIQUE INDEX IF NOT EXISTS uq_payment_apt_month "
+                             "ON payment (apartment_id, month_paid)"))
+
+
+@migration(5, 'compte super admin')
+def _m0005_superadmin():
+    from models import ensure_superadmin
+    ensure_superadmin()
+
+
+@migration(6, 'colonnes miniatures (*_thumb_url)')
+def _m0006_thumbnails():
+    _add_columns([
+        ('ticket', 'photo_thumb_url', 'TEXT'),
+        ('payment', 'cheque_thumb_url', 'VARCHAR(500)'),
+        ('payment_request', 'photo_thumb_url', 'TEXT'),
+        ('expense', 'facture_thumb_url', 'TEXT'),
+        ('appel_fonds', 'devis_thumb_url', 'TEXT'),
+        ('appel_fonds_depense', 'facture_thumb_url', 'TEXT'),
+    ])
+
+
+@migration(7, 'rapports en arrière-plan (report_artifact, organization.data_version)')
+def _m0007_report_artifacts():
+    _add_columns([('organization', 'data_version', 'INTEGER NOT NULL DEFAULT 0')])
+    db.create_all()
+
+
+@migration(8, "clôtures d'exercice (fiscal_year_closing)")
+def _m0008_fiscal_year_closing():
+    db.create_all()
+
+
+@migration(9, 'clés API badges hachées (organization.badges_api_key_hash)')
+def _m0009_hashed_badges_api_keys():
+    from utils_badges import hash_api_key
+    _add_columns([('organization', 'badges_api_key_hash', 'VARCHAR(64)'),
+                  ('organization', 'badges_api_key_hint', 'VARCHAR(8)')])
+    with db.engine.begin() as conn:
+        conn.execute(db.text("CREATE UNIQUE INDEX IF NOT EXISTS ix_organization_badges_api_key_hash "
+                             "ON organization (badges_api_key_hash)"))
+        rows = conn.execute(db.text("SELECT id, badges_api_key FROM organization "
+                                    "WHERE badges_api_key IS NOT NULL AND badges_api_key <> ''")).all()
+        for org_id, key in rows:
+            conn.execute(db.text("UPDATE organization SET badges_api_key_hash = :h, badges_api_key_hint = :t, "
+                                 "badges_api_key = NULL WHERE id = :id"),
+                         {'h': hash_api_key(key), 't': key[-4:], 'id': org_id})
+
+
+@migration(10, 'ingestion par lots (séquences lecteurs / capteurs, liste d\'accès incrémentale)')
+def _m0010_batch_ingest():
+    _add_columns([
+        ('badge_access_log', 'reader_id', 'VARCHAR(64)'),
+        ('badge_access_log', 'client_seq', 'BIGINT'),
+        ('badge', 'updated_at', 'TIMESTAMP'),
+        ('organization', 'badges_deleted_at', 'TIMESTAMP'),
+        ('lift', 'iot_last_seq', 'BIGINT'),
+    ])
+    with db.engine.begin() as conn:
+        conn.execute(db.text("CREATE UNIQUE INDEX IF NOT EXISTS uq_badge_access_log_reader_seq "
+                             "ON badge_access_log (organization_id, reader_id, client_seq)"))
+        conn.execute(db.text("UPDATE badge SET updated_at = COALESCE(blocked_at, issued_at, CURRENT_TIMESTAMP) "
+                             "WHERE updated_at IS NULL"))
+
+
+@migration(11, 'télémétrie ascenseurs (lift_telemetry, lift_telemetry_rollup)')
+def _m0011_lift_telemetry():
+    _add_columns([
+        ('lift', 'telemetry_last_at', 'TIMESTAMP'),
+        ('lift', 'telemetry_last_status', 'VARCHAR(20)'),
+    ])
+    db.create_all()
+
+
+@migration(12, "archives mensuelles et index de recherche des journaux d'accès")
+def _m0012_access_log_archives():
+    db.create_all()
+    postgres = db.engine.dialect.name == 'postgresql'
+    with db.engine.begin() as conn:
+        conn.execute(db.text(
+            "CREATE INDEX IF NOT EXISTS ix_badge_access_log_org_number ON badge_access_log "
+            f"(organization_id, badge_number{' text_pattern_ops' if postgres else ''}, timestamp)"))
+    if not postgres:
+        return
+    # Recherche « contient » (ILIKE '%x%') : index trigrammes, si l'extension est disponible
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for name, table, col in (('ix_badge_access_log_point_trgm', 'badge_access_log', 'access_point'),
+                                     ('ix_access_log_visitor_trgm', 'access_log', 'visitor_name')):
+                conn.execute(db.text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} "
+                                     f"USING gin ({col} gin_trgm_ops)"))
+    except Exception as e:
+        print(f"[Migrations] Index trigrammes non créés (pg_trgm indisponible) : {e}")
+
+
+@migration(13, "version de l'index des badges (organization.badges_version)")
+def _m0013_badges_version():
+    _add_columns([('organization', 'badges_version', 'INTEGER NOT NULL DEFAULT 0')])
+
+
+@migration(14, "recherche du journal des badges sans casse (lower(badge_number))")
+def _m0014_badge_number_ci():
+    # Remplace ix_badge_access_log_org_number : même recherche par préfixe que les
+    # archives (comparaison en minuscules)
+    ops = ' text_pattern_ops' if db.engine.dialect.name == 'postgresql' else ''
+    _create_indexes([
+        "CREATE INDEX IF NOT EXISTS ix_badge_access_log_org_number_ci ON badge_access_log "
+        f"(organization_id, lower(badge_number){ops}, timestamp)",
+        "DROP INDEX IF EXISTS ix_badge_access_log_org_number",
+    ])
+
+
+@migration(15, 'registre des impayés rempli pour tous les appartements')
+def _m0015_backfill_arrears():
+    # Sans ligne, chaque page en lecture seule reconstruisait le registre sans l'enregistrer
+    from utils_arrears import backfill_arrears
+    print(f"[Migrations] registre impayés : {backfill_arrears()} ligne(s) reconstruite(s)")
+
+
+def _add_columns(columns):
+    """ALTER TABLE … ADD COLUMN pour les colonnes absentes (bases antérieures au modèle)."""
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table, col, col_type in columns:
+            if col not in {c['name'] for c in inspector.get_columns(table)}:
+                conn.execute(db.text(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}"))
+
+
+def _create_indexes(statements):
+    with db.engine.begin() as conn:
+        for stmt in statements:
+            conn.execute(db.text(stmt))
+
+
+# ─── Moteur ──────────────────────────────────────────────────────────────────
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def applied_versions():
+    """{version: (nom, appliquée le)} — {} si schema_version n'existe pas encore."""
+    try:
+        with db.engine.connect() as conn:
+            rows = conn.execute(db.select(SchemaVersion.version, SchemaVersion.name,
+                                          SchemaVersion.applied_at)).fetchall()
+    except DBAPIError:
+        return {}
+    return {v: (name, at) for v, name, at in rows}
+
+
+def current_version():
+    """Version du schéma — 1 requête. 0 pour une base antérieure au versionnage."""
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(db.text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except DBAPIError:     # table absente
+        return 0
+
+
+def applied_count():
+    """Nombre de migrations appliquées — 1 requête (une migration reportée laisse un trou
+    sous MAX(version))."""
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(db.text("SELECT COUNT(*) FROM schema_version")).scalar() or 0
+    except DBAPIError:
+        return 0
+
+
+@contextmanager
+def migration_lock():
+    """Verrou exclusif entre process pendant l'application des migrations."""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as conn:
+            conn.execute(db.text("SELECT pg_advisory_lock(:k)"), {'k': PG_LOCK_KEY})
+            conn.commit()
+            try:
+                yield
+            finally:
+                conn.execute(db.text("SELECT pg_advisory_unlock(:k)"), {'k': PG_LOCK_KEY})
+                conn.commit()
+        return
+    path = db.engine.url.database
+    if fcntl is None or not path or path == ':memory:':
+        yield
+        return
+    with open(path + '.migrate.lock', 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def migrate():
+    """Applique les migrations en attente. Retourne les versions appliquées."""
+    applied = []
+    with migration_lock():
+        # Relu sous verrou : un autre worker a pu migrer pendant l'attente
+        SchemaVersion.__table__.create(db.engine, checkfirst=True)
+        done = set(applied_versions())
+        for version, name, fn in MIGRATIONS:
+            if version in done:
+                continue
+            t0 = time.perf_counter()
+            try:
+                fn()
+            except MigrationDeferred as e:
+                db.session.rollback()
+                print(f"[Migrations] {version:04d} {name} reportée : {e}")
+                continue
+            except Exception:
+                db.session.rollback()
+                print(f"[Migrations] {version:04d} {name} ÉCHEC")
+                raise
+            ms = int((time.perf_counter() - t0) * 1000)
+            db.session.add(SchemaVersion(version=version, name=name, duration_ms=ms))
+            db.session.commit()
+            applied.append(version)
+            print(f"[Migrations] {version:04d} {name} appliquée ({ms} ms)")
+    return applied
+
+
+def ensure_schema():
+    """Appelé au démarrage : 1 requête si le schéma est à jour."""
+    count = applied_count()
+    if count >= len(MIGRATIONS):
+        return
+    if not app.config['AUTO_MIGRATE']:
+        print(f"[Migrations] {len(MIGRATIONS) - count} migration(s) en attente "
+              f"(code en version {latest_version()}) — lancer `flask db-migrate`.")
+        return
+    migrate()
+
+
+@app.cli.command('db-migrate')
+@click.option('--status', is_flag=True, help="Affiche l'état sans rien appliquer.")
+def db_migrate_command(status):
+    """Applique les migrations de schéma en attente."""
+    if not status:
+        applied = migrate()
+        click.echo(f"{len(applied)} migration(s) appliquée(s).")
+    done = applied_versions()
+    for version, name, _ in MIGRATIONS:
+        state = f"appliquée le {done[version][1]:%Y-%m-%d %H:%M}" if version in done else 'EN ATTENTE'
+        click.echo(f"  {version:04d}  {name:<45} {state}")
@@ -4,6 +4,17 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import os
 
 
+# ─── Colonnes volumineuses ───────────────────────────────────────────────────
+# Convention : une colonne base64 (*_data) ou un texte long inutile aux listes
+# est déclarée avec big_column() — chargement différé. Les listes testent la
+# présence d'une pièce jointe avec *_url / *_mime, jamais *_data (sinon une
+# requête par ligne). Les routes de détail / téléchargement qui lisent le
+# contenu le chargent dans le même SELECT : .options(db.undefer(Model.col)).
+
+def big_column(*args, **kwargs):
+    return db.deferred(db.Column(db.Text, *args, **kwargs))
+
+
 class Organization(db.Model):
     """Organisation = 1 Syndic client"""
     id = db.Column(db.Integer, primary_key=True)
@@ -29,9 +40,18 @@ class Organization(db.Model):
     # Notes internes superadmin
     superadmin_notes = db.Column(db.Text, nullable=True)
     # Clé API lecteurs de badges (IoT)
-    badges_api_key = db.Column(db.String(64), nullable=True)
+    badges_api_key = db.Column(db.String(64), nullable=True)   # ancien stockage en clair (vidé, migration 9)
+    # Empreinte SHA-256 de la clé API des lecteurs de badges + 4 derniers caractères (affichage)
+    badges_api_key_hash = db.Column(db.String(64), nullable=True, unique=True, index=True)
+    badges_api_key_hint = db.Column(db.String(8), nullable=True)
+    # Dernière suppression de badge : les lecteurs synchronisés avant reçoivent la liste complète
+    badges_deleted_at = db.Column(db.DateTime, nullable=True)
+    # Incrémenté à chaque changement de badge / résident : validité de l'index des lecteurs
+    badges_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     # Code d'invitation résident (auto-inscription)
     invite_code = db.Column(db.String(8), nullable=True, unique=True)
+    # Incrémenté à chaque écriture sur les données des rapports (cf. utils_reports)
+    data_version = db.Column(db.Integer, default=0, nullable=False, server_default='0')
 
     subscription = db.relationship('Subscription', backref='organization', uselist=False, lazy=True)
     users = db.relationship('User', backref='organization', lazy=True)
@@ -136,6 +156,27 @@ class Payment(db.Model):
     cheque_number = db.Column(db.String(50), nullable=True)
     cheque_bank = db.Column(db.String(100), nullable=True)
     cheque_url = db.Column(db.String(500), nullable=True)
+    cheque_thumb_url = db.Column(db.String(500), nullable=True)   # miniature (utils_media)
+    __table_args__ = (
+        # Anti-doublon au niveau base : un seul paiement par appartement et par mois
+        db.Index('uq_payment_apt_month', 'apartment_id', 'month_paid', unique=True),
+        db.Index('ix_payment_org_month', 'organization_id', 'month_paid'),
+        db.Index('ix_payment_org_date', 'organization_id', 'payment_date'),
+    )
+
+
+class ApartmentArrears(db.Model):
+    """Registre des impayés d'un appartement, tenu à jour à chaque encaissement.
+    Les mois sont des entiers year*12+month (cf. utils.ym_str)."""
+    __tablename__ = 'apartment_arrears'
+    apartment_id    = db.Column(db.Integer, db.ForeignKey('apartment.id', ondelete='CASCADE'), primary_key=True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), nullable=False, index=True)
+    start_ym        = db.Column(db.Integer, nullable=False)      # mois de création de l'appartement
+    paid_bitmap     = db.Column(db.Text, nullable=False, default='0')  # hex — bit i = mois start_ym+i payé
+    first_unpaid_ym = db.Column(db.Integer, nullable=False)      # premier mois impayé (futur inclus)
+    unpaid_count    = db.Column(db.Integer, nullable=False, default=0)  # impayés au mois computed_ym
+    computed_ym     = db.Column(db.Integer, nullable=False)
+    updated_at      = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
 class MiscReceipt(db.Model):
@@ -148,6 +189,7 @@ class MiscReceipt(db.Model):
     libelle = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(300))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_misc_org_date', 'organization_id', 'payment_date'),)
 
 
 class AppelFonds(db.Model):
@@ -162,10 +204,11 @@ class AppelFonds(db.Model):
     date_echeance   = db.Column(db.Date, nullable=True)
     status          = db.Column(db.String(20), default='ouvert')   # ouvert / clos
     # Devis du projet (fichier joint)
-    devis_data      = db.Column(db.Text)       # base64 (legacy)
+    devis_data      = big_column()             # base64 (legacy)
     devis_mime      = db.Column(db.String(30))
     devis_nom       = db.Column(db.String(200))
     devis_url       = db.Column(db.Text)
+    devis_thumb_url = db.Column(db.Text)       # miniature (utils_media)
     created_at      = db.Column(db.DateTime, default=datetime.utcnow)
     quotas    = db.relationship('AppelFondsQuota',    backref='appel', cascade='all, delete-orphan', lazy=True)
     paiements = db.relationship('AppelFondsPaiement', backref='appel', cascade='all, delete-orphan', lazy=True)
@@ -207,10 +250,11 @@ class AppelFondsDepense(db.Model):
     libelle         = db.Column(db.String(200), nullable=False)
     notes           = db.Column(db.Text)
     # Facture / devis joint
-    facture_data    = db.Column(db.Text)       # base64 (legacy)
+    facture_data    = big_column()             # base64 (legacy)
     facture_mime    = db.Column(db.String(30))
     facture_nom     = db.Column(db.String(200))
     facture_url     = db.Column(db.Text)
+    facture_thumb_url = db.Column(db.Text)     # miniature (utils_media)
     created_at      = db.Column(db.DateTime, default=datetime.utcnow)
 
 
@@ -222,11 +266,13 @@ class Expense(db.Model):
     category = db.Column(db.String(120))
     description = db.Column(db.String(300))
     intervenant_id = db.Column(db.Integer, db.ForeignKey('intervenant.id'), nullable=True)
-    facture_data = db.Column(db.Text, nullable=True)   # base64 (legacy)
+    facture_data = big_column(nullable=True)   # base64 (legacy)
     facture_mime = db.Column(db.String(30), nullable=True)
     facture_nom  = db.Column(db.String(200), nullable=True)
     facture_url  = db.Column(db.Text, nullable=True)
+    facture_thumb_url = db.Column(db.Text, nullable=True)   # miniature (utils_media)
     intervenant  = db.relationship('Intervenant', backref='expenses', lazy=True)
+    __table_args__ = (db.Index('ix_expense_org_date', 'organization_id', 'expense_date'),)
 
 
 class Ticket(db.Model):
@@ -241,10 +287,15 @@ class Ticket(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     admin_response = db.Column(db.Text)
-    photo_data = db.Column(db.Text, nullable=True)   # base64 (legacy)
+    photo_data = big_column(nullable=True)   # base64 (legacy)
     photo_mime = db.Column(db.String(30), nullable=True)
     photo_url  = db.Column(db.Text, nullable=True)
+    photo_thumb_url = db.Column(db.Text, nullable=True)   # miniature (utils_media)
     user = db.relationship('User', backref='tickets')
+    __table_args__ = (
+        db.Index('ix_ticket_org_status_created', 'organization_id', 'status', 'created_at'),
+        db.Index('ix_ticket_apt', 'apartment_id'),
+    )
 
 
 class SuperAdminSettings(db.Model):
@@ -308,6 +359,7 @@ class UnpaidAlert(db.Model):
     alert_date = db.Column(db.DateTime, default=datetime.utcnow)
     email_sent = db.Column(db.Boolean, default=False)
     apartment = db.relationship('Apartment', backref='alerts')
+    __table_args__ = (db.Index('ix_unpaid_alert_apt_date', 'apartment_id', 'alert_date'),)
 
 
 class Announcement(db.Model):
@@ -333,6 +385,7 @@ class PushSubscription(db.Model):
     auth = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user = db.relationship('User', backref='push_subscriptions')
+    __table_args__ = (db.Index('ix_push_subscription_user', 'user_id'),)
 
 
 class DirectMessage(db.Model):
@@ -347,6 +400,10 @@ class DirectMessage(db.Model):
     read_at = db.Column(db.DateTime, nullable=True)
     sender = db.relationship('User', backref='sent_messages', lazy=True)
     apartment = db.relationship('Apartment', backref='messages', lazy=True)
+    __table_args__ = (
+        db.Index('ix_dm_org_apt_read', 'organization_id', 'apartment_id', 'read_at'),
+        db.Index('ix_dm_apt_created', 'apartment_id', 'created_at'),
+    )
 
 
 class AssemblyGeneral(db.Model):
@@ -424,13 +481,13 @@ class Litige(db.Model):
     unpaid_count    = db.Column(db.Integer, default=0)
     amount_due      = db.Column(db.Float, default=0.0)
     huissier_id     = db.Column(db.Integer, db.ForeignKey('intervenant.id'), nullable=True)
-    letter_content  = db.Column(db.Text, nullable=True)
+    letter_content  = big_column(nullable=True)
     letter_sent_at  = db.Column(db.DateTime, nullable=True)
-    accuse_data     = db.Column(db.Text, nullable=True)   # base64 (legacy)
+    accuse_data     = big_column(nullable=True)   # base64 (legacy)
     accuse_mime     = db.Column(db.String(30), nullable=True)
     accuse_nom      = db.Column(db.String(200), nullable=True)
     accuse_url      = db.Column(db.Text, nullable=True)
-    decharge_data   = db.Column(db.Text, nullable=True)   # base64 (legacy)
+    decharge_data   = big_column(nullable=True)   # base64 (legacy)
     decharge_mime   = db.Column(db.String(30), nullable=True)
     decharge_nom    = db.Column(db.String(200), nullable=True)
     decharge_url    = db.Column(db.Text, nullable=True)
@@ -458,7 +515,7 @@ class LitigeDocument(db.Model):
     id          = db.Column(db.Integer, primary_key=True)
     litige_id   = db.Column(db.Integer, db.ForeignKey('autre_litige.id'), nullable=False)
     nom         = db.Column(db.String(200), nullable=False)
-    data        = db.Column(db.Text)                   # base64 (legacy)
+    data        = big_column()                     # base64 (legacy)
     mime        = db.Column(db.String(30), nullable=False)
     url         = db.Column(db.Text)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -508,6 +565,9 @@ class Lift(db.Model):
     location = db.Column(db.String(200))                       # ex: "Entrée principale"
     status = db.Column(db.String(20), default='ok')            # ok / warning / down
     iot_api_key = db.Column(db.String(64), unique=True)        # clé secrète capteur IoT
+    iot_last_seq = db.Column(db.BigInteger, nullable=True)     # dernier seq appliqué (lots /telemetry/batch)
+    telemetry_last_at = db.Column(db.DateTime, nullable=True)        # dernière mesure agrégée (utils_telemetry)
+    telemetry_last_status = db.Column(db.String(20), nullable=True)   # statut de cette mesure
     last_maintenance = db.Column(db.Date, nullable=True)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -533,6 +593,35 @@ class LiftIncident(db.Model):
     intervenant = db.relationship('Intervenant', backref='lift_incidents', lazy=True)
 
 
+class LiftTelemetry(db.Model):
+    """Mesure brute d'un capteur d'ascenseur (conservée LIFT_TELEMETRY_RAW_RETENTION_DAYS jours)"""
+    __tablename__ = 'lift_telemetry'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    lift_id = db.Column(db.Integer, db.ForeignKey('lift.id'), nullable=False)
+    ts = db.Column(db.DateTime, nullable=False)                 # horodatage capteur (UTC)
+    status = db.Column(db.String(20), nullable=False)           # ok / warning / down
+    metrics = db.Column(db.Text, nullable=True)                 # JSON optionnel (vibrations, étage…)
+    __table_args__ = (db.Index('ix_lift_telemetry_lift_ts', 'lift_id', 'ts'),)
+
+
+class LiftTelemetryRollup(db.Model):
+    """Agrégat minute / heure / jour des mesures d'un ascenseur, mis à jour à l'ingestion.
+    Durées pondérées par le temps : l'intervalle entre deux mesures est attribué au
+    statut de la première."""
+    __tablename__ = 'lift_telemetry_rollup'
+    id = db.Column(db.Integer, primary_key=True)
+    lift_id = db.Column(db.Integer, db.ForeignKey('lift.id'), nullable=False)
+    bucket = db.Column(db.String(6), nullable=False)            # minute / hour / day
+    start = db.Column(db.DateTime, nullable=False)              # début du créneau (UTC)
+    samples = db.Column(db.Integer, default=0, nullable=False)
+    ok_seconds = db.Column(db.Float, default=0, nullable=False)
+    warning_seconds = db.Column(db.Float, default=0, nullable=False)
+    down_seconds = db.Column(db.Float, default=0, nullable=False)
+    failures = db.Column(db.Integer, default=0, nullable=False)   # passages en panne (→ down)
+    repairs = db.Column(db.Integer, default=0, nullable=False)    # remises en service (down →)
+    __table_args__ = (db.UniqueConstraint('lift_id', 'bucket', 'start', name='uq_lift_telemetry_rollup'),)
+
+
 class PaymentRequest(db.Model):
     """Demande de virement bancaire soumise par un résident — confirmée par l'admin en 1 clic"""
     __tablename__ = 'payment_request'
@@ -544,9 +633,10 @@ class PaymentRequest(db.Model):
     amount_declared = db.Column(db.Float, nullable=False)        # montant déclaré par le résident
     bank_reference  = db.Column(db.String(200))                  # référence virement
     # Photo de la décharge / reçu bancaire
-    photo_data      = db.Column(db.Text)                         # base64 (legacy)
+    photo_data      = big_column()                               # base64 (legacy)
     photo_mime      = db.Column(db.String(30))
     photo_url       = db.Column(db.Text)
+    photo_thumb_url = db.Column(db.Text)                         # miniature (utils_media)
     # Token sécurisé pour lien de confirmation admin
     confirm_token   = db.Column(db.String(64), unique=True, nullable=False)
     # Statut : en_attente / confirme / rejete
@@ -559,6 +649,7 @@ class PaymentRequest(db.Model):
     confirmed_at    = db.Column(db.DateTime)
     apartment = db.relationship('Apartment', backref='payment_requests', lazy=True)
     user      = db.relationship('User', backref='payment_requests', lazy=True)
+    __table_args__ = (db.Index('ix_payment_request_org_status', 'organization_id', 'status'),)
 
 
 class AccessLog(db.Model):
@@ -573,6 +664,7 @@ class AccessLog(db.Model):
     logged_at = db.Column(db.DateTime, default=datetime.utcnow)
     logged_by = db.Column(db.String(120))
     apartment = db.relationship('Apartment', backref='access_logs', lazy=True)
+    __table_args__ = (db.Index('ix_access_log_org_logged', 'organization_id', 'logged_at'),)
 
 
 class Badge(db.Model):
@@ -586,6 +678,8 @@ class Badge(db.Model):
     issued_at  = db.Column(db.DateTime, default=datetime.utcnow)
     blocked_at = db.Column(db.DateTime, nullable=True)
     notes = db.Column(db.Text, nullable=True)
+    # Liste d'accès incrémentale des lecteurs (/api/badges/sync) : badges modifiés depuis le curseur
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     resident = db.relationship('User', backref='badges', lazy=True)
 
 
@@ -600,7 +694,17 @@ class BadgeAccessLog(db.Model):
     direction     = db.Column(db.String(10), default='entree')# entree / sortie
     access_granted = db.Column(db.Boolean, default=True)      # autorisé ou refusé
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Lots hors ligne (/api/badges/sync) : lecteur + numéro de séquence → rejeu idempotent
+    reader_id  = db.Column(db.String(64), nullable=True)
+    client_seq = db.Column(db.BigInteger, nullable=True)
     badge = db.relationship('Badge', backref='access_logs', lazy=True)
+    __table_args__ = (db.Index('ix_badge_access_log_org_ts', 'organization_id', 'timestamp'),
+                      db.Index('uq_badge_access_log_reader_seq', 'organization_id', 'reader_id', 'client_seq',
+                               unique=True),
+                      # Recherche du journal par préfixe de numéro, sans casse (lower(x) LIKE 'x%')
+                      db.Index('ix_badge_access_log_org_number_ci', organization_id,
+                               db.func.lower(badge_number).label('badge_number_ci'), timestamp,
+                               postgresql_ops={'badge_number_ci': 'text_pattern_ops'}))
 
 
 class SubscriptionPaymentRequest(db.Model):
@@ -616,7 +720,7 @@ class SubscriptionPaymentRequest(db.Model):
     amount_declared  = db.Column(db.Float, nullable=False)
     bank_reference   = db.Column(db.String(200))
     # Scan virement / avis de débit
-    photo_data       = db.Column(db.Text)                         # base64 (fallback Supabase)
+    photo_data       = big_column()                               # base64 (fallback Supabase)
     photo_mime       = db.Column(db.String(30))
     photo_url        = db.Column(db.Text)                         # URL Supabase Storage
     # Token sécurisé pour action superadmin
@@ -639,6 +743,92 @@ class SubscriptionPaymentRequest(db.Model):
     }
 
 
+class NotificationJob(db.Model):
+    """File d'attente persistante des notifications sortantes (WhatsApp, Push, email).
+    Alimentée par les routes, vidée par le worker (cf. utils_jobs)."""
+    __tablename__ = 'notification_job'
+    id              = db.Column(db.Integer, primary_key=True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id', ondelete='CASCADE'), nullable=True)
+    provider        = db.Column(db.String(20), nullable=False)          # whatsapp / push / email / media / stub
+    payload         = db.Column(db.Text, nullable=False)                # JSON
+    status          = db.Column(db.String(20), default='pending')       # pending / running / done / failed
+    attempts        = db.Column(db.Integer, default=0)
+    max_attempts    = db.Column(db.Integer, default=5)
+    run_after       = db.Column(db.DateTime, default=datetime.utcnow)   # prochaine tentative (backoff)
+    locked_at       = db.Column(db.DateTime, nullable=True)
+    last_error      = db.Column(db.Text, nullable=True)
+    created_at      = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at     = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (db.Index('ix_notification_job_status_run', 'status', 'run_after'),)
+
+
+class FiscalYearClosing(db.Model):
+    """Clôture d'un exercice passé : soldes d'ouverture, totaux de l'année et créances
+    au 31/12, figés pour ne plus relire les opérations (cf. utils_closing).
+    `stale` passe à True dès qu'une opération datée de cet exercice (ou d'un exercice
+    antérieur) est créée, modifiée ou supprimée : la clôture doit être refaite."""
+    __tablename__ = 'fiscal_year_closing'
+    id                 = db.Column(db.Integer, primary_key=True)
+    organization_id    = db.Column(db.Integer, db.ForeignKey('organization.id', ondelete='CASCADE'), nullable=False)
+    year               = db.Column(db.Integer, nullable=False)
+    closed_at          = db.Column(db.DateTime, default=datetime.utcnow)
+    closed_by_id       = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    stale              = db.Column(db.Boolean, default=False, nullable=False)
+    stale_since        = db.Column(db.DateTime, nullable=True)
+    # Cumuls au 31/12 de l'exercice précédent
+    opening_payments   = db.Column(db.Float, default=0.0, nullable=False)
+    opening_misc       = db.Column(db.Float, default=0.0, nullable=False)
+    opening_expenses   = db.Column(db.Float, default=0.0, nullable=False)   # immobilisations incluses
+    opening_immos      = db.Column(db.Float, default=0.0, nullable=False)
+    # Totaux de l'exercice
+    payments_total     = db.Column(db.Float, default=0.0, nullable=False)
+    misc_total         = db.Column(db.Float, default=0.0, nullable=False)
+    expenses_by_category = db.Column(db.Text, nullable=False, default='[]')  # JSON [[catégorie, montant]]
+    sce_accounts       = db.Column(db.Text, nullable=False, default='[]')    # JSON [[compte, libellé, montant]]
+    monthly            = db.Column(db.Text, nullable=False, default='[]')    # JSON 12 × [encaissé, dépensé]
+    receivables        = db.Column(db.Text, nullable=False, default='{}')    # JSON {apt_id: [mois, montant]}
+    receivables_total  = db.Column(db.Float, default=0.0, nullable=False)
+    exercices          = db.Column(db.Text, nullable=False, default='[]')    # JSON années actives ≤ year
+    __table_args__ = (db.UniqueConstraint('organization_id', 'year', name='uq_fiscal_year_closing_org_year'),)
+
+
+class AccessLogArchive(db.Model):
+    """Mois de journal d'accès archivé (cf. utils_access_archive) : lignes sorties de
+    la table chaude, conservées dans un fichier JSON Lines compressé (gzip)."""
+    __tablename__ = 'access_log_archive'
+    id              = db.Column(db.Integer, primary_key=True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id', ondelete='CASCADE'), nullable=False)
+    kind            = db.Column(db.String(20), nullable=False)       # badges / visiteurs
+    month           = db.Column(db.String(7), nullable=False)        # YYYY-MM
+    rows            = db.Column(db.Integer, nullable=False, default=0)
+    file_url        = db.Column(db.Text, nullable=False)             # référence blob / URL Supabase
+    size            = db.Column(db.Integer, nullable=True)           # octets compressés
+    created_at      = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('organization_id', 'kind', 'month', name='uq_access_log_archive_month'),)
+
+
+class ReportArtifact(db.Model):
+    """Rapport (PDF, Excel) rendu par le worker et réutilisé tant que les données
+    de l'organisation n'ont pas changé (cf. utils_reports)."""
+    __tablename__ = 'report_artifact'
+    id              = db.Column(db.Integer, primary_key=True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organization.id', ondelete='CASCADE'), nullable=False)
+    kind            = db.Column(db.String(40), nullable=False)           # monthly_pdf / excel_export / ag_pv…
+    params          = db.Column(db.Text, nullable=False)                 # JSON
+    params_key      = db.Column(db.String(64), nullable=False, index=True)   # kind + org + params
+    cache_key       = db.Column(db.String(64), nullable=False, unique=True)  # + version des données
+    status          = db.Column(db.String(20), default='pending')        # pending / running / done / failed
+    file_url        = db.Column(db.Text, nullable=True)                  # référence blob / URL Supabase
+    filename        = db.Column(db.String(255), nullable=True)
+    mime            = db.Column(db.String(100), nullable=False)
+    size            = db.Column(db.Integer, nullable=True)
+    error           = db.Column(db.Text, nullable=True)
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    created_at      = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at      = db.Column(db.DateTime, nullable=True)
+    finished_at     = db.Column(db.DateTime, nullable=True)
+
+
 class SiteVisit(db.Model):
     """Suivi des visites du site public (analytics)."""
     __tablename__ = 'site_visit'
@@ -659,11 +849,73 @@ class SiteVisit(db.Model):
     status_code  = db.Column(db.SmallInteger)
 
 
+class SiteRollupDay(db.Model):
+    """Journée de site_visit déjà agrégée dans les tables de rollup (1 ligne par jour clos)."""
+    __tablename__ = 'site_rollup_day'
+    day       = db.Column(db.Date, primary_key=True)
+    views     = db.Column(db.Integer, default=0)
+    sessions  = db.Column(db.Integer, default=0)
+    rolled_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SiteVisitDaily(db.Model):
+    """Pages vues agrégées par jour × page × source × appareil × UTM."""
+    __tablename__ = 'site_visit_daily'
+    id              = db.Column(db.Integer, primary_key=True)
+    day             = db.Column(db.Date, nullable=False, index=True)
+    path            = db.Column(db.String(500))
+    referrer_domain = db.Column(db.String(150))
+    is_direct       = db.Column(db.Boolean, default=False)   # ni référent ni domaine
+    device_type     = db.Column(db.String(10))
+    browser         = db.Column(db.String(30))
+    os_name         = db.Column(db.String(30))
+    utm_source      = db.Column(db.String(80))
+    utm_medium      = db.Column(db.String(80))
+    utm_campaign    = db.Column(db.String(100))
+    views           = db.Column(db.Integer, default=0)
+
+
+class SiteVisitHourly(db.Model):
+    """Pages vues par jour × heure (heures de pointe)."""
+    __tablename__ = 'site_visit_hourly'
+    day   = db.Column(db.Date, primary_key=True)
+    hour  = db.Column(db.SmallInteger, primary_key=True)
+    views = db.Column(db.Integer, default=0)
+
+
+class SiteSessionDaily(db.Model):
+    """Agrégat journalier par session anonyme (cookie _sv) : visiteurs, rebond, durée, entonnoir."""
+    __tablename__ = 'site_session_daily'
+    id           = db.Column(db.Integer, primary_key=True)
+    day          = db.Column(db.Date, nullable=False, index=True)
+    session_key  = db.Column(db.String(32), nullable=False, index=True)
+    views        = db.Column(db.Integer, default=0)
+    first_ts     = db.Column(db.DateTime)
+    last_ts      = db.Column(db.DateTime)
+    saw_index    = db.Column(db.Boolean, default=False)
+    saw_register = db.Column(db.Boolean, default=False)
+
+
+class SchemaVersion(db.Model):
+    """Migrations de schéma appliquées (cf. migrations.py) — une ligne par version."""
+    __tablename__ = 'schema_version'
+    version     = db.Column(db.Integer, primary_key=True)
+    name        = db.Column(db.String(120), nullable=False)
+    applied_at  = db.Column(db.DateTime, default=datetime.utcnow)
+    duration_ms = db.Column(db.Integer)
+
+
 def init_db():
-    """Initialise la base de données multi-tenant"""
-    db_dir = os.path.join(BASE_DIR, 'database')
-    os.makedirs(db_dir, exist_ok=True)
-    db.create_all()
+    """Initialise la base au démarrage : une seule lecture de schema_version,
+    migrations appliquées seulement si la base est en retard (cf. migrations.py)."""
+    os.makedirs(os.path.join(BASE_DIR, 'database'), exist_ok=True)
+    from migrations import ensure_schema
+    ensure_schema()
+
+
+def legacy_schema_upgrades():
+    """Ancien corps de init_db : ALTER / CREATE idempotents protégés par try/except.
+    Exécuté une seule fois, comme migration n°1 (cf. migrations.py)."""
 
     # Migration : Ajouter credit_balance si la colonne n'existe pas
     try:
@@ -1650,37 +1902,9 @@ def init_db():
     except Exception as e:
         print(f"Migration assembly_general PV : {e}")
 
-    # Migration PERF : index sur les colonnes filtrées (multi-tenant à grande échelle)
-    # PostgreSQL ne crée PAS d'index sur les clés étrangères → balayage complet sans ça.
-    # CREATE INDEX IF NOT EXISTS fonctionne sur PostgreSQL ET SQLite. Idempotent.
-    _perf_indexes = [
-        "CREATE INDEX IF NOT EXISTS ix_payment_org          ON payment (organization_id)",
-        "CREATE INDEX IF NOT EXISTS ix_payment_apt          ON payment (apartment_id)",
-        "CREATE INDEX IF NOT EXISTS ix_payment_org_month    ON payment (organization_id, month_paid)",
-        "CREATE INDEX IF NOT EXISTS ix_payment_org_date     ON payment (organization_id, payment_date)",
-        "CREATE INDEX IF NOT EXISTS ix_expense_org          ON expense (organization_id)",
-        "CREATE INDEX IF NOT EXISTS ix_expense_org_date     ON expense (organization_id, expense_date)",
-        "CREATE INDEX IF NOT EXISTS ix_misc_org             ON misc_receipt (organization_id)",
-        "CREATE INDEX IF NOT EXISTS ix_apartment_org        ON apartment (organization_id)",
-        "CREATE INDEX IF NOT EXISTS ix_apartment_block      ON apartment (block_id)",
-        "CREATE INDEX IF NOT EXISTS ix_block_org            ON block (organization_id)",
-        'CREATE INDEX IF NOT EXISTS ix_user_org             ON "user" (organization_id)',
-        'CREATE INDEX IF NOT EXISTS ix_user_apt             ON "user" (apartment_id)',
-        "CREATE INDEX IF NOT EXISTS ix_ticket_org           ON ticket (organization_id)",
-        "CREATE INDEX IF NOT EXISTS ix_dm_org               ON direct_message (organization_id)",
-        "CREATE INDEX IF NOT EXISTS ix_announcement_org     ON announcement (organization_id)",
-        "CREATE INDEX IF NOT EXISTS ix_unpaid_alert_org     ON unpaid_alert (organization_id)",
-    ]
-    # Chaque index dans sa propre transaction : une erreur n'annule pas les autres
-    for _stmt in _perf_indexes:
-        try:
-            with db.engine.connect() as conn:
-                conn.execute(db.text(_stmt))
-                conn.commit()
-        except Exception as e:
-            print(f"Index perf ignoré ({_stmt.split('ON')[-1].strip()}) : {e}")
-    print("Migration PERF : index multi-tenant vérifiés.")
 
+def ensure_superadmin():
+    """Crée le compte super admin s'il n'existe pas (migration n°5)."""
     if not User.query.filter_by(email='superadmin@syndicpro.tn').first():
         # CRIT-003 : SUPERADMIN_PASSWORD obligatoire et >= 16 caractères
         _sa_pwd = os.environ.get('SUPERADMIN_PASSWORD', '')
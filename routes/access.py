@@ -3,6 +3,8 @@ from core import app, db
 from models import Apartment, AccessLog
 from utils import current_user, current_organization, login_required, admin_required, subscription_required
 from datetime import datetime
+from sqlalchemy.orm import joinedload
+from utils_access_archive import archived_months, month_bounds, month_records
 
 
 @app.route('/access', methods=['GET', 'POST'])
@@ -11,7 +13,8 @@ from datetime import datetime
 @subscription_required
 def access_log():
     org = current_organization()
-    apartments = Apartment.query.filter_by(organization_id=org.id).all()
+    apartments = (Apartment.query.filter_by(organization_id=org.id)
+                  .options(joinedload(Apartment.block)).all())
 
     if request.method == 'POST':
         visitor_name = request.form.get('visitor_name', '').strip()
@@ -43,12 +46,32 @@ def access_log():
         flash(f"{direction_label} enregistrée pour {visitor_name}.", "success")
         return redirect(url_for('access_log'))
 
-    logs = (AccessLog.query
-            .filter_by(organization_id=org.id)
-            .order_by(AccessLog.logged_at.desc())
-            .limit(100)
-            .all())
-    return render_template('access_log.html', logs=logs, apartments=apartments, user=current_user())
+    # Filtres : nom (sous-chaîne, index trigrammes sous PostgreSQL), mois (table ou archive)
+    filter_name  = request.args.get('q', '').strip()
+    filter_month = request.args.get('mois', '').strip()
+    months = archived_months(org.id, 'visiteurs')
+
+    if filter_month in months:
+        name = filter_name.lower()
+        logs = month_records(org.id, 'visiteurs', filter_month, limit=100,
+                             match=lambda r: name in r.visitor_name.lower())
+    else:
+        query = AccessLog.query.filter_by(organization_id=org.id)
+        if filter_month:
+            try:
+                start, end = month_bounds(filter_month)
+                query = query.filter(AccessLog.logged_at >= start, AccessLog.logged_at < end)
+            except ValueError:
+                filter_month = ''
+        if filter_name:
+            query = query.filter(AccessLog.visitor_name.ilike(f'%{filter_name}%'))
+        logs = query.order_by(AccessLog.logged_at.desc()).limit(100).all()
+
+    return render_template('access_log.html', logs=logs, apartments=apartments,
+                           apartment_labels={a.id: f"{a.block.name}-{a.number}" if a.block else a.number
+                                             for a in apartments},
+                           archived_months=months, filter_name=filter_name, filter_month=filter_month,
+                           user=current_user())
 
 
 @app.route('/access/delete/<int:entry_id>', methods=['POST'])
@@ -1,28 +1,16 @@
 from flask import render_template, request
 from core import app, db
-from models import SiteVisit, Organization, User
+from models import Organization
 from utils import login_required, superadmin_required
+from utils_analytics_rollup import DIMS, rollup_closed_days, load_window
+from collections import Counter, namedtuple
 from datetime import datetime, timedelta
 from sqlalchemy import func
 
-
-def _get_excluded_user_ids():
-    """Retourne la liste des user_ids à exclure des analytics (superadmin + orgs de test)."""
-    excluded = []
-    # Superadmins
-    for u in User.query.filter_by(role='superadmin').all():
-        excluded.append(u.id)
-    # Orgs de test (contenant 'jasmin' dans le nom ou le slug)
-    test_orgs = Organization.query.filter(
-        db.or_(
-            func.lower(Organization.name).contains('jasmin'),
-            func.lower(Organization.slug).contains('jasmin'),
-        )
-    ).all()
-    for org in test_orgs:
-        for u in User.query.filter_by(organization_id=org.id).all():
-            excluded.append(u.id)
-    return excluded
+# Lignes passées au template (mêmes attributs que les anciens résultats de requête)
+PageRow     = namedtuple('PageRow', 'path cnt')
+ReferrerRow = namedtuple('ReferrerRow', 'referrer_domain cnt')
+UtmRow      = namedtuple('UtmRow', 'utm_source utm_medium utm_campaign cnt')
 
 
 @app.route('/superadmin/analytics')
@@ -37,85 +25,35 @@ def superadmin_analytics():
     except ValueError:
         days = 30
 
-    since = datetime.utcnow() - timedelta(days=days)
-
-    # ── Exclusion superadmin + comptes de test ───────────────────────────────
-    excluded_ids = _get_excluded_user_ids()
+    now = datetime.utcnow()
+    since = now - timedelta(days=days)
 
-    def _exclude(q):
-        if excluded_ids:
-            return q.filter(
-                db.or_(
-                    SiteVisit.user_id.is_(None),
-                    SiteVisit.user_id.notin_(excluded_ids),
-                )
-            )
-        return q
+    # ── Rollups des jours clos + lignes brutes du jour (comptes exclus déjà retirés) ─
+    rollup_closed_days()
+    agg = load_window(since.date())
+    dims, sessions = agg['dims'], agg['sessions']
 
-    base_q = _exclude(SiteVisit.query.filter(SiteVisit.ts >= since))
+    def _by(*names):
+        idx = [DIMS.index(n) for n in names]
+        c = Counter()
+        for key, n in dims.items():
+            c[tuple(key[i] for i in idx) if len(idx) > 1 else key[idx[0]]] += n
+        return c
 
     # ── Chiffres globaux ─────────────────────────────────────────────────────
-    total_pages_vues = base_q.count()
-
-    visiteurs_uniques = (
-        db.session.query(func.count(func.distinct(SiteVisit.session_key)))
-        .filter(SiteVisit.ts >= since, SiteVisit.session_key != '')
-        .filter(db.or_(SiteVisit.user_id.is_(None), SiteVisit.user_id.notin_(excluded_ids)) if excluded_ids else db.true())
-        .scalar() or 0
-    )
-
-    subq_first = (
-        db.session.query(
-            SiteVisit.session_key,
-            func.min(SiteVisit.ts).label('first_ts')
-        )
-        .filter(SiteVisit.session_key != '')
-        .filter(db.or_(SiteVisit.user_id.is_(None), SiteVisit.user_id.notin_(excluded_ids)) if excluded_ids else db.true())
-        .group_by(SiteVisit.session_key)
-        .subquery()
-    )
-    nouvelles_sessions = (
-        db.session.query(func.count())
-        .filter(subq_first.c.first_ts >= since)
-        .scalar() or 0
-    )
+    total_pages_vues = sum(dims.values())
+    visiteurs_uniques = len(sessions)
+    nouvelles_sessions = agg['new_sessions']
 
     # ── Bounce rate (sessions avec 1 seule page vue) ─────────────────────────
-    sessions_with_counts = (
-        db.session.query(
-            SiteVisit.session_key,
-            func.count(SiteVisit.id).label('page_count')
-        )
-        .filter(SiteVisit.ts >= since, SiteVisit.session_key != '')
-        .filter(db.or_(SiteVisit.user_id.is_(None), SiteVisit.user_id.notin_(excluded_ids)) if excluded_ids else db.true())
-        .group_by(SiteVisit.session_key)
-        .subquery()
-    )
-    total_sessions = db.session.query(func.count()).select_from(sessions_with_counts).scalar() or 0
-    bounce_sessions = (
-        db.session.query(func.count())
-        .select_from(sessions_with_counts)
-        .filter(sessions_with_counts.c.page_count == 1)
-        .scalar() or 0
-    )
+    total_sessions = len(sessions)
+    bounce_sessions = sum(1 for s in sessions.values() if s[0] == 1)
     bounce_rate = round(bounce_sessions / total_sessions * 100, 1) if total_sessions else 0
 
     # ── Durée de session estimée (moy. en secondes entre 1ère et dernière vue) ─
-    session_times = (
-        db.session.query(
-            SiteVisit.session_key,
-            func.min(SiteVisit.ts).label('first'),
-            func.max(SiteVisit.ts).label('last'),
-            func.count(SiteVisit.id).label('cnt')
-        )
-        .filter(SiteVisit.ts >= since, SiteVisit.session_key != '')
-        .filter(db.or_(SiteVisit.user_id.is_(None), SiteVisit.user_id.notin_(excluded_ids)) if excluded_ids else db.true())
-        .group_by(SiteVisit.session_key)
-        .having(func.count(SiteVisit.id) > 1)
-        .all()
-    )
+    session_times = [s for s in sessions.values() if s[0] > 1]
     if session_times:
-        total_secs = sum((r.last - r.first).total_seconds() for r in session_times)
+        total_secs = sum((s[2] - s[1]).total_seconds() for s in session_times)
         avg_duration_secs = int(total_secs / len(session_times))
         avg_duration = f"{avg_duration_secs // 60}m {avg_duration_secs % 60}s"
     else:
@@ -123,122 +61,39 @@ def superadmin_analytics():
 
     # ── Visites par jour ─────────────────────────────────────────────────────
     chart_days = min(days, 90)
-    chart_since = datetime.utcnow() - timedelta(days=chart_days)
-
-    if 'postgresql' in str(db.engine.url):
-        day_expr = func.date_trunc('day', SiteVisit.ts)
-    else:
-        day_expr = func.date(SiteVisit.ts)
-
-    visits_by_day_rows = (
-        _exclude(
-            db.session.query(day_expr.label('day'), func.count().label('cnt'))
-            .filter(SiteVisit.ts >= chart_since)
-        )
-        .group_by('day')
-        .order_by('day')
-        .all()
-    )
-
-    day_map = {}
-    for row in visits_by_day_rows:
-        d = row.day
-        if hasattr(d, 'date'):
-            d = d.date()
-        day_map[str(d)] = row.cnt
-
     chart_labels = []
     chart_data = []
     for i in range(chart_days):
-        d = (datetime.utcnow() - timedelta(days=chart_days - 1 - i)).date()
+        d = (now - timedelta(days=chart_days - 1 - i)).date()
         chart_labels.append(d.strftime('%d/%m'))
-        chart_data.append(day_map.get(str(d), 0))
+        chart_data.append(agg['days'].get(d, 0))
 
     # ── Pages les plus visitées ──────────────────────────────────────────────
-    top_pages = (
-        _exclude(
-            db.session.query(SiteVisit.path, func.count().label('cnt'))
-            .filter(SiteVisit.ts >= since)
-        )
-        .group_by(SiteVisit.path)
-        .order_by(func.count().desc())
-        .limit(15)
-        .all()
-    )
+    top_pages = [PageRow(p, n) for p, n in _by('path').most_common(15)]
 
     # ── Sources de trafic ────────────────────────────────────────────────────
-    top_referrers = (
-        _exclude(
-            db.session.query(SiteVisit.referrer_domain, func.count().label('cnt'))
-            .filter(SiteVisit.ts >= since, SiteVisit.referrer_domain.isnot(None))
-        )
-        .group_by(SiteVisit.referrer_domain)
-        .order_by(func.count().desc())
-        .limit(10)
-        .all()
-    )
-
-    direct_count = (
-        _exclude(
-            db.session.query(func.count())
-            .filter(SiteVisit.ts >= since,
-                    SiteVisit.referrer_domain.is_(None),
-                    SiteVisit.referrer == '')
-        )
-        .scalar() or 0
-    )
+    referrers = _by('referrer_domain')
+    referrers.pop(None, None)
+    top_referrers = [ReferrerRow(r, n) for r, n in referrers.most_common(10)]
+    direct_count = _by('is_direct').get(True, 0)
 
     # ── Appareils ────────────────────────────────────────────────────────────
-    devices = (
-        _exclude(
-            db.session.query(SiteVisit.device_type, func.count().label('cnt'))
-            .filter(SiteVisit.ts >= since)
-        )
-        .group_by(SiteVisit.device_type)
-        .all()
-    )
-    device_labels = [r.device_type or 'inconnu' for r in devices]
-    device_data   = [r.cnt for r in devices]
+    devices = _by('device_type')
+    device_labels = [d or 'inconnu' for d in devices]
+    device_data   = list(devices.values())
 
     # ── Navigateurs ──────────────────────────────────────────────────────────
-    browsers = (
-        _exclude(
-            db.session.query(SiteVisit.browser, func.count().label('cnt'))
-            .filter(SiteVisit.ts >= since)
-        )
-        .group_by(SiteVisit.browser)
-        .order_by(func.count().desc())
-        .all()
-    )
-    browser_labels = [r.browser or 'Autre' for r in browsers]
-    browser_data   = [r.cnt for r in browsers]
+    browsers = _by('browser').most_common()
+    browser_labels = [b or 'Autre' for b, _ in browsers]
+    browser_data   = [n for _, n in browsers]
 
     # ── Systèmes d'exploitation ───────────────────────────────────────────────
-    os_rows = (
-        _exclude(
-            db.session.query(SiteVisit.os_name, func.count().label('cnt'))
-            .filter(SiteVisit.ts >= since)
-        )
-        .group_by(SiteVisit.os_name)
-        .order_by(func.count().desc())
-        .all()
-    )
-    os_labels = [r.os_name or 'Autre' for r in os_rows]
-    os_data   = [r.cnt for r in os_rows]
+    os_rows = _by('os_name').most_common()
+    os_labels = [o or 'Autre' for o, _ in os_rows]
+    os_data   = [n for _, n in os_rows]
 
     # ── Entonnoir de conversion ───────────────────────────────────────────────
-    visitors_index = (
-        db.session.query(func.count(func.distinct(SiteVisit.session_key)))
-        .filter(SiteVisit.ts >= since, SiteVisit.path == '/', SiteVisit.session_key != '')
-        .filter(db.or_(SiteVisit.user_id.is_(None), SiteVisit.user_id.notin_(excluded_ids)) if excluded_ids else db.true())
-        .scalar() or 0
-    )
-    visitors_register = (
-        db.session.query(func.count(func.distinct(SiteVisit.session_key)))
-        .filter(SiteVisit.ts >= since, SiteVisit.path == '/register', SiteVisit.session_key != '')
-        .filter(db.or_(SiteVisit.user_id.is_(None), SiteVisit.user_id.notin_(excluded_ids)) if excluded_ids else db.true())
-        .scalar() or 0
-    )
+    visitors_register = sum(1 for s in sessions.values() if s[4])
     # Exclure les orgs de test des inscriptions réelles
     test_org_ids = [o.id for o in Organization.query.filter(
         db.or_(
@@ -259,40 +114,13 @@ def superadmin_analytics():
     conv_rate = round(new_orgs / visitors_register * 100, 1) if visitors_register else 0
 
     # ── Campagnes UTM ────────────────────────────────────────────────────────
-    utm_rows = (
-        _exclude(
-            db.session.query(
-                SiteVisit.utm_source,
-                SiteVisit.utm_medium,
-                SiteVisit.utm_campaign,
-                func.count().label('cnt')
-            )
-            .filter(SiteVisit.ts >= since, SiteVisit.utm_source.isnot(None))
-        )
-        .group_by(SiteVisit.utm_source, SiteVisit.utm_medium, SiteVisit.utm_campaign)
-        .order_by(func.count().desc())
-        .limit(10)
-        .all()
-    )
+    utms = _by('utm_source', 'utm_medium', 'utm_campaign')
+    utm_rows = [UtmRow(src, med, camp, n)
+                for (src, med, camp), n in utms.most_common() if src is not None][:10]
 
     # ── Heures de pointe ─────────────────────────────────────────────────────
-    if 'postgresql' in str(db.engine.url):
-        hour_expr = func.extract('hour', SiteVisit.ts)
-    else:
-        hour_expr = func.strftime('%H', SiteVisit.ts)
-
-    hours_rows = (
-        _exclude(
-            db.session.query(hour_expr.label('h'), func.count().label('cnt'))
-            .filter(SiteVisit.ts >= since)
-        )
-        .group_by('h')
-        .order_by('h')
-        .all()
-    )
-    hour_map = {int(float(str(r.h))): r.cnt for r in hours_rows}
     hour_labels = [f"{h:02d}h" for h in range(24)]
-    hour_data   = [hour_map.get(h, 0) for h in range(24)]
+    hour_data   = [agg['hours'].get(h, 0) for h in range(24)]
 
     return render_template(
         'superadmin/analytics.html',
@@ -4,6 +4,7 @@ from models import Block, Apartment
 from utils import (current_user, current_organization, login_required,
                    admin_required, subscription_required,
                    get_unpaid_details_map)
+from utils_arrears import delete_arrears, rebuild_arrears
 
 
 @app.route('/apartments', methods=['GET', 'POST'])
@@ -51,6 +52,8 @@ def apartments():
                         parking_spot=parking_spot
                     )
                     db.session.add(a)
+                    db.session.flush()
+                    rebuild_arrears([a])     # ligne du registre des impayés créée avec l'appartement
                     db.session.commit()
                     flash(f'Appartement {number} ajouté', 'success')
                 except ValueError:
@@ -104,6 +107,7 @@ def edit_apartment(apartment_id):
 def delete_apartment(apartment_id):
     org = current_organization()
     apt = Apartment.query.filter_by(id=apartment_id, organization_id=org.id).first_or_404()
+    delete_arrears(apt.id)
     db.session.delete(apt)
     db.session.commit()
     flash('Appartement supprimé', 'success')
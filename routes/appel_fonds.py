@@ -5,6 +5,8 @@ from models import AppelFonds, AppelFondsQuota, AppelFondsPaiement, AppelFondsDe
 from utils import current_user, current_organization, login_required, admin_required, subscription_required
 from datetime import datetime, date
 from storage_helper import upload_file as _storage_upload
+from utils_blobs import send_attachment
+from utils_media import schedule as schedule_media
 
 MAX_FILE_BYTES = 10 * 1024 * 1024
 ALLOWED_MIMES  = {'image/jpeg', 'image/png', 'image/webp', 'application/pdf'}
@@ -141,7 +143,9 @@ def appel_fonds_detail(af_id):
                 d, m, n, u = _read_file(request.files.get('devis_file'), folder='appels_fonds')
                 if m:
                     af.devis_data, af.devis_mime, af.devis_nom, af.devis_url = d, m, n, u
+                    af.devis_thumb_url = None
                     db.session.commit()
+                    schedule_media('appel_devis', u, m, org.id)
                     flash('Devis enregistré.', 'success')
             except ValueError as e:
                 flash(str(e), 'warning')
@@ -205,6 +209,7 @@ def appel_fonds_detail(af_id):
                     flash(str(e), 'warning')
                 db.session.add(dep)
                 db.session.commit()
+                schedule_media('appel_facture', dep.facture_url, dep.facture_mime, org.id)
                 flash('Dépense enregistrée.', 'success')
             except Exception as e:
                 flash(f'Erreur : {e}', 'danger')
@@ -239,18 +244,11 @@ def appel_fonds_detail(af_id):
 @login_required
 @subscription_required
 def appel_fonds_devis(af_id):
-    from flask import redirect as _redirect
     org = current_organization()
-    af  = AppelFonds.query.filter_by(id=af_id, organization_id=org.id).first_or_404()
-    if af.devis_url:
-        return _redirect(af.devis_url)
-    if not af.devis_data:
-        abort(404)
-    buf = io.BytesIO(base64.b64decode(af.devis_data))
-    buf.seek(0)
-    return send_file(buf, mimetype=af.devis_mime,
-                     as_attachment=request.args.get('dl') == '1',
-                     download_name=af.devis_nom or f'devis_{af_id}')
+    af  = AppelFonds.query.options(db.undefer(AppelFonds.devis_data))\
+        .filter_by(id=af_id, organization_id=org.id).first_or_404()
+    return send_attachment(af.devis_url, af.devis_data, af.devis_mime,
+                           af.devis_nom or f'devis_{af_id}')
 
 
 # ─── Téléchargement facture dépense ──────────────────────────────────────────
@@ -259,19 +257,12 @@ def appel_fonds_devis(af_id):
 @login_required
 @subscription_required
 def appel_fonds_facture(af_id, dep_id):
-    from flask import redirect as _redirect
     org = current_organization()
     af  = AppelFonds.query.filter_by(id=af_id, organization_id=org.id).first_or_404()
-    dep = AppelFondsDepense.query.filter_by(id=dep_id, appel_id=af_id).first_or_404()
-    if dep.facture_url:
-        return _redirect(dep.facture_url)
-    if not dep.facture_data:
-        abort(404)
-    buf = io.BytesIO(base64.b64decode(dep.facture_data))
-    buf.seek(0)
-    return send_file(buf, mimetype=dep.facture_mime,
-                     as_attachment=request.args.get('dl') == '1',
-                     download_name=dep.facture_nom or f'facture_{dep_id}')
+    dep = AppelFondsDepense.query.options(db.undefer(AppelFondsDepense.facture_data))\
+        .filter_by(id=dep_id, appel_id=af_id).first_or_404()
+    return send_attachment(dep.facture_url, dep.facture_data, dep.facture_mime,
+                           dep.facture_nom or f'facture_{dep_id}')
 
 
 # ─── Reçu PDF d'un paiement appel de fonds ───────────────────────────────────
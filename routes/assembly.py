@@ -1,11 +1,12 @@
-from flask import render_template, request, redirect, url_for, flash, send_file
-import io
+from flask import render_template, request, redirect, url_for, flash
 from core import app, db
-from models import AssemblyGeneral, AGItem, AGVote, Apartment, User, AutreLitige
+from models import AssemblyGeneral, AGItem, AGVote, Apartment, User, AutreLitige, LitigeDocument
 from utils import (current_user, current_organization, login_required,
                    admin_required, subscription_required)
 from datetime import datetime
 from storage_helper import upload_file as _storage_upload
+from utils_profiler import query_budget
+from utils_reports import report, serve_report
 
 STATUS_LABELS_AUTRES = {
     'ouvert':   ('Ouvert',   'danger'),
@@ -62,30 +63,42 @@ def _user_votes(ag, user):
 @app.route('/assemblees')
 @login_required
 @subscription_required
+@query_budget(12)
 def assembly_list():
     org  = current_organization()
     user = current_user()
     assemblies = AssemblyGeneral.query.filter_by(organization_id=org.id)\
         .order_by(AssemblyGeneral.meeting_date.desc()).all()
 
-    stats = {}
-    for ag in assemblies:
-        item_ids = [it.id for it in ag.items]
-        voter_count = 0
-        if item_ids:
-            voter_count = db.session.query(
-                db.func.count(db.func.distinct(AGVote.user_id))
-            ).filter(AGVote.item_id.in_(item_ids)).scalar() or 0
-        stats[ag.id] = {'nb_items': len(ag.items), 'nb_voters': voter_count}
+    # Points et votants par assemblée : 2 requêtes groupées (au lieu de 2 par AG)
+    ag_ids = [ag.id for ag in assemblies]
+    nb_items, nb_voters = {}, {}
+    if ag_ids:
+        nb_items = dict(db.session.query(AGItem.assembly_id, db.func.count(AGItem.id))
+                        .filter(AGItem.assembly_id.in_(ag_ids))
+                        .group_by(AGItem.assembly_id).all())
+        nb_voters = dict(db.session.query(AGItem.assembly_id,
+                                          db.func.count(db.func.distinct(AGVote.user_id)))
+                         .join(AGVote, AGVote.item_id == AGItem.id)
+                         .filter(AGItem.assembly_id.in_(ag_ids))
+                         .group_by(AGItem.assembly_id).all())
+    stats = {ag_id: {'nb_items': nb_items.get(ag_id, 0), 'nb_voters': nb_voters.get(ag_id, 0)}
+             for ag_id in ag_ids}
 
     autres = (AutreLitige.query
               .filter_by(organization_id=org.id)
               .order_by(AutreLitige.created_at.desc())
               .all())
+    doc_counts = {}
+    if autres:
+        doc_counts = dict(db.session.query(LitigeDocument.litige_id, db.func.count(LitigeDocument.id))
+                          .filter(LitigeDocument.litige_id.in_([al.id for al in autres]))
+                          .group_by(LitigeDocument.litige_id).all())
 
     return render_template('assembly_list.html',
                            assemblies=assemblies, stats=stats, user=user,
-                           autres=autres, status_labels=STATUS_LABELS_AUTRES)
+                           autres=autres, doc_counts=doc_counts,
+                           status_labels=STATUS_LABELS_AUTRES)
 
 
 # ─── Nouvelle assemblée ──────────────────────────────────────────────────────
@@ -345,7 +358,7 @@ def assembly_upload_pv_scan(ag_id):
         db.session.commit()
         flash('PV scanné enregistré dans le dossier de l\'assemblée.', 'success')
     else:
-        flash('Stockage non configuré - scan non sauvegardé.', 'warning')
+        flash('Stockage indisponible - scan non sauvegardé.', 'warning')
     return redirect(url_for('assembly_pv', ag_id=ag_id))
 
 
@@ -389,7 +402,6 @@ def assembly_pv(ag_id):
 @login_required
 @subscription_required
 def assembly_pv_pdf(ag_id):
-    from fpdf import FPDF
     org  = current_organization()
     user = current_user()
     ag   = AssemblyGeneral.query.filter_by(id=ag_id, organization_id=org.id).first_or_404()
@@ -398,6 +410,14 @@ def assembly_pv_pdf(ag_id):
         flash("Le PV PDF est disponible après clôture de l'assemblée.", 'warning')
         return redirect(url_for('assembly_detail', ag_id=ag_id))
 
+    return serve_report('ag_pv', org, {'ag_id': ag.id}, user=user, title=f"PV — {ag.title}")
+
+
+@report('ag_pv')
+def _render_assembly_pv(org, ag_id):
+    from fpdf import FPDF
+    ag = AssemblyGeneral.query.filter_by(id=ag_id, organization_id=org.id).one()
+
     votes_data = _build_votes(ag)
 
     item_ids  = [it.id for it in ag.items]
@@ -662,11 +682,9 @@ def assembly_pv_pdf(ag_id):
                  "Ce PV constitue le document officiel de l'assemblee generale - CDR Tunisie.",
                  new_x="LMARGIN", new_y="NEXT", align='C')
 
-    buf = io.BytesIO(pdf.output())
-    buf.seek(0)
     prefix = 'BROUILLON_PV' if is_draft else 'PV_AG'
     filename = f"{prefix}_{ag.id}_{ag.meeting_date.strftime('%Y%m%d')}.pdf"
-    return send_file(buf, mimetype='application/pdf', as_attachment=True, download_name=filename)
+    return pdf.output(), filename
 
 
 # ─── Convocation PDF ─────────────────────────────────────────────────────────
@@ -676,9 +694,16 @@ def assembly_pv_pdf(ag_id):
 @admin_required
 @subscription_required
 def assembly_convocation_pdf(ag_id):
-    from fpdf import FPDF
     org  = current_organization()
     ag   = AssemblyGeneral.query.filter_by(id=ag_id, organization_id=org.id).first_or_404()
+    return serve_report('ag_convocation', org, {'ag_id': ag.id}, user=current_user(),
+                        title=f"Convocations — {ag.title}")
+
+
+@report('ag_convocation', admin_only=True)
+def _render_assembly_convocation(org, ag_id):
+    from fpdf import FPDF
+    ag   = AssemblyGeneral.query.filter_by(id=ag_id, organization_id=org.id).one()
 
     residents = User.query.filter_by(organization_id=org.id, role='resident').all()
 
@@ -872,10 +897,8 @@ def assembly_convocation_pdf(ag_id):
                    + ' par SyndicPro - ' + org.name),
                  new_x="LMARGIN", new_y="NEXT", align='C')
 
-    buf = io.BytesIO(pdf.output())
-    buf.seek(0)
     filename = 'Convocation_AG_' + str(ag.id) + '_' + ag.meeting_date.strftime('%Y%m%d') + '.pdf'
-    return send_file(buf, mimetype='application/pdf', as_attachment=True, download_name=filename)
+    return pdf.output(), filename
 
 
 # ─── Supprimer une AG ────────────────────────────────────────────────────────
@@ -1,13 +1,14 @@
-from flask import render_template, redirect, url_for, flash, send_file
+from flask import render_template, redirect, url_for, flash
 from core import app, db
 from models import Apartment, Payment, Expense, User, Organization
 from utils import (current_user, current_organization, login_required,
                    admin_required, subscription_required, get_unpaid_map)
-from utils_whatsapp import send_whatsapp
+from utils_whatsapp import queue_whatsapp
+from utils_jobs import commit_enqueued
+from utils_reports import report, serve_report
 from sqlalchemy import func
 from sqlalchemy.orm import joinedload
 from datetime import date
-import io
 
 
 # ─── Tableau de bord automatisation ─────────────────────────────────────────
@@ -91,13 +92,15 @@ def send_reminders():
             f"Merci de régulariser votre situation.\n"
             f"— {org.name}"
         )
-        if send_whatsapp(org, r.phone, msg):
+        if queue_whatsapp(org, r.phone, msg, commit=False):
             sent += 1
         else:
             no_phone += 1
 
+    # Envoi effectif par le worker de notifications (utils_jobs) — la requête rend la main
     if sent:
-        flash(f"✅ {sent} rappel(s) WhatsApp envoyé(s).", "success")
+        commit_enqueued()
+        flash(f"✅ {sent} rappel(s) WhatsApp programmé(s) — envoi en cours.", "success")
     if no_phone:
         flash(f"⚠️ {no_phone} appartement(s) sans numéro WhatsApp — non contactés.", "warning")
     if not sent and not no_phone:
@@ -112,10 +115,16 @@ def send_reminders():
 @admin_required
 @subscription_required
 def pdf_report():
-    org = current_organization()
+    current_month = date.today().strftime('%Y-%m')
+    return serve_report('monthly_pdf', current_organization(), {'month': current_month},
+                        user=current_user(), title='Rapport mensuel PDF')
+
+
+@report('monthly_pdf', admin_only=True)
+def _render_monthly_report(org, month):
     from fpdf import FPDF
 
-    current_month = date.today().strftime('%Y-%m')
+    current_month = month
     year, month_num = current_month.split('-')
     months_fr = ['', 'Janvier', 'Février', 'Mars', 'Avril', 'Mai', 'Juin',
                  'Juillet', 'Août', 'Septembre', 'Octobre', 'Novembre', 'Décembre']
@@ -156,7 +165,7 @@ def pdf_report():
     pdf.cell(0, 12, 'SyndicPro', new_x="LMARGIN", new_y="NEXT", align='C')
     pdf.set_font('Helvetica', '', 12)
     pdf.set_text_color(255, 255, 255)
-    pdf.cell(0, 6, f"Rapport mensuel — {month_label}", new_x="LMARGIN", new_y="NEXT", align='C')
+    pdf.cell(0, 6, f"Rapport mensuel - {month_label}", new_x="LMARGIN", new_y="NEXT", align='C')
     pdf.cell(0, 6, org.name, new_x="LMARGIN", new_y="NEXT", align='C')
     pdf.ln(6)
 
@@ -176,7 +185,7 @@ def pdf_report():
         pdf.cell(0, 7, str(value), new_x="LMARGIN", new_y="NEXT")
 
     # Résumé du mois
-    section(f"  Résumé — {month_label}")
+    section(f"  Résumé - {month_label}")
     pdf.set_text_color(50, 50, 50)
     pdf.set_font('Helvetica', '', 10)
     row("Appartements total :", len(apartments))
@@ -196,7 +205,7 @@ def pdf_report():
 
     # Encaissements du mois (déjà chargés, scopés au mois)
     if month_payments:
-        section(f"  Encaissements — {month_label}")
+        section(f"  Encaissements - {month_label}")
         pdf.set_font('Helvetica', 'B', 9)
         pdf.set_text_color(100, 100, 100)
         pdf.cell(55, 6, "Appartement")
@@ -219,7 +228,7 @@ def pdf_report():
     # Impayés du mois
     unpaid_apts = [a for a in apartments if a.id not in paid_ids]
     if unpaid_apts:
-        section(f"  Appartements impayés — {month_label}")
+        section(f"  Appartements impayés - {month_label}")
         pdf.set_font('Helvetica', 'B', 9)
         pdf.set_text_color(100, 100, 100)
         pdf.cell(55, 6, "Appartement")
@@ -239,7 +248,7 @@ def pdf_report():
 
     # Dépenses du mois (déjà chargées, scopées au mois)
     if month_expenses:
-        section(f"  Dépenses — {month_label}")
+        section(f"  Dépenses - {month_label}")
         pdf.set_font('Helvetica', 'B', 9)
         pdf.set_text_color(100, 100, 100)
         pdf.cell(55, 6, "Date")
@@ -262,8 +271,4 @@ def pdf_report():
     pdf.set_text_color(150, 150, 150)
     pdf.cell(0, 6, f"Genere par SyndicPro le {date.today().strftime('%d/%m/%Y')} - www.syndicpro.tn", align='C')
 
-    buf = io.BytesIO(pdf.output())
-    buf.seek(0)
-    filename = f"rapport_{org.slug}_{current_month}.pdf"
-    return send_file(buf, mimetype='application/pdf',
-                     as_attachment=True, download_name=filename)
+    return pdf.output(), f"rapport_{org.slug}_{current_month}.pdf"
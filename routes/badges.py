@@ -1,8 +1,14 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, session
 from core import app, db
-from models import Badge, BadgeAccessLog, User, Apartment, Organization
+from models import Badge, BadgeAccessLog, User
 from utils import current_user, current_organization, login_required, admin_required, subscription_required
+from utils_badges import access_list, decide, flush_access_logs, log_access, resolve_api_key
+from utils_ingest import BatchError, batch_events, insert_ignore, parse_ts, validate
+from utils_access_archive import archived_months, month_bounds, month_records
+from utils_profiler import query_budget
 from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 
 
 # ─────────────────────────────────────────────
@@ -72,6 +78,7 @@ def badges():
                            residents=residents,
                            stats=stats,
                            org=org,
+                           new_api_key=session.pop('badges_api_key_once', None),
                            user=current_user())
 
 
@@ -140,7 +147,8 @@ def badge_delete(badge_id):
     org = current_organization()
     badge = Badge.query.filter_by(id=badge_id, organization_id=org.id).first_or_404()
     num = badge.badge_number
-    # Supprimer aussi les logs liés
+    # Supprimer aussi les logs liés (y compris ceux encore dans le tampon)
+    flush_access_logs()
     BadgeAccessLog.query.filter_by(badge_id=badge.id).delete()
     db.session.delete(badge)
     db.session.commit()
@@ -158,7 +166,9 @@ def badge_delete(badge_id):
 @subscription_required
 def badge_journal():
     org = current_organization()
-    badges_list = Badge.query.filter_by(organization_id=org.id).all()
+    flush_access_logs()   # passages en tampon de ce process (utils_badges)
+    badges_list = (Badge.query.filter_by(organization_id=org.id)
+                   .options(joinedload(Badge.resident)).all())
 
     if request.method == 'POST':
         badge_number  = request.form.get('badge_number', '').strip()
@@ -188,29 +198,50 @@ def badge_journal():
         flash("Passage enregistré.", "success")
         return redirect(url_for('badge_journal'))
 
-    # Filtres optionnels
+    # Filtres optionnels, sans casse comme dans les archives : numéro par préfixe
+    # (index organisation + lower(numéro)), point d'accès par sous-chaîne (index
+    # trigrammes sous PostgreSQL)
     filter_badge   = request.args.get('badge', '').strip()
     filter_point   = request.args.get('point', '').strip()
     filter_granted = request.args.get('granted', '')
-
-    query = BadgeAccessLog.query.filter_by(organization_id=org.id)
-    if filter_badge:
-        query = query.filter(BadgeAccessLog.badge_number.ilike(f'%{filter_badge}%'))
-    if filter_point:
-        query = query.filter(BadgeAccessLog.access_point.ilike(f'%{filter_point}%'))
-    if filter_granted == '1':
-        query = query.filter_by(access_granted=True)
-    elif filter_granted == '0':
-        query = query.filter_by(access_granted=False)
-
-    logs = query.order_by(BadgeAccessLog.timestamp.desc()).limit(200).all()
+    filter_month   = request.args.get('mois', '').strip()
+    months = archived_months(org.id, 'badges')
+
+    if filter_month in months:
+        # Mois archivé : lecture du fichier compressé (+ lignes arrivées depuis)
+        badge_prefix, point = filter_badge.lower(), filter_point.lower()
+        logs = month_records(org.id, 'badges', filter_month, match=lambda r: (
+            r.badge_number.lower().startswith(badge_prefix)
+            and point in r.access_point.lower()
+            and (filter_granted == '' or r.access_granted == (filter_granted == '1'))))
+    else:
+        query = BadgeAccessLog.query.filter_by(organization_id=org.id)
+        if filter_month:
+            try:
+                start, end = month_bounds(filter_month)
+                query = query.filter(BadgeAccessLog.timestamp >= start, BadgeAccessLog.timestamp < end)
+            except ValueError:
+                filter_month = ''
+        if filter_badge:
+            query = query.filter(func.lower(BadgeAccessLog.badge_number)
+                                 .startswith(filter_badge.lower(), autoescape=True))
+        if filter_point:
+            query = query.filter(BadgeAccessLog.access_point.ilike(f'%{filter_point}%'))
+        if filter_granted == '1':
+            query = query.filter_by(access_granted=True)
+        elif filter_granted == '0':
+            query = query.filter_by(access_granted=False)
+        logs = query.order_by(BadgeAccessLog.timestamp.desc()).limit(200).all()
 
     return render_template('badge_journal.html',
                            logs=logs,
                            badges=badges_list,
+                           residents={b.id: b.resident.name for b in badges_list if b.resident},
+                           archived_months=months,
                            filter_badge=filter_badge,
                            filter_point=filter_point,
                            filter_granted=filter_granted,
+                           filter_month=filter_month,
                            user=current_user())
 
 
@@ -219,6 +250,7 @@ def badge_journal():
 # ─────────────────────────────────────────────
 
 @app.route('/api/badges/access', methods=['POST'])
+@query_budget(2)     # clé + badges_version à chaque passage ; + index à froid
 def badge_api_access():
     """Endpoint public pour lecteurs RFID / contrôleurs d'accès.
 
@@ -241,8 +273,9 @@ def badge_api_access():
     if not api_key:
         return jsonify({'granted': False, 'reason': 'Clé API manquante'}), 401
 
-    org = Organization.query.filter_by(badges_api_key=api_key).first()
-    if not org:
+    # Clé hachée + index des badges en mémoire (utils_badges) : 1 requête à chaud
+    org_id, version = resolve_api_key(api_key)
+    if not org_id:
         return jsonify({'granted': False, 'reason': 'Clé API invalide'}), 401
 
     badge_number = (request.form.get('badge_number') or json_body.get('badge_number') or '').strip()
@@ -252,38 +285,89 @@ def badge_api_access():
     if not badge_number:
         return jsonify({'granted': False, 'reason': 'badge_number manquant'}), 400
 
-    badge = Badge.query.filter_by(
-        organization_id=org.id, badge_number=badge_number
-    ).first()
-
-    granted = badge is not None and badge.status == 'actif'
-    reason  = None
-    if not badge:
-        reason = 'Badge inconnu'
-    elif badge.status != 'actif':
-        reason = f'Badge {badge.status}'
-
-    log = BadgeAccessLog(
-        organization_id=org.id,
-        badge_id=badge.id if badge else None,
-        badge_number=badge_number,
-        access_point=access_point,
-        direction=direction,
-        access_granted=granted,
-    )
-    db.session.add(log)
-    db.session.commit()
+    granted, badge, reason = decide(org_id, version, badge_number)
+    # Journal écrit en arrière-plan : la réponse au lecteur n'attend pas le commit
+    log_access(org_id, badge, badge_number, access_point, direction, granted)
 
     resp = {'granted': granted, 'badge_number': badge_number}
-    if granted and badge.resident_id:
-        resident = User.query.get(badge.resident_id)
-        if resident:
-            resp['resident'] = resident.name
-            if resident.apartment_id:
-                apt = Apartment.query.get(resident.apartment_id)
-                if apt and apt.block:
-                    resp['apartment'] = f"{apt.block.name}-{apt.number}"
+    if granted and badge['resident']:
+        resp['resident'] = badge['resident']
+        if badge['apartment']:
+            resp['apartment'] = badge['apartment']
     if reason:
         resp['reason'] = reason
 
     return jsonify(resp)
+
+
+@app.route('/api/badges/sync', methods=['POST'])
+@query_budget(6)     # clé + index + INSERT + suppression + liste d'accès
+def badge_api_sync():
+    """Synchronisation par lots d'un lecteur resté hors ligne.
+
+    Authentification : api_key dans le corps JSON ou header X-Api-Key.
+
+    Corps JSON :
+      reader_id — identifiant du lecteur (obligatoire, clé d'idempotence avec seq)
+      since     — curseur de la synchro précédente (optionnel : liste complète sinon)
+      events    — [{seq, ts, badge_number, access_point?, direction?, granted?}]
+                  granted absent : décision du serveur au moment de la synchro
+
+    Un lot rejoué (même reader_id + seq) n'est inséré qu'une fois.
+
+    Réponse JSON :
+      { accepted, duplicates, rejected: [{seq, error}], last_seq,
+        access_list: {cursor, full, entries: [{badge_number, allow}]} }
+    """
+    body = request.get_json(silent=True) or {}
+    api_key = body.get('api_key') or request.headers.get('X-Api-Key', '')
+    if not api_key:
+        return jsonify({'error': 'Clé API manquante'}), 401
+    org_id, version = resolve_api_key(api_key)
+    if not org_id:
+        return jsonify({'error': 'Clé API invalide'}), 401
+
+    reader_id = str(body.get('reader_id') or '').strip()[:64]
+    if not reader_id:
+        return jsonify({'error': 'reader_id manquant'}), 400
+    try:
+        events = batch_events(body)
+        since = parse_ts(body['since']) if body.get('since') else None
+    except BatchError as e:
+        return jsonify({'error': str(e)}), e.status
+    except ValueError:
+        return jsonify({'error': 'since invalide'}), 400
+
+    def check(event):
+        number = str(event.get('badge_number') or '').strip()
+        if not number:
+            raise ValueError('badge_number manquant')
+        granted = event.get('granted')
+        if granted is not None and not isinstance(granted, bool):
+            raise ValueError('granted doit être un booléen')
+        return {'badge_number': number[:50],
+                'access_point': str(event.get('access_point') or 'Entrée principale')[:100],
+                'direction': str(event.get('direction') or 'entree')[:10],
+                'granted': granted}
+
+    valid, rejected = validate(events, check)
+    rows = []
+    for e in valid:
+        granted, badge, _ = decide(org_id, version, e['badge_number'])
+        rows.append({'organization_id': org_id, 'badge_id': badge['id'] if badge else None,
+                     'badge_number': e['badge_number'], 'access_point': e['access_point'],
+                     'direction': e['direction'],
+                     'access_granted': granted if e['granted'] is None else e['granted'],
+                     'timestamp': e['ts'], 'reader_id': reader_id, 'client_seq': e['seq']})
+    # 1 INSERT multi-lignes ; les séquences déjà reçues sont ignorées
+    inserted = insert_ignore(BadgeAccessLog.__table__, rows,
+                             ['organization_id', 'reader_id', 'client_seq'])
+    db.session.commit()
+
+    return jsonify({
+        'accepted': inserted,
+        'duplicates': len(events) - len(rejected) - inserted,
+        'rejected': rejected,
+        'last_seq': max((e['seq'] for e in valid), default=None),
+        'access_list': access_list(org_id, since),
+    })
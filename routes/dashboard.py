@@ -303,6 +303,18 @@ def api_dashboard_data():
     return jsonify({'labels': labels, 'payments': data_pay, 'expenses': data_exp})
 
 
+@app.route('/api/notif/feed')
+@login_required
+def api_notif_feed():
+    """Contenu de la cloche admin en JSON — chargé après l'affichage de la page."""
+    from utils import notification_feed
+    from utils_notifications import feed_json
+    user = current_user()
+    if user.role != 'admin' or not user.organization_id:
+        return jsonify({'count': 0, 'unpaid_critical': 0, 'items': []})
+    return jsonify(feed_json(notification_feed(user)))
+
+
 @app.route('/api/notif/seen', methods=['POST'])
 @login_required
 def api_notif_seen():
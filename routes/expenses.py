@@ -1,12 +1,13 @@
 import base64
-import io
-from flask import render_template, request, redirect, url_for, flash, send_file, abort
+from flask import render_template, request, redirect, url_for, flash
 from core import app, db
 from models import Expense, Intervenant
 from utils import (current_user, current_organization, login_required,
                    admin_required, subscription_required)
 from datetime import datetime, date
 from storage_helper import upload_file as _storage_upload, delete_file as _storage_delete
+from utils_blobs import send_attachment
+from utils_media import schedule as schedule_media
 
 MAX_FACTURE_BYTES = 5 * 1024 * 1024   # 5 Mo
 ALLOWED_MIMES = {'image/jpeg', 'image/png', 'image/webp', 'application/pdf'}
@@ -91,6 +92,7 @@ def expenses():
             )
             db.session.add(e)
             db.session.commit()
+            schedule_media('expense_facture', facture_url, facture_mime, org.id)
             flash('Dépense enregistrée', 'success')
         except Exception as ex:
             print(f"ERREUR dépense: {ex}")
@@ -111,7 +113,7 @@ def expenses():
 @subscription_required
 def edit_expense(expense_id):
     org = current_organization()
-    e = Expense.query.filter_by(id=expense_id, organization_id=org.id).first_or_404()
+    e = Expense.query.options(db.undefer(Expense.facture_data)).filter_by(id=expense_id, organization_id=org.id).first_or_404()
     intervenants = Intervenant.query.filter_by(organization_id=org.id)\
         .order_by(Intervenant.categorie, Intervenant.nom_societe, Intervenant.nom).all()
 
@@ -141,11 +143,17 @@ def edit_expense(expense_id):
             e.facture_mime = None
             e.facture_nom  = None
             e.facture_url  = None
+            e.facture_thumb_url = None
         else:
+            previous_url = e.facture_url
             e.facture_data, e.facture_mime, e.facture_nom, e.facture_url = _handle_facture(
                 request.files, e.facture_data, e.facture_mime, e.facture_nom, e.facture_url)
+            if e.facture_url != previous_url:
+                e.facture_thumb_url = None
 
         db.session.commit()
+        if e.facture_url and not e.facture_thumb_url:
+            schedule_media('expense_facture', e.facture_url, e.facture_mime, org.id)
         flash('Dépense modifiée', 'success')
         return redirect(url_for('expenses'))
 
@@ -161,20 +169,10 @@ def edit_expense(expense_id):
 @subscription_required
 def expense_facture(expense_id):
     """Affiche ou télécharge la facture jointe à une dépense."""
-    from flask import redirect as _redirect
     org = current_organization()
-    e = Expense.query.filter_by(id=expense_id, organization_id=org.id).first_or_404()
-    if e.facture_url:
-        return _redirect(e.facture_url)
-    if not e.facture_data:
-        abort(404)
-    raw = base64.b64decode(e.facture_data)
-    buf = io.BytesIO(raw)
-    buf.seek(0)
-    download = request.args.get('dl', '0') == '1'
-    filename = e.facture_nom or f"facture_{expense_id}"
-    return send_file(buf, mimetype=e.facture_mime,
-                     as_attachment=download, download_name=filename)
+    e = Expense.query.options(db.undefer(Expense.facture_data)).filter_by(id=expense_id, organization_id=org.id).first_or_404()
+    return send_attachment(e.facture_url, e.facture_data, e.facture_mime,
+                           e.facture_nom or f"facture_{expense_id}")
 
 
 @app.route('/expense/nouvelle-immobilisation', methods=['GET', 'POST'])
@@ -209,7 +207,7 @@ def nouvelle_immobilisation():
                 parts.append(f"Note: {notes}")
             description = " | ".join(parts)
 
-            facture_data, facture_mime, facture_nom = _handle_facture(request.files)
+            facture_data, facture_mime, facture_nom, facture_url = _handle_facture(request.files)
 
             e = Expense(
                 organization_id=org.id,
@@ -220,9 +218,11 @@ def nouvelle_immobilisation():
                 facture_data=facture_data,
                 facture_mime=facture_mime,
                 facture_nom=facture_nom,
+                facture_url=facture_url,
             )
             db.session.add(e)
             db.session.commit()
+            schedule_media('expense_facture', facture_url, facture_mime, org.id)
             flash(f'Immobilisation "{asset_name}" enregistrée ({amount:.3f} DT, amort. {duration} ans).', 'success')
         except Exception as ex:
             print(f"ERREUR immobilisation: {ex}")
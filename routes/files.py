@@ -0,0 +1,20 @@
+"""
+Fichiers du stockage local adressé par contenu (cf. storage_helper).
+"""
+from flask import request
+from core import app
+from utils import login_required
+from storage_helper import BLOB_PREFIX, file_href
+from utils_blobs import send_attachment
+
+
+@app.template_filter('file_url')
+def file_url_filter(value):
+    return file_href(value)
+
+
+@app.route('/fichiers/<name>')
+@login_required
+def blob_download(name):
+    """Blob référencé directement par un gabarit (scan chèque, photo ticket, PV…)."""
+    return send_attachment(BLOB_PREFIX + name, download_name=request.args.get('nom'))
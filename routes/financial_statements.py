@@ -3,13 +3,17 @@
 Conformes au Système Comptable des Entreprises (SCE) — Loi tunisienne 96-112 du 30/12/1996
 Normes Comptables Tunisiennes (NCT 01 et suivantes)
 """
-from flask import render_template, request, send_file
-from core import app
-from models import Apartment, Payment, Expense, Organization, MiscReceipt
-from utils import current_user, current_organization, login_required, admin_required, subscription_required
+from flask import render_template, request, flash, redirect, url_for
+from core import app, db
+from models import Apartment, Payment, Expense, Organization, MiscReceipt, FiscalYearClosing
+from utils import (current_user, current_organization, login_required, admin_required,
+                   subscription_required, get_unpaid_map)
+from utils_reports import report, serve_report
+from utils_closing import (YearFigures, base_cumuls, close_year, closing_receivables,
+                           closing_sce_accounts, fresh_closings, sums_by_month, sums_by_year,
+                           year_figures)
 from datetime import datetime, date
-from dateutil.relativedelta import relativedelta
-import io
+from sqlalchemy.orm import joinedload, selectinload
 
 
 # Mapping categories depenses -> comptes SCE tunisiens
@@ -48,57 +52,76 @@ def _s(text):
     )
 
 
+def sce_accounts(categories):
+    """Charges d'exploitation par compte SCE, depuis [(catégorie, montant)] de l'exercice
+    (immobilisations et charges financières exclues)."""
+    par_compte = {}
+    for cat, amount in categories:
+        if cat in ('Immobilisation', 'Charges bancaires'):
+            continue
+        key = CATEGORY_TO_SCE.get(cat or 'Autre', ('65x', "Autres charges d'exploitation"))
+        par_compte[key] = par_compte.get(key, 0.0) + amount
+    return sorted([
+        {'compte': k[0], 'libelle': k[1], 'montant': v}
+        for k, v in par_compte.items()
+    ], key=lambda x: x['compte'])
+
+
 def _compute_financial_data(org, year):
-    """Calcule toutes les données financières pour une organisation et une année."""
-
-    apartments = Apartment.query.filter_by(organization_id=org.id).all()
-    all_payments = Payment.query.filter_by(organization_id=org.id).all()
-    all_expenses = Expense.query.filter_by(organization_id=org.id).all()
-    all_misc = MiscReceipt.query.filter_by(organization_id=org.id).all()
-
-    year_payments = [p for p in all_payments if p.payment_date.year == year]
-    year_expenses = [e for e in all_expenses if e.expense_date.year == year]
-    year_misc = [m for m in all_misc if m.payment_date.year == year]
-
-    # Séparer immobilisations (22x), charges financières (627) et charges d'exploitation (6xx)
-    all_immos    = [e for e in all_expenses  if e.category == 'Immobilisation']
-    year_immos   = [e for e in year_expenses if e.category == 'Immobilisation']
-    all_charges  = [e for e in all_expenses  if e.category != 'Immobilisation']
-    year_charges = [e for e in year_expenses if e.category != 'Immobilisation']
-    # Charges financières (compte 627) — séparées pour l'état de résultat
-    year_charges_fin  = [e for e in year_charges  if e.category == 'Charges bancaires']
-    year_charges_expl = [e for e in year_charges  if e.category != 'Charges bancaires']
+    """Calcule toutes les données financières pour une organisation et une année.
+    Agrégats SQL groupés (année, catégorie, mois) : le coût dépend du nombre de
+    comptes SCE et d'exercices, pas du nombre d'opérations. Les exercices clôturés
+    (utils_closing) ne sont plus agrégés : les cumuls partent de la dernière clôture."""
+
+    apartments = (Apartment.query
+                  .options(joinedload(Apartment.block), selectinload(Apartment.residents))
+                  .filter_by(organization_id=org.id).order_by(Apartment.id).all())
+
+    # Dernière clôture à jour : cumuls au 31/12, seuls les exercices suivants sont agrégés
+    closings = fresh_closings(org.id)
+    base_year, base = base_cumuls(closings)
+    payments_by_year = sums_by_year(Payment, Payment.payment_date, org.id, after=base_year)
+    misc_by_year     = sums_by_year(MiscReceipt, MiscReceipt.payment_date, org.id, after=base_year)
+    # {(année, catégorie): total} — base de tous les totaux de dépenses postérieurs
+    expenses_by_cat  = sums_by_year(Expense, Expense.expense_date, org.id, Expense.category,
+                                    after=base_year)
+
+    def expenses(cats=lambda c: True):
+        return sum(v for (_, c), v in expenses_by_cat.items() if cats(c))
+
+    is_immo = lambda c: c == 'Immobilisation'
+    is_fin  = lambda c: c == 'Charges bancaires'
+
+    # Totaux de l'exercice affiché : clôture, exercice antérieur (SQL) ou groupes ci-dessus
+    if base_year is not None and year <= base_year:
+        figures = year_figures(org.id, year, closings)
+    else:
+        encaisse_par_mois = sums_by_month(Payment, Payment.payment_date, org.id, year)
+        depense_par_mois  = sums_by_month(Expense, Expense.expense_date, org.id, year)
+        figures = YearFigures(
+            payments=payments_by_year.get((year,), 0.0),
+            misc=misc_by_year.get((year,), 0.0),
+            categories=[(c, v) for (y, c), v in expenses_by_cat.items() if y == year],
+            monthly=[(encaisse_par_mois.get(m, 0.0), depense_par_mois.get(m, 0.0)) for m in range(1, 13)],
+        )
 
     # ── BILAN — ACTIF ─────────────────────────────────────────────────────────
 
     # 511/530 — Liquidités : trésorerie nette cumulée (tous décaissements inclus)
-    total_encaisse_cumul = sum(p.amount for p in all_payments) + sum(m.amount for m in all_misc)
-    total_depenses_cumul = sum(e.amount for e in all_expenses)  # immos incluses car argent sorti
+    total_paiements_cumul = base['payments'] + sum(payments_by_year.values())
+    total_encaisse_cumul = total_paiements_cumul + base['misc'] + sum(misc_by_year.values())
+    total_depenses_cumul = base['expenses'] + expenses()  # immos incluses car argent sorti
     tresorerie_nette = total_encaisse_cumul - total_depenses_cumul
     liquidites = max(0.0, tresorerie_nette)
 
     # 411 — Créances copropriétaires : charges impayées (valeur des mois en souffrance)
-    today = date.today()
-    # Mois payés par appartement, construits UNE fois (au lieu de parcourir
-    # all_payments pour chaque appartement → évite O(apts × paiements))
-    paid_by_apt = {}
-    for p in all_payments:
-        paid_by_apt.setdefault(p.apartment_id, set()).add(p.month_paid)
+    # Mois impayés depuis la création : registre apartment_arrears, 1 requête
+    unpaid_map = get_unpaid_map(org.id, apartments)
     creances_detail = []
     total_creances = 0.0
     for apt in apartments:
-        apt_paid_months = paid_by_apt.get(apt.id, set())
-        # Compter les mois depuis la création de l'appartement jusqu'à aujourd'hui
-        start = apt.created_at.date().replace(day=1)
-        cursor = start
-        montant_du = 0.0
-        while cursor <= today.replace(day=1):
-            mk = cursor.strftime('%Y-%m')
-            if mk not in apt_paid_months:
-                montant_du += apt.monthly_fee
-            cursor += relativedelta(months=1)
         # Déduire le crédit disponible
-        montant_du = max(0.0, montant_du - apt.credit_balance)
+        montant_du = max(0.0, unpaid_map.get(apt.id, 0) * apt.monthly_fee - apt.credit_balance)
         if montant_du > 0:
             resident = apt.residents[0] if apt.residents else None
             creances_detail.append({
@@ -111,14 +134,14 @@ def _compute_financial_data(org, year):
     total_actif_courant = liquidites + total_creances
 
     # 22x — Immobilisations corporelles (valeur brute cumulée tous exercices)
-    total_immobilisations = sum(e.amount for e in all_immos)
-    immos_detail = []
-    for e in sorted(all_immos, key=lambda x: x.expense_date, reverse=True):
-        immos_detail.append({
-            'date': e.expense_date,
-            'description': e.description or e.category,
-            'montant': e.amount,
-        })
+    total_immobilisations = base['immos'] + expenses(cats=is_immo)
+    immos_detail = [
+        {'date': d, 'description': desc or cat, 'montant': amount}
+        for d, desc, cat, amount in (
+            db.session.query(Expense.expense_date, Expense.description, Expense.category, Expense.amount)
+            .filter(Expense.organization_id == org.id, Expense.category == 'Immobilisation')
+            .order_by(Expense.expense_date.desc(), Expense.id))
+    ]
     total_actif_non_courant = total_immobilisations
     total_actif = total_actif_courant + total_actif_non_courant
 
@@ -147,13 +170,13 @@ def _compute_financial_data(org, year):
     fonds_roulement = total_actif - total_passif_courant - total_passif_non_courant
 
     # Résultat de l'exercice sélectionné (hors immobilisations — ce sont des actifs, pas des charges)
-    produits_exercice = sum(p.amount for p in year_payments)
-    charges_exercice = sum(e.amount for e in year_charges)
+    produits_exercice = figures.payments
+    charges_exercice = sum(v for c, v in figures.categories if not is_immo(c))
     resultat_exercice = produits_exercice - charges_exercice
 
     # Résultats reportés = résultat cumulé hors exercice en cours (hors immobilisations)
-    produits_anterieurs = sum(p.amount for p in all_payments if p.payment_date.year != year)
-    charges_anterieures = sum(e.amount for e in all_charges if e.expense_date.year != year)
+    produits_anterieurs = total_paiements_cumul - produits_exercice
+    charges_anterieures = total_depenses_cumul - total_immobilisations - charges_exercice
     resultats_reportes = produits_anterieurs - charges_anterieures
 
     # Recalcul capitaux propres pour équilibre bilanciel
@@ -171,28 +194,34 @@ def _compute_financial_data(org, year):
     # Cotisations appelées théoriques (ce qui aurait dû être encaissé)
     cotisations_appelees = sum(apt.monthly_fee * 12 for apt in apartments)
 
-    # Autres produits d'exploitation (encaissements divers)
-    autres_produits = sum(m.amount for m in year_misc)
+    # Autres produits d'exploitation (encaissements divers) — lignes de l'exercice seulement
+    autres_produits = figures.misc
     autres_produits_detail = [
-        {'libelle': m.libelle, 'date': m.payment_date, 'montant': m.amount}
-        for m in sorted(year_misc, key=lambda x: x.payment_date)
+        {'libelle': libelle, 'date': d, 'montant': amount}
+        for libelle, d, amount in (
+            db.session.query(MiscReceipt.libelle, MiscReceipt.payment_date, MiscReceipt.amount)
+            .filter(MiscReceipt.organization_id == org.id,
+                    MiscReceipt.payment_date >= date(year, 1, 1),
+                    MiscReceipt.payment_date < date(year + 1, 1, 1))
+            .order_by(MiscReceipt.payment_date, MiscReceipt.id))
     ]
 
-    # Charges d'exploitation par catégorie SCE (immobilisations + charges financières exclues)
-    charges_par_compte = {}
-    for e in year_charges_expl:
-        cat = e.category or 'Autre'
-        compte, libelle = CATEGORY_TO_SCE.get(cat, ('65x', "Autres charges d'exploitation"))
-        key = (compte, libelle)
-        charges_par_compte[key] = charges_par_compte.get(key, 0.0) + e.amount
+    # Charges d'exploitation par catégorie SCE (immobilisations + charges financières exclues) :
+    # figées à la clôture pour un exercice clôturé
+    closing = closings.get(year)
+    charges_sce = closing_sce_accounts(closing) if closing else sce_accounts(figures.categories)
 
-    charges_sce = sorted([
-        {'compte': k[0], 'libelle': k[1], 'montant': v}
-        for k, v in charges_par_compte.items()
-    ], key=lambda x: x['compte'])
+    # Annexe — créances au 31/12 de l'exercice clôturé (le bilan ci-dessus est à date)
+    creances_cloture = None
+    if closing:
+        by_id = {apt.id: apt for apt in apartments}
+        creances_cloture = [
+            {'apt': f"{by_id[apt_id].block.name}-{by_id[apt_id].number}" if apt_id in by_id else f"#{apt_id}",
+             'mois': mois, 'montant': montant}
+            for apt_id, (mois, montant) in sorted(closing_receivables(closing).items())]
 
     # Charges financières (compte 627 — services bancaires)
-    total_charges_financieres = sum(e.amount for e in year_charges_fin)
+    total_charges_financieres = sum(v for c, v in figures.categories if is_fin(c))
     charges_financieres_sce = []
     if total_charges_financieres > 0:
         charges_financieres_sce = [{'compte': '627', 'libelle': 'Services bancaires et assimilés', 'montant': total_charges_financieres}]
@@ -204,9 +233,7 @@ def _compute_financial_data(org, year):
 
     # ── FLUX DE TRÉSORERIE (mensuel pour l'exercice) ─────────────────────────
     flux_mensuel = []
-    for m in range(1, 13):
-        encaisse = sum(p.amount for p in year_payments if p.payment_date.month == m)
-        depense = sum(e.amount for e in year_expenses if e.expense_date.month == m)
+    for m, (encaisse, depense) in enumerate(figures.monthly, start=1):
         flux_mensuel.append({
             'mois': m,
             'mois_label': ['', 'Jan', 'Fév', 'Mar', 'Avr', 'Mai', 'Jun',
@@ -264,6 +291,7 @@ def _compute_financial_data(org, year):
         'total_charges_expl': total_charges_expl,
         'charges_financieres_sce': charges_financieres_sce,
         'total_charges_financieres': total_charges_financieres,
+        'creances_cloture': creances_cloture,
         'total_charges': total_charges,
         'total_produits': total_produits,
         'resultat_net': resultat_net,
@@ -271,6 +299,10 @@ def _compute_financial_data(org, year):
         # Flux de trésorerie
         'flux_mensuel': flux_mensuel,
         'tresorerie_nette': tresorerie_nette,
+        'exercices': sorted(base['exercices'] | {y for (y,) in payments_by_year}
+                            | {y for y, _ in expenses_by_cat}),
+        'total_paiements_cumul': total_paiements_cumul,
+        'total_depenses_cumul': total_depenses_cumul,
     }
 
 
@@ -282,32 +314,60 @@ def etats_financiers():
     org = current_organization()
     year = request.args.get('year', date.today().year, type=int)
 
+    data = _compute_financial_data(org, year)
+
     # Années disponibles (depuis la première dépense ou le premier paiement)
-    all_payments = Payment.query.filter_by(organization_id=org.id).all()
-    all_expenses = Expense.query.filter_by(organization_id=org.id).all()
-    years_set = {p.payment_date.year for p in all_payments} | {e.expense_date.year for e in all_expenses}
+    years_set = set(data['exercices'])
     years_set.add(date.today().year)
     available_years = sorted(years_set, reverse=True)
 
-    data = _compute_financial_data(org, year)
+    can_close = year < date.today().year
+    closing = (FiscalYearClosing.query.filter_by(organization_id=org.id, year=year).first()
+               if can_close else None)
 
     return render_template(
         'financial_statements.html',
         user=current_user(),
         available_years=available_years,
         selected_year=year,
+        can_close=can_close,
+        closing=closing,
         **data
     )
 
 
+@app.route('/etats-financiers/cloture', methods=['POST'])
+@login_required
+@admin_required
+@subscription_required
+def etats_financiers_cloture():
+    """Clôture (ou re-clôture) d'un exercice terminé."""
+    org = current_organization()
+    year = request.form.get('year', type=int)
+    try:
+        close_year(org, year, user=current_user())
+    except (TypeError, ValueError):
+        flash("Seul un exercice terminé peut être clôturé.", "danger")
+    else:
+        flash(f"Exercice {year} clôturé.", "success")
+    return redirect(url_for('etats_financiers', year=year))
+
+
 @app.route('/etats-financiers/pdf')
 @login_required
 @admin_required
 @subscription_required
 def etats_financiers_pdf():
     """Génère le PDF des états financiers selon les normes SCE tunisiennes."""
-    org = current_organization()
     year = request.args.get('year', date.today().year, type=int)
+    return serve_report('financial_statements_pdf', current_organization(), {'year': year},
+                        user=current_user(), title=f"États financiers {year}")
+
+
+# « Arrêté au » = date du jour : un PDF par jour au plus
+@report('financial_statements_pdf', admin_only=True,
+        version=lambda org, params: date.today().isoformat())
+def _render_financial_statements(org, year):
     data = _compute_financial_data(org, year)
 
     from fpdf import FPDF
@@ -600,8 +660,8 @@ def etats_financiers_pdf():
     pdf.set_font('Helvetica', '', 8)
     pdf.set_text_color(WHITE_R, WHITE_G, WHITE_B)
     items = [
-        ("Total encaissements cumulés (511)", f"{sum(p.amount for p in Payment.query.filter_by(organization_id=org.id).all()):,.3f} DT"),
-        ("Total dépenses cumulées (401/511)", f"{sum(e.amount for e in Expense.query.filter_by(organization_id=org.id).all()):,.3f} DT"),
+        ("Total encaissements cumulés (511)", f"{data['total_paiements_cumul']:,.3f} DT"),
+        ("Total dépenses cumulées (401/511)", f"{data['total_depenses_cumul']:,.3f} DT"),
         ("Solde trésorerie nette", f"{data['tresorerie_nette']:,.3f} DT"),
     ]
     for label, value in items:
@@ -621,13 +681,5 @@ def etats_financiers_pdf():
     pdf.cell(0, 4, "Ce document est produit a titre informatif et de gestion interne. Il ne remplace pas un bilan certifie par un expert-comptable agree.", new_x="LMARGIN", new_y="NEXT", align='C')
 
     # ── Export PDF ────────────────────────────────────────────────────────────
-    pdf_bytes = pdf.output()
-    output = io.BytesIO(pdf_bytes)
-    output.seek(0)
     filename = f"SyndicPro_{org.name}_EtatsFinanciers_{year}_{datetime.now().strftime('%Y%m%d')}.pdf"
-    return send_file(
-        output,
-        download_name=filename,
-        as_attachment=True,
-        mimetype='application/pdf'
-    )
+    return pdf.output(), filename
@@ -4,10 +4,11 @@ from models import Apartment, Payment, FlouciPayment, Organization, User
 from utils import (current_user, current_organization, login_required,
                    admin_required, subscription_required, get_next_unpaid_month)
 from datetime import datetime
-import requests as http
+import utils_http as http
 import os
 import uuid
 from utils_whatsapp import notify_payment
+from utils_arrears import record_paid_months
 
 BASE_URL = os.environ.get('BASE_URL', 'https://www.syndicpro.tn')
 
@@ -34,7 +35,7 @@ def _call_flouci_init(org, apartment, month_target, amount_dt, created_by='resid
 
     try:
         resp = http.post(
-            FLOUCI_GENERATE_URL,
+            'flouci', FLOUCI_GENERATE_URL,
             json={
                 'app_token': org.flouci_app_token,
                 'app_secret': org.flouci_app_secret,
@@ -45,7 +46,6 @@ def _call_flouci_init(org, apartment, month_target, amount_dt, created_by='resid
                 'fail_link': f"{BASE_URL}/flouci/fail",
                 'developer_tracking_id': f"fp-{fp.id}",
             },
-            timeout=15
         )
 
         if resp.status_code in (200, 201):
@@ -142,12 +142,11 @@ def flouci_success():
     verified = False
     try:
         resp = http.get(
-            FLOUCI_VERIFY_URL.format(payment_id=payment_id),
+            'flouci', FLOUCI_VERIFY_URL.format(payment_id=payment_id),
             headers={
                 'app_token': org.flouci_app_token,
                 'app_secret': org.flouci_app_secret,
             },
-            timeout=10
         )
         if resp.status_code == 200:
             data = resp.json()
@@ -181,6 +180,7 @@ def flouci_success():
                     credit_used=0.0
                 )
                 db.session.add(p)
+        record_paid_months(Apartment.query.get(fp.apartment_id), months_to_pay)
         fp.status = 'completed'
         fp.paid_at = datetime.utcnow()
         db.session.commit()
@@ -256,7 +256,7 @@ def flouci_pay_multi():
     session_id = f"fp-{fp.id}-multi"
     try:
         resp = http.post(
-            FLOUCI_GENERATE_URL,
+            'flouci', FLOUCI_GENERATE_URL,
             json={
                 'app_token': org.flouci_app_token,
                 'app_secret': org.flouci_app_secret,
@@ -267,7 +267,6 @@ def flouci_pay_multi():
                 'fail_link': f"{BASE_URL}/flouci/fail",
                 'developer_tracking_id': f"fp-{fp.id}",
             },
-            timeout=15
         )
         if resp.status_code in (200, 201):
             data = resp.json()
@@ -0,0 +1,43 @@
+from flask import render_template, redirect, url_for, flash, request
+from core import app, db
+from models import NotificationJob, Organization
+from utils import login_required, superadmin_required
+from utils_jobs import queue_stats, PROVIDER_CONCURRENCY
+from datetime import datetime
+
+
+@app.route('/superadmin/jobs')
+@login_required
+@superadmin_required
+def superadmin_jobs():
+    """État de la file des notifications sortantes."""
+    status = request.args.get('status', '')
+    q = NotificationJob.query
+    if status in ('pending', 'running', 'done', 'failed'):
+        q = q.filter_by(status=status)
+    jobs = q.order_by(NotificationJob.id.desc()).limit(100).all()
+    org_names = dict(db.session.query(Organization.id, Organization.name)
+                     .filter(Organization.id.in_({j.organization_id for j in jobs if j.organization_id}))
+                     .all())
+    return render_template('superadmin/jobs.html',
+                           stats=queue_stats(),
+                           concurrency=PROVIDER_CONCURRENCY,
+                           jobs=jobs,
+                           org_names=org_names,
+                           status=status)
+
+
+@app.route('/superadmin/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+@superadmin_required
+def superadmin_job_retry(job_id):
+    """Remet un job échoué dans la file (nouvelle série de tentatives)."""
+    job = NotificationJob.query.get_or_404(job_id)
+    if job.status == 'failed':
+        job.status = 'pending'
+        job.attempts = 0
+        job.run_after = datetime.utcnow()
+        job.finished_at = None
+        db.session.commit()
+        flash(f'Job #{job.id} remis en file.', 'success')
+    return redirect(url_for('superadmin_jobs', status=request.args.get('status', '')))
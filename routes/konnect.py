@@ -4,9 +4,10 @@ from models import Apartment, Payment, KonnectPayment, Organization, User
 from utils import (current_user, current_organization, login_required,
                    admin_required, subscription_required, get_next_unpaid_month)
 from datetime import datetime
-import requests as http
+import utils_http as http
 import os
 from utils_whatsapp import notify_payment
+from utils_arrears import record_paid_months
 
 BASE_URL = os.environ.get('BASE_URL', 'https://www.syndicpro.tn')
 
@@ -28,7 +29,7 @@ def _call_konnect_init(org, apartment, month_target, amount_dt, created_by='resi
 
     try:
         resp = http.post(
-            'https://api.konnect.network/api/v2/payments/init-payment',
+            'konnect', 'https://api.konnect.network/api/v2/payments/init-payment',
             headers={
                 'x-api-key': org.konnect_api_key,
                 'Content-Type': 'application/json'
@@ -47,7 +48,6 @@ def _call_konnect_init(org, apartment, month_target, amount_dt, created_by='resi
                 'failRedirectUrl': f"{BASE_URL}/konnect/fail",
                 'orderId': f"kp-{kp.id}",
             },
-            timeout=15
         )
 
         if resp.status_code in (200, 201):
@@ -146,9 +146,8 @@ def konnect_success():
     verified = False
     try:
         resp = http.get(
-            f'https://api.konnect.network/api/v2/payments/{payment_ref}',
+            'konnect', f'https://api.konnect.network/api/v2/payments/{payment_ref}',
             headers={'x-api-key': org.konnect_api_key},
-            timeout=10
         )
         if resp.status_code == 200:
             data = resp.json()
@@ -183,6 +182,7 @@ def konnect_success():
                     credit_used=0.0
                 )
                 db.session.add(p)
+        record_paid_months(Apartment.query.get(kp.apartment_id), months_to_pay)
 
         kp.status = 'completed'
         kp.paid_at = datetime.utcnow()
@@ -302,8 +302,8 @@ def konnect_pay_multi():
     db.session.flush()
 
     try:
-        resp = __import__('requests').post(
-            'https://api.konnect.network/api/v2/payments/init-payment',
+        resp = http.post(
+            'konnect', 'https://api.konnect.network/api/v2/payments/init-payment',
             headers={'x-api-key': org.konnect_api_key, 'Content-Type': 'application/json'},
             json={
                 'receiverWalletId': org.konnect_wallet_id,
@@ -319,7 +319,6 @@ def konnect_pay_multi():
                 'failRedirectUrl': f"{BASE_URL}/konnect/fail",
                 'orderId': f"kp-{kp.id}",
             },
-            timeout=15
         )
         if resp.status_code in (200, 201):
             data = resp.json()
@@ -1,10 +1,12 @@
 from flask import render_template, request, redirect, url_for, flash, jsonify
 from core import app, db
-from models import Lift, LiftIncident, Block, Intervenant, User
+from models import Lift, LiftIncident, Block, Intervenant, Organization, User
 from utils import current_user, current_organization, login_required, admin_required, subscription_required
 from datetime import datetime
 import secrets
 
+from utils_telemetry import delete_lift_telemetry, lift_availability, parse_metrics, record_samples
+
 
 # ─── Pages principales ────────────────────────────────────────────────────────
 
@@ -106,7 +108,8 @@ def lift_detail(lift_id):
                            user=user, org=org,
                            lift=lift,
                            incidents=incidents,
-                           intervenants=intervenants)
+                           intervenants=intervenants,
+                           availability=lift_availability(lift.id))
 
 
 # ─── CRUD ascenseurs (admin) ──────────────────────────────────────────────────
@@ -143,6 +146,7 @@ def lift_supprimer(lift_id):
     org  = current_organization()
     lift = Lift.query.filter_by(id=lift_id, organization_id=org.id).first_or_404()
     nom  = lift.name
+    delete_lift_telemetry(lift.id)
     db.session.delete(lift)
     db.session.commit()
     flash(f'Ascenseur « {nom} » supprimé.', 'success')
@@ -188,54 +192,121 @@ def lift_report_incident(lift_id):
 
 # ─── Endpoint IoT (capteur physique) ─────────────────────────────────────────
 
+def _iot_lift(data, lock=False):
+    """Ascenseur authentifié par sa clé IoT (header X-API-Key ou api_key du corps).
+    lock=True : ligne verrouillée (SELECT … FOR UPDATE) jusqu'au commit — deux lots
+    du même capteur (rejeu, requêtes concurrentes) sont appliqués l'un après l'autre."""
+    api_key = request.headers.get('X-API-Key') or data.get('api_key')
+    if not api_key:
+        return None, (jsonify({'error': 'X-API-Key manquant'}), 401)
+    q = Lift.query.filter_by(iot_api_key=api_key)
+    lift = (q.with_for_update() if lock else q).first()
+    if not lift:
+        return None, (jsonify({'error': 'Clé invalide'}), 401)
+    return lift, None
+
+
+def _apply_iot_statuses(lift, samples):
+    """Applique des mesures [(statut, description, horodatage ou None)] dans l'ordre.
+    Au plus un incident automatique (premier passage ok → warning/down, si aucun
+    incident n'est ouvert). Retourne (incident créé ou None, statut à notifier ou None)
+    — une seule notification pour le lot, sur la transition nette."""
+    initial = lift.status
+    incident = None
+    for status, description, ts in samples:
+        if status in ('warning', 'down') and lift.status == 'ok' and incident is None:
+            existing = LiftIncident.query.filter_by(lift_id=lift.id).filter(
+                LiftIncident.status.in_(['ouvert', 'en_cours'])).first()
+            if not existing:
+                incident = LiftIncident(
+                    organization_id=lift.organization_id,
+                    lift_id=lift.id,
+                    source='iot',
+                    description=description or f'Anomalie détectée par capteur IoT — statut : {status.upper()}',
+                    status='ouvert',
+                    created_at=ts or datetime.utcnow(),
+                )
+                db.session.add(incident)
+        lift.status = status
+    if incident is not None and lift.status != 'ok':
+        return incident, lift.status
+    if lift.status == 'ok' and initial != 'ok':
+        return incident, 'ok'
+    return incident, None
+
+
 @app.route('/api/v1/iot/telemetry', methods=['POST'])
 def iot_telemetry():
     """Reçoit les données du capteur IoT. Authentification par iot_api_key."""
-    api_key = request.headers.get('X-API-Key') or (request.get_json(silent=True) or {}).get('api_key')
-    if not api_key:
-        return jsonify({'error': 'X-API-Key manquant'}), 401
-
-    lift = Lift.query.filter_by(iot_api_key=api_key).first()
-    if not lift:
-        return jsonify({'error': 'Clé invalide'}), 401
+    data = request.get_json(silent=True) or {}
+    # Verrou : telemetry_last_* lus puis avancés par record_samples
+    lift, error = _iot_lift(data, lock=True)
+    if error:
+        return error
 
-    data   = request.get_json(silent=True) or {}
     status = data.get('status', '').lower()
-    if status not in ('ok', 'warning', 'down'):
-        return jsonify({'error': 'status doit être ok / warning / down'}), 400
-
-    old_status = lift.status
-    lift.status = status
-
-    incident_id = None
-    if status in ('warning', 'down') and old_status == 'ok':
-        # Créer un incident automatique si pas déjà ouvert
-        existing = LiftIncident.query.filter_by(lift_id=lift.id).filter(
-            LiftIncident.status.in_(['ouvert', 'en_cours'])).first()
-        if not existing:
-            desc = data.get('description') or f'Anomalie détectée par capteur IoT — statut : {status.upper()}'
-            inc = LiftIncident(
-                organization_id=lift.organization_id,
-                lift_id=lift.id,
-                source='iot',
-                description=desc,
-                status='ouvert',
-            )
-            db.session.add(inc)
-            db.session.flush()
-            incident_id = inc.id
-            from core import db as _db
-            _db.session.commit()
-            _notify_lift_status(lift.organization, lift, status, source='iot', incident=inc)
-        else:
-            db.session.commit()
-    elif status == 'ok' and old_status != 'ok':
-        db.session.commit()
-        _notify_lift_status(lift.organization, lift, 'ok', source='iot')
-    else:
-        db.session.commit()
+    try:
+        if status not in ('ok', 'warning', 'down'):
+            raise ValueError('status doit être ok / warning / down')
+        metrics = parse_metrics(data.get('metrics'))
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+    record_samples(lift, [(datetime.utcnow(), status, metrics)])
+    inc, notify = _apply_iot_statuses(lift, [(status, data.get('description'), None)])
+    db.session.commit()
+    if notify:
+        _notify_lift_status(db.session.get(Organization, lift.organization_id), lift, notify, source='iot', incident=inc)
+
+    return jsonify({'ok': True, 'lift_id': lift.id, 'status': status, 'incident_id': inc.id if inc else None})
+
+
+@app.route('/api/v1/iot/telemetry/batch', methods=['POST'])
+def iot_telemetry_batch():
+    """Mesures accumulées par un capteur hors ligne : {"events": [{seq, ts, status,
+    description?, metrics?}]}. Les seq déjà appliqués (≤ lift.iot_last_seq) sont ignorés ;
+    les autres sont enregistrés dans l'ordre des horodatages, en un seul commit. Seuls
+    ceux postérieurs à la dernière mesure reçue modifient le statut de l'ascenseur."""
+    from utils_ingest import BatchError, batch_events, validate
+    data = request.get_json(silent=True) or {}
+    # Verrou : iot_last_seq lu puis avancé dans la même transaction
+    lift, error = _iot_lift(data, lock=True)
+    if error:
+        return error
+    try:
+        events = batch_events(data)
+    except BatchError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), e.status
+
+    def check(event):
+        status = str(event.get('status') or '').lower()
+        if status not in ('ok', 'warning', 'down'):
+            raise ValueError('status doit être ok / warning / down')
+        return {'status': status, 'description': event.get('description'),
+                'metrics': parse_metrics(event.get('metrics'))}
+
+    valid, rejected = validate(events, check)
+    last_seq = lift.iot_last_seq if lift.iot_last_seq is not None else -1
+    fresh = [e for e in valid if e['seq'] > last_seq]
+
+    # Mesures antérieures à la dernière reçue (lot en retard sur une lecture en direct) :
+    # historisées seulement, le statut courant n'est pas remplacé par un état passé
+    last_at = lift.telemetry_last_at
+    current = [e for e in fresh if last_at is None or e['ts'] >= last_at]
+    record_samples(lift, [(e['ts'], e['status'], e['metrics']) for e in fresh])
+    inc, notify = _apply_iot_statuses(lift, [(e['status'], e['description'], e['ts']) for e in current])
+    if fresh:
+        lift.iot_last_seq = max(e['seq'] for e in fresh)
+    db.session.commit()
+    if notify:
+        _notify_lift_status(db.session.get(Organization, lift.organization_id), lift, notify, source='iot', incident=inc)
 
-    return jsonify({'ok': True, 'lift_id': lift.id, 'status': status, 'incident_id': incident_id})
+    return jsonify({'ok': True, 'lift_id': lift.id, 'status': lift.status,
+                    'accepted': len(fresh), 'duplicates': len(events) - len(rejected) - len(fresh),
+                    'rejected': rejected, 'last_seq': lift.iot_last_seq,
+                    'incident_id': inc.id if inc else None})
 
 
 # ─── Helpers notifications ────────────────────────────────────────────────────
@@ -284,18 +355,18 @@ def _notify_lift_status(org, lift, status, source='manuel', incident=None, repor
 
     # WhatsApp → admin
     try:
-        from utils_whatsapp import send_whatsapp
+        from utils_whatsapp import queue_whatsapp
         if org.whatsapp_admin_phone:
-            send_whatsapp(org, org.whatsapp_admin_phone, f"{title_admin}\n{body_admin}")
+            queue_whatsapp(org, org.whatsapp_admin_phone, f"{title_admin}\n{body_admin}")
     except Exception:
         pass
 
-    # Push → TOUS les résidents (warning + down + ok)
+    # Push → TOUS les résidents (warning + down + ok) — 1 seul job pour tout l'immeuble
     try:
-        from utils_push import push_to_user
-        residents = User.query.filter_by(organization_id=org.id, role='resident').all()
-        for r in residents:
-            push_to_user(r.id, title=title_res, body=body_res, url=url, tag=f"lift-res-{lift.id}")
+        from utils_push import push_to_users
+        resident_ids = [r[0] for r in db.session.query(User.id)
+                        .filter_by(organization_id=org.id, role='resident').all()]
+        push_to_users(resident_ids, title=title_res, body=body_res, url=url, tag=f"lift-res-{lift.id}")
     except Exception:
         pass
 
@@ -303,7 +374,7 @@ def _notify_lift_status(org, lift, status, source='manuel', incident=None, repor
 def _notify_intervenant(org, lift, incident, interv):
     """Notifie le réparateur assigné via WhatsApp."""
     try:
-        from utils_whatsapp import send_whatsapp
+        from utils_whatsapp import queue_whatsapp
         if interv.telephone:
             msg = (
                 f"🔧 *SyndicPro — Intervention ascenseur*\n"
@@ -313,6 +384,6 @@ def _notify_intervenant(org, lift, incident, interv):
                 f"\nProblème : {incident.description[:200]}\n"
                 f"Merci de confirmer votre intervention."
             )
-            send_whatsapp(org, interv.telephone, msg)
+            queue_whatsapp(org, interv.telephone, msg)
     except Exception:
         pass
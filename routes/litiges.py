@@ -1,5 +1,5 @@
-import base64, io
-from flask import render_template, request, redirect, url_for, flash, send_file, abort
+import base64
+from flask import render_template, request, redirect, url_for, flash
 from core import app, db
 from models import Litige, AutreLitige, LitigeDocument, Apartment, Intervenant
 from utils import (current_user, current_organization, login_required,
@@ -8,6 +8,7 @@ from utils import (current_user, current_organization, login_required,
 from sqlalchemy.orm import joinedload
 from datetime import datetime, date
 from storage_helper import upload_file as _storage_upload, delete_file as _storage_delete
+from utils_blobs import send_attachment
 
 SEUIL_ALERTE = 3   # mois impayés avant de proposer un litige
 MAX_DOC_BYTES = 10 * 1024 * 1024   # 10 Mo
@@ -158,7 +159,7 @@ def litige_ouvrir():
 @subscription_required
 def litige_detail(litige_id):
     org = current_organization()
-    l   = Litige.query.filter_by(id=litige_id, organization_id=org.id).first_or_404()
+    l   = Litige.query.options(db.undefer(Litige.letter_content)).filter_by(id=litige_id, organization_id=org.id).first_or_404()
     huissiers = Intervenant.query.filter(
         Intervenant.organization_id == org.id,
         Intervenant.categorie == 'Huissier de justice'
@@ -229,18 +230,11 @@ def litige_detail(litige_id):
 @admin_required
 @subscription_required
 def litige_accuse(litige_id):
-    from flask import redirect as _redirect
     org = current_organization()
-    l = Litige.query.filter_by(id=litige_id, organization_id=org.id).first_or_404()
-    if l.accuse_url:
-        return _redirect(l.accuse_url)
-    if not l.accuse_data:
-        abort(404)
-    buf = io.BytesIO(base64.b64decode(l.accuse_data))
-    buf.seek(0)
-    return send_file(buf, mimetype=l.accuse_mime,
-                     as_attachment=request.args.get('dl') == '1',
-                     download_name=l.accuse_nom or f'accuse_{litige_id}')
+    l = Litige.query.options(db.undefer(Litige.accuse_data))\
+        .filter_by(id=litige_id, organization_id=org.id).first_or_404()
+    return send_attachment(l.accuse_url, l.accuse_data, l.accuse_mime,
+                           l.accuse_nom or f'accuse_{litige_id}')
 
 
 @app.route('/litiges/<int:litige_id>/decharge')
@@ -248,18 +242,11 @@ def litige_accuse(litige_id):
 @admin_required
 @subscription_required
 def litige_decharge(litige_id):
-    from flask import redirect as _redirect
     org = current_organization()
-    l = Litige.query.filter_by(id=litige_id, organization_id=org.id).first_or_404()
-    if l.decharge_url:
-        return _redirect(l.decharge_url)
-    if not l.decharge_data:
-        abort(404)
-    buf = io.BytesIO(base64.b64decode(l.decharge_data))
-    buf.seek(0)
-    return send_file(buf, mimetype=l.decharge_mime,
-                     as_attachment=request.args.get('dl') == '1',
-                     download_name=l.decharge_nom or f'decharge_{litige_id}')
+    l = Litige.query.options(db.undefer(Litige.decharge_data))\
+        .filter_by(id=litige_id, organization_id=org.id).first_or_404()
+    return send_attachment(l.decharge_url, l.decharge_data, l.decharge_mime,
+                           l.decharge_nom or f'decharge_{litige_id}')
 
 
 # ─── Supprimer litige ─────────────────────────────────────────────────────────
@@ -351,19 +338,11 @@ def autre_litige_dossier(al_id):
 @admin_required
 @subscription_required
 def autre_litige_doc(al_id, doc_id):
-    from flask import redirect as _redirect
     org = current_organization()
     al  = AutreLitige.query.filter_by(id=al_id, organization_id=org.id).first_or_404()
-    doc = LitigeDocument.query.filter_by(id=doc_id, litige_id=al.id).first_or_404()
-    if doc.url:
-        return _redirect(doc.url)
-    if not doc.data:
-        abort(404)
-    buf = io.BytesIO(base64.b64decode(doc.data))
-    buf.seek(0)
-    return send_file(buf, mimetype=doc.mime,
-                     as_attachment=request.args.get('dl') == '1',
-                     download_name=doc.nom)
+    doc = LitigeDocument.query.options(db.undefer(LitigeDocument.data))\
+        .filter_by(id=doc_id, litige_id=al.id).first_or_404()
+    return send_attachment(doc.url, doc.data, doc.mime, doc.nom)
 
 
 @app.route('/litiges/autres/<int:al_id>/doc/<int:doc_id>/supprimer', methods=['POST'])
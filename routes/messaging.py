@@ -7,6 +7,9 @@ from models import DirectMessage, Apartment, User, Block
 from utils import (current_user, current_organization, login_required,
                    admin_required, subscription_required, check_subscription)
 from utils_push import push_to_user, push_to_admins
+from utils_profiler import query_budget
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
 from datetime import datetime
 
 
@@ -15,45 +18,51 @@ from datetime import datetime
 @app.route('/messagerie')
 @login_required
 @subscription_required
+@query_budget(12)
 def messagerie():
     org  = current_organization()
     user = current_user()
 
     if user.role == 'admin':
-        # Tous les appartements qui ont au moins 1 message, triés par dernier message
-        apts = (
-            db.session.query(Apartment)
-            .join(DirectMessage, DirectMessage.apartment_id == Apartment.id)
-            .filter(DirectMessage.organization_id == org.id)
-            .distinct()
-            .all()
-        )
-        # Pour chaque appartement : dernier message + nombre non-lus
+        # 4 requêtes quel que soit le nombre de fils : appartements (+ bloc, résidents),
+        # dernier message par appartement, non-lus groupés par appartement
+        all_apts = (Apartment.query.filter_by(organization_id=org.id)
+                    .options(joinedload(Apartment.block), selectinload(Apartment.residents))
+                    .all())
+        last_ts = (db.session.query(DirectMessage.apartment_id,
+                                    func.max(DirectMessage.created_at).label('last_ts'))
+                   .filter(DirectMessage.organization_id == org.id)
+                   .group_by(DirectMessage.apartment_id)
+                   .subquery())
+        last_msgs = {}
+        for m in (DirectMessage.query
+                  .join(last_ts, (DirectMessage.apartment_id == last_ts.c.apartment_id)
+                        & (DirectMessage.created_at == last_ts.c.last_ts))
+                  .filter(DirectMessage.organization_id == org.id)
+                  .order_by(DirectMessage.id.desc())):
+            last_msgs.setdefault(m.apartment_id, m)
+        unread_map = dict(db.session.query(DirectMessage.apartment_id, func.count(DirectMessage.id))
+                          .filter(DirectMessage.organization_id == org.id,
+                                  DirectMessage.read_at.is_(None),
+                                  DirectMessage.sender_id != user.id)
+                          .group_by(DirectMessage.apartment_id).all())
+
+        # Pour chaque appartement avec au moins 1 message : dernier message + nombre non-lus
         fils = []
-        for apt in apts:
-            last_msg = (DirectMessage.query
-                        .filter_by(organization_id=org.id, apartment_id=apt.id)
-                        .order_by(DirectMessage.created_at.desc())
-                        .first())
-            unread = (DirectMessage.query
-                      .filter_by(organization_id=org.id, apartment_id=apt.id)
-                      .filter(DirectMessage.read_at.is_(None))
-                      .filter(DirectMessage.sender_id != user.id)
-                      .count())
-            resident = apt.residents[0] if apt.residents else None
+        apts_sans_msg = []
+        for apt in all_apts:
+            last_msg = last_msgs.get(apt.id)
+            if last_msg is None:
+                apts_sans_msg.append(apt)
+                continue
             fils.append({
                 'apt': apt,
-                'resident': resident,
+                'resident': apt.residents[0] if apt.residents else None,
                 'last_msg': last_msg,
-                'unread': unread,
+                'unread': unread_map.get(apt.id, 0),
             })
         # Trier par dernier message (plus récent en premier)
-        fils.sort(key=lambda x: x['last_msg'].created_at if x['last_msg'] else datetime.min, reverse=True)
-
-        # Appartements sans messages pour démarrer une conversation
-        apt_ids_with_msgs = {f['apt'].id for f in fils}
-        all_apts = Apartment.query.filter_by(organization_id=org.id).all()
-        apts_sans_msg = [a for a in all_apts if a.id not in apt_ids_with_msgs]
+        fils.sort(key=lambda x: x['last_msg'].created_at, reverse=True)
 
         return render_template('messagerie.html', fils=fils, apts_sans_msg=apts_sans_msg, user=user)
 
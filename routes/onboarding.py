@@ -3,6 +3,7 @@ from flask import render_template, request, redirect, url_for, flash, send_file,
 from core import app, db
 from models import Organization, Block, Apartment, User
 from utils import current_user, current_organization, login_required, admin_required, subscription_required
+from utils_arrears import rebuild_arrears
 
 
 # ─── Dismiss du setup wizard ──────────────────────────────────────────────────
@@ -191,6 +192,7 @@ def onboarding_import():
     blocks_cache = {b.name.strip().upper(): b
                     for b in Block.query.filter_by(organization_id=org.id).all()}
     apts_cache   = {}  # (block_id, number_upper) → Apartment
+    new_apts     = []  # appartements créés : lignes du registre des impayés
 
     for apt in Apartment.query.filter_by(organization_id=org.id).all():
         apts_cache[(apt.block_id, apt.number.strip().upper())] = apt
@@ -260,6 +262,7 @@ def onboarding_import():
             db.session.add(apt)
             db.session.flush()
             apts_cache[apt_key] = apt
+            new_apts.append(apt)
             results['apts_created'] += 1
         else:
             apt = apts_cache[apt_key]
@@ -301,6 +304,7 @@ def onboarding_import():
                 })
 
     try:
+        rebuild_arrears(new_apts)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -14,6 +14,9 @@ from datetime import datetime, date
 import secrets
 import base64
 from storage_helper import upload_file as _storage_upload
+from utils_blobs import send_attachment
+from utils_media import schedule as schedule_media
+from utils_arrears import record_paid_months
 
 
 # ─── Résident — soumettre un virement ────────────────────────────────────────
@@ -87,6 +90,7 @@ def virement_soumettre():
     )
     db.session.add(pr)
     db.session.commit()
+    schedule_media('virement_photo', photo_url, photo_mime, org.id)
 
     flash('Votre demande de virement a été transmise. L\'administration va la valider sous peu.', 'success')
 
@@ -177,6 +181,8 @@ def confirm_virement(token):
                     description=f"{desc_base} — {mth}",
                 ))
                 created_months.append(mth)
+        if created_months:
+            record_paid_months(apt, created_months)
 
         # 2. Frais bancaires comme dépense (si > 0)
         if bank_fees > 0:
@@ -254,16 +260,11 @@ def virements_liste():
 @app.route('/payments/virement/<int:pr_id>/photo')
 @login_required
 def virement_photo(pr_id):
-    from flask import Response, redirect as _redirect
     user = current_user()
     org  = current_organization()
-    pr = PaymentRequest.query.filter_by(id=pr_id, organization_id=org.id).first_or_404()
-    if pr.photo_url:
-        return _redirect(pr.photo_url)
-    if not pr.photo_data:
-        abort(404)
-    raw = base64.b64decode(pr.photo_data)
-    return Response(raw, mimetype=pr.photo_mime or 'image/jpeg')
+    pr = PaymentRequest.query.options(db.undefer(PaymentRequest.photo_data))\
+        .filter_by(id=pr_id, organization_id=org.id).first_or_404()
+    return send_attachment(pr.photo_url, pr.photo_data, pr.photo_mime or 'image/jpeg')
 
 
 # ─── Notifications ───────────────────────────────────────────────────────────
@@ -290,7 +291,7 @@ def _notify_admin_virement(org, apt, resident, pr):
 
     # WhatsApp
     try:
-        from utils_whatsapp import send_whatsapp
+        from utils_whatsapp import queue_whatsapp
         if org.whatsapp_admin_phone:
             msg = (
                 f"💸 *SyndicPro — Virement bancaire reçu*\n"
@@ -302,7 +303,7 @@ def _notify_admin_virement(org, apt, resident, pr):
                 + (f"Réf. virement : {pr.bank_reference}\n" if pr.bank_reference else '') +
                 f"\n✅ Confirmer en 1 clic :\n{confirm_url}"
             )
-            send_whatsapp(org, org.whatsapp_admin_phone, msg)
+            queue_whatsapp(org, org.whatsapp_admin_phone, msg)
     except Exception:
         pass
 
@@ -2,14 +2,18 @@ from flask import render_template, request, redirect, url_for, flash, jsonify, s
 import io
 from core import app, db
 from sqlalchemy import extract as sql_extract
+from sqlalchemy.exc import IntegrityError
 from models import Apartment, Block, Payment, User, MiscReceipt, KonnectPayment, FlouciPayment, PaymentRequest
 from utils import (current_user, current_organization, login_required,
                    admin_required, subscription_required,
-                   get_unpaid_months_count, get_next_unpaid_month, ym_str)
+                   get_unpaid_months_count, get_next_unpaid_month,
+                   get_unpaid_details_map)
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
 from utils_whatsapp import notify_payment
 from storage_helper import upload_file as _storage_upload
+from utils_arrears import record_paid_months, refresh_arrears
+from utils_media import schedule as schedule_media
 
 MAX_CHEQUE_BYTES = 5 * 1024 * 1024
 ALLOWED_CHEQUE_MIMES = {'image/jpeg', 'image/png', 'image/webp', 'application/pdf'}
@@ -129,8 +133,11 @@ def payments():
             # Mettre à jour le crédit résiduel
             apt.credit_balance = new_remainder
             db.session.flush()  # obtenir les IDs avant l'upload
+            if paid_months_list:
+                record_paid_months(apt, paid_months_list)
 
             # Upload scan chèque — URL propagée sur tous les mois du groupe
+            cheque_scan = None   # (url, mime) à traiter après le commit
             if payment_mode == 'cheque' and all_payment_objs:
                 cheque_file = request.files.get('cheque_file')
                 if cheque_file and cheque_file.filename:
@@ -146,10 +153,13 @@ def payments():
                             if url:
                                 for po in all_payment_objs:
                                     po.cheque_url = url
+                                cheque_scan = (url, mime)
                             else:
-                                flash('Scan chèque non sauvegardé (Storage non configuré).', 'warning')
+                                flash('Scan chèque non sauvegardé (stockage indisponible).', 'warning')
 
             db.session.commit()
+            if cheque_scan:
+                schedule_media('payment_cheque', *cheque_scan, org.id)
 
             # Messages de confirmation détaillés
             if months_actually_paid > 0:
@@ -234,39 +244,13 @@ def payments():
     payments_pagination = pay_q.paginate(page=page, per_page=per_page, error_out=False)
     payments_list = payments_pagination.items
 
-    # Grouper les mois payés — 2 colonnes seulement, pas les objets complets
-    rows = db.session.query(Payment.apartment_id, Payment.month_paid)\
-        .filter(Payment.organization_id == org.id).all()
-    paid_months_by_apt = {}
-    for apt_id, month in rows:
-        paid_months_by_apt.setdefault(apt_id, set()).add(month)
-
     # Encaissements divers
     misc_list = MiscReceipt.query.filter_by(organization_id=org.id).order_by(MiscReceipt.payment_date.desc()).all()
 
-    today_month = date.today().replace(day=1)
-    today_ym    = today_month.year * 12 + today_month.month
-    end_next_ym = today_ym + 3  # horizon 3 mois
-
+    # Impayés + prochain mois dû : lecture du registre apartment_arrears (1 requête)
+    details = get_unpaid_details_map(org.id, apartments)
     for apt in apartments:
-        paid     = paid_months_by_apt.get(apt.id, set())
-        start_d  = apt.created_at.date().replace(day=1) if apt.created_at else today_month
-        start_ym = start_d.year * 12 + start_d.month
-
-        # Une seule passe : unpaid_count + next_unpaid calculés simultanément
-        unpaid   = 0
-        next_u   = ym_str(end_next_ym + 1)   # défaut si tout payé dans la fenêtre
-        next_set = False
-        for ym in range(start_ym, end_next_ym + 1):
-            m_str = ym_str(ym)
-            if m_str not in paid:
-                if ym <= today_ym:
-                    unpaid += 1
-                if not next_set:
-                    next_u   = m_str
-                    next_set = True
-        apt.unpaid_count = unpaid
-        apt.next_unpaid  = next_u
+        apt.unpaid_count, apt.next_unpaid = details.get(apt.id, (0, ''))
 
     konnect_links = KonnectPayment.query.filter_by(organization_id=org.id)\
         .order_by(KonnectPayment.created_at.desc()).all()
@@ -406,6 +390,7 @@ def edit_payment(payment_id):
     p = Payment.query.filter_by(id=payment_id, organization_id=org.id).first_or_404()
     apartments = Apartment.query.filter_by(organization_id=org.id).all()
     if request.method == 'POST':
+        old_apartment_id = p.apartment_id
         try:
             amount = float(request.form['amount'])
             if amount <= 0 or amount > 9_999_999:
@@ -418,12 +403,19 @@ def edit_payment(payment_id):
             payment_mode = request.form.get('payment_mode', 'especes')
             if payment_mode not in ('especes', 'virement', 'cheque'):
                 payment_mode = 'especes'
-            p.apartment_id = int(request.form['apartment_id'])
+            apartment_id, month_paid = int(request.form['apartment_id']), request.form['month_paid']
+            # Unicité (apartment_id, month_paid) : vérifiée avant modification
+            if (Payment.query.filter(Payment.apartment_id == apartment_id, Payment.month_paid == month_paid,
+                                     Payment.id != p.id).first() is not None):
+                flash(f'Le mois {month_paid} est déjà encaissé pour cet appartement.', 'danger')
+                return redirect(url_for('edit_payment', payment_id=payment_id))
+            p.apartment_id = apartment_id
             p.amount = amount
             p.payment_date = payment_date
-            p.month_paid = request.form['month_paid']
+            p.month_paid = month_paid
             p.description = request.form.get('description', '')[:200]
             p.payment_mode = payment_mode
+            cheque_scan = None
             if payment_mode == 'cheque':
                 p.cheque_number = request.form.get('cheque_number', '').strip()[:50] or None
                 p.cheque_bank = request.form.get('cheque_bank', '').strip()[:100] or None
@@ -436,12 +428,23 @@ def edit_payment(payment_id):
                             url = _storage_upload(raw, mime, folder='cheques')
                             if url:
                                 p.cheque_url = url
+                                p.cheque_thumb_url = None
+                                cheque_scan = (url, mime)
             else:
                 p.cheque_number = None
                 p.cheque_bank = None
+            refresh_arrears(old_apartment_id, p.apartment_id)
             db.session.commit()
+            if cheque_scan:
+                schedule_media('payment_cheque', *cheque_scan, org.id)
             flash('Encaissement modifié', 'success')
+        except IntegrityError:
+            # Encaissement concurrent du même mois (index uq_payment_apt_month)
+            db.session.rollback()
+            flash('Ce mois est déjà encaissé pour cet appartement.', 'danger')
+            return redirect(url_for('edit_payment', payment_id=payment_id))
         except Exception as e:
+            db.session.rollback()
             app.logger.error("ERREUR edit_payment: %s", e, exc_info=True)
             flash('Une erreur est survenue lors de la modification.', 'danger')
         # Retour à la même recherche qu'avant l'édition
@@ -623,7 +626,9 @@ def payment_receipt(payment_id):
 def delete_payment(payment_id):
     org = current_organization()
     p = Payment.query.filter_by(id=payment_id, organization_id=org.id).first_or_404()
+    apartment_id = p.apartment_id
     db.session.delete(p)
+    refresh_arrears(apartment_id)
     db.session.commit()
     flash('Encaissement supprimé', 'success')
     return redirect(url_for('payments'))
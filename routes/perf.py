@@ -0,0 +1,35 @@
+from flask import render_template, request, redirect, url_for, flash
+from core import app
+from utils import login_required, superadmin_required
+from utils_profiler import endpoint_stats, reset_stats
+from utils_explain import explain_all
+import utils_http
+
+_ORDERS = {'avg_queries': 'Requêtes / appel', 'max_queries': 'Requêtes max',
+           'avg_db_ms': 'Temps DB moyen', 'over_budget': 'Dépassements de budget'}
+
+
+@app.route('/superadmin/perf')
+@login_required
+@superadmin_required
+def superadmin_perf():
+    """Endpoints les plus coûteux en SQL (statistiques du process courant)."""
+    order = request.args.get('order', 'avg_queries')
+    if order not in _ORDERS:
+        order = 'avg_queries'
+    # EXPLAIN des requêtes chaudes : à la demande (une requête par entrée du registre)
+    explain = explain_all() if request.args.get('explain') else None
+    return render_template('superadmin/perf.html',
+                           rows=endpoint_stats(order_by=order),
+                           order=order, orders=_ORDERS, explain=explain,
+                           http_rows=utils_http.provider_stats())
+
+
+@app.route('/superadmin/perf/reset', methods=['POST'])
+@login_required
+@superadmin_required
+def superadmin_perf_reset():
+    reset_stats()
+    utils_http.reset_stats()
+    flash('Statistiques SQL et HTTP remises à zéro.', 'success')
+    return redirect(url_for('superadmin_perf'))
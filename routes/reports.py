@@ -1,15 +1,15 @@
-from flask import render_template, send_file, jsonify, request
+from flask import render_template, jsonify, request, abort
 from core import app, db
 from models import Apartment, Payment, Expense, MiscReceipt
 from utils import (current_user, current_organization, login_required,
                    subscription_required, last_n_months, get_month_name,
-                   get_paid_months_map, get_unpaid_map, get_unpaid_details_map)
+                   get_unpaid_details_map)
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
 from sqlalchemy import func
 from sqlalchemy.orm import joinedload
-import pandas as pd
-import io
+from utils_reports import report, serve_report, status_payload, REPORTS
+from utils_months import cash_matrix, created_ym, month_totals, paid_matrix
 
 
 @app.route('/tresorerie')
@@ -22,76 +22,29 @@ def tresorerie():
                   .filter_by(organization_id=org.id)
                   .order_by(Apartment.block_id, Apartment.number).all())
 
-    # Fenêtre de la requête = premier mois affiché → on ne charge QUE les 12 mois,
-    # pas les 10 ans d'historique. Agrégation SQL GROUP BY (pas de boucle Python).
-    first_year, first_month = months[0]
-    window_start = date(first_year, first_month, 1)
-
-    def _mk(y, m):
-        return f"{y}-{m:02d}"
-
-    # Paiements agrégés par (appartement, année, mois)
-    pay_rows = (db.session.query(
-            Payment.apartment_id,
-            func.extract('year',  Payment.payment_date).label('y'),
-            func.extract('month', Payment.payment_date).label('m'),
-            func.sum(Payment.amount).label('total'))
-        .filter(Payment.organization_id == org.id,
-                Payment.payment_date >= window_start)
-        .group_by(Payment.apartment_id, 'y', 'm').all())
-    pay_map = {(r.apartment_id, _mk(int(r.y), int(r.m))): float(r.total or 0) for r in pay_rows}
-
-    # Dépenses agrégées par (année, mois)
-    exp_rows = (db.session.query(
-            func.extract('year',  Expense.expense_date).label('y'),
-            func.extract('month', Expense.expense_date).label('m'),
-            func.sum(Expense.amount).label('total'))
-        .filter(Expense.organization_id == org.id,
-                Expense.expense_date >= window_start)
-        .group_by('y', 'm').all())
-    exp_map = {_mk(int(r.y), int(r.m)): float(r.total or 0) for r in exp_rows}
-
-    # Encaissements divers agrégés par (année, mois)
-    misc_rows = (db.session.query(
-            func.extract('year',  MiscReceipt.payment_date).label('y'),
-            func.extract('month', MiscReceipt.payment_date).label('m'),
-            func.sum(MiscReceipt.amount).label('total'))
-        .filter(MiscReceipt.organization_id == org.id,
-                MiscReceipt.payment_date >= window_start)
-        .group_by('y', 'm').all())
-    misc_map = {_mk(int(r.y), int(r.m)): float(r.total or 0) for r in misc_rows}
-
-    data = []
-    for apt in apartments:
-        row = {'apartment': f"{apt.block.name}-{apt.number}", 'months': {}}
-        for year, month in months:
-            month_key = f"{year}-{month:02d}"
-            row['months'][month_key] = pay_map.get((apt.id, month_key), 0)
-        data.append(row)
-
-    # Ligne encaissements divers
-    misc_row = {'apartment': 'ENCAISSEMENTS DIVERS', 'months': {}}
-    for year, month in months:
-        month_key = f"{year}-{month:02d}"
-        misc_row['months'][month_key] = misc_map.get(month_key, 0)
-
-    expense_row = {'apartment': 'DÉPENSES', 'months': {}}
-    for year, month in months:
-        month_key = f"{year}-{month:02d}"
-        expense_row['months'][month_key] = exp_map.get(month_key, 0)
-
-    solde_row = {'apartment': 'SOLDE', 'months': {}}
-    for year, month in months:
-        month_key = f"{year}-{month:02d}"
-        total_in = sum(row['months'][month_key] for row in data) + misc_row['months'][month_key]
-        total_out = expense_row['months'][month_key]
-        solde_row['months'][month_key] = total_in - total_out
+    # Fenêtre = les 12 mois affichés, pas les 10 ans d'historique : matrice
+    # appartements × mois (utils_months) et totaux mensuels en GROUP BY.
+    start_ym = months[0][0] * 12 + months[0][1]
+    end_ym = months[-1][0] * 12 + months[-1][1]
+    cash = cash_matrix(org.id, apartments, start_ym, end_ym)
+    misc = month_totals(MiscReceipt, MiscReceipt.payment_date, org.id, start_ym, end_ym)
+    expenses = month_totals(Expense, Expense.expense_date, org.id, start_ym, end_ym)
+    encaisse = cash.column_totals() + misc
+
+    data = [{'apartment': f"{apt.block.name}-{apt.number}",
+             'months': cash.row_dict(apt.id, cash.amounts)} for apt in apartments]
+    misc_row = {'apartment': 'ENCAISSEMENTS DIVERS', 'months': cash.totals_dict(misc)}
+    expense_row = {'apartment': 'DÉPENSES', 'months': cash.totals_dict(expenses)}
+    solde_row = {'apartment': 'SOLDE', 'months': cash.totals_dict(encaisse - expenses)}
+    totals = {'encaissements': float(cash.amounts.sum()), 'depenses': float(expenses.sum()),
+              'encaisse_par_mois': encaisse.tolist()}
 
     return render_template('tresorerie.html',
                          data=data,
                          misc_row=misc_row,
                          expense_row=expense_row,
                          solde_row=solde_row,
+                         totals=totals,
                          months=months,
                          user=current_user())
 
@@ -134,31 +87,33 @@ def comptable():
                   .filter_by(organization_id=org.id)
                   .order_by(Apartment.block_id, Apartment.number).all())
 
-    # 1 seule requête pour les mois payés, réutilisée pour la grille ET les impayés
-    all_paid_months = get_paid_months_map(org.id)
-    unpaid_map = get_unpaid_map(org.id, apartments, paid=all_paid_months)
-    data = []
+    # 1 seule requête : matrice des mois couverts (création → fin de la grille),
+    # réutilisée pour la grille, les impayés et les totaux par mois
+    today_ym = today.year * 12 + today.month
+    first_shown, last_shown = months[0][0] * 12 + months[0][1], months[-1][0] * 12 + months[-1][1]
+    created = created_ym(apartments, default=today_ym)
+    start_ym = min([first_shown, *created.tolist()])
+    matrix = paid_matrix(org.id, apartments, start_ym, max(today_ym, last_shown))
+    unpaid_counts = matrix.unpaid_counts(created, today_ym).tolist()
+    shown = matrix.cols(first_shown, last_shown)
+    keys = matrix.keys[shown]
+    fees = [apt.monthly_fee for apt in apartments]
 
-    for apt in apartments:
-        row = {
+    data = []
+    for i, apt in enumerate(apartments):
+        data.append({
             'apartment': f"{apt.block.name}-{apt.number}",
             'monthly_fee': apt.monthly_fee,
             'credit_balance': apt.credit_balance,
-            'months': {}
-        }
-
-        apt_paid_months = all_paid_months.get(apt.id, set())
-
-        for year, month in months:
-            month_key = f"{year}-{month:02d}"
-            paid = month_key in apt_paid_months
-            amount = apt.monthly_fee if paid else 0
-            row['months'][month_key] = {'paid': paid, 'amount': amount}
-
-        row['unpaid_count'] = unpaid_map.get(apt.id, 0)
-        data.append(row)
-
-    return render_template('comptable.html', data=data, months=months, user=current_user(),
+            'months': {k: {'paid': p, 'amount': fees[i] if p else 0}
+                       for k, p in zip(keys, matrix.paid[i, shown].tolist())},
+            'unpaid_count': unpaid_counts[i],
+        })
+    paid_counts = matrix.paid_counts()[shown].tolist()
+    month_stats = {k: {'paid': n, 'unpaid': len(apartments) - n} for k, n in zip(keys, paid_counts)}
+
+    return render_template('comptable.html', data=data, months=months, month_stats=month_stats,
+                           user=current_user(),
                            available_years=available_years, selected_year=selected_year)
 
 
@@ -166,9 +121,6 @@ def comptable():
 @login_required
 @subscription_required
 def export_excel():
-    from openpyxl.styles import PatternFill, Font
-    from models import User as UserModel
-
     org = current_organization()
 
     # Années disponibles — DISTINCT en SQL (paiements via month_paid + dépenses via année)
@@ -190,157 +142,154 @@ def export_excel():
                                current_year=str(date.today().year),
                                user=current_user())
 
-    year_str = year_param
-    year = int(year_str)
-
-    # Données de l'année sélectionnée — requêtes scopées (pas de chargement des 10 ans)
-    # month_paid pilote l'année (les paiements en avance tombent dans la bonne année)
-    payments_year = (Payment.query
-                     .options(joinedload(Payment.apartment).joinedload(Apartment.block))
-                     .filter(Payment.organization_id == org.id,
-                             Payment.month_paid.like(f"{year_str}-%"))
-                     .order_by(Payment.payment_date.desc(), Payment.id.desc()).all())
-    expenses_year = (Expense.query
-                     .filter(Expense.organization_id == org.id,
-                             func.extract('year', Expense.expense_date) == year)
-                     .order_by(Expense.expense_date.desc()).all())
+    return serve_report('excel_export', org, {'year': int(year_param)}, user=current_user(),
+                        title=f"Export Excel {year_param}")
+
+
+# Feuille « Impayés » = état actuel : le classeur est refait au changement de mois
+@report('excel_export', fmt='xlsx', version=lambda org, params: date.today().strftime('%Y-%m'))
+def _render_excel_export(org, year):
+    import utils_xlsx as xlsx
+    from models import User as UserModel, Block
+    year_str = str(year)
+
+    # Feuilles bornées par le nombre d'appartements : préparées en mémoire.
+    # Encaissements / dépenses (année entière) : lus en flux, jamais matérialisés.
     apartments = (Apartment.query.options(joinedload(Apartment.block))
                   .filter_by(organization_id=org.id)
                   .order_by(Apartment.block_id, Apartment.number).all())
 
     # Impayés de TOUS les appartements en 1 requête (au lieu de 7 appels N+1 par apt)
     unpaid_details = get_unpaid_details_map(org.id, apartments)
+    residents_by_apt = {apt_id: (name, email, phone) for apt_id, name, email, phone in
+                        db.session.query(UserModel.apartment_id, UserModel.name,
+                                         UserModel.email, UserModel.phone)
+                        .filter_by(organization_id=org.id, role='resident')}
+    # Mois payés de l'année par appartement (month_paid pilote l'année)
+    year_matrix = paid_matrix(org.id, apartments, year * 12 + 1, year * 12 + 12)
+    nb_payes_by_row = year_matrix.paid.sum(axis=1).tolist()
+
+    wb = xlsx.new_workbook()
 
     # ---- Sheet 1: Appartements (état actuel) ----
-    residents_by_apt = {u.apartment_id: u for u in UserModel.query.filter_by(organization_id=org.id, role='resident').all()}
-    df_apartments = pd.DataFrame([{
-        'Bloc': apt.block.name,
-        'Appartement': apt.number,
-        'Référence': f"{apt.block.name}-{apt.number}",
-        'Place Parking': apt.parking_spot or '',
-        'Redevance Mensuelle (DT)': apt.monthly_fee,
-        'Crédit (DT)': apt.credit_balance,
-        'Résident': residents_by_apt[apt.id].name if apt.id in residents_by_apt else '',
-        'Email Résident': residents_by_apt[apt.id].email if apt.id in residents_by_apt else '',
-        'Téléphone': residents_by_apt[apt.id].phone if apt.id in residents_by_apt else '',
-        'Mois Impayés': unpaid_details.get(apt.id, (0, ''))[0],
-        'Total Dû (DT)': apt.monthly_fee * unpaid_details.get(apt.id, (0, ''))[0],
-        'Créé le': apt.created_at.strftime('%d/%m/%Y') if apt.created_at else '',
-    } for apt in apartments])
+    rows = []
+    for apt in apartments:
+        name, email, phone = residents_by_apt.get(apt.id, ('', '', ''))
+        nb_unpaid = unpaid_details.get(apt.id, (0, ''))[0]
+        rows.append((apt.block.name, apt.number, f"{apt.block.name}-{apt.number}",
+                     apt.parking_spot or '', apt.monthly_fee, apt.credit_balance,
+                     name or '', email or '', phone or '', nb_unpaid, apt.monthly_fee * nb_unpaid,
+                     apt.created_at.strftime('%d/%m/%Y') if apt.created_at else ''))
+    headers = ['Bloc', 'Appartement', 'Référence', 'Place Parking', 'Redevance Mensuelle (DT)',
+               'Crédit (DT)', 'Résident', 'Email Résident', 'Téléphone', 'Mois Impayés',
+               'Total Dû (DT)', 'Créé le']
+    xlsx.write_sheet(wb, 'Appartements',
+                     [xlsx.Column(h, w) for h, w in zip(headers, xlsx.data_widths(rows) or [0] * 12)], rows)
 
     # ---- Sheet 2: Encaissements YYYY ----
     MODE_LABELS = {'especes': 'Espèces', 'virement': 'Virement', 'cheque': 'Chèque'}
-    df_payments = pd.DataFrame([{
-        'ID': p.id,
-        'Appartement': f"{p.apartment.block.name}-{p.apartment.number}" if p.apartment else '',
-        'Montant (DT)': p.amount,
-        'Date Paiement': p.payment_date.strftime('%d/%m/%Y'),
-        'Mois Payé': p.month_paid,
-        'Mode': MODE_LABELS.get(p.payment_mode or 'especes', 'Espèces'),
-        'N° Chèque': p.cheque_number or '',
-        'Banque': p.cheque_bank or '',
-        'Crédit Utilisé': p.credit_used or 0,
-        'Description': p.description or '',
-    } for p in payments_year])
-    if df_payments.empty:
-        df_payments = pd.DataFrame(columns=['ID', 'Appartement', 'Montant (DT)', 'Date Paiement', 'Mois Payé', 'Mode', 'N° Chèque', 'Banque', 'Crédit Utilisé', 'Description'])
+    year_payments = lambda q: q.filter(Payment.organization_id == org.id,
+                                       Payment.month_paid.like(f"{year_str}-%"))
+    apt_w, bank_w, desc_w = xlsx.sql_widths(
+        lambda q: year_payments(q.select_from(Payment).outerjoin(Apartment).outerjoin(Block)),
+        Block.name + '-' + Apartment.number, Payment.cheque_bank, Payment.description)
+    payments_q = (year_payments(db.session.query(
+                      Payment.id, Block.name, Apartment.number, Payment.amount, Payment.payment_date,
+                      Payment.month_paid, Payment.payment_mode, Payment.cheque_number,
+                      Payment.cheque_bank, Payment.credit_used, Payment.description)
+                  .select_from(Payment).outerjoin(Apartment).outerjoin(Block))
+                  .order_by(Payment.payment_date.desc(), Payment.id.desc())
+                  .execution_options(yield_per=500))
+    xlsx.write_sheet(wb, f'Encaissements {year_str}', [
+        xlsx.Column('ID', 6), xlsx.Column('Appartement', apt_w), xlsx.Column('Montant (DT)', 10),
+        xlsx.Column('Date Paiement', 10), xlsx.Column('Mois Payé', 7), xlsx.Column('Mode', 8),
+        xlsx.Column('N° Chèque', 12), xlsx.Column('Banque', bank_w), xlsx.Column('Crédit Utilisé', 8),
+        xlsx.Column('Description', desc_w),
+    ], ((pid, f"{block}-{number}" if number is not None else '', amount, pdate.strftime('%d/%m/%Y'),
+         month, MODE_LABELS.get(mode or 'especes', 'Espèces'), cheque or '', bank or '',
+         credit or 0, desc or '')
+        for pid, block, number, amount, pdate, month, mode, cheque, bank, credit, desc in payments_q))
 
     # ---- Sheet 3: Dépenses YYYY ----
-    df_expenses = pd.DataFrame([{
-        'ID': e.id,
-        'Montant (DT)': e.amount,
-        'Date': e.expense_date.strftime('%d/%m/%Y'),
-        'Catégorie': e.category or '',
-        'Description': e.description or '',
-    } for e in expenses_year])
-    if df_expenses.empty:
-        df_expenses = pd.DataFrame(columns=['ID', 'Montant (DT)', 'Date', 'Catégorie', 'Description'])
+    year_expenses = lambda q: q.filter(Expense.organization_id == org.id,
+                                       func.extract('year', Expense.expense_date) == year)
+    cat_w, desc_w = xlsx.sql_widths(year_expenses, Expense.category, Expense.description)
+    expenses_q = (year_expenses(db.session.query(Expense.id, Expense.amount, Expense.expense_date,
+                                                 Expense.category, Expense.description))
+                  .order_by(Expense.expense_date.desc())
+                  .execution_options(yield_per=500))
+    xlsx.write_sheet(wb, f'Dépenses {year_str}', [
+        xlsx.Column('ID', 6), xlsx.Column('Montant (DT)', 10), xlsx.Column('Date', 10),
+        xlsx.Column('Catégorie', cat_w), xlsx.Column('Description', desc_w),
+    ], ((eid, amount, edate.strftime('%d/%m/%Y'), cat or '', desc or '')
+        for eid, amount, edate, cat, desc in expenses_q))
 
     # ---- Sheet 4: Impayés (état actuel) ----
-    df_unpaid = pd.DataFrame([{
-        'Appartement': f"{apt.block.name}-{apt.number}",
-        'Place Parking': apt.parking_spot or '',
-        'Redevance Mensuelle (DT)': apt.monthly_fee,
-        'Crédit Disponible (DT)': apt.credit_balance,
-        'Mois Impayés': unpaid_details.get(apt.id, (0, ''))[0],
-        'Prochain Mois': unpaid_details.get(apt.id, (0, ''))[1],
-        'Total Dû (DT)': apt.monthly_fee * unpaid_details.get(apt.id, (0, ''))[0],
-    } for apt in apartments if unpaid_details.get(apt.id, (0, ''))[0] > 0])
-    if df_unpaid.empty:
-        df_unpaid = pd.DataFrame(columns=['Appartement', 'Place Parking', 'Redevance Mensuelle (DT)', 'Crédit Disponible (DT)', 'Mois Impayés', 'Prochain Mois', 'Total Dû (DT)'])
+    rows = []
+    for apt in apartments:
+        nb_unpaid, next_month = unpaid_details.get(apt.id, (0, ''))
+        if nb_unpaid > 0:
+            rows.append((f"{apt.block.name}-{apt.number}", apt.parking_spot or '', apt.monthly_fee,
+                         apt.credit_balance, nb_unpaid, next_month, apt.monthly_fee * nb_unpaid))
+    headers = ['Appartement', 'Place Parking', 'Redevance Mensuelle (DT)', 'Crédit Disponible (DT)',
+               'Mois Impayés', 'Prochain Mois', 'Total Dû (DT)']
+    xlsx.write_sheet(wb, 'Impayés',
+                     [xlsx.Column(h, w) for h, w in zip(headers, xlsx.data_widths(rows) or [0] * 7)], rows)
 
     # ---- Sheet 5: Tableau Comptable YYYY (12 mois fixes, avec couleurs) ----
     MONTH_NAMES = ['Jan', 'Fév', 'Mar', 'Avr', 'Mai', 'Juin', 'Juil', 'Aoû', 'Sep', 'Oct', 'Nov', 'Déc']
+    rows = []
+    for i, apt in enumerate(apartments):
+        status = ['Payé' if p else 'Impayé' for p in year_matrix.paid[i].tolist()]
+        nb_payes = nb_payes_by_row[i]
+        nb_impayes = 12 - nb_payes
+        rows.append((f"{apt.block.name}-{apt.number}", apt.monthly_fee, *status, nb_payes, nb_impayes,
+                     round(apt.monthly_fee * nb_payes, 3), round(apt.monthly_fee * nb_impayes, 3)))
+    headers = ['Appartement', 'Redevance (DT)', *MONTH_NAMES, 'Nb Payés', 'Nb Impayés',
+               'Total Perçu (DT)', 'Total Dû (DT)']
 
-    # Paid months per apartment for the selected year (payments_year déjà scopé à l'année)
-    paid_by_apt = {}
-    for p in payments_year:
-        if p.month_paid:
-            paid_by_apt.setdefault(p.apartment_id, set()).add(p.month_paid)
+    def color_months(ws, row):
+        return [*row[:2],
+                *(xlsx.styled(ws, v, xlsx.PAID_FILL, xlsx.PAID_FONT) if v == 'Payé'
+                  else xlsx.styled(ws, v, xlsx.UNPAID_FILL, xlsx.UNPAID_FONT) for v in row[2:14]),
+                *row[14:]]
+
+    xlsx.write_sheet(wb, f'Tableau {year_str}',
+                     [xlsx.Column(h, w) for h, w in zip(headers, xlsx.data_widths(rows) or [0] * 18)],
+                     rows, freeze='C2', style_row=color_months)
 
-    comptable_data = []
-    for apt in apartments:
-        apt_paid = paid_by_apt.get(apt.id, set())
-        nb_payes = 0
-        total_percu = 0.0
-        row = {
-            'Appartement': f"{apt.block.name}-{apt.number}",
-            'Redevance (DT)': apt.monthly_fee,
-        }
-        for m in range(1, 13):
-            month_key = f"{year_str}-{m:02d}"
-            if month_key in apt_paid:
-                row[MONTH_NAMES[m - 1]] = 'Payé'
-                nb_payes += 1
-                total_percu += apt.monthly_fee
-            else:
-                row[MONTH_NAMES[m - 1]] = 'Impayé'
-        nb_impayes = 12 - nb_payes
-        row['Nb Payés'] = nb_payes
-        row['Nb Impayés'] = nb_impayes
-        row['Total Perçu (DT)'] = round(total_percu, 3)
-        row['Total Dû (DT)'] = round(apt.monthly_fee * nb_impayes, 3)
-        comptable_data.append(row)
-    df_comptable = pd.DataFrame(comptable_data)
-
-    # Write Excel
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df_apartments.to_excel(writer, sheet_name='Appartements', index=False)
-        df_payments.to_excel(writer, sheet_name=f'Encaissements {year_str}', index=False)
-        df_expenses.to_excel(writer, sheet_name=f'Dépenses {year_str}', index=False)
-        df_unpaid.to_excel(writer, sheet_name='Impayés', index=False)
-        df_comptable.to_excel(writer, sheet_name=f'Tableau {year_str}', index=False)
-
-        # Color coding for Tableau sheet
-        fill_green = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
-        font_green = Font(color='276221')
-        fill_red = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
-        font_red = Font(color='9C0006')
-
-        ws_tab = writer.sheets[f'Tableau {year_str}']
-        headers = [cell.value for cell in ws_tab[1]]
-        month_cols = {h: i + 1 for i, h in enumerate(headers) if h in MONTH_NAMES}
-
-        for row_idx in range(2, ws_tab.max_row + 1):
-            for col_idx in month_cols.values():
-                cell = ws_tab.cell(row=row_idx, column=col_idx)
-                if cell.value == 'Payé':
-                    cell.fill = fill_green
-                    cell.font = font_green
-                elif cell.value == 'Impayé':
-                    cell.fill = fill_red
-                    cell.font = font_red
-
-        ws_tab.freeze_panes = 'C2'
-
-        # Auto-fit column widths on all sheets
-        for ws in writer.sheets.values():
-            for col in ws.columns:
-                max_len = max((len(str(cell.value)) for cell in col if cell.value), default=8)
-                ws.column_dimensions[col[0].column_letter].width = min(max_len + 3, 32)
-
-    output.seek(0)
     filename = f"SyndicPro_{org.name}_{year_str}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    return send_file(output, download_name=filename, as_attachment=True,
-                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    return xlsx.save(wb).read(), filename
+
+
+# ─── Rapports générés en arrière-plan (cf. utils_reports) ────────────────────
+
+def _artifact_or_404(artifact_id):
+    from models import ReportArtifact
+    user = current_user()
+    artifact = db.get_or_404(ReportArtifact, artifact_id)
+    if user.role != 'superadmin':
+        if artifact.organization_id != user.organization_id:
+            abort(404)
+        spec = REPORTS.get(artifact.kind)
+        if spec and spec.admin_only and user.role != 'admin':
+            abort(403)
+    return artifact
+
+
+@app.route('/rapports/<int:artifact_id>/etat')
+@login_required
+def report_status(artifact_id):
+    """Avancement d'un rapport — interrogé par la page d'attente."""
+    return jsonify(status_payload(_artifact_or_404(artifact_id)))
+
+
+@app.route('/rapports/<int:artifact_id>')
+@login_required
+def report_download(artifact_id):
+    from utils_blobs import send_attachment
+    artifact = _artifact_or_404(artifact_id)
+    if artifact.status != 'done':
+        abort(404)
+    return send_attachment(artifact.file_url, mime=artifact.mime,
+                           download_name=artifact.filename, as_attachment=True)
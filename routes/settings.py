@@ -1,8 +1,8 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, session
 from core import app, db
 from models import Organization, Camera
 from utils import current_user, current_organization, login_required, admin_required, subscription_required
-import requests as http
+import utils_http as http
 
 
 @app.route('/settings', methods=['GET', 'POST'])
@@ -74,7 +74,7 @@ def test_flouci():
         # Flouci n'a pas d'endpoint /me — on teste en générant un paiement de 0,001 DT
         # et on vérifie que la réponse est cohérente (pas d'erreur d'authentification)
         resp = http.post(
-            'https://api.flouci.com/payment/generate',
+            'flouci', 'https://api.flouci.com/payment/generate',
             json={
                 'app_token': org.flouci_app_token,
                 'app_secret': org.flouci_app_secret,
@@ -109,7 +109,7 @@ def test_konnect():
         return jsonify({'ok': False, 'message': 'Clé API ou Wallet ID manquant.'})
     try:
         resp = http.get(
-            'https://api.konnect.network/api/v2/account/me',
+            'konnect', 'https://api.konnect.network/api/v2/account/me',
             headers={'x-api-key': org.konnect_api_key},
             timeout=8
         )
@@ -149,10 +149,13 @@ def regen_invite_code():
 @subscription_required
 def regen_badges_api_key():
     import secrets
+    from utils_badges import set_api_key
     org = current_organization()
-    org.badges_api_key = secrets.token_hex(16)
+    api_key = secrets.token_hex(16)
+    set_api_key(org, api_key)     # seule l'empreinte est conservée
     db.session.commit()
-    flash('Clé API badges regénérée avec succès.', 'success')
+    session['badges_api_key_once'] = api_key
+    flash('Clé API badges regénérée avec succès. Copiez-la maintenant : elle ne sera plus affichée.', 'success')
     return redirect(url_for('badges'))
 
 
@@ -9,14 +9,15 @@ Flux :
 import os
 import secrets
 import base64
-import io
 from datetime import datetime, timedelta
-from flask import render_template, request, redirect, url_for, flash, send_file, abort, Response
+from flask import render_template, request, redirect, url_for, flash, abort
 from core import app, db
 from models import SubscriptionPaymentRequest, Organization, Subscription, User
 from utils import (current_user, current_organization, login_required,
                    admin_required, superadmin_required)
 from storage_helper import upload_file as _storage_upload
+from utils_blobs import send_attachment
+from utils_reports import report, serve_report
 
 MAX_SCAN_BYTES = 5 * 1024 * 1024
 ALLOWED_MIMES  = {'image/jpeg', 'image/png', 'image/webp', 'application/pdf'}
@@ -315,19 +316,14 @@ def superadmin_sub_edit(pr_id):
 @login_required
 def sub_payment_scan(pr_id):
     user = current_user()
-    pr   = SubscriptionPaymentRequest.query.get_or_404(pr_id)
+    pr   = SubscriptionPaymentRequest.query\
+        .options(db.undefer(SubscriptionPaymentRequest.photo_data)).get_or_404(pr_id)
 
     # Droits : superadmin ou admin de la même org
     if user.role != 'superadmin' and user.organization_id != pr.organization_id:
         abort(403)
 
-    if pr.photo_url:
-        from flask import redirect as _r
-        return _r(pr.photo_url)
-    if not pr.photo_data:
-        abort(404)
-    raw = base64.b64decode(pr.photo_data)
-    return Response(raw, mimetype=pr.photo_mime or 'image/jpeg')
+    return send_attachment(pr.photo_url, pr.photo_data, pr.photo_mime or 'image/jpeg')
 
 
 # ─── 6. Facture PDF — téléchargement (superadmin + admin de l'org) ───────────
@@ -335,7 +331,6 @@ def sub_payment_scan(pr_id):
 @app.route('/subscription/facture/<int:pr_id>.pdf')
 @login_required
 def sub_payment_invoice(pr_id):
-    from fpdf import FPDF
     user = current_user()
     pr   = SubscriptionPaymentRequest.query.get_or_404(pr_id)
 
@@ -345,8 +340,17 @@ def sub_payment_invoice(pr_id):
         flash('La facture n\'est disponible qu\'après approbation.', 'warning')
         return redirect(url_for('subscription_status'))
 
+    return serve_report('subscription_invoice', pr.organization, {'pr_id': pr.id}, user=user,
+                        title=f"Facture {pr.invoice_number}")
+
+
+# L'émetteur (variables d'environnement) n'appartient pas à l'organisation : il
+# fait partie de la version du rapport
+@report('subscription_invoice', admin_only=True, version=lambda org, params: _get_emetteur())
+def _render_subscription_invoice(org, pr_id):
+    from fpdf import FPDF
+    pr      = SubscriptionPaymentRequest.query.filter_by(id=pr_id, organization_id=org.id).one()
     em      = _get_emetteur()
-    org     = pr.organization
     details = SubscriptionPaymentRequest.PLAN_DETAILS.get(pr.plan_requested, {})
     amount  = pr.amount_confirmed or pr.amount_declared
 
@@ -498,10 +502,7 @@ def sub_payment_invoice(pr_id):
     pdf.cell(0, 4, _s(f"Genere le {datetime.now().strftime('%d/%m/%Y %H:%M')} - {em['produit']} (www.syndicpro.tn) - {em['nom']}"), new_x="LMARGIN", new_y="NEXT", align='C')
     pdf.cell(0, 4, 'Cette facture est valable comme justificatif de paiement conformement a la legislation tunisienne.', new_x="LMARGIN", new_y="NEXT", align='C')
 
-    buf = io.BytesIO(pdf.output())
-    buf.seek(0)
-    filename = f"Facture_{pr.invoice_number}_{org.slug}.pdf"
-    return send_file(buf, mimetype='application/pdf', as_attachment=True, download_name=filename)
+    return pdf.output(), f"Facture_{pr.invoice_number}_{org.slug}.pdf"
 
 
 # ─── Notifications internes ──────────────────────────────────────────────────
@@ -528,7 +529,7 @@ def _notify_superadmin_new_virement(org, pr):
 def _notify_admin_approved(org, pr):
     """Email + push à l'admin du syndic quand l'abonnement est activé."""
     try:
-        from utils_email import send_email
+        from utils_email import queue_email
         em = _get_emetteur()
         details = SubscriptionPaymentRequest.PLAN_DETAILS.get(pr.plan_requested, {})
         plan_label = details.get('label', pr.plan_requested.capitalize())
@@ -556,7 +557,7 @@ def _notify_admin_approved(org, pr):
         </p>
         """
         from utils_email import _base_html
-        send_email(org.email, f'SyndicPro — Abonnement {plan_label} activé ({pr.invoice_number})', _base_html(html))
+        queue_email(org.email, f'SyndicPro — Abonnement {plan_label} activé ({pr.invoice_number})', _base_html(html))
     except Exception:
         pass
 
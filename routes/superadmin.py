@@ -4,7 +4,7 @@ from models import Organization, Apartment, User, SuperAdminSettings, Payment, T
 from utils import current_user, login_required, superadmin_required
 from datetime import datetime, timedelta, date
 from sqlalchemy import func
-import requests as http
+import utils_http as http
 import csv
 import io
 
@@ -425,9 +425,11 @@ def superadmin_delete_org(org_id):
             conn.execute(t("DELETE FROM appel_fonds_depense WHERE organization_id=:o"), {"o": oid})
             conn.execute(t("DELETE FROM payment_request WHERE organization_id=:o"), {"o": oid})
             conn.execute(t("DELETE FROM push_subscription WHERE organization_id=:o"), {"o": oid})
+            conn.execute(t("DELETE FROM lift_telemetry WHERE lift_id IN (SELECT id FROM lift WHERE organization_id=:o)"), {"o": oid})
+            conn.execute(t("DELETE FROM lift_telemetry_rollup WHERE lift_id IN (SELECT id FROM lift WHERE organization_id=:o)"), {"o": oid})
             for table in [
                 'announcement', 'assembly_general', 'litige', 'autre_litige',
-                'appel_fonds', 'camera', 'access_log', 'misc_receipt',
+                'appel_fonds', 'camera', 'access_log', 'access_log_archive', 'misc_receipt',
                 'konnect_payment', 'flouci_payment', 'direct_message',
                 'unpaid_alert', 'ticket', 'payment', 'expense', 'intervenant',
                 'lift_incident', 'lift',
@@ -607,7 +609,7 @@ def superadmin_test_konnect():
     if not settings.konnect_api_key or not settings.konnect_wallet_id:
         return jsonify({'ok': False, 'message': 'Clé API ou Wallet ID manquant.'})
     try:
-        resp = http.get('https://api.konnect.network/api/v2/account/me',
+        resp = http.get('konnect', 'https://api.konnect.network/api/v2/account/me',
                         headers={'x-api-key': settings.konnect_api_key}, timeout=8)
         if resp.status_code == 200:
             return jsonify({'ok': True, 'message': 'Connexion Konnect réussie ✅'})
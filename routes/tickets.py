@@ -1,4 +1,4 @@
-from flask import render_template, request, redirect, url_for, flash, Response
+from flask import render_template, request, redirect, url_for, flash, abort
 from core import app, db
 from models import Ticket, User
 from utils import (current_user, current_organization, login_required,
@@ -7,6 +7,8 @@ from datetime import datetime
 from utils_whatsapp import notify_ticket_created, notify_ticket_response
 import base64
 from storage_helper import upload_file as _storage_upload
+from utils_blobs import send_attachment
+from utils_media import schedule as schedule_media
 
 
 @app.route('/tickets', methods=['GET', 'POST'])
@@ -53,6 +55,7 @@ def tickets():
                 ticket.photo_data = base64.b64encode(data).decode('utf-8')
         db.session.add(ticket)
         db.session.commit()
+        schedule_media('ticket_photo', ticket.photo_url, ticket.photo_mime, org.id)
         flash('Ticket créé avec succès', 'success')
         # Notifications → admin (WhatsApp + Push)
         try:
@@ -122,6 +125,19 @@ def ticket_detail(ticket_id):
     return render_template('ticket_detail.html', ticket=ticket, user=user)
 
 
+@app.route('/ticket/<int:ticket_id>/photo')
+@login_required
+@subscription_required
+def ticket_photo(ticket_id):
+    org = current_organization()
+    ticket = Ticket.query.options(db.undefer(Ticket.photo_data))\
+        .filter_by(id=ticket_id, organization_id=org.id).first_or_404()
+    user = current_user()
+    if user.role != 'admin' and ticket.apartment_id != user.apartment_id:
+        abort(403)
+    return send_attachment(ticket.photo_url, ticket.photo_data, ticket.photo_mime)
+
+
 @app.route('/ticket/delete/<int:ticket_id>', methods=['POST'])
 @login_required
 @admin_required
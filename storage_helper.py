@@ -1,56 +1,170 @@
+"""
+Stockage des pièces jointes (factures, photos, scans).
+
+Deux backends, choisis par STORAGE_BACKEND (défaut : supabase si configuré, sinon local) :
+  supabase — Supabase Storage ; la colonne *_url reçoit l'URL publique
+  local    — dossier adressé par contenu (BLOB_STORE_DIR, défaut database/blobs) :
+             fichier <sha256[:2]>/<sha256>, déduplication automatique ; la
+             colonne *_url reçoit une référence « blob:<sha256>.<ext> », servie
+             par la route /fichiers/<nom> (cf. routes/files.py, filtre file_url)
+
+Le dossier local doit être sur un disque persistant. Les blobs locaux ne sont
+jamais supprimés un par un (un même contenu peut servir à plusieurs lignes) :
+`flask blobs-gc` supprime ceux que plus aucune ligne ne référence.
+"""
+import hashlib
 import os
+import tempfile
 import uuid
-import requests as _req
+import utils_http as http
 
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
 SUPABASE_ANON_KEY = os.environ.get('SUPABASE_ANON_KEY', '')
 BUCKET = 'syndicpro-files'
 
+BLOB_PREFIX = 'blob:'
+
 _EXT = {
     'image/jpeg': '.jpg',
     'image/png': '.png',
     'image/webp': '.webp',
     'image/gif': '.gif',
     'application/pdf': '.pdf',
+    'application/gzip': '.gz',
 }
+_MIME = {ext: mime for mime, ext in _EXT.items()}
 
 
-def upload_file(raw_bytes, mime_type, folder='uploads'):
-    """Upload vers Supabase Storage. Retourne l'URL publique ou None si échec/non configuré."""
-    if not SUPABASE_URL or not SUPABASE_ANON_KEY:
+class SupabaseStore:
+    """Supabase Storage (bucket public, chemins aléatoires)."""
+
+    def put(self, raw_bytes, mime_type, folder='uploads'):
+        ext = _EXT.get(mime_type, '.bin')
+        path = f"{folder}/{uuid.uuid4().hex}{ext}"
+        try:
+            # Chemin aléatoire propre à cet envoi : x-upsert rend la nouvelle tentative sans
+            # effet si la première a abouti (réponse perdue) au lieu d'un refus « doublon »
+            resp = http.post(
+                'supabase', f"{SUPABASE_URL}/storage/v1/object/{BUCKET}/{path}",
+                headers={
+                    'Authorization': f'Bearer {SUPABASE_ANON_KEY}',
+                    'Content-Type': mime_type,
+                    'x-upsert': 'true',
+                },
+                data=raw_bytes,
+                idempotent=True,
+            )
+            if resp.status_code in (200, 201):
+                return f"{SUPABASE_URL}/storage/v1/object/public/{BUCKET}/{path}"
+        except Exception:
+            pass
         return None
-    ext = _EXT.get(mime_type, '.bin')
-    path = f"{folder}/{uuid.uuid4().hex}{ext}"
-    try:
-        resp = _req.post(
-            f"{SUPABASE_URL}/storage/v1/object/{BUCKET}/{path}",
-            headers={
-                'Authorization': f'Bearer {SUPABASE_ANON_KEY}',
-                'Content-Type': mime_type,
-            },
-            data=raw_bytes,
-            timeout=30,
-        )
-        if resp.status_code in (200, 201):
-            return f"{SUPABASE_URL}/storage/v1/object/public/{BUCKET}/{path}"
-    except Exception:
-        pass
-    return None
+
+    def delete(self, file_url):
+        prefix = f"{SUPABASE_URL}/storage/v1/object/public/{BUCKET}/"
+        if not file_url.startswith(prefix):
+            return
+        path = file_url[len(prefix):]
+        try:
+            http.delete(
+                'supabase', f"{SUPABASE_URL}/storage/v1/object/{BUCKET}/{path}",
+                headers={'Authorization': f'Bearer {SUPABASE_ANON_KEY}'},
+            )
+        except Exception:
+            pass
+
+
+class LocalBlobStore:
+    """Dossier adressé par contenu : le nom du fichier est le SHA-256 de son contenu."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, raw_bytes, mime_type, folder=None):
+        digest = hashlib.sha256(raw_bytes).hexdigest()
+        dest = self.path(digest)
+        try:
+            if not os.path.exists(dest):
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                # Écriture atomique : fichier temporaire puis renommage
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix='.tmp-')
+                with os.fdopen(fd, 'wb') as fh:
+                    fh.write(raw_bytes)
+                os.replace(tmp, dest)
+        except OSError as e:
+            print(f"[Storage] Écriture blob {digest[:12]} impossible : {e}")
+            return None
+        return f"{BLOB_PREFIX}{digest}{_EXT.get(mime_type, '.bin')}"
+
+    def digests(self):
+        """Tous les blobs présents : {digest: chemin}."""
+        found = {}
+        if not os.path.isdir(self.root):
+            return found
+        for sub in os.listdir(self.root):
+            d = os.path.join(self.root, sub)
+            if len(sub) == 2 and os.path.isdir(d):
+                for name in os.listdir(d):
+                    if not name.startswith('.'):
+                        found[name] = os.path.join(d, name)
+        return found
+
+
+BLOB_STORE_DIR = os.environ.get('BLOB_STORE_DIR') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'database', 'blobs')
+local_store = LocalBlobStore(BLOB_STORE_DIR)
+
+
+def _make_store():
+    backend = os.environ.get('STORAGE_BACKEND') or (
+        'supabase' if SUPABASE_URL and SUPABASE_ANON_KEY else 'local')
+    return SupabaseStore() if backend == 'supabase' else local_store
+
+
+_store = _make_store()
+
+
+def upload_file(raw_bytes, mime_type, folder='uploads'):
+    """Enregistre le fichier. Retourne l'URL / la référence blob, ou None si échec."""
+    return _store.put(raw_bytes, mime_type, folder)
 
 
 def delete_file(file_url):
-    """Supprime un fichier de Supabase Storage via son URL publique."""
-    if not file_url or not SUPABASE_URL or not SUPABASE_ANON_KEY:
-        return
-    prefix = f"{SUPABASE_URL}/storage/v1/object/public/{BUCKET}/"
-    if not file_url.startswith(prefix):
+    """Supprime un fichier Supabase via son URL publique (blobs locaux : cf. blobs-gc)."""
+    if not file_url or is_blob_ref(file_url):
         return
-    path = file_url[len(prefix):]
-    try:
-        _req.delete(
-            f"{SUPABASE_URL}/storage/v1/object/{BUCKET}/{path}",
-            headers={'Authorization': f'Bearer {SUPABASE_ANON_KEY}'},
-            timeout=10,
-        )
-    except Exception:
-        pass
+    if SUPABASE_URL and SUPABASE_ANON_KEY:
+        SupabaseStore().delete(file_url)
+
+
+# ─── Références blob locales ─────────────────────────────────────────────────
+
+def is_blob_ref(value):
+    return bool(value) and value.startswith(BLOB_PREFIX)
+
+
+def blob_name(ref):
+    """'blob:<sha256>.pdf' → '<sha256>.pdf' (nom utilisé dans /fichiers/<nom>)."""
+    return ref[len(BLOB_PREFIX):]
+
+
+def blob_file(name):
+    """(chemin, mime) du blob '<sha256>.<ext>', ou (None, None) si absent / nom invalide."""
+    digest, _, ext = name.partition('.')
+    if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+        return None, None
+    path = local_store.path(digest)
+    if not os.path.exists(path):
+        return None, None
+    return path, _MIME.get(f'.{ext}', 'application/octet-stream')
+
+
+def file_href(value):
+    """URL affichable d'une colonne *_url : URL Supabase telle quelle, blob → /fichiers/."""
+    if is_blob_ref(value):
+        from flask import url_for
+        return url_for('blob_download', name=blob_name(value))
+    return value
@@ -0,0 +1,85 @@
+"""
+Fixtures partagées des tests SyndicPro.
+"""
+import pytest
+import sys
+import os
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+
+@pytest.fixture
+def client():
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+    os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+    os.environ.setdefault('CACHE_BACKEND', 'memory')      # pas de fichier partagé entre les tests
+    os.environ.setdefault('STORAGE_BACKEND', 'local')    # pièces jointes hors Supabase
+    os.environ.setdefault('BLOB_STORE_DIR', os.path.join(tempfile.gettempdir(), 'syndicpro-test-blobs'))
+
+    # Importer app charge toutes les routes
+    import app as _app_module   # noqa: F401
+    from core import app as flask_app, db as _db
+
+    flask_app.config['TESTING'] = True
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    flask_app.config['JOBS_EMBEDDED_WORKER'] = False   # file vidée explicitement (run_pending)
+    flask_app.config['JOBS_STUB_PROVIDERS'] = True     # aucun appel réseau
+    flask_app.config['ANALYTICS_BACKGROUND_FLUSH'] = False   # visites vidées via flush_visits()
+    flask_app.config['BADGE_LOG_BACKGROUND_FLUSH'] = False   # passages vidés via flush_access_logs()
+    flask_app.config['SQL_QUERY_BUDGET_STRICT'] = True       # dépassement de @query_budget → échec
+
+    with flask_app.app_context():
+        _db.create_all()
+        yield flask_app.test_client()
+        _db.session.remove()
+        _db.drop_all()
+    import utils_badges
+    utils_badges._indexes.clear()     # index des lecteurs propre au process
+
+
+@pytest.fixture
+def org_factory(client):
+    """Crée une organisation (abonnement actif) avec un bloc et `n` appartements
+    créés il y a `months` mois."""
+    from core import db
+    from models import Organization, Block, Apartment, Subscription
+    from dateutil.relativedelta import relativedelta
+
+    def _make(n=3, months=14, slug='org-test'):
+        org = Organization(name='Résidence Test', slug=slug, email=f'{slug}@test.tn')
+        db.session.add(org)
+        db.session.flush()
+        db.session.add(Subscription(organization_id=org.id, plan='pro', status='active',
+                                    max_apartments=500))
+        block = Block(organization_id=org.id, name='A')
+        db.session.add(block)
+        db.session.flush()
+        created = datetime.utcnow() - relativedelta(months=months)
+        apts = []
+        for i in range(n):
+            apt = Apartment(organization_id=org.id, block_id=block.id,
+                            number=str(101 + i), monthly_fee=100.0, created_at=created)
+            db.session.add(apt)
+            apts.append(apt)
+        db.session.commit()
+        return org, apts
+
+    return _make
+
+
+@pytest.fixture
+def login(client):
+    """Ouvre une session pour l'utilisateur donné (sans passer par /login)."""
+    def _login(user):
+        # Le contexte d'application des tests est partagé entre requêtes : on vide
+        # g pour ne pas réutiliser l'utilisateur / l'organisation mis en cache.
+        from flask import g
+        for key in list(g):
+            g.pop(key)
+        with client.session_transaction() as s:
+            s['user_id'] = user.id
+        return client
+
+    return _login
@@ -0,0 +1,60 @@
+"""
+Archivage mensuel des journaux d'accès (utils_access_archive) : mois anciens sortis
+des tables chaudes vers des fichiers compressés, toujours consultables.
+"""
+from datetime import datetime, timedelta
+
+
+def test_old_months_are_archived_and_still_searchable(client, org_factory, login):
+    from core import db
+    from models import AccessLog, AccessLogArchive, Badge, BadgeAccessLog, User
+    from utils_access_archive import archive_old_months, month_records
+    org, apts = org_factory(n=1)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    resident = User(email='r@t.tn', name='Résident Un', phone='20000000', role='resident',
+                    organization_id=org.id, apartment_id=apts[0].id)
+    db.session.add_all([admin, resident])
+    db.session.flush()
+    badge = Badge(organization_id=org.id, badge_number='RF-001', resident_id=resident.id)
+    db.session.add(badge)
+    db.session.flush()
+
+    now = datetime.utcnow()
+    old = datetime(now.year - 2, 3, 15, 8, 30)           # hors fenêtre chaude (12 mois)
+    def swipe(ts, number='RF-001', point='Parking'):
+        db.session.add(BadgeAccessLog(organization_id=org.id, badge_id=badge.id if number == 'RF-001' else None,
+                                      badge_number=number, access_point=point, timestamp=ts))
+    swipe(old)
+    swipe(old + timedelta(days=1), 'XX-900', 'Entrée principale')
+    swipe(old + timedelta(days=40))
+    swipe(now)
+    db.session.add_all([AccessLog(organization_id=org.id, visitor_name='Livreur Ali',
+                                  apartment_id=apts[0].id, logged_at=old),
+                        AccessLog(organization_id=org.id, visitor_name='Plombier', logged_at=now)])
+    db.session.commit()
+
+    assert archive_old_months() == 4
+    assert BadgeAccessLog.query.count() == 1 and AccessLog.query.count() == 1
+    month = f"{old.year}-03"
+    arch = AccessLogArchive.query.filter_by(organization_id=org.id, kind='badges', month=month).one()
+    assert arch.rows == 2 and arch.size > 0
+
+    # Ligne tardive (lecteur resynchronisé) : fusionnée dans l'archive à la passe suivante
+    swipe(old + timedelta(hours=2))
+    db.session.commit()
+    assert archive_old_months() == 1
+    assert AccessLogArchive.query.filter_by(kind='badges', month=month).one().rows == 3
+    assert [r.badge_number for r in month_records(org.id, 'badges', month)] == ['XX-900', 'RF-001', 'RF-001']
+
+    client = login(admin)
+    page = client.get(f'/badges/journal?mois={month}&badge=rf').data.decode()   # sans casse
+    assert 'Passages de ' + month + ' (archive)' in page
+    assert page.count('Résident Un') == 1 + 2 and 'XX-900' not in page   # liste des badges + 2 passages
+    page = client.get(f'/badges/journal?mois={month}&point=entr').data.decode()
+    assert 'XX-900' in page and page.count('Résident Un') == 1
+    page = client.get('/badges/journal?badge=rf-0').data.decode()      # table chaude, idem
+    assert page.count('Résident Un') == 1 + 1
+
+    page = client.get(f'/access?mois={old.year}-03&q=livreur').data.decode()
+    assert 'Livreur Ali' in page and 'A-101' in page
+    assert 'Plombier' in client.get('/access').data.decode()
@@ -0,0 +1,106 @@
+"""
+Suivi des visites (utils_analytics) — tampon en mémoire et vidage groupé.
+"""
+
+UA = 'Mozilla/5.0 (Windows NT 10.0) Chrome/120.0'
+
+
+def test_visits_are_buffered_then_bulk_inserted(client):
+    from core import db
+    from models import SiteVisit, User
+    import utils_analytics
+
+    utils_analytics.flush_visits()
+    db.session.query(SiteVisit).delete()
+    db.session.commit()
+
+    for _ in range(3):
+        client.get('/', headers={'User-Agent': UA})
+    client.get('/', headers={'User-Agent': 'Googlebot/2.1'})
+    assert SiteVisit.query.count() == 0          # rien d'écrit pendant la requête
+
+    assert utils_analytics.flush_visits() == 3
+    rows = SiteVisit.query.all()
+    assert len(rows) == 3 and all(r.ts and r.browser == 'Chrome' for r in rows)
+    assert utils_analytics.flush_visits() == 0
+
+
+def test_excluded_users_from_cached_set(client):
+    from core import db
+    from models import User, Organization
+    import utils_analytics
+
+    org = Organization(name='Résidence Jasmin (test)', slug='jasmin-test', email='j@t.tn')
+    db.session.add(org)
+    db.session.flush()
+    test_user = User(email='j@t.tn', role='admin', organization_id=org.id)
+    sa = User(email='sa@t.tn', role='superadmin')
+    real = User(email='r@t.tn', role='admin')
+    db.session.add_all([test_user, sa, real])
+    db.session.commit()
+
+    utils_analytics.invalidate_excluded_users()
+    assert utils_analytics._is_excluded_user(test_user.id)
+    assert utils_analytics._is_excluded_user(sa.id)
+    assert not utils_analytics._is_excluded_user(real.id)
+    assert not utils_analytics._is_excluded_user(None)
+
+
+def _seed_visits(now):
+    from datetime import timedelta
+    from core import db
+    from models import SiteVisit
+    rows = []
+    for days_ago, session, path, ref, utm in [
+        (3, 's1', '/', None, 'fb'), (3, 's1', '/register', None, None),
+        (1, 's2', '/', 'google.com', None), (1, 's1', '/tarifs', None, None),
+        (0, 's3', '/', None, 'fb'), (0, 's2', '/register', 'google.com', None),
+        (0, '', '/', None, None),
+    ]:
+        rows.append(SiteVisit(ts=now - timedelta(days=days_ago, minutes=len(rows)), path=path,
+                              session_key=session, referrer=f'https://{ref}/' if ref else '',
+                              referrer_domain=ref, device_type='mobile', browser='Chrome',
+                              os_name='Android', utm_source=utm))
+    db.session.add_all(rows)
+    db.session.commit()
+
+
+def test_rollups_match_raw_and_retention(client):
+    from datetime import datetime, timedelta
+    from models import SiteVisit, SiteRollupDay
+    from utils_analytics_rollup import load_window, rollup_closed_days, purge_raw_visits
+
+    now = datetime.utcnow().replace(hour=12)
+    _seed_visits(now)
+    since = (now - timedelta(days=30)).date()
+
+    raw = load_window(since)                  # aucun rollup : tout vient de site_visit
+    assert rollup_closed_days(purge=False, now=now) == 3
+    assert rollup_closed_days(purge=False, now=now) == 0     # incrémental
+    rolled = load_window(since)
+
+    for key in ('days', 'dims', 'hours', 'sessions', 'new_sessions'):
+        assert rolled[key] == raw[key], key
+    assert sum(rolled['dims'].values()) == 7
+    assert rolled['new_sessions'] == 3
+    assert SiteRollupDay.query.count() == 3
+
+    client.application.config['ANALYTICS_RAW_RETENTION_DAYS'] = 2
+    try:
+        assert purge_raw_visits(now) == 2           # seules les visites d'il y a 3 jours
+    finally:
+        client.application.config['ANALYTICS_RAW_RETENTION_DAYS'] = 90
+    assert SiteVisit.query.count() == 5
+    assert load_window(since)['dims'] == raw['dims']
+
+
+def test_analytics_dashboard_renders(client, login):
+    from core import db
+    from models import User
+    sa = User(email='sa2@t.tn', role='superadmin')
+    db.session.add(sa)
+    db.session.commit()
+    _seed_visits(__import__('datetime').datetime.utcnow())
+    r = login(sa).get('/superadmin/analytics?period=7')
+    assert r.status_code == 200
+    assert b'/register' in r.data
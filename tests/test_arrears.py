@@ -0,0 +1,118 @@
+"""
+Registre des impayés (utils_arrears) — cohérence avec le recalcul mois par mois.
+"""
+from datetime import date
+from dateutil.relativedelta import relativedelta
+
+
+def _months_ago(n):
+    return (date.today().replace(day=1) - relativedelta(months=n)).strftime('%Y-%m')
+
+
+def _pay(org, apt, months):
+    from core import db
+    from models import Payment
+    for m in months:
+        db.session.add(Payment(organization_id=org.id, apartment_id=apt.id, amount=100.0,
+                               payment_date=date.today(), month_paid=m))
+
+
+def test_ledger_matches_rescan(org_factory):
+    from core import db
+    from utils import get_unpaid_map, get_unpaid_details_map, get_paid_months_map
+    from utils_arrears import check_arrears
+    org, apts = org_factory(n=3, months=14)
+    _pay(org, apts[0], [_months_ago(i) for i in range(0, 15)])   # tout payé
+    _pay(org, apts[1], [_months_ago(14), _months_ago(13), _months_ago(5)])
+    db.session.commit()
+
+    ledger = get_unpaid_details_map(org.id, apts)
+    legacy = get_unpaid_details_map(org.id, apts, paid=get_paid_months_map(org.id))
+    assert ledger == legacy
+    assert get_unpaid_map(org.id, apts) == {a.id: legacy[a.id][0] for a in apts}
+    assert ledger[apts[1].id] == (12, _months_ago(12))
+    assert check_arrears(org.id) == []
+
+
+def test_record_and_refresh(org_factory):
+    from core import db
+    from models import Payment
+    from utils import get_unpaid_months_count, get_next_unpaid_month
+    from utils_arrears import record_paid_months, refresh_arrears, check_arrears
+    org, apts = org_factory(n=1, months=2)
+    apt = apts[0]
+    assert get_unpaid_months_count(apt.id) == 3
+
+    months = [_months_ago(2), _months_ago(1)]
+    _pay(org, apt, months)
+    record_paid_months(apt, months)
+    db.session.commit()
+    assert get_unpaid_months_count(apt.id) == 1
+    assert get_next_unpaid_month(apt.id) == _months_ago(0)
+
+    p = Payment.query.filter_by(apartment_id=apt.id, month_paid=_months_ago(2)).first()
+    db.session.delete(p)
+    refresh_arrears(apt.id)
+    db.session.commit()
+    assert get_unpaid_months_count(apt.id) == 2
+    assert get_next_unpaid_month(apt.id) == _months_ago(2)
+    assert check_arrears(org.id) == []
+
+
+def test_edit_payment_refuses_month_already_paid(org_factory, login):
+    from core import db
+    from models import Payment, User
+    org, (apt,) = org_factory(n=1, months=2)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    db.session.add(admin)
+    _pay(org, apt, [_months_ago(2), _months_ago(1)])
+    db.session.commit()
+    p = Payment.query.filter_by(apartment_id=apt.id, month_paid=_months_ago(1)).one()
+
+    r = login(admin).post(f'/payment/edit/{p.id}', data={
+        'amount': '100', 'payment_date': date.today().isoformat(), 'payment_mode': 'especes',
+        'apartment_id': str(apt.id), 'month_paid': _months_ago(2)}, follow_redirects=True)
+    assert 'déjà encaissé' in r.data.decode()
+    assert db.session.get(Payment, p.id).month_paid == _months_ago(1)
+
+
+def test_backfill_leaves_caller_transaction_alone(org_factory):
+    from core import db
+    from models import ApartmentArrears, Block
+    from utils_arrears import get_arrears_map
+    org, apts = org_factory(n=2, months=2)
+    ApartmentArrears.query.delete()
+    db.session.commit()
+
+    db.session.add(Block(organization_id=org.id, name='Z'))      # travail en cours de l'appelant
+    rows = get_arrears_map(org.id, apts)
+    assert set(rows) == {a.id for a in apts}
+    db.session.rollback()
+    assert Block.query.filter_by(name='Z').count() == 0         # pas validé par la reconstruction
+    assert ApartmentArrears.query.count() == 0
+
+    get_arrears_map(org.id, apts)
+    db.session.commit()                                         # enregistrées avec le commit
+    assert ApartmentArrears.query.count() == 2
+
+
+def test_backfill_fills_ledger_so_reads_do_not_rebuild(org_factory):
+    from sqlalchemy import event
+    from core import db
+    from models import ApartmentArrears
+    from utils_arrears import backfill_arrears, get_arrears_map
+    org, apts = org_factory(n=3, months=2)
+    _pay(org, apts[0], [_months_ago(1)])
+    db.session.commit()
+
+    assert backfill_arrears() == 3 and ApartmentArrears.query.count() == 3
+    assert backfill_arrears() == 0
+    org_id, _ = org.id, [a.id for a in apts]          # attributs rechargés hors mesure
+    stmts = []
+    listener = lambda conn, cursor, statement, *a: stmts.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        rows = get_arrears_map(org_id, apts)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert len(stmts) == 1 and rows[apts[0].id].unpaid_count == 2
@@ -0,0 +1,91 @@
+"""
+API des lecteurs de badges (utils_badges) : clé hachée, index en mémoire invalidé
+par les changements de statut, journal écrit hors de la décision.
+"""
+
+
+def _setup(org_factory):
+    from core import db
+    from models import Badge, User
+    from utils_badges import set_api_key
+    org, apts = org_factory(n=1)
+    resident = User(email='r@t.tn', name='Résident Un', phone='20000000', role='resident',
+                    organization_id=org.id, apartment_id=apts[0].id)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    db.session.add_all([resident, admin])
+    db.session.flush()
+    badge = Badge(organization_id=org.id, badge_number='RF-001', resident_id=resident.id, status='actif')
+    db.session.add(badge)
+    set_api_key(org, 'cle-secrete-0001')
+    db.session.commit()
+    return org, badge, admin
+
+
+def test_access_decision_uses_cached_index_and_buffers_log(client, org_factory, login, monkeypatch):
+    from core import app
+    from models import BadgeAccessLog, Organization
+    from utils_badges import flush_access_logs
+    org, badge, admin = _setup(org_factory)
+    assert Organization.query.get(org.id).badges_api_key is None    # pas de clé en clair
+
+    reader = app.test_client()       # lecteur RFID : pas de session
+
+    def swipe(number='RF-001', key='cle-secrete-0001'):
+        return reader.post('/api/badges/access', json={'badge_number': number},
+                           headers={'X-Api-Key': key})
+
+    with monkeypatch.context() as m:     # rappels d'abonnement quotidiens — hors budget
+        m.setitem(app.config, 'SQL_QUERY_BUDGET_STRICT', False)
+        assert swipe(key='mauvaise').status_code == 401
+    r = swipe()                                           # index construit
+    assert r.json == {'granted': True, 'badge_number': 'RF-001',
+                      'resident': 'Résident Un', 'apartment': 'A-101'}
+    r = swipe()                                           # à chaud : clé + version seulement
+    assert r.json['granted'] and r.headers['X-DB-Queries'] == '1'
+    assert swipe('INCONNU').json == {'granted': False, 'badge_number': 'INCONNU', 'reason': 'Badge inconnu'}
+    assert BadgeAccessLog.query.count() == 0               # journal en tampon
+    assert flush_access_logs() == 3
+    assert [l.access_granted for l in BadgeAccessLog.query.order_by(BadgeAccessLog.id)] == [True, True, False]
+
+    # Blocage depuis l'interface : effet immédiat sur le lecteur
+    client = login(admin)
+    client.post(f'/badges/{badge.id}/status', data={'status': 'bloqué'})
+    assert swipe().json == {'granted': False, 'badge_number': 'RF-001', 'reason': 'Badge bloqué'}
+
+    # Nouvelle clé : l'ancienne est refusée, la nouvelle n'est montrée qu'une fois
+    client.post('/settings/regen-badges-api-key')
+    page = client.get('/badges').data.decode()
+    new_key = Organization.query.get(org.id)
+    assert swipe().status_code == 401
+    assert new_key.badges_api_key_hint in page and 'Copiez cette clé maintenant' in page
+    assert 'Copiez cette clé maintenant' not in client.get('/badges').data.decode()
+
+
+def test_block_in_another_worker_invalidates_index(client, org_factory, login, monkeypatch):
+    import utils_badges
+    import utils_cache
+    from core import app
+    org, badge, admin = _setup(org_factory)
+    reader = app.test_client()
+
+    def swipe(key='cle-secrete-0001'):
+        return reader.post('/api/badges/access', json={'badge_number': 'RF-001'},
+                           headers={'X-Api-Key': key})
+
+    with monkeypatch.context() as m:
+        m.setitem(app.config, 'SQL_QUERY_BUDGET_STRICT', False)
+        assert swipe().json['granted']              # index construit dans le worker A
+
+    # Worker B : mémoire propre (index, cache) — seule la base est partagée avec A
+    def in_worker_b(url, **data):
+        with monkeypatch.context() as m:
+            m.setattr(utils_badges, '_indexes', {})
+            m.setattr(utils_cache, 'cache', utils_cache.MemoryCache())
+            login(admin).post(url, data=data)
+
+    in_worker_b(f'/badges/{badge.id}/status', status='bloqué')
+    assert org.id in utils_badges._indexes                  # index de A toujours en mémoire
+    assert swipe().json == {'granted': False, 'badge_number': 'RF-001', 'reason': 'Badge bloqué'}
+
+    in_worker_b('/settings/regen-badges-api-key')
+    assert swipe().status_code == 401
@@ -0,0 +1,91 @@
+"""
+Stockage adressé par contenu et migration des pièces jointes base64 (utils_blobs).
+"""
+import base64
+import os
+from datetime import date
+
+
+def _use_tmp_store(monkeypatch, tmp_path):
+    import storage_helper
+    monkeypatch.setattr(storage_helper.local_store, 'root', str(tmp_path))
+    monkeypatch.setattr(storage_helper, '_store', storage_helper.local_store)
+
+
+def test_local_store_deduplicates(monkeypatch, tmp_path):
+    _use_tmp_store(monkeypatch, tmp_path)
+    from storage_helper import upload_file, local_store
+    a = upload_file(b'meme contenu', 'application/pdf', folder='factures')
+    b = upload_file(b'meme contenu', 'application/pdf', folder='tickets')
+    assert a == b and a.startswith('blob:') and a.endswith('.pdf')
+    assert len(local_store.digests()) == 1
+
+
+def test_migrate_base64_columns_then_serve_and_gc(client, org_factory, login, monkeypatch, tmp_path):
+    _use_tmp_store(monkeypatch, tmp_path)
+    from core import db
+    from models import Expense, User
+    from utils_blobs import ATTACHMENTS, migrate_attachment, pending, collect_garbage
+    org, _ = org_factory(n=1)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    pdf = b'%PDF-1.4 ' + os.urandom(3000)
+    expenses = [Expense(organization_id=org.id, amount=10.0, expense_date=date.today(),
+                        facture_data=base64.b64encode(pdf).decode(), facture_mime='application/pdf',
+                        facture_nom=f'facture{i}.pdf') for i in range(3)]
+    db.session.add_all([admin, *expenses])
+    db.session.commit()
+
+    spec = next(a for a in ATTACHMENTS if a.model is Expense)
+    assert pending(spec)[0] == 3
+    assert migrate_attachment(spec, batch=2) == (3, 0)
+    assert pending(spec) == (0, 0)
+    db.session.expire_all()
+    refs = {e.facture_url for e in Expense.query.all()}
+    assert len(refs) == 1 and refs.pop().startswith('blob:')
+
+    r = login(admin).get(f'/expense/{expenses[0].id}/facture?dl=1')
+    assert r.status_code == 200 and r.data == pdf
+    assert r.mimetype == 'application/pdf' and 'facture0.pdf' in r.headers['Content-Disposition']
+    assert login(admin).get(f'/expense/{expenses[0].id}/facture',
+                            headers={'If-None-Match': r.headers['ETag']}).status_code == 304
+
+    # Plus aucune référence → supprimé par le ramasse-miettes (après le délai de grâce)
+    Expense.query.update({'facture_url': None})
+    db.session.commit()
+    path = next(iter(__import__('storage_helper').local_store.digests().values()))
+    os.utime(path, (0, 0))
+    assert collect_garbage()[0] == 1 and not os.path.exists(path)
+
+
+def test_send_attachment_validators_ranges_and_redirects(client, org_factory, login):
+    import hashlib
+    from core import db
+    from models import LitigeDocument, AutreLitige, User
+    org, _ = org_factory(n=1)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    al = AutreLitige(organization_id=org.id, titre='Dossier')
+    db.session.add_all([admin, al])
+    db.session.flush()
+    pdf = b'%PDF-1.4 ' + os.urandom(5000)
+    legacy = LitigeDocument(litige_id=al.id, nom='pv.pdf', mime='application/pdf',
+                            data=base64.b64encode(pdf).decode())
+    external = LitigeDocument(litige_id=al.id, nom='ext.pdf', mime='application/pdf',
+                              url='https://cdn.example.test/litiges/abc.pdf')
+    db.session.add_all([legacy, external])
+    db.session.commit()
+    c = login(admin)
+
+    # ETag fort = SHA-256 du contenu, y compris pour une ligne base64 non migrée
+    r = c.get(f'/litiges/autres/{al.id}/doc/{legacy.id}')
+    assert r.status_code == 200 and r.data == pdf
+    assert r.headers['ETag'] == f'"{hashlib.sha256(pdf).hexdigest()}"'
+    assert c.get(f'/litiges/autres/{al.id}/doc/{legacy.id}',
+                 headers={'If-None-Match': r.headers['ETag']}).status_code == 304
+
+    r = c.get(f'/litiges/autres/{al.id}/doc/{legacy.id}', headers={'Range': 'bytes=100-199'})
+    assert r.status_code == 206 and r.data == pdf[100:200]
+    assert r.headers['Content-Range'] == f'bytes 100-199/{len(pdf)}'
+
+    r = c.get(f'/litiges/autres/{al.id}/doc/{external.id}')
+    assert r.status_code == 302 and r.location == external.url
+    assert 'max-age=' in r.headers['Cache-Control']
@@ -0,0 +1,93 @@
+"""
+Cache applicatif (utils_cache) — backends, tags, invalidation au commit.
+"""
+import pytest
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'fakeredis'])
+def backend(request, tmp_path):
+    from utils_cache import MemoryCache, SQLiteCache, RedisCache, FakeRedis
+    return {'memory': lambda: MemoryCache(max_entries=3),
+            'sqlite': lambda: SQLiteCache(str(tmp_path / 'cache.sqlite3')),
+            'fakeredis': lambda: RedisCache(FakeRedis())}[request.param]()
+
+
+def test_backend_tags_and_counters(backend):
+    calls = []
+    load = lambda: calls.append(1) or len(calls)
+
+    assert backend.get_or_set('notif:1', load, tags=['org:1', 'user:1']) == 1
+    assert backend.get_or_set('notif:1', load, tags=['org:1', 'user:1']) == 1
+    backend.set('notif:2', 'autre', tags=['org:2'])
+
+    backend.invalidate_tags('org:1')
+    assert backend.get_or_set('notif:1', load, tags=['org:1', 'user:1']) == 2
+    assert backend.get('notif:2') == 'autre'          # autre organisation intacte
+    backend.invalidate_tags('user:1')
+    assert backend.get('notif:1') is None
+
+    stats = backend.stats()['notif']
+    assert stats['hits'] == 2 and stats['misses'] == 3
+
+
+def test_memory_lru_and_ttl(monkeypatch):
+    import utils_cache
+    c = utils_cache.MemoryCache(max_entries=2)
+    c.set('a', 1)
+    c.set('b', 2)
+    c.get('a')
+    c.set('c', 3)                   # évince 'b' (le moins récemment utilisé)
+    assert c.get('b') is None and c.get('a') == 1
+
+    c.set('t', 'x', ttl=10)
+    now = utils_cache.time.monotonic()
+    monkeypatch.setattr(utils_cache.time, 'monotonic', lambda: now + 11)
+    assert c.get('t') is None
+
+
+def test_notifications_invalidated_by_commit(client, org_factory):
+    from core import app, db
+    from flask import session
+    from models import User, Ticket
+    from utils import inject_notifications, notification_feed
+    from utils_cache import cache
+
+    org, apts = org_factory(n=1)
+    admin = User(email='adm@t.tn', role='admin', organization_id=org.id)
+    db.session.add(admin)
+    db.session.commit()
+
+    def render():
+        with app.test_request_context('/payments'):
+            session['user_id'] = admin.id
+            app.preprocess_request()
+            return inject_notifications()
+
+    def feed():
+        with app.test_request_context('/api/notif/feed'):
+            return notification_feed(admin)
+
+    assert render()['notif_lazy']                  # cloche pas encore en cache : chargement différé
+    before = cache.stats()['notif-feed']
+    assert feed()['notif_list'] == []
+    assert feed()['notif_list'] == []
+    assert cache.stats()['notif-feed']['hits'] == before['hits'] + 1
+    assert render()['notif_list'] == []            # désormais rendue côté serveur
+
+    db.session.add(Ticket(organization_id=org.id, apartment_id=apts[0].id, user_id=admin.id,
+                          subject='Fuite', message='...'))
+    db.session.commit()
+    assert render()['notif_lazy']
+    assert [n['text'] for n in feed()['notif_list']] == ['Nouveau ticket — A-101']
+
+
+def test_default_backend_shared_between_workers(monkeypatch, tmp_path):
+    from utils_cache import MemoryCache, SQLiteCache, _make_cache
+    monkeypatch.delenv('CACHE_BACKEND', raising=False)
+    monkeypatch.setenv('CACHE_SQLITE_PATH', str(tmp_path / 'cache.sqlite3'))
+    worker_a, worker_b = _make_cache(), _make_cache()
+    assert isinstance(worker_a, SQLiteCache) and worker_a.shared
+    worker_a.set('notif:1', 'ancien', tags=['org:1'])
+    worker_b.invalidate_tags('org:1')                  # écriture traitée par l'autre worker
+    assert worker_a.get('notif:1') is None
+    assert MemoryCache.shared is False
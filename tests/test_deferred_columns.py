@@ -0,0 +1,83 @@
+"""
+Colonnes volumineuses différées (models.big_column) : les pages de liste ne
+chargent pas les pièces jointes base64.
+"""
+import base64
+import os
+from contextlib import contextmanager
+from datetime import date
+
+from sqlalchemy import event
+
+PAYLOAD = base64.b64encode(os.urandom(200_000)).decode()   # ~270 Ko par pièce jointe
+
+
+@contextmanager
+def _loaded_bytes():
+    """Compte les octets (str / bytes) matérialisés par l'ORM pendant le bloc."""
+    from core import db
+    total = [0]
+
+    def on_load(target, context):
+        total[0] += sum(len(v) for v in vars(target).values() if isinstance(v, (str, bytes)))
+
+    event.listen(db.Model, 'load', on_load, propagate=True)
+    try:
+        yield total
+    finally:
+        event.remove(db.Model, 'load', on_load)
+
+
+def _seed(org, apts, n=5):
+    from core import db
+    from models import User, Ticket, Expense, AppelFonds, AppelFondsDepense
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    db.session.add(admin)
+    db.session.flush()
+    for i in range(n):
+        db.session.add(Ticket(organization_id=org.id, apartment_id=apts[0].id, user_id=admin.id,
+                              subject=f'Fuite {i}', message='Fuite au 3e étage',
+                              photo_data=PAYLOAD, photo_mime='image/jpeg'))
+        db.session.add(Expense(organization_id=org.id, amount=10.0, expense_date=date.today(),
+                               facture_data=PAYLOAD, facture_mime='application/pdf'))
+        af = AppelFonds(organization_id=org.id, titre=f'Travaux {i}', budget_total=1000.0,
+                        devis_data=PAYLOAD, devis_mime='application/pdf')
+        db.session.add(af)
+        db.session.flush()
+        db.session.add(AppelFondsDepense(appel_id=af.id, organization_id=org.id, amount=50.0,
+                                         date=date.today(), libelle='Acompte',
+                                         facture_data=PAYLOAD, facture_mime='application/pdf'))
+    db.session.commit()
+    return admin
+
+
+def test_list_pages_do_not_load_attachments(client, org_factory, login):
+    from core import db
+    org, apts = org_factory(n=1)
+    admin = _seed(org, apts)
+    for url in ('/tickets', '/expenses', '/appels-fonds'):
+        client = login(admin)
+        db.session.expunge_all()    # la page recharge tout depuis la base
+        with _loaded_bytes() as loaded:
+            r = client.get(url)
+        assert r.status_code == 200, url
+        assert loaded[0] < 20_000, f"{url} : {loaded[0]} octets chargés"
+    # Indicateur de pièce jointe toujours affiché (via *_mime)
+    assert b'/facture' in login(db.session.merge(admin)).get('/expenses').data
+
+
+def test_download_route_undefers_attachment(client, org_factory, login):
+    from core import db
+    from models import Expense
+    org, apts = org_factory(n=1)
+    admin = _seed(org, apts, n=1)
+    expense_id = Expense.query.first().id
+    client = login(admin)
+    db.session.expunge_all()
+    r = client.get(f'/expense/{expense_id}/facture')
+    assert r.status_code == 200 and r.data == base64.b64decode(PAYLOAD)
+    from models import Ticket
+    ticket_id = Ticket.query.first().id
+    assert b'/photo' in login(db.session.merge(admin)).get(f'/ticket/{ticket_id}').data
+    r = login(db.session.merge(admin)).get(f'/ticket/{ticket_id}/photo')
+    assert r.status_code == 200 and r.mimetype == 'image/jpeg'
@@ -0,0 +1,54 @@
+"""
+Export Excel en flux (utils_xlsx, openpyxl write-only) : feuilles, valeurs, couleurs.
+"""
+import io
+from datetime import date
+
+from openpyxl import load_workbook
+
+
+def test_export_excel_sheets_and_styles(client, org_factory, login):
+    from core import db
+    from models import User, Payment, Expense
+    org, apts = org_factory(n=2)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    db.session.add(admin)
+    db.session.add(User(email='r@t.tn', name='Résident Un', phone='20000000', role='resident',
+                        organization_id=org.id, apartment_id=apts[0].id))
+    db.session.add(Payment(organization_id=org.id, apartment_id=apts[0].id, amount=100.0,
+                           payment_date=date(2025, 3, 5), month_paid='2025-03',
+                           payment_mode='cheque', cheque_number='123', cheque_bank='BIAT',
+                           description='Virement du mois de mars, reçu au guichet'))
+    db.session.add(Payment(organization_id=org.id, apartment_id=apts[1].id, amount=100.0,
+                           payment_date=date(2024, 12, 5), month_paid='2024-12'))
+    db.session.add(Expense(organization_id=org.id, amount=42.5, expense_date=date(2025, 6, 1),
+                           category='Nettoyage', description='Produits'))
+    db.session.commit()
+
+    from utils_jobs import run_pending
+    client = login(admin)
+    assert b'report-progress' in client.get('/export_excel?year=2025').data   # rendu par le worker
+    run_pending()
+    resp = client.get('/export_excel?year=2025')
+    assert resp.status_code == 200 and resp.mimetype.endswith('spreadsheetml.sheet')
+    wb = load_workbook(io.BytesIO(resp.data))
+    assert wb.sheetnames == ['Appartements', 'Encaissements 2025', 'Dépenses 2025',
+                             'Impayés', 'Tableau 2025']
+
+    apt_rows = list(wb['Appartements'].iter_rows(values_only=True))
+    assert apt_rows[1][2] == 'A-101' and apt_rows[1][6] == 'Résident Un'
+
+    ws = wb['Encaissements 2025']
+    rows = list(ws.iter_rows(values_only=True))
+    assert len(rows) == 2      # l'encaissement de 2024-12 n'est pas exporté
+    assert rows[1][1:8] == ('A-101', 100.0, '05/03/2025', '2025-03', 'Chèque', '123', 'BIAT')
+    assert ws['A1'].font.bold
+    assert ws.column_dimensions['J'].width > ws.column_dimensions['A'].width   # description longue
+
+    assert list(wb['Dépenses 2025'].iter_rows(values_only=True))[1][1:4] == (42.5, '01/06/2025', 'Nettoyage')
+
+    tab = wb['Tableau 2025']
+    assert tab.freeze_panes == 'C2'
+    assert tab['E2'].value == 'Payé' and tab['E2'].fill.start_color.rgb.endswith('C6EFCE')
+    assert tab['C2'].value == 'Impayé' and tab['C2'].fill.start_color.rgb.endswith('FFC7CE')
+    assert tab['O2'].value == 1 and tab['P2'].value == 11
@@ -0,0 +1,171 @@
+"""
+États financiers : les agrégats SQL (_compute_financial_data) donnent exactement
+le résultat de l'ancien calcul en Python sur toutes les opérations ; les clôtures
+d'exercice (utils_closing) ne changent rien et sont périmées par une correction.
+"""
+from datetime import date, datetime
+
+from dateutil.relativedelta import relativedelta
+
+
+def _reference(org, year):
+    """Ancien calcul (tout l'historique chargé, filtré en Python) — référence du test."""
+    from routes.financial_statements import CATEGORY_TO_SCE
+    from models import Apartment, Payment, Expense, MiscReceipt
+    apartments = Apartment.query.filter_by(organization_id=org.id).order_by(Apartment.id).all()
+    pays = Payment.query.filter_by(organization_id=org.id).order_by(Payment.id).all()
+    exps = Expense.query.filter_by(organization_id=org.id).order_by(Expense.id).all()
+    misc = MiscReceipt.query.filter_by(organization_id=org.id).order_by(MiscReceipt.id).all()
+    y_pays = [p for p in pays if p.payment_date.year == year]
+    y_exps = [e for e in exps if e.expense_date.year == year]
+    y_misc = [m for m in misc if m.payment_date.year == year]
+    immos = [e for e in exps if e.category == 'Immobilisation']
+    charges = [e for e in exps if e.category != 'Immobilisation']
+    y_charges = [e for e in y_exps if e.category != 'Immobilisation']
+
+    tresorerie = sum(p.amount for p in pays) + sum(m.amount for m in misc) - sum(e.amount for e in exps)
+    paid = {}
+    for p in pays:
+        paid.setdefault(p.apartment_id, set()).add(p.month_paid)
+    today = date.today().replace(day=1)
+    creances, trop_percus = [], []
+    for apt in apartments:
+        cursor, du = apt.created_at.date().replace(day=1), 0.0
+        while cursor <= today:
+            if cursor.strftime('%Y-%m') not in paid.get(apt.id, set()):
+                du += apt.monthly_fee
+            cursor += relativedelta(months=1)
+        du = max(0.0, du - apt.credit_balance)
+        resident = apt.residents[0].name if apt.residents else '-'
+        if du > 0:
+            creances.append({'apt': f"{apt.block.name}-{apt.number}", 'resident': resident, 'montant': du})
+        if apt.credit_balance > 0:
+            trop_percus.append({'apt': f"{apt.block.name}-{apt.number}", 'resident': resident,
+                                'montant': apt.credit_balance})
+
+    par_compte = {}
+    for e in y_charges:
+        if e.category != 'Charges bancaires':
+            key = CATEGORY_TO_SCE.get(e.category or 'Autre', ('65x', "Autres charges d'exploitation"))
+            par_compte[key] = par_compte.get(key, 0.0) + e.amount
+    produits = sum(p.amount for p in y_pays)
+    reportes = (sum(p.amount for p in pays if p.payment_date.year != year)
+                - sum(e.amount for e in charges if e.expense_date.year != year))
+    return {
+        'liquidites': max(0.0, tresorerie), 'decouvert': max(0.0, -tresorerie),
+        'tresorerie_nette': tresorerie,
+        'creances_detail': creances, 'total_creances': sum(c['montant'] for c in creances),
+        'trop_percus_detail': trop_percus, 'total_trop_percus': sum(t['montant'] for t in trop_percus),
+        'total_immobilisations': sum(e.amount for e in immos),
+        'immos_detail': [{'date': e.expense_date, 'description': e.description or e.category,
+                          'montant': e.amount}
+                         for e in sorted(immos, key=lambda x: x.expense_date, reverse=True)],
+        'resultat_exercice': produits - sum(e.amount for e in y_charges),
+        'resultats_reportes': reportes,
+        'cotisations_encaissees': produits,
+        'autres_produits': sum(m.amount for m in y_misc),
+        'autres_produits_detail': [{'libelle': m.libelle, 'date': m.payment_date, 'montant': m.amount}
+                                   for m in sorted(y_misc, key=lambda x: x.payment_date)],
+        'charges_sce': sorted([{'compte': k[0], 'libelle': k[1], 'montant': v}
+                               for k, v in par_compte.items()], key=lambda x: x['compte']),
+        'total_charges_financieres': sum(e.amount for e in y_charges if e.category == 'Charges bancaires'),
+        'flux_mensuel': [(sum(p.amount for p in y_pays if p.payment_date.month == m),
+                          sum(e.amount for e in y_exps if e.expense_date.month == m))
+                         for m in range(1, 13)],
+    }
+
+
+def _rounded(value):
+    """Arrondi à 1e-6 : seul l'ordre des additions flottantes diffère (SUM SQL)."""
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {k: _rounded(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_rounded(v) for v in value]
+    return value
+
+
+def _seed(org, apts):
+    from core import db
+    from models import User, Payment, Expense, MiscReceipt
+    today = date.today()
+    apts[0].credit_balance = 37.5
+    apts[2].created_at = datetime.utcnow() - relativedelta(months=2)
+    db.session.add(User(email='r@t.tn', name='Résident A', role='resident',
+                        organization_id=org.id, apartment_id=apts[0].id))
+    for i in range(24):                        # 2 ans de redevances, avec trous et avances
+        m = today - relativedelta(months=i)
+        for apt in apts[:2]:
+            if (i + apt.id) % 5:
+                db.session.add(Payment(organization_id=org.id, apartment_id=apt.id, amount=100.0,
+                                       payment_date=m - relativedelta(days=3), month_paid=m.strftime('%Y-%m')))
+    db.session.add(Payment(organization_id=org.id, apartment_id=apts[1].id, amount=100.0, payment_date=today,
+                           month_paid=(today + relativedelta(months=2)).strftime('%Y-%m')))
+    cats = ['Electricité', 'Eau', 'Entretien', None, 'Immobilisation', 'Charges bancaires',
+            'Gardiennage', 'Catégorie libre']
+    for i in range(40):
+        db.session.add(Expense(organization_id=org.id, amount=12.345 * (i + 1),
+                               expense_date=today - relativedelta(days=17 * i), category=cats[i % len(cats)],
+                               description=None if i % 3 else f'Facture {i}'))
+    for i in range(6):
+        db.session.add(MiscReceipt(organization_id=org.id, libelle=f'Location salle {i}', amount=55.5,
+                                   payment_date=today - relativedelta(months=3 * i)))
+    db.session.commit()
+
+
+def test_sql_aggregates_match_python_reference(client, org_factory):
+    from routes.financial_statements import _compute_financial_data
+    org, apts = org_factory(n=3, months=30)
+    _seed(org, apts)
+    for year in (date.today().year, date.today().year - 1, date.today().year - 2):
+        data = _compute_financial_data(org, year)
+        expected = _reference(org, year)
+        got = {k: data[k] for k in expected if k != 'flux_mensuel'}
+        got['flux_mensuel'] = [(f['encaissements'], f['decaissements']) for f in data['flux_mensuel']]
+        assert _rounded(got) == _rounded(expected), year
+        assert data['charges_sce'] and data['immos_detail'] and data['creances_detail']
+
+
+def test_closed_years_give_same_statements_and_go_stale_on_edit(client, org_factory):
+    from core import db
+    from models import Expense, FiscalYearClosing
+    from routes.financial_statements import _compute_financial_data
+    from utils_closing import close_year
+    org, apts = org_factory(n=3, months=30)
+    _seed(org, apts)
+    this_year = date.today().year
+    years = (this_year, this_year - 1, this_year - 2)
+    before = {y: _rounded(_compute_financial_data(org, y)) for y in years}
+    for y in (this_year - 2, this_year - 1):
+        close_year(org, y)
+    for y in years:
+        after = _rounded(_compute_financial_data(org, y))
+        skip = ('generated_at', 'creances_cloture')
+        assert {k: after[k] for k in after if k not in skip} == \
+               {k: before[y][k] for k in before[y] if k not in skip}, y
+    # Exercice clôturé : comptes SCE et créances au 31/12 lus dans la clôture
+    closed = _compute_financial_data(org, this_year - 1)
+    closing = FiscalYearClosing.query.filter_by(organization_id=org.id, year=this_year - 1).one()
+    assert closed['creances_cloture'] and _compute_financial_data(org, this_year)['creances_cloture'] is None
+    assert round(sum(c['montant'] for c in closed['creances_cloture']), 3) == closing.receivables_total
+
+    # Correction d'une dépense de l'avant-dernier exercice : les deux clôtures sont périmées
+    exp = Expense.query.filter(Expense.organization_id == org.id,
+                               Expense.expense_date < date(this_year - 1, 1, 1)).first()
+    exp.amount += 1000
+    db.session.commit()
+    assert [c.stale for c in FiscalYearClosing.query.order_by(FiscalYearClosing.year)] == [True, True]
+    expected = _reference(org, this_year)
+    data = _compute_financial_data(org, this_year)
+    assert _rounded(data['tresorerie_nette']) == _rounded(expected['tresorerie_nette'])
+    assert _rounded(data['resultats_reportes']) == _rounded(expected['resultats_reportes'])
+
+    # Re-clôture, et une écriture de l'exercice en cours ne touche pas aux clôtures
+    close_year(org, this_year - 2)
+    close_year(org, this_year - 1)
+    db.session.add(Expense(organization_id=org.id, amount=5.0, expense_date=date.today(), category='Eau'))
+    db.session.commit()
+    assert not any(c.stale for c in FiscalYearClosing.query)
+    assert _rounded(_compute_financial_data(org, this_year)['tresorerie_nette']) == \
+           _rounded(_reference(org, this_year)['tresorerie_nette'])
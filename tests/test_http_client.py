@@ -0,0 +1,111 @@
+"""
+Client HTTP des intégrations (utils_http) : réessais, disjoncteur, statistiques.
+"""
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+
+class _FakeAdapter(BaseAdapter):
+    """Répond dans l'ordre avec les codes HTTP / exceptions de `script`."""
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = list(script)
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        outcome = self.script.pop(0) if self.script else 200
+        if isinstance(outcome, Exception):
+            raise outcome
+        resp = requests.Response()
+        resp.status_code, resp.request, resp.url = outcome, request, request.url
+        return resp
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    import utils_http
+    monkeypatch.setattr(utils_http, 'BACKOFF_BASE', 0)
+    utils_http.reset_stats()
+
+    def _mount(provider, script):
+        adapter = _FakeAdapter(script)
+        utils_http.session(provider).mount('https://fake.test/', adapter)
+        return adapter
+    yield _mount
+    utils_http.reset_stats()
+    utils_http._sessions.clear()
+
+
+def test_idempotent_calls_retried_posts_not(fake):
+    import utils_http as http
+    adapter = fake('konnect', [503, requests.ConnectionError('reset'), 200])
+    assert http.get('konnect', 'https://fake.test/payments/1').status_code == 200
+    assert adapter.calls == 3
+
+    adapter = fake('konnect', [503, 200])
+    assert http.post('konnect', 'https://fake.test/init-payment').status_code == 503
+    assert adapter.calls == 1
+
+    stats = next(r for r in http.provider_stats() if r['provider'] == 'konnect')
+    assert stats['calls'] == 4 and stats['errors'] == 3 and stats['retries'] == 2
+
+
+def test_circuit_breaker_fails_fast_then_recovers(fake, monkeypatch):
+    import utils_http as http
+    spec = http.PROVIDERS['fonnte']
+    adapter = fake('fonnte', [requests.ConnectionError('down')] * spec.failures)
+    for _ in range(spec.failures):
+        with pytest.raises(requests.ConnectionError):
+            http.post('fonnte', 'https://fake.test/send')
+    with pytest.raises(http.ProviderUnavailable):
+        http.post('fonnte', 'https://fake.test/send')
+    assert adapter.calls == spec.failures           # aucun appel réseau disjoncteur ouvert
+
+    # Après le délai : un appel d'essai, qui referme le disjoncteur s'il réussit
+    breaker = http._breakers['fonnte']
+    breaker.opened_at -= spec.cooldown + 1
+    assert http.post('fonnte', 'https://fake.test/send').status_code == 200
+    stats = next(r for r in http.provider_stats() if r['provider'] == 'fonnte')
+    assert stats['state'] == 'fermé' and stats['rejected'] == 1
+
+
+def test_retries_stop_at_call_deadline(fake, monkeypatch):
+    import utils_http as http
+    clock = [0.0]
+    monkeypatch.setattr(http.time, 'monotonic', lambda: clock[0])
+    timeouts = []
+
+    class _Slow(_FakeAdapter):
+        def send(self, request, **kwargs):
+            timeouts.append(kwargs['timeout'])
+            clock[0] += 14.5        # tentative qui consomme presque tout le budget
+            return super().send(request, **kwargs)
+
+    adapter = _Slow([504, 504, 200])
+    http.session('konnect').mount('https://fake.test/', adapter)
+    assert http.get('konnect', 'https://fake.test/payments/1').status_code == 504
+    assert adapter.calls == 1                       # 0,5 s restante < MIN_ATTEMPT : pas de réessai
+
+    clock[0], timeouts[:] = 0.0, []
+    adapter = _Slow([504, 200])
+    http.session('konnect').mount('https://fake.test/', adapter)
+    assert http.get('konnect', 'https://fake.test/payments/1', deadline=20).status_code == 200
+    assert timeouts == [(3.05, 10), (3.05, 5.5)]     # 2e tentative réduite au temps restant
+
+
+def test_supabase_upload_retry_overwrites_its_own_object(fake, monkeypatch):
+    import storage_helper
+    monkeypatch.setattr(storage_helper, 'SUPABASE_URL', 'https://fake.test')
+    adapter = fake('supabase', [requests.ConnectionError('réponse perdue'), 200])
+    sent = []
+    send = adapter.send
+    adapter.send = lambda request, **kw: sent.append(request) or send(request, **kw)
+    url = storage_helper.SupabaseStore().put(b'%PDF', 'application/pdf', 'cheques')
+    assert url and url.endswith('.pdf') and adapter.calls == 2
+    assert sent[0].url == sent[1].url and all(r.headers['x-upsert'] == 'true' for r in sent)
@@ -0,0 +1,38 @@
+"""
+Index composites multi-tenant et contrôle des plans (utils_explain).
+"""
+from datetime import date
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+
+def test_hot_queries_use_indexes(client):
+    from utils_explain import explain_all
+    report = explain_all()
+    assert report
+    assert {r['name']: r['seq_scans'] for r in report if r['seq_scans']} == {}
+
+
+def test_explain_reports_sequential_scan(client):
+    from core import db
+    from utils_explain import explain_all
+    # Tous les index préfixés par organization_id (org + date, séquence lecteur, numéro)
+    for name in ('ix_badge_access_log_org_ts', 'uq_badge_access_log_reader_seq',
+                 'ix_badge_access_log_org_number_ci'):
+        db.session.execute(db.text(f'DROP INDEX {name}'))
+    db.session.commit()
+    [r] = explain_all(names={'badge_access_log_recent'})
+    assert r['seq_scans'] == ['badge_access_log']
+
+
+def test_payment_unique_per_apartment_month(client, org_factory):
+    from core import db
+    from models import Payment
+    org, (apt,) = org_factory(n=1)
+    for _ in range(2):
+        db.session.add(Payment(organization_id=org.id, apartment_id=apt.id, amount=100.0,
+                               payment_date=date.today(), month_paid='2026-01'))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
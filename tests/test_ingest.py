@@ -0,0 +1,131 @@
+"""
+Synchronisation par lots des appareils (utils_ingest) : lecteurs de badges
+(/api/badges/sync) et capteurs d'ascenseur (/api/v1/iot/telemetry/batch).
+"""
+from datetime import datetime, timedelta
+
+
+def _ts(minutes_ago):
+    return (datetime.utcnow() - timedelta(minutes=minutes_ago)).isoformat() + 'Z'
+
+
+def test_badge_sync_is_idempotent_and_pushes_access_delta(client, org_factory, login, monkeypatch):
+    from core import app, db
+    from models import Badge, BadgeAccessLog, User
+    from utils_badges import set_api_key
+    org, apts = org_factory(n=1)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    db.session.add(admin)
+    db.session.add_all([Badge(organization_id=org.id, badge_number=n, status='actif')
+                        for n in ('RF-001', 'RF-002')])
+    set_api_key(org, 'cle-lecteur-0001')
+    db.session.commit()
+
+    reader = app.test_client()
+
+    def sync(events, since=None):
+        return reader.post('/api/badges/sync', headers={'X-Api-Key': 'cle-lecteur-0001'},
+                           json={'reader_id': 'hall-1', 'since': since, 'events': events})
+
+    events = [{'seq': 1, 'ts': _ts(30), 'badge_number': 'RF-001'},
+              {'seq': 2, 'ts': _ts(20), 'badge_number': 'RF-002', 'granted': False},
+              {'seq': 3, 'ts': _ts(10), 'badge_number': 'INCONNU'},
+              {'seq': 4, 'ts': 'hier', 'badge_number': 'RF-001'},
+              {'seq': 5, 'ts': _ts(5)}]
+    with monkeypatch.context() as m:     # rappels d'abonnement quotidiens — hors budget
+        m.setitem(app.config, 'SQL_QUERY_BUDGET_STRICT', False)
+        r = sync(events)
+    assert r.status_code == 200
+    assert (r.json['accepted'], r.json['duplicates'], r.json['last_seq']) == (3, 0, 3)
+    assert [x['seq'] for x in r.json['rejected']] == [4, 5]
+    assert r.json['access_list']['full'] is True
+    assert r.json['access_list']['entries'] == [{'badge_number': 'RF-001', 'allow': True},
+                                                {'badge_number': 'RF-002', 'allow': True}]
+    logs = BadgeAccessLog.query.order_by(BadgeAccessLog.client_seq).all()
+    assert [(l.client_seq, l.access_granted) for l in logs] == [(1, True), (2, False), (3, False)]
+    assert logs[0].timestamp < datetime.utcnow() - timedelta(minutes=29)    # heure du passage
+
+    # Rejeu après coupure réseau : rien n'est inséré deux fois
+    cursor = r.json['access_list']['cursor']
+    r = sync(events[:3] + [{'seq': 6, 'ts': _ts(1), 'badge_number': 'RF-001'}], since=cursor)
+    assert (r.json['accepted'], r.json['duplicates']) == (1, 3)
+    assert BadgeAccessLog.query.count() == 4
+
+    # Badge bloqué : delta d'une entrée ; badge supprimé : liste complète
+    Badge.query.update({'updated_at': datetime.utcnow() - timedelta(hours=1)})
+    db.session.commit()
+    cursor = (datetime.utcnow() - timedelta(minutes=1)).isoformat() + 'Z'
+    client = login(admin)
+    b2 = Badge.query.filter_by(badge_number='RF-002').first()
+    client.post(f'/badges/{b2.id}/status', data={'status': 'bloqué'})
+    r = sync([], since=cursor)
+    assert r.json['access_list']['full'] is False
+    assert r.json['access_list']['entries'] == [{'badge_number': 'RF-002', 'allow': False}]
+    client.post(f'/badges/{b2.id}/delete')
+    r = sync([], since=cursor)
+    assert r.json['access_list']['full'] is True
+    assert r.json['access_list']['entries'] == [{'badge_number': 'RF-001', 'allow': True}]
+
+    too_many = [{'seq': i, 'ts': _ts(1), 'badge_number': 'RF-001'} for i in range(501)]
+    assert sync(too_many).status_code == 413
+
+
+def test_lift_batch_opens_one_incident_and_skips_replayed_seq(client, org_factory, monkeypatch):
+    from core import app, db
+    from models import Lift, LiftIncident
+    import routes.lifts as lifts
+    org, _ = org_factory(n=1)
+    lift = Lift(organization_id=org.id, name='Ascenseur A', iot_api_key='capteur-0001')
+    db.session.add(lift)
+    db.session.commit()
+    notified = []
+    monkeypatch.setattr(lifts, '_notify_lift_status',
+                        lambda org, lift, status, **kw: notified.append((status, kw.get('incident'))))
+
+    sensor = app.test_client()
+
+    def batch(events):
+        return sensor.post('/api/v1/iot/telemetry/batch', headers={'X-API-Key': 'capteur-0001'},
+                           json={'events': events})
+
+    events = [{'seq': 12, 'ts': _ts(3), 'status': 'ok'},
+              {'seq': 10, 'ts': _ts(9), 'status': 'warning', 'description': 'Vibrations'},
+              {'seq': 11, 'ts': _ts(6), 'status': 'down'},
+              {'seq': 13, 'ts': _ts(1), 'status': 'down'},
+              {'seq': 14, 'ts': _ts(1), 'status': 'cassé'}]
+    r = batch(events)
+    assert r.status_code == 200
+    assert (r.json['status'], r.json['accepted'], r.json['last_seq']) == ('down', 4, 13)
+    assert [x['seq'] for x in r.json['rejected']] == [14]
+    incidents = LiftIncident.query.all()
+    assert len(incidents) == 1 and incidents[0].description == 'Vibrations'
+    assert r.json['incident_id'] == incidents[0].id
+    assert [s for s, _ in notified] == ['down']
+
+    r = batch(events[:4] + [{'seq': 15, 'ts': _ts(0), 'status': 'ok'}])
+    assert (r.json['accepted'], r.json['duplicates'], r.json['status']) == (1, 4, 'ok')
+    assert LiftIncident.query.count() == 1
+    assert [s for s, _ in notified] == ['down', 'ok']
+
+
+def test_late_batch_does_not_override_live_status(client, org_factory, monkeypatch):
+    from core import app, db
+    from models import Lift, LiftIncident, LiftTelemetry
+    import routes.lifts as lifts
+    org, _ = org_factory(n=1)
+    lift = Lift(organization_id=org.id, name='Ascenseur A', iot_api_key='capteur-0001')
+    db.session.add(lift)
+    db.session.commit()
+    notified = []
+    monkeypatch.setattr(lifts, '_notify_lift_status', lambda org, lift, status, **kw: notified.append(status))
+
+    sensor = app.test_client()
+    headers = {'X-API-Key': 'capteur-0001'}
+    assert sensor.post('/api/v1/iot/telemetry', headers=headers, json={'status': 'ok'}).status_code == 200
+    r = sensor.post('/api/v1/iot/telemetry/batch', headers=headers, json={'events': [
+        {'seq': 1, 'ts': _ts(125), 'status': 'ok'},
+        {'seq': 2, 'ts': _ts(120), 'status': 'down'}]})
+    assert (r.json['accepted'], r.json['status']) == (2, 'ok')
+    assert db.session.get(Lift, lift.id).status == 'ok'
+    assert LiftIncident.query.count() == 0 and notified == []
+    assert LiftTelemetry.query.count() == 3                    # historisées quand même
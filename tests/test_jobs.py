@@ -0,0 +1,46 @@
+"""
+File des notifications (utils_jobs) — fournisseur stub, retries et backoff.
+"""
+from datetime import datetime, timedelta
+
+
+def test_whatsapp_is_queued_not_sent(client):
+    from core import db
+    from models import Organization, NotificationJob
+    from utils_whatsapp import queue_whatsapp
+    from utils_jobs import run_pending, STUB_OUTBOX
+    org = Organization(name='Test', slug='t-q', email='t@t.tn',
+                       whatsapp_enabled=True, whatsapp_token='tok')
+    db.session.add(org)
+    db.session.commit()
+    STUB_OUTBOX.clear()
+
+    assert queue_whatsapp(org, '20123456', 'Bonjour')
+    job = NotificationJob.query.one()
+    assert job.provider == 'whatsapp' and job.status == 'pending'
+    assert STUB_OUTBOX == []
+
+    assert run_pending() == 1
+    assert NotificationJob.query.get(job.id).status == 'done'
+    assert STUB_OUTBOX[0]['provider'] == 'whatsapp'
+    assert STUB_OUTBOX[0]['message'] == 'Bonjour'
+
+
+def test_retry_with_backoff_then_failed(client):
+    from core import db
+    from models import NotificationJob
+    from utils_jobs import enqueue, run_pending
+    job = enqueue('stub', {'fail': True}, max_attempts=2)
+
+    assert run_pending() == 1
+    job = NotificationJob.query.get(job.id)
+    assert job.status == 'pending' and job.attempts == 1
+    assert job.run_after > datetime.utcnow()
+    assert run_pending() == 0          # pas encore dû
+
+    job.run_after = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert run_pending() == 1
+    job = NotificationJob.query.get(job.id)
+    assert job.status == 'failed' and job.attempts == 2
+    assert 'simulé' in job.last_error
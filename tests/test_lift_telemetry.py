@@ -0,0 +1,79 @@
+"""
+Télémétrie des ascenseurs (utils_telemetry) : agrégats minute / heure / jour
+maintenus à l'ingestion, disponibilité lue dans les agrégats, rétention.
+"""
+from datetime import datetime, timedelta
+
+
+def test_rollups_serve_availability_and_retention(client, org_factory, login, monkeypatch):
+    from core import app, db
+    from models import Lift, LiftTelemetry, LiftTelemetryRollup, User
+    import routes.lifts as lifts
+    from utils_telemetry import availability, bucket_start, purge_telemetry
+    org, _ = org_factory(n=1)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    lift = Lift(organization_id=org.id, name='Ascenseur A', iot_api_key='capteur-0001')
+    db.session.add_all([admin, lift])
+    db.session.commit()
+    monkeypatch.setattr(lifts, '_notify_lift_status', lambda *a, **kw: None)
+
+    t0 = bucket_start(datetime.utcnow() - timedelta(hours=3), 3600)
+    at = lambda minutes: (t0 + timedelta(minutes=minutes)).isoformat() + 'Z'
+    r = app.test_client().post('/api/v1/iot/telemetry/batch', headers={'X-API-Key': 'capteur-0001'}, json={
+        'events': [{'seq': 1, 'ts': at(0), 'status': 'ok', 'metrics': {'vibration': 0.2}},
+                   {'seq': 3, 'ts': at(40), 'status': 'ok'},
+                   {'seq': 2, 'ts': at(10), 'status': 'down'},
+                   {'seq': 4, 'ts': at(50), 'status': 'warning'},
+                   {'seq': 5, 'ts': at(55), 'status': 'ok', 'metrics': 'bruit'}]})
+    assert r.json['accepted'] == 4 and [x['seq'] for x in r.json['rejected']] == [5]
+    assert LiftTelemetry.query.count() == 4
+
+    # Mêmes totaux à chaque niveau ; durées découpées par minute
+    for bucket in ('minute', 'hour', 'day'):
+        a = availability(lift.id, t0, bucket)
+        assert (a['samples'], a['covered_seconds'], a['down_seconds']) == (4, 3000.0, 1800.0)
+        assert (a['uptime'], a['failures'], a['mtbf_hours'], a['mttr_minutes']) == (40.0, 1, 0.3, 30.0)
+    assert LiftTelemetryRollup.query.filter_by(bucket='minute').count() == 51
+    assert LiftTelemetryRollup.query.filter_by(bucket='hour').count() == 1
+
+    # Capteur muet plus longtemps que LIFT_TELEMETRY_MAX_GAP : durée non attribuée
+    app.test_client().post('/api/v1/iot/telemetry', headers={'X-API-Key': 'capteur-0001'},
+                           json={'status': 'ok'})
+    a = availability(lift.id, t0, 'hour')
+    assert (a['samples'], a['covered_seconds']) == (5, 3000.0)
+
+    page = login(admin).get(f'/lift/{lift.id}').data.decode()
+    assert 'Disponibilité (capteur IoT)' in page and '40.0 %' in page
+
+    # Rétention : brut et agrégats minute supprimés, heure / jour conservés
+    assert purge_telemetry(now=datetime.utcnow() + timedelta(days=31)) == (5, 52)
+    assert availability(lift.id, t0, 'day')['uptime'] == 40.0
+
+
+def test_replayed_batch_leaves_rollups_unchanged(client, org_factory, monkeypatch):
+    from core import app, db
+    from models import Lift, LiftTelemetry, LiftTelemetryRollup
+    import routes.lifts as lifts
+    org, _ = org_factory(n=1)
+    lift = Lift(organization_id=org.id, name='Ascenseur A', iot_api_key='capteur-0001')
+    db.session.add(lift)
+    db.session.commit()
+    monkeypatch.setattr(lifts, '_notify_lift_status', lambda *a, **kw: None)
+
+    t0 = datetime.utcnow() - timedelta(hours=2)
+    events = [{'seq': i, 'ts': (t0 + timedelta(minutes=10 * i)).isoformat() + 'Z',
+               'status': 'down' if i == 2 else 'ok'} for i in range(1, 6)]
+    sensor = app.test_client()
+
+    def rollups():
+        R = LiftTelemetryRollup
+        return sorted(db.session.query(R.bucket, R.start, R.samples, R.ok_seconds, R.down_seconds,
+                                       R.failures, R.repairs))
+
+    assert sensor.post('/api/v1/iot/telemetry/batch', headers={'X-API-Key': 'capteur-0001'},
+                       json={'events': events}).json['accepted'] == 5
+    before = rollups()
+    r = sensor.post('/api/v1/iot/telemetry/batch', headers={'X-API-Key': 'capteur-0001'},
+                    json={'events': events})
+    assert (r.json['accepted'], r.json['duplicates']) == (0, 5)
+    assert rollups() == before and LiftTelemetry.query.count() == 5
@@ -0,0 +1,68 @@
+"""
+Réencodage des images envoyées (utils_media) : EXIF, taille plafonnée, miniatures.
+"""
+import io
+
+from PIL import Image
+
+
+def _camera_jpeg(w=3000, h=2000):
+    """Photo « de téléphone » : grande, qualité maximale, EXIF avec rotation et GPS."""
+    img = Image.radial_gradient('L').resize((w, h)).convert('RGB')
+    exif = Image.Exif()
+    exif[0x0112] = 6                     # Orientation : rotation 90°
+    exif[0x010F] = 'PhoneMaker'          # Make
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=98, exif=exif)
+    return buf.getvalue()
+
+
+def _use_tmp_store(monkeypatch, tmp_path):
+    import storage_helper
+    monkeypatch.setattr(storage_helper.local_store, 'root', str(tmp_path))
+    monkeypatch.setattr(storage_helper, '_store', storage_helper.local_store)
+
+
+def test_compress_image_strips_exif_and_caps_size():
+    from utils_media import compress_image, MAX_SIDE, THUMB_SIDE, OUTPUT_MIME
+    raw = _camera_jpeg()
+    main, mime, thumb = compress_image(raw)
+    assert mime == OUTPUT_MIME and len(main) < len(raw) / 3
+    out = Image.open(io.BytesIO(main))
+    assert out.size[1] == MAX_SIDE and out.size[0] < MAX_SIDE   # rotation EXIF appliquée
+    assert not out.getexif()
+    assert max(Image.open(io.BytesIO(thumb)).size) == THUMB_SIDE
+    assert compress_image(b'%PDF-1.4 pas une image') is None
+
+
+def test_ticket_photo_is_processed_by_worker(client, org_factory, login, monkeypatch, tmp_path):
+    _use_tmp_store(monkeypatch, tmp_path)
+    from core import db
+    from models import User, Ticket, NotificationJob
+    from utils_jobs import run_pending
+    from utils_media import OUTPUT_MIME
+    org, apts = org_factory(n=1)
+    resident = User(email='res@t.tn', name='Résident', phone='20123456', role='resident',
+                    organization_id=org.id, apartment_id=apts[0].id)
+    db.session.add(resident)
+    db.session.commit()
+    raw = _camera_jpeg(2000, 1500)
+
+    r = login(resident).post('/tickets', data={
+        'subject': 'Fuite', 'message': 'Sous l’évier',
+        'photo': (io.BytesIO(raw), 'IMG_0001.jpg', 'image/jpeg')},
+        content_type='multipart/form-data')
+    assert r.status_code == 302
+    ticket = Ticket.query.one()
+    original = ticket.photo_url
+    assert original.endswith('.jpg') and ticket.photo_thumb_url is None
+    assert NotificationJob.query.filter_by(provider='media', status='pending').count() == 1
+
+    run_pending()
+    db.session.expire_all()
+    ticket = Ticket.query.one()
+    assert ticket.photo_url != original and ticket.photo_mime == OUTPUT_MIME
+    assert ticket.photo_thumb_url
+    photo = login(resident).get(f'/ticket/{ticket.id}/photo')
+    assert photo.status_code == 200 and len(photo.data) < len(raw)
+    assert not Image.open(io.BytesIO(photo.data)).getexif()
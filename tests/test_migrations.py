@@ -0,0 +1,51 @@
+"""
+Moteur de migrations versionnées (migrations.py).
+"""
+from datetime import date
+
+from sqlalchemy import event
+
+
+def _count_statements(fn):
+    from core import db
+    stmts = []
+    listener = lambda conn, cursor, statement, *a: stmts.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    return stmts
+
+
+def test_migrate_once_then_single_version_check(client):
+    from migrations import migrate, ensure_schema, current_version, latest_version
+    # La fixture crée les tables sans les estampiller : base « antérieure au versionnage »
+    assert current_version() == 0
+    assert migrate() == list(range(1, latest_version() + 1))
+    assert current_version() == latest_version()
+    assert migrate() == []
+    assert len(_count_statements(ensure_schema)) == 1
+
+
+def test_migration_deferred_until_duplicates_fixed(client, org_factory):
+    from core import db
+    from models import Payment
+    from migrations import (MIGRATIONS, applied_count, applied_versions, current_version,
+                            latest_version, migrate)
+    org, (apt,) = org_factory(n=1)
+    db.session.execute(db.text('DROP INDEX uq_payment_apt_month'))
+    for _ in range(2):
+        db.session.add(Payment(organization_id=org.id, apartment_id=apt.id, amount=100.0,
+                               payment_date=date.today(), month_paid='2026-01'))
+    db.session.commit()
+
+    # 0004 reportée, les suivantes appliquées quand même
+    assert migrate() == [v for v in range(1, latest_version() + 1) if v != 4]
+    assert current_version() == latest_version() and 4 not in applied_versions()
+    assert migrate() == []
+
+    Payment.query.filter_by(apartment_id=apt.id).limit(1).one().month_paid = '2026-02'
+    db.session.commit()
+    assert migrate() == [4]
+    assert applied_count() == len(MIGRATIONS)
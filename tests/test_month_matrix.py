@@ -0,0 +1,65 @@
+"""
+Matrice appartements × mois (utils_months) : mêmes résultats que les helpers par
+sets de chaînes 'YYYY-MM', et pages comptable / trésorerie rendues depuis la matrice.
+"""
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+
+
+def _month(n):
+    return date.today().replace(day=1) - relativedelta(months=n)
+
+
+def _seed(org, apts):
+    from core import db
+    from models import Payment, Expense
+    for i in range(0, 16):
+        for apt in apts:
+            if (i + apt.id) % 3:
+                db.session.add(Payment(organization_id=org.id, apartment_id=apt.id, amount=80.0,
+                                       payment_date=_month(i) + relativedelta(days=4),
+                                       month_paid=_month(i).strftime('%Y-%m')))
+    db.session.add(Payment(organization_id=org.id, apartment_id=apts[0].id, amount=80.0,
+                           payment_date=date.today(), month_paid=_month(-2).strftime('%Y-%m')))
+    db.session.add(Expense(organization_id=org.id, amount=30.0, expense_date=date.today(), category='Eau'))
+    db.session.commit()
+
+
+def test_matrix_matches_set_helpers(client, org_factory):
+    from utils import get_paid_months_map, get_unpaid_map, _unpaid_count_from_set
+    from utils_months import paid_matrix, created_ym, month_index, ym_of
+    org, apts = org_factory(n=4, months=14)
+    _seed(org, apts)
+    today_ym = ym_of(date.today())
+    created = created_ym(apts)
+    m = paid_matrix(org.id, apts, int(created.min()), today_ym + 3)
+
+    paid = get_paid_months_map(org.id)
+    assert m.unpaid_counts(created, today_ym).tolist() == \
+           [get_unpaid_map(org.id, apts, paid=paid)[a.id] for a in apts]
+    for i, apt in enumerate(apts):
+        assert {k for k, p in m.row_dict(apt.id, m.paid).items() if p} == \
+               {k for k in paid.get(apt.id, set()) if month_index(k) >= m.start_ym}
+        # ancienne version (ym_str par mois) de _unpaid_count_from_set
+        legacy = sum(1 for ym in range(int(created[i]), today_ym + 1)
+                     if f"{(ym - 1) // 12}-{(ym - 1) % 12 + 1:02d}" not in paid.get(apt.id, set()))
+        assert _unpaid_count_from_set(apt, paid.get(apt.id, set()) | {'2024-1', ''}, today_ym) == legacy
+    assert m.amounts.sum() == 80.0 * m.paid.sum()
+    assert month_index('2025-13') is None and month_index('2025-03') == 2025 * 12 + 3
+
+
+def test_comptable_and_tresorerie_pages(client, org_factory, login):
+    from core import db
+    from models import User
+    org, apts = org_factory(n=2, months=14)
+    _seed(org, apts)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    db.session.add(admin)
+    db.session.commit()
+    client = login(admin)
+    assert client.get('/comptable').status_code == 200
+    assert client.get(f'/comptable?year={date.today().year}').status_code == 200
+    resp = client.get('/tresorerie')
+    assert resp.status_code == 200
+    assert b'const encData = [' in resp.data
@@ -0,0 +1,64 @@
+"""
+Fil de notifications admin (utils_notifications) — 2 requêtes, même contenu.
+"""
+from datetime import date, datetime, timedelta
+
+
+def test_admin_feed_two_queries(client, org_factory, login):
+    from sqlalchemy import event
+    from core import app, db
+    from models import (User, Payment, Ticket, Announcement, AnnouncementRead, UnpaidAlert,
+                        PaymentRequest, DirectMessage)
+    from utils_notifications import admin_feed
+
+    org, apts = org_factory(n=2)
+    admin = User(email='adm@t.tn', role='admin', organization_id=org.id,
+                 notif_seen_at=datetime.utcnow() - timedelta(hours=1))
+    res = User(email='res@t.tn', role='resident', organization_id=org.id, apartment_id=apts[1].id)
+    db.session.add_all([admin, res])
+    db.session.flush()
+    ann = Announcement(organization_id=org.id, title='Coupure d\'eau', body='...')
+    db.session.add(ann)
+    db.session.flush()
+    db.session.add_all([
+        Payment(organization_id=org.id, apartment_id=apts[0].id, amount=100,
+                payment_date=date.today(), month_paid='2026-10'),
+        Ticket(organization_id=org.id, apartment_id=apts[1].id, user_id=res.id,
+               subject='Ascenseur en panne', message='...',
+               created_at=datetime.utcnow() - timedelta(hours=3)),
+        Ticket(organization_id=org.id, apartment_id=apts[1].id, user_id=res.id,
+               subject='Résolu', message='...', status='ferme'),
+        AnnouncementRead(announcement_id=ann.id, apartment_id=apts[1].id, user_id=res.id),
+        UnpaidAlert(organization_id=org.id, apartment_id=apts[0].id, months_unpaid=4),
+        PaymentRequest(organization_id=org.id, apartment_id=apts[1].id, user_id=res.id,
+                       month_target='2026-10', amount_declared=100, confirm_token='tok'),
+        DirectMessage(organization_id=org.id, apartment_id=apts[1].id, sender_id=res.id, body='Bonjour'),
+    ])
+    db.session.commit()
+    db.session.refresh(admin)
+
+    statements = []
+    listener = lambda *a: statements.append(a[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        with app.test_request_context('/'):
+            feed = admin_feed(admin)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert len(statements) == 2
+    assert sum('UNION ALL' in s for s in statements) == 1
+    texts = [n['text'] for n in feed['notif_list']]
+    assert texts == ['A-102 a lu une annonce', 'Nouveau ticket — A-102', 'Paiement reçu — A-101']
+    assert feed['notif_list'][2]['sub'] == '100 DT · 2026-10'
+    assert [n['new'] for n in feed['notif_list']] == [True, False, False]
+    assert feed['notif_count'] == 2                 # 1 élément non vu + impayés critiques
+    assert feed['unpaid_critical'] == 1
+    assert feed['pending_virements_count'] == 1
+    assert feed['unread_messages_count'] == 1
+
+    r = login(admin).get('/api/notif/feed')
+    assert r.status_code == 200
+    data = r.get_json()
+    assert data['count'] == 2 and len(data['items']) == 3
+    assert data['items'][0]['url'] == '/annonces'
@@ -0,0 +1,78 @@
+"""
+Envoi Web Push groupé (utils_push.send_bulk) — session HTTP factice, aucun appel réseau.
+"""
+import threading
+
+
+class _Resp:
+    def __init__(self, status):
+        self.status_code = status
+        self.text = ''
+        self.headers = {}
+
+
+class _FakeSession:
+    """Répond selon le suffixe de l'endpoint : .../gone → 410, .../err → 500, sinon 201."""
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def post(self, endpoint, timeout=None, **params):
+        with self.lock:
+            self.calls.append((endpoint, params['headers'].get('Authorization')))
+        if endpoint.endswith('gone'):
+            return _Resp(410)
+        if endpoint.endswith('err'):
+            return _Resp(500)
+        return _Resp(201)
+
+
+def _keys():
+    import base64
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives import serialization
+    pub = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    b64 = lambda b: base64.urlsafe_b64encode(b).rstrip(b'=').decode()
+    return b64(pub), b64(b'0123456789abcdef')
+
+
+def test_send_bulk_reports_and_batches_cleanup(client, monkeypatch):
+    from py_vapid import Vapid, b64urlencode
+    from core import db
+    from models import Organization, User, PushSubscription
+    import utils_push
+
+    v = Vapid()
+    v.generate_keys()
+    raw = v.private_key.private_numbers().private_value.to_bytes(32, 'big')
+    session = _FakeSession()
+    monkeypatch.setattr(utils_push, 'VAPID_PRIVATE_KEY', b64urlencode(raw))
+    monkeypatch.setattr(utils_push, 'VAPID_PUBLIC_KEY', 'pub')
+    monkeypatch.setattr(utils_push, '_vapid_key', None)
+    monkeypatch.setattr(utils_push, '_session', session)
+
+    org = Organization(name='Push', slug='org-push', email='p@p.tn')
+    db.session.add(org)
+    db.session.flush()
+    user = User(email='u@p.tn', password_hash='x', role='admin', organization_id=org.id)
+    db.session.add(user)
+    db.session.flush()
+    p256dh, auth = _keys()
+    suffixes = ['a', 'b', 'gone', 'c', 'gone', 'err']
+    for i, suf in enumerate(suffixes):
+        db.session.add(PushSubscription(user_id=user.id, organization_id=org.id, p256dh=p256dh,
+                                        auth=auth, endpoint=f'https://push.example.com/{i}/{suf}'))
+    db.session.commit()
+
+    results = utils_push.deliver_to_users([user.id], 'Titre', 'Corps')
+
+    assert len(results) == len(suffixes) == len(session.calls)
+    outcomes = sorted(r['outcome'] for r in results)
+    assert outcomes == ['error', 'expired', 'expired', 'ok', 'ok', 'ok']
+    assert all(r['latency_ms'] >= 0 for r in results)
+    # Une seule signature VAPID pour le service push commun
+    assert len({auth_header for _, auth_header in session.calls}) == 1
+    # Les deux abonnements 410 sont supprimés, les autres conservés
+    remaining = [s.endpoint for s in PushSubscription.query.all()]
+    assert len(remaining) == 4 and not any(e.endswith('gone') for e in remaining)
@@ -0,0 +1,120 @@
+"""
+Profilage SQL (utils_profiler) — en-têtes, empreintes et budgets de requêtes par route.
+Les budgets sont vérifiés sur des jeux de données de tailles différentes : un
+nombre de requêtes qui grandit avec les données (boucle N+1) dépasse le budget.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def _seed(org, apts, admin):
+    from core import db
+    from models import (User, DirectMessage, AssemblyGeneral, AGItem, AGVote,
+                        AutreLitige, LitigeDocument)
+    residents = []
+    for apt in apts:
+        u = User(email=f'r{apt.id}@t.tn', name=f'Rés {apt.number}', role='resident',
+                 organization_id=org.id, apartment_id=apt.id, phone='20000000')
+        db.session.add(u)
+        residents.append(u)
+    db.session.flush()
+    for i, (apt, res) in enumerate(zip(apts, residents)):
+        db.session.add(DirectMessage(organization_id=org.id, apartment_id=apt.id,
+                                     sender_id=res.id, body='Bonjour',
+                                     created_at=datetime.utcnow() - timedelta(minutes=i)))
+        db.session.add(DirectMessage(organization_id=org.id, apartment_id=apt.id,
+                                     sender_id=admin.id, body='Réponse'))
+    for k in range(len(apts)):
+        ag = AssemblyGeneral(organization_id=org.id, title=f'AG {k}',
+                             meeting_date=datetime.utcnow(), status='ouverte')
+        db.session.add(ag)
+        db.session.flush()
+        item = AGItem(assembly_id=ag.id, question='Travaux ?')
+        db.session.add(item)
+        db.session.flush()
+        for apt, res in zip(apts, residents):
+            db.session.add(AGVote(item_id=item.id, user_id=res.id, apartment_id=apt.id, vote='pour'))
+        al = AutreLitige(organization_id=org.id, titre=f'Dossier {k}')
+        db.session.add(al)
+        db.session.flush()
+        db.session.add(LitigeDocument(litige_id=al.id, nom='scan.pdf', mime='application/pdf'))
+    db.session.commit()
+
+
+def _queries(login, org_factory, monkeypatch, n, url):
+    from core import app, db
+    from models import User
+    org, apts = org_factory(n=n, slug=f'org-{n}')
+    admin = User(email=f'adm{n}@t.tn', name='Admin', role='admin', organization_id=org.id)
+    db.session.add(admin)
+    db.session.commit()
+    _seed(org, apts, admin)
+    # 1re requête : rappels d'abonnement quotidiens, caches froids — hors budget
+    with monkeypatch.context() as m:
+        m.setitem(app.config, 'SQL_QUERY_BUDGET_STRICT', False)
+        login(admin).get(url)
+    r = login(admin).get(url)  # SQL_QUERY_BUDGET_STRICT : lève si budget dépassé
+    assert r.status_code == 200
+    assert int(r.headers['X-DB-Queries']) <= int(r.headers['X-DB-Budget'])
+    return int(r.headers['X-DB-Queries'])
+
+
+@pytest.mark.parametrize('url', ['/messagerie', '/assemblees'])
+def test_route_query_count_does_not_grow_with_data(client, org_factory, login, monkeypatch, url):
+    assert (_queries(login, org_factory, monkeypatch, 2, url)
+            == _queries(login, org_factory, monkeypatch, 8, url))
+
+
+def test_budget_exceeded_and_fingerprints(client, org_factory, login, monkeypatch):
+    from core import app, db
+    from models import User
+    from utils_profiler import QueryBudgetExceeded, fingerprint, endpoint_stats, reset_stats
+
+    assert fingerprint("SELECT * FROM t WHERE id = 12 AND x IN (?, ?, ?)") == \
+        fingerprint("SELECT *  FROM t WHERE id = 7 AND x IN (?)")
+
+    org, _ = org_factory(n=2)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    db.session.add(admin)
+    db.session.commit()
+    reset_stats()
+    monkeypatch.setattr(app.view_functions['messagerie'], '_query_budget', 1)
+    with pytest.raises(QueryBudgetExceeded):
+        login(admin).get('/messagerie')
+    monkeypatch.setitem(app.config, 'SQL_QUERY_BUDGET_STRICT', False)
+    r = login(admin).get('/messagerie')
+    assert r.status_code == 200 and r.headers['X-DB-Budget'] == '1'
+    row = next(s for s in endpoint_stats() if s['endpoint'] == 'messagerie')
+    assert row['requests'] == 2 and row['over_budget'] == 2
+
+    sa = User(email='sa@t.tn', name='Super', role='superadmin')
+    db.session.add(sa)
+    db.session.commit()
+    r = login(sa).get('/superadmin/perf?order=over_budget')
+    assert r.status_code == 200, r.headers.get('Location')
+    assert b'messagerie' in r.data
+
+
+def test_request_bootstrap_loads_principal_once(client, org_factory, login, monkeypatch):
+    """Requête authentifiée à froid (nouvelle session SQLAlchemy, comme en production) :
+    utilisateur + organisation + abonnement en 1 requête, réutilisés par tous les hooks."""
+    from core import app, db
+    from models import User
+    org, _ = org_factory(n=2)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    db.session.add(admin)
+    db.session.commit()
+    with monkeypatch.context() as m:     # rappels quotidiens, caches froids
+        m.setitem(app.config, 'SQL_QUERY_BUDGET_STRICT', False)
+        login(admin).get('/access')
+    admin_id = admin.id
+    db.session.remove()
+    from utils_profiler import fingerprint
+    statements = []
+    monkeypatch.setattr('utils_profiler.fingerprint', lambda sql: statements.append(sql) or fingerprint(sql))
+    r = login(db.session.get(User, admin_id)).get('/access')
+    assert r.status_code == 200
+    # 1 amorce (user ⟕ organization ⟕ subscription) + appartements, mois archivés, registre
+    assert int(r.headers['X-DB-Queries']) == 4
+    assert sum(' FROM user ' in s.replace('\n', ' ') for s in statements) == 1
@@ -0,0 +1,62 @@
+"""
+Rapports en arrière-plan (utils_reports) : artefact réutilisé, invalidé par la
+version des données de l'organisation, page d'attente et contrôle d'accès.
+"""
+from datetime import date
+
+
+def test_artifact_reused_until_data_changes(client, org_factory, login):
+    from core import db
+    from models import User, Payment, ReportArtifact, Organization
+    from utils_jobs import run_pending
+    org, apts = org_factory(n=2)
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    db.session.add(admin)
+    db.session.commit()
+    client = login(admin)
+
+    resp = client.get('/automation/pdf-report')
+    assert b'report-progress' in resp.data
+    artifact = ReportArtifact.query.one()
+    assert client.get(f'/rapports/{artifact.id}/etat').get_json()['status'] == 'pending'
+    assert run_pending() == 1
+    state = client.get(f'/rapports/{artifact.id}/etat').get_json()
+    assert state['status'] == 'done' and state['url'] == f'/rapports/{artifact.id}'
+
+    resp = client.get('/automation/pdf-report')               # 2e clic : servi tel quel
+    assert resp.mimetype == 'application/pdf' and resp.data.startswith(b'%PDF')
+    assert run_pending() == 0
+
+    # Écriture sur une donnée source : nouvelle version → nouveau rendu
+    version = Organization.query.get(org.id).data_version
+    db.session.add(Payment(organization_id=org.id, apartment_id=apts[0].id, amount=100.0,
+                           payment_date=date.today(), month_paid=date.today().strftime('%Y-%m')))
+    db.session.commit()
+    assert db.session.query(Organization.data_version).filter_by(id=org.id).scalar() == version + 1
+    assert b'report-progress' in client.get('/automation/pdf-report').data
+    assert run_pending() == 1
+    assert ReportArtifact.query.count() == 1                  # l'ancien rendu est supprimé
+
+    # Connexion (last_login_at) : ne compte pas comme une modification des données
+    admin = db.session.merge(admin)
+    admin.last_login_at = db.func.now()
+    db.session.commit()
+    assert client.get('/automation/pdf-report').mimetype == 'application/pdf'
+
+
+def test_artifact_access_scoped(client, org_factory, login):
+    from core import db
+    from models import User, ReportArtifact
+    org, apts = org_factory(n=1)
+    other, _ = org_factory(n=1, slug='autre')
+    admin = User(email='adm@t.tn', name='Admin', role='admin', organization_id=org.id)
+    resident = User(email='r@t.tn', name='Rés', phone='20000000', role='resident',
+                    organization_id=org.id, apartment_id=apts[0].id)
+    intruder = User(email='x@t.tn', name='X', role='admin', organization_id=other.id)
+    db.session.add_all([admin, resident, intruder])
+    db.session.commit()
+
+    login(admin).get('/automation/pdf-report')
+    artifact_id = ReportArtifact.query.one().id
+    assert login(resident).get(f'/rapports/{artifact_id}/etat').status_code == 403
+    assert login(intruder).get(f'/rapports/{artifact_id}/etat').status_code == 404
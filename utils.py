@@ -1,19 +1,35 @@
 from functools import wraps
 from flask import session, flash, redirect, url_for, request as _req, g
 from core import app, db
-from models import User, Organization, Apartment, Payment, UnpaidAlert
+from models import (User, Organization, Apartment, Payment, UnpaidAlert, Ticket,
+                    DirectMessage, Announcement, AnnouncementRead, PaymentRequest)
 from datetime import datetime, date, timedelta
 from dateutil.relativedelta import relativedelta
+from sqlalchemy.orm import joinedload
+from utils_arrears import (get_arrears_map, get_apartment_arrears,
+                           row_unpaid_count, row_next_unpaid)
+from utils_cache import cache, invalidate_on_commit, org_tag, user_tag
 
 
-_notif_cache: dict = {}   # {user_id: (datetime, result_dict)}
-_NOTIF_TTL = 30           # secondes — équilibre fraîcheur vs charge DB
+# secondes — les écritures invalident le cache (tags org/user) ; backend propre au
+# process : l'invalidation n'atteint pas les autres workers → péremption courte
+_NOTIF_TTL = 300 if cache.shared else 30
+
+
+def _announcement_read_tags(r):
+    apt = db.session.get(Apartment, r.apartment_id)
+    return [org_tag(apt.organization_id if apt else None), user_tag(r.user_id)]
+
+
+# Tout commit touchant ces modèles invalide les notifications de l'organisation
+invalidate_on_commit(Payment, Ticket, DirectMessage, Announcement, UnpaidAlert, PaymentRequest)
+invalidate_on_commit(AnnouncementRead, tags=_announcement_read_tags)
 
 
 @app.context_processor
 def inject_notifications():
     """Injecte les notifications dans tous les templates (admin + résident).
-    Résultat mis en cache 30 s par utilisateur pour éviter 7 requêtes/page."""
+    Résultat mis en cache par utilisateur (utils_cache), invalidé par tags org/user."""
     if _req.endpoint in (None, 'static', 'login', 'logout', 'register',
                          'register_resident', 'complete_profile',
                          'index', 'demo', 'subscription_status'):
@@ -33,155 +49,40 @@ def inject_notifications():
     if not user.organization_id:
         return {}
 
-    # Vérifier le cache 30 s
-    now = datetime.utcnow()
-    cached = _notif_cache.get(user.id)
-    if cached:
-        cached_at, cached_result = cached
-        if (now - cached_at).total_seconds() < _NOTIF_TTL:
-            return cached_result
-
-    org_id = user.organization_id
-    result = {}
+    from utils_notifications import admin_counts, resident_feed
+    tags = [org_tag(user.organization_id), user_tag(user.id)]
 
     if user.role == 'admin':
-        from models import Ticket, AnnouncementRead, Announcement
-        from sqlalchemy.orm import joinedload
-
-        since_list = datetime.utcnow() - timedelta(hours=24)   # fenêtre affichage
-        # Seuil "non vu" : depuis la dernière ouverture de la cloche (ou 24h si jamais ouvert)
-        seen_at = user.notif_seen_at or (datetime.utcnow() - timedelta(hours=24))
-        since_new = min(seen_at, since_list)   # on prend le plus ancien des deux
-
-        notifs = []
-
-        # Paiements récents
-        recent_payments = Payment.query.options(
-            joinedload(Payment.apartment).joinedload(Apartment.block)
-        ).filter(
-            Payment.organization_id == org_id,
-            Payment.payment_date >= since_list.date()
-        ).order_by(Payment.payment_date.desc()).limit(5).all()
-        for p in recent_payments:
-            apt_label = (f"{p.apartment.block.name}-{p.apartment.number}"
-                         if p.apartment and p.apartment.block else "?")
-            ts = datetime.combine(p.payment_date, datetime.min.time())
-            notifs.append({
-                'icon': 'cash-coin', 'color': '#00C896',
-                'text': f"Paiement reçu — {apt_label}",
-                'sub': f"{p.amount:.0f} DT · {p.month_paid}",
-                'ts': ts,
-                'new': ts > seen_at,
-                'url': url_for('payments')
-            })
-
-        # Lectures d'annonces récentes
-        recent_reads = (db.session.query(AnnouncementRead)
-            .join(Announcement)
-            .options(joinedload(AnnouncementRead.apartment).joinedload(Apartment.block))
-            .filter(
-                Announcement.organization_id == org_id,
-                AnnouncementRead.read_at >= since_list
-            ).order_by(AnnouncementRead.read_at.desc()).limit(5).all())
-        for r in recent_reads:
-            apt_label = (f"{r.apartment.block.name}-{r.apartment.number}"
-                         if r.apartment and r.apartment.block else "?")
-            notifs.append({
-                'icon': 'eye', 'color': '#60A5FA',
-                'text': f"{apt_label} a lu une annonce",
-                'sub': (r.announcement.title[:40] if r.announcement else ""),
-                'ts': r.read_at,
-                'new': r.read_at > seen_at,
-                'url': url_for('announcements')
-            })
-
-        # Tickets ouverts récents
-        recent_tickets = Ticket.query.options(
-            joinedload(Ticket.apartment).joinedload(Apartment.block)
-        ).filter(
-            Ticket.organization_id == org_id,
-            Ticket.status == 'ouvert',
-            Ticket.created_at >= since_list
-        ).order_by(Ticket.created_at.desc()).limit(5).all()
-        for t in recent_tickets:
-            apt_label = (f"{t.apartment.block.name}-{t.apartment.number}"
-                         if t.apartment and t.apartment.block else "?")
-            notifs.append({
-                'icon': 'chat-left-dots', 'color': '#F59E0B',
-                'text': f"Nouveau ticket — {apt_label}",
-                'sub': t.subject[:40],
-                'ts': t.created_at,
-                'new': t.created_at > seen_at,
-                'url': url_for('tickets')
-            })
-
-        # Impayés critiques (nouveaux depuis seen_at)
-        unpaid_critical = UnpaidAlert.query.filter(
-            UnpaidAlert.organization_id == org_id,
-            UnpaidAlert.email_sent == False,
-            UnpaidAlert.alert_date > seen_at
-        ).count()
-        unpaid_critical_total = UnpaidAlert.query.filter_by(
-            organization_id=org_id, email_sent=False
-        ).count()
-
-        notifs.sort(key=lambda x: x['ts'], reverse=True)
-        # Badge = seulement les éléments non vus
-        unseen_count = sum(1 for n in notifs if n['new']) + (1 if unpaid_critical > 0 else 0)
-
-        # Virements en attente
-        from models import PaymentRequest, DirectMessage
-        pending_virements = PaymentRequest.query.filter_by(
-            organization_id=org_id, status='en_attente').count()
-
-        # Messages non lus (envoyés par des résidents)
-        unread_msgs = DirectMessage.query.filter_by(organization_id=org_id)\
-            .filter(DirectMessage.read_at.is_(None))\
-            .filter(DirectMessage.sender_id != user.id).count()
-
-        result.update({
-            'notif_list': notifs[:8],
-            'notif_count': unseen_count,
-            'unpaid_critical': unpaid_critical_total,
-            'pending_virements_count': pending_virements,
-            'unread_messages_count': unread_msgs,
-        })
-
-    elif user.role == 'resident' and user.apartment_id:
-        from models import Announcement, AnnouncementRead, DirectMessage
-        anns = Announcement.query.filter_by(organization_id=org_id)\
-            .order_by(Announcement.pinned.desc(), Announcement.created_at.desc()).limit(5).all()
-        read_ids = {r.announcement_id for r in
-                    AnnouncementRead.query.filter_by(user_id=user.id).all()}
-        sidebar_anns = [(a, a.id not in read_ids) for a in anns]
-
-        # Messages non lus pour le résident (envoyés par l'admin)
-        unread_msgs_res = DirectMessage.query.filter_by(
-            organization_id=org_id, apartment_id=user.apartment_id)\
-            .filter(DirectMessage.read_at.is_(None))\
-            .filter(DirectMessage.sender_id != user.id).count()
-
-        result.update({
-            'sidebar_announcements': sidebar_anns,
-            'sidebar_unread_count': sum(1 for _, unread in sidebar_anns if unread),
-            'unread_messages_count': unread_msgs_res,
-        })
-
-    # Mettre en cache le résultat
-    _notif_cache[user.id] = (datetime.utcnow(), result)
-    # Nettoyer les entrées expirées (évite que le dict grossisse indéfiniment)
-    if len(_notif_cache) > 500:
-        cutoff = datetime.utcnow() - timedelta(seconds=_NOTIF_TTL * 2)
-        expired = [uid for uid, (ts, _) in _notif_cache.items() if ts < cutoff]
-        for uid in expired:
-            _notif_cache.pop(uid, None)
-
-    return result
+        # Compteurs de la sidebar : 1 requête (en cache). Le contenu de la cloche est
+        # rendu s'il est déjà en cache, sinon chargé après affichage via /api/notif/feed.
+        result = dict(cache.get_or_set(f'notif-counts:{user.id}', lambda: admin_counts(user),
+                                       ttl=_NOTIF_TTL, tags=tags))
+        feed = cache.get(f'notif-feed:{user.id}')
+        if feed is not None:
+            result.update(feed)
+        else:
+            result['notif_lazy'] = True
+        return result
+
+    if user.role == 'resident' and user.apartment_id:
+        return cache.get_or_set(f'notif:{user.id}', lambda: resident_feed(user),
+                                ttl=_NOTIF_TTL, tags=tags)
+    return {}
+
+
+def notification_feed(user):
+    """Contenu de la cloche admin (en cache) — utilisé par /api/notif/feed."""
+    from utils_notifications import admin_counts, admin_feed
+    tags = [org_tag(user.organization_id), user_tag(user.id)]
+    counts = cache.get_or_set(f'notif-counts:{user.id}', lambda: admin_counts(user),
+                              ttl=_NOTIF_TTL, tags=tags)
+    return cache.get_or_set(f'notif-feed:{user.id}', lambda: admin_feed(user, counts),
+                            ttl=_NOTIF_TTL, tags=tags)
 
 
 def invalidate_notif_cache(user_id: int):
     """Invalide le cache de notifications pour un utilisateur (ex: après clic sur la cloche)."""
-    _notif_cache.pop(user_id, None)
+    cache.invalidate_tags(user_tag(user_id))
 
 
 @app.before_request
@@ -197,6 +98,12 @@ def check_session_timeout():
         session['last_activity'] = datetime.utcnow().isoformat()
 
 
+@app.before_request
+def load_request_principal():
+    """Amorce de la requête : utilisateur, organisation et abonnement en 1 requête."""
+    _load_principal()
+
+
 @app.before_request
 def check_resident_profile_complete():
     """Redirige les résidents dont le profil est incomplet (nom ou WhatsApp manquant)."""
@@ -208,10 +115,7 @@ def check_resident_profile_complete():
     }
     if req.endpoint in allowed or req.endpoint is None:
         return
-    uid = session.get('user_id')
-    if not uid:
-        return
-    user = User.query.get(uid)
+    user = current_user()
     if not user or user.role != 'resident':
         return
     if not user.name or not user.phone:
@@ -226,13 +130,10 @@ def warn_subscription_expiry():
     if req.endpoint in (None, 'static', 'login', 'logout', 'register',
                         'subscription_status', 'index'):
         return
-    uid = session.get('user_id')
-    if not uid:
-        return
-    user = User.query.get(uid)
+    user = current_user()
     if not user or user.role in ('superadmin',):
         return
-    org = Organization.query.get(user.organization_id) if user.organization_id else None
+    org = current_organization()
     if not org or not org.subscription or not org.subscription.end_date:
         return
     days = org.subscription.days_remaining()
@@ -248,30 +149,33 @@ def warn_subscription_expiry():
         session.pop('sub_expired_warned', None)  # abonnement valide → reset lecture seule
 
 
-def current_user():
-    """Retourne l'utilisateur courant — mis en cache dans g pour la durée de la requête."""
-    if 'current_user_obj' in g:
-        return g.current_user_obj
+def _load_principal():
+    """Charge dans g l'utilisateur de la session, son organisation et l'abonnement
+    (jointures : org.subscription ne déclenche plus de requête). Rechargé seulement
+    si l'utilisateur de la session a changé depuis le dernier chargement."""
     uid = session.get('user_id')
-    if not uid:
-        g.current_user_obj = None
-        return None
-    user = User.query.get(uid)
+    if 'current_user_obj' in g and g.get('principal_uid') == uid:
+        return
+    user = None
+    if uid:
+        user = (User.query
+                .options(joinedload(User.organization).joinedload(Organization.subscription))
+                .filter(User.id == uid).first())
+    g.principal_uid = uid
     g.current_user_obj = user
-    return user
+    g.current_org_obj = user.organization if user and user.role != 'superadmin' else None
+
+
+def current_user():
+    """Retourne l'utilisateur courant — chargé une fois par requête dans g."""
+    _load_principal()
+    return g.current_user_obj
 
 
 def current_organization():
-    """Retourne l'organisation courante — mise en cache dans g pour la durée de la requête."""
-    if 'current_org_obj' in g:
-        return g.current_org_obj
-    user = current_user()
-    if not user or user.role == 'superadmin':
-        g.current_org_obj = None
-        return None
-    org = Organization.query.get(user.organization_id)
-    g.current_org_obj = org
-    return org
+    """Retourne l'organisation courante (abonnement déjà chargé) — cf. _load_principal."""
+    _load_principal()
+    return g.current_org_obj
 
 
 def check_subscription():
@@ -347,38 +251,24 @@ def ym_str(ym):
 
 
 def get_unpaid_months_count(apartment_id):
-    """Compte le nombre de mois impayés DEPUIS LA CRÉATION de l'appartement."""
-    apt = Apartment.query.get(apartment_id)
-    if not apt:
-        return 0
-    paid_months = {p.month_paid for p in Payment.query.filter_by(apartment_id=apartment_id).all()}
-    start_d   = apt.created_at.date().replace(day=1) if apt.created_at else date.today().replace(day=1)
-    today_d   = date.today().replace(day=1)
-    start_ym  = start_d.year * 12 + start_d.month
-    today_ym  = today_d.year * 12 + today_d.month
-    return sum(1 for ym in range(start_ym, today_ym + 1) if ym_str(ym) not in paid_months)
+    """Compte le nombre de mois impayés DEPUIS LA CRÉATION de l'appartement.
+    Lecture du registre apartment_arrears (cf. utils_arrears) — 1 requête."""
+    row = get_apartment_arrears(apartment_id)
+    return row_unpaid_count(row) if row else 0
 
 
 def get_next_unpaid_month(apartment_id):
     """Retourne le premier mois (YYYY-MM) impayé depuis la création, jusqu'à 3 mois dans le futur."""
-    apt = Apartment.query.get(apartment_id)
-    if not apt:
+    row = get_apartment_arrears(apartment_id)
+    if not row:
         return date.today().strftime('%Y-%m')
-    paid_months  = {p.month_paid for p in Payment.query.filter_by(apartment_id=apartment_id).all()}
-    start_d      = apt.created_at.date().replace(day=1) if apt.created_at else date.today().replace(day=1)
-    today_d      = date.today().replace(day=1)
-    start_ym     = start_d.year * 12 + start_d.month
-    end_next_ym  = today_d.year * 12 + today_d.month + 3
-    for ym in range(start_ym, end_next_ym + 1):
-        if ym_str(ym) not in paid_months:
-            return ym_str(ym)
-    return ym_str(end_next_ym + 1)
+    return row_next_unpaid(row)
 
 
 # ─── Helpers BATCH : calcul des impayés de toute l'org en 1 requête (anti N+1) ──
 # Ces fonctions remplacent les appels répétés à get_unpaid_months_count() dans les
-# boucles `for apt in apartments`. Logique de calcul IDENTIQUE, mais une seule
-# requête SQL au lieu d'une par appartement.
+# boucles `for apt in apartments`. Sans `paid`, elles lisent le registre
+# apartment_arrears (1 requête indexée, indépendante de la longueur de l'historique).
 
 def get_paid_months_map(org_id):
     """{apartment_id: set(month_paid)} pour toute l'org — 1 requête légère (2 colonnes)."""
@@ -392,32 +282,42 @@ def get_paid_months_map(org_id):
 
 
 def _unpaid_count_from_set(apt, paid_set, today_ym):
-    """Nombre de mois impayés d'un apt depuis sa création — sans requête."""
+    """Nombre de mois impayés d'un apt depuis sa création — sans requête.
+    Mois dus moins mois payés de la période : 1 conversion par mois payé, pas de
+    ym_str() par mois d'historique."""
+    from utils_months import month_index
     start_d  = apt.created_at.date().replace(day=1) if apt.created_at else date.today().replace(day=1)
     start_ym = start_d.year * 12 + start_d.month
-    return sum(1 for ym in range(start_ym, today_ym + 1) if ym_str(ym) not in paid_set)
+    paid = {ym for ym in map(month_index, paid_set) if ym is not None and start_ym <= ym <= today_ym}
+    return max(0, today_ym - start_ym + 1) - len(paid)
 
 
 def get_unpaid_map(org_id, apartments, paid=None):
     """{apartment_id: unpaid_count} pour une liste d'apts — 1 requête au total.
     Équivaut à appeler get_unpaid_months_count() sur chaque apt, mais sans N+1.
-    `paid` : map déjà chargée via get_paid_months_map() pour éviter une 2e requête."""
-    if paid is None:
-        paid = get_paid_months_map(org_id)
+    `paid` : map déjà chargée via get_paid_months_map() — calcul direct sur cette map."""
     td = date.today().replace(day=1)
     today_ym = td.year * 12 + td.month
-    return {apt.id: _unpaid_count_from_set(apt, paid.get(apt.id, set()), today_ym)
+    if paid is not None:
+        return {apt.id: _unpaid_count_from_set(apt, paid.get(apt.id, set()), today_ym)
+                for apt in apartments}
+    rows = get_arrears_map(org_id, apartments)
+    return {apt.id: row_unpaid_count(rows[apt.id], today_ym) if apt.id in rows else 0
             for apt in apartments}
 
 
 def get_unpaid_details_map(org_id, apartments, horizon=3, paid=None):
     """{apartment_id: (unpaid_count, next_unpaid_month)} — 1 requête, calcul en une passe.
     Réplique exactement get_unpaid_months_count() + get_next_unpaid_month()."""
-    if paid is None:
-        paid = get_paid_months_map(org_id)
     td = date.today().replace(day=1)
     today_ym    = td.year * 12 + td.month
     end_next_ym = today_ym + horizon
+    if paid is None:
+        rows = get_arrears_map(org_id, apartments)
+        return {apt.id: ((row_unpaid_count(rows[apt.id], today_ym),
+                          row_next_unpaid(rows[apt.id], horizon, today_ym))
+                         if apt.id in rows else (0, ym_str(end_next_ym + 1)))
+                for apt in apartments}
     result = {}
     for apt in apartments:
         apt_paid = paid.get(apt.id, set())
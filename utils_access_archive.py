@@ -0,0 +1,193 @@
+"""
+Archivage mensuel des journaux d'accès (badge_access_log, access_log).
+
+Les tables chaudes ne gardent que les ACCESS_LOG_HOT_MONTHS derniers mois (mois en
+cours compris). Chaque mois plus ancien est sorti de la table, par organisation,
+dans un fichier JSON Lines compressé (gzip) enregistré dans le stockage des pièces
+jointes (storage_helper) et référencé par access_log_archive — une « partition »
+froide par (organisation, journal, mois). Les index de la table chaude restent
+de taille bornée, quel que soit le nombre d'années de passages.
+
+Les journaux restent consultables : le filtre « mois » de /badges/journal et de
+/access lit l'archive du mois (décompressée en mémoire, filtrée en Python, cache
+LRU du process — le fichier est adressé par contenu, jamais réécrit sur place) en
+plus des lignes chaudes arrivées après l'archivage (synchronisation tardive d'un
+lecteur hors ligne) ; une nouvelle passe fusionne ces lignes dans l'archive.
+
+L'archivage est lancé une fois par jour par le worker (job « archive », cf.
+app._daily_subscription_reminders) ou à la main :
+
+  flask access-logs-archive [--months N]
+"""
+import gzip
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+import click
+from sqlalchemy import func
+
+from core import app, db
+from models import AccessLog, AccessLogArchive, BadgeAccessLog
+
+app.config.setdefault('ACCESS_LOG_HOT_MONTHS', int(os.environ.get('ACCESS_LOG_HOT_MONTHS', 12)))
+
+BadgeRecord = namedtuple('BadgeRecord', 'timestamp badge_id badge_number access_point direction '
+                                        'access_granted reader_id client_seq')
+VisitorRecord = namedtuple('VisitorRecord', 'logged_at visitor_name apartment_id direction reason logged_by')
+
+# journal → (modèle, colonne horodatage, type d'enregistrement archivé)
+Journal = namedtuple('Journal', 'model ts record')
+JOURNALS = {
+    'badges':    Journal(BadgeAccessLog, 'timestamp', BadgeRecord),
+    'visiteurs': Journal(AccessLog, 'logged_at', VisitorRecord),
+}
+
+
+def _ym(d):
+    return d.year * 12 + d.month
+
+
+def _ym_str(ym):
+    y, m = divmod(ym - 1, 12)
+    return f"{y}-{m + 1:02d}"
+
+
+def month_bounds(month):
+    """'YYYY-MM' → (début, début du mois suivant)."""
+    y, m = int(month[:4]), int(month[5:7])
+    return datetime(y, m, 1), datetime(y + m // 12, m % 12 + 1, 1)
+
+
+def hot_cutoff(now=None, months=None):
+    """Premier instant conservé dans les tables chaudes."""
+    now = now or datetime.utcnow()
+    months = months or app.config['ACCESS_LOG_HOT_MONTHS']
+    return month_bounds(_ym_str(_ym(now) - months + 1))[0]
+
+
+# ─── Format des archives ─────────────────────────────────────────────────────
+
+def _encode(records):
+    lines = [json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in r],
+                        ensure_ascii=False, separators=(',', ':')) for r in records]
+    return gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), compresslevel=6)
+
+
+def _decode(kind, raw):
+    record = JOURNALS[kind].record
+    out = []
+    for line in gzip.decompress(raw).decode('utf-8').splitlines():
+        if line:
+            values = json.loads(line)
+            out.append(record(datetime.fromisoformat(values[0]), *values[1:]))
+    return out
+
+
+def _read_file(ref):
+    from storage_helper import is_blob_ref, blob_name, blob_file
+    if is_blob_ref(ref):
+        path, _ = blob_file(blob_name(ref))
+        if path is None:
+            raise FileNotFoundError(ref)
+        with open(path, 'rb') as fh:
+            return fh.read()
+    import utils_http as http
+    resp = http.get('supabase', ref)
+    resp.raise_for_status()
+    return resp.content
+
+
+@lru_cache(maxsize=16)
+def _load(kind, ref):
+    return tuple(_decode(kind, _read_file(ref)))
+
+
+def _hot_records(kind, org_id, start, end):
+    j = JOURNALS[kind]
+    ts = getattr(j.model, j.ts)
+    cols = [getattr(j.model, c) for c in j.record._fields]
+    return [j.record(*r) for r in (db.session.query(*cols)
+                                   .filter(j.model.organization_id == org_id, ts >= start, ts < end)
+                                   .order_by(ts, j.model.id))]
+
+
+# ─── Archivage ───────────────────────────────────────────────────────────────
+
+def archive_month(org_id, kind, month):
+    """Sort le mois `month` ('YYYY-MM') de la table chaude vers son archive (fusionnée
+    avec l'archive existante). Valide la transaction. Retourne le nombre de lignes."""
+    from storage_helper import upload_file
+    j = JOURNALS[kind]
+    start, end = month_bounds(month)
+    rows = _hot_records(kind, org_id, start, end)
+    if not rows:
+        return 0
+    archive = AccessLogArchive.query.filter_by(organization_id=org_id, kind=kind, month=month).first()
+    records = list(_load(kind, archive.file_url)) if archive else []
+    records = sorted(records + rows, key=lambda r: r[0])
+    raw = _encode(records)
+    url = upload_file(raw, 'application/gzip', 'archives')
+    if not url:
+        raise RuntimeError(f"archive {kind} {month} (org {org_id}) : écriture impossible")
+
+    ts = getattr(j.model, j.ts)
+    (j.model.query.filter(j.model.organization_id == org_id, ts >= start, ts < end)
+     .delete(synchronize_session=False))
+    archive = archive or AccessLogArchive(organization_id=org_id, kind=kind, month=month)
+    archive.rows, archive.file_url, archive.size = len(records), url, len(raw)
+    archive.created_at = datetime.utcnow()
+    db.session.add(archive)
+    db.session.commit()
+    print(f"[Archives] org {org_id} {kind} {month} : {len(rows)} ligne(s) archivée(s)")
+    return len(rows)
+
+
+def archive_old_months(now=None, months=None):
+    """Archive tous les mois sortis de la fenêtre chaude (1 commit par mois archivé).
+    Retourne le nombre de lignes archivées."""
+    cutoff = hot_cutoff(now, months)
+    total = 0
+    for kind, j in JOURNALS.items():
+        ts = getattr(j.model, j.ts)
+        firsts = (db.session.query(j.model.organization_id, func.min(ts))
+                  .filter(ts < cutoff).group_by(j.model.organization_id).all())
+        for org_id, first in firsts:
+            for ym in range(_ym(first), _ym(cutoff)):
+                total += archive_month(org_id, kind, _ym_str(ym))
+    return total
+
+
+# ─── Lecture (interfaces journal) ────────────────────────────────────────────
+
+def archived_months(org_id, kind):
+    """Mois archivés de l'organisation, du plus récent au plus ancien."""
+    return [m for (m,) in (db.session.query(AccessLogArchive.month)
+                           .filter_by(organization_id=org_id, kind=kind)
+                           .order_by(AccessLogArchive.month.desc()))]
+
+
+def month_records(org_id, kind, month, match=None, limit=200):
+    """Enregistrements du mois (archive + lignes chaudes), plus récents d'abord,
+    filtrés par `match(record)`."""
+    archive = AccessLogArchive.query.filter_by(organization_id=org_id, kind=kind, month=month).first()
+    records = list(_load(kind, archive.file_url)) if archive else []
+    records += _hot_records(kind, org_id, *month_bounds(month))
+    records.sort(key=lambda r: r[0], reverse=True)
+    if match is not None:
+        records = [r for r in records if match(r)]
+    return records[:limit]
+
+
+# ─── CLI ─────────────────────────────────────────────────────────────────────
+
+@app.cli.command('access-logs-archive')
+@click.option('--months', type=int, default=None,
+              help="Mois conservés en table (défaut : ACCESS_LOG_HOT_MONTHS).")
+def access_logs_archive_command(months):
+    """Archive les mois anciens des journaux d'accès (badges, visiteurs)."""
+    n = archive_old_months(months=months)
+    click.echo(f"{n} ligne(s) archivée(s) "
+               f"(fenêtre chaude : {months or app.config['ACCESS_LOG_HOT_MONTHS']} mois).")
@@ -1,36 +1,79 @@
 """
 Suivi des visites du site SyndicPro.
-Enregistre chaque page vue (GET) en base de données pour le tableau de bord superadmin.
+Enregistre chaque page vue (GET) pour le tableau de bord superadmin.
+
+Le hook after_request ne touche pas à la base : la visite est ajoutée à un
+tampon en mémoire, vidé en un INSERT multi-lignes par un thread de fond
+(FLUSH_SIZE visites ou FLUSH_INTERVAL secondes). Benchmark : benchmarks/bench_track_visit.py
 """
+import atexit
 import hashlib
+import os
 import secrets
+import threading
+import time
+from datetime import datetime
 from urllib.parse import urlparse
 
+from core import app, db
+
 # Orgs exclues des analytics (comptes de test — insensible à la casse, recherche partielle)
 _EXCLUDED_ORG_KEYWORDS = ('jasmin',)
 
+# Tampon des visites : vidé en INSERT groupé par un thread de fond (un par process
+# gunicorn — chaque worker a son propre tampon, aucun état partagé entre process).
+FLUSH_SIZE       = 50      # vidage immédiat au-delà de N visites en attente
+FLUSH_INTERVAL   = 5.0     # sinon toutes les N secondes
+BUFFER_MAX       = 5000    # plafond mémoire : au-delà, les visites les plus anciennes sont perdues
+EXCLUDED_REFRESH = 300     # rafraîchissement de l'ensemble des utilisateurs exclus (s)
+
+app.config.setdefault('ANALYTICS_BACKGROUND_FLUSH', True)
+
+_buffer = []
+_buffer_lock = threading.Lock()
+_flush_event = threading.Event()
+_flusher_pid = None
+
+_excluded_ids = frozenset()
+_excluded_loaded_at = 0.0
+_excluded_lock = threading.Lock()
+
+
+def excluded_user_ids():
+    """Ensemble des user_id exclus des analytics (superadmins + orgs de test).
+    Chargé en 1 requête puis gardé en mémoire EXCLUDED_REFRESH secondes."""
+    global _excluded_ids, _excluded_loaded_at
+    if time.monotonic() - _excluded_loaded_at < EXCLUDED_REFRESH:
+        return _excluded_ids
+    with _excluded_lock:
+        if time.monotonic() - _excluded_loaded_at < EXCLUDED_REFRESH:
+            return _excluded_ids
+        try:
+            from sqlalchemy import or_
+            from models import User, Organization
+            conds = [User.role == 'superadmin']
+            for kw in _EXCLUDED_ORG_KEYWORDS:
+                conds += [Organization.name.ilike(f'%{kw}%'), Organization.slug.ilike(f'%{kw}%')]
+            rows = (db.session.query(User.id)
+                    .outerjoin(Organization, Organization.id == User.organization_id)
+                    .filter(or_(*conds)).all())
+            _excluded_ids = frozenset(r[0] for r in rows)
+        except Exception as e:
+            print(f'[Analytics] Chargement des exclusions : {e}')
+        # En cas d'erreur on garde l'ancien ensemble et on réessaie au prochain intervalle
+        _excluded_loaded_at = time.monotonic()
+    return _excluded_ids
+
+
+def invalidate_excluded_users():
+    """Force le rechargement de l'ensemble des exclus à la prochaine visite."""
+    global _excluded_loaded_at
+    _excluded_loaded_at = 0.0
+
 
 def _is_excluded_user(user_id):
     """Retourne True si cet utilisateur ne doit pas être comptabilisé dans les analytics."""
-    if not user_id:
-        return False
-    try:
-        from models import User, Organization
-        user = User.query.get(user_id)
-        if not user:
-            return False
-        if user.role == 'superadmin':
-            return True
-        if user.organization_id:
-            org = Organization.query.get(user.organization_id)
-            if org:
-                name_lower = (org.name or '').lower()
-                slug_lower = (org.slug or '').lower()
-                if any(kw in name_lower or kw in slug_lower for kw in _EXCLUDED_ORG_KEYWORDS):
-                    return True
-    except Exception:
-        pass
-    return False
+    return bool(user_id) and user_id in excluded_user_ids()
 
 
 # ─── Parsing User-Agent (sans bibliothèque externe) ───────────────────────────
@@ -115,13 +158,82 @@ def _referrer_domain(referrer: str) -> str | None:
         return None
 
 
+# ─── Tampon et vidage groupé ──────────────────────────────────────────────────
+
+def flush_visits():
+    """Insère en base toutes les visites en attente (1 INSERT multi-lignes).
+    Nécessite un contexte d'application. Retourne le nombre de lignes écrites."""
+    global _buffer
+    with _buffer_lock:
+        rows, _buffer = _buffer, []
+    if not rows:
+        return 0
+    from models import SiteVisit
+    try:
+        db.session.execute(SiteVisit.__table__.insert(), rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f'[Analytics] Échec écriture de {len(rows)} visite(s) : {e}')
+        return 0
+    return len(rows)
+
+
+def _flusher_loop():
+    while True:
+        _flush_event.wait(FLUSH_INTERVAL)
+        _flush_event.clear()
+        with app.app_context():
+            try:
+                flush_visits()
+            finally:
+                db.session.remove()
+
+
+def _ensure_flusher():
+    """Démarre le thread de vidage une fois par process (gunicorn fork → nouveau pid)."""
+    global _flusher_pid, _buffer
+    if _flusher_pid == os.getpid():
+        return
+    with _buffer_lock:
+        if _flusher_pid == os.getpid():
+            return
+        if _flusher_pid is not None:
+            _buffer = []    # tampon hérité du process parent : écrit par le parent
+        threading.Thread(target=_flusher_loop, name='analytics-flush', daemon=True).start()
+        _flusher_pid = os.getpid()
+
+
+def _flush_at_exit():
+    if _flusher_pid == os.getpid() and _buffer:
+        try:
+            with app.app_context():
+                flush_visits()
+        except Exception:
+            pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def _buffer_visit(row):
+    with _buffer_lock:
+        _buffer.append(row)
+        if len(_buffer) > BUFFER_MAX:
+            del _buffer[:len(_buffer) - BUFFER_MAX]
+        size = len(_buffer)
+    if not app.config.get('ANALYTICS_BACKGROUND_FLUSH'):
+        return
+    _ensure_flusher()
+    if size >= FLUSH_SIZE:
+        _flush_event.set()
+
+
 # ─── Enregistrement d'une visite ──────────────────────────────────────────────
 
 def track_visit(response):
     """Hook after_request : enregistre la visite si applicable."""
     from flask import request, session as flask_session
-    from models import SiteVisit
-    from core import db
 
     try:
         # Seulement les pages (GET, pas AJAX / POST / API)
@@ -171,7 +283,8 @@ def track_visit(response):
         if _is_excluded_user(user_id):
             return response
 
-        visit = SiteVisit(
+        _buffer_visit(dict(
+            ts=datetime.utcnow(),
             path=path[:500],
             ip_hash=ip_hash,
             session_key=session_key[:32] if session_key else '',
@@ -185,9 +298,7 @@ def track_visit(response):
             utm_medium=utm_medium,
             utm_campaign=utm_campaign,
             status_code=response.status_code,
-        )
-        db.session.add(visit)
-        db.session.commit()
+        ))
 
         # Poser le cookie anonyme si absent (365 jours)
         if not session_key:
@@ -201,9 +312,6 @@ def track_visit(response):
                 secure=secure,
             )
     except Exception:
-        try:
-            db.session.rollback()
-        except Exception:
-            pass
+        pass
 
     return response
@@ -0,0 +1,221 @@
+"""
+Agrégats journaliers des visites (tableau de bord /superadmin/analytics).
+
+site_visit reste la table brute écrite par utils_analytics. Chaque jour clos est
+agrégé une seule fois dans :
+  site_visit_daily    — jour × page × source × appareil × navigateur × OS × UTM
+  site_visit_hourly   — jour × heure
+  site_session_daily  — jour × session (pages vues, 1re/dernière vue, entonnoir)
+  site_rollup_day     — marqueur « jour agrégé » + totaux du jour
+
+Le tableau de bord lit les rollups pour les jours clos et les lignes brutes des
+jours pas encore agrégés (aujourd'hui). Les lignes brutes plus anciennes que
+ANALYTICS_RAW_RETENTION_DAYS — et déjà agrégées — sont supprimées.
+
+Les comptes exclus (superadmin, orgs de test) sont filtrés en Python avec
+l'ensemble en mémoire de utils_analytics, plus de NOT IN (...) en SQL.
+
+  flask analytics-rollup [--no-purge]
+"""
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import func, cast, Integer
+
+from core import app, db
+from models import SiteVisit, SiteRollupDay, SiteVisitDaily, SiteVisitHourly, SiteSessionDaily
+
+# Un jour n'est agrégé qu'après ce délai (tampon de utils_analytics vidé après minuit)
+ROLLUP_GRACE = timedelta(minutes=15)
+
+app.config.setdefault('ANALYTICS_RAW_RETENTION_DAYS',
+                      int(os.environ.get('ANALYTICS_RAW_RETENTION_DAYS', 90)))
+
+# Dimensions de site_visit_daily (ordre des clés du Counter `dims`)
+DIMS = ('path', 'referrer_domain', 'is_direct', 'device_type', 'browser', 'os_name',
+        'utm_source', 'utm_medium', 'utm_campaign')
+
+_RAW_COLS = (SiteVisit.ts, SiteVisit.path, SiteVisit.session_key, SiteVisit.user_id,
+             SiteVisit.referrer, SiteVisit.referrer_domain, SiteVisit.device_type,
+             SiteVisit.browser, SiteVisit.os_name, SiteVisit.utm_source,
+             SiteVisit.utm_medium, SiteVisit.utm_campaign)
+
+
+def _day_start(d):
+    return datetime(d.year, d.month, d.day)
+
+
+def _empty():
+    # sessions : {session_key: [vues, first_ts, last_ts, saw_index, saw_register]}
+    return {'days': Counter(), 'dims': Counter(), 'hours': Counter(), 'sessions': {}}
+
+
+def _merge_session(sessions, key, views, first, last, saw_index, saw_register):
+    s = sessions.get(key)
+    if s is None:
+        sessions[key] = [views, first, last, bool(saw_index), bool(saw_register)]
+    else:
+        s[0] += views
+        s[1] = min(s[1], first)
+        s[2] = max(s[2], last)
+        s[3] = s[3] or bool(saw_index)
+        s[4] = s[4] or bool(saw_register)
+
+
+def aggregate_raw(start, end=None):
+    """Agrège en Python les visites brutes de [start, end), comptes exclus retirés."""
+    from utils_analytics import excluded_user_ids
+    excluded = excluded_user_ids()
+    agg = _empty()
+    q = db.session.query(*_RAW_COLS).filter(SiteVisit.ts >= start)
+    if end is not None:
+        q = q.filter(SiteVisit.ts < end)
+    for r in q.yield_per(2000):
+        if r.user_id and r.user_id in excluded:
+            continue
+        agg['days'][r.ts.date()] += 1
+        agg['hours'][r.ts.hour] += 1
+        agg['dims'][(r.path, r.referrer_domain, r.referrer_domain is None and not r.referrer,
+                     r.device_type, r.browser, r.os_name,
+                     r.utm_source, r.utm_medium, r.utm_campaign)] += 1
+        if r.session_key:
+            _merge_session(agg['sessions'], r.session_key, 1, r.ts, r.ts,
+                           r.path == '/', r.path == '/register')
+    return agg
+
+
+# ─── Job d'agrégation ────────────────────────────────────────────────────────
+
+def last_rolled_day():
+    return db.session.query(func.max(SiteRollupDay.day)).scalar()
+
+
+def pending_days(now=None):
+    """Jours clos pas encore agrégés, du plus ancien au plus récent."""
+    now = now or datetime.utcnow()
+    last_closed = (now - ROLLUP_GRACE).date() - timedelta(days=1)
+    last = last_rolled_day()
+    if last is not None:
+        first = last + timedelta(days=1)
+    else:
+        first_ts = db.session.query(func.min(SiteVisit.ts)).scalar()
+        if first_ts is None:
+            return []
+        first = first_ts.date()
+    return [first + timedelta(days=i) for i in range((last_closed - first).days + 1)]
+
+
+def rollup_day(day):
+    """(Ré)agrège un jour dans les tables de rollup. Sans commit."""
+    for model in (SiteVisitDaily, SiteVisitHourly, SiteSessionDaily, SiteRollupDay):
+        model.query.filter(model.day == day).delete(synchronize_session=False)
+    agg = aggregate_raw(_day_start(day), _day_start(day + timedelta(days=1)))
+    if agg['dims']:
+        db.session.execute(SiteVisitDaily.__table__.insert(), [
+            dict(zip(DIMS, key), day=day, views=n) for key, n in agg['dims'].items()])
+        db.session.execute(SiteVisitHourly.__table__.insert(), [
+            {'day': day, 'hour': h, 'views': n} for h, n in agg['hours'].items()])
+    if agg['sessions']:
+        db.session.execute(SiteSessionDaily.__table__.insert(), [
+            {'day': day, 'session_key': k, 'views': s[0], 'first_ts': s[1], 'last_ts': s[2],
+             'saw_index': s[3], 'saw_register': s[4]} for k, s in agg['sessions'].items()])
+    db.session.add(SiteRollupDay(day=day, views=sum(agg['dims'].values()),
+                                 sessions=len(agg['sessions'])))
+
+
+def purge_raw_visits(now=None):
+    """Supprime les visites brutes hors rétention, uniquement pour des jours déjà agrégés."""
+    now = now or datetime.utcnow()
+    last = last_rolled_day()
+    if last is None:
+        return 0
+    cutoff = min(now.date() - timedelta(days=app.config['ANALYTICS_RAW_RETENTION_DAYS']),
+                 last + timedelta(days=1))
+    n = (SiteVisit.query.filter(SiteVisit.ts < _day_start(cutoff))
+         .delete(synchronize_session=False))
+    db.session.commit()
+    return n
+
+
+def rollup_closed_days(purge=True, now=None):
+    """Agrège tous les jours clos en attente (1 commit par jour). Retourne le nombre de jours."""
+    days = pending_days(now)
+    for day in days:
+        try:
+            rollup_day(day)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f'[Analytics] Agrégation du {day} échouée : {e}')
+            return days.index(day)
+    if days and purge:
+        purge_raw_visits(now)
+    return len(days)
+
+
+# ─── Lecture (tableau de bord) ───────────────────────────────────────────────
+
+def load_window(since_day):
+    """Agrégats de la fenêtre [since_day, maintenant] : rollups pour les jours
+    agrégés + lignes brutes pour le reste. Même structure que aggregate_raw(),
+    plus 'new_sessions' (sessions dont la toute première visite est dans la fenêtre)."""
+    last = last_rolled_day()
+    raw_from = max(since_day, last + timedelta(days=1)) if last else since_day
+    agg = aggregate_raw(_day_start(raw_from))
+    raw_sessions = set(agg['sessions'])
+
+    if last is not None and last >= since_day:
+        in_window = lambda m: (m.day >= since_day, m.day <= last)
+
+        for day, views in (db.session.query(SiteRollupDay.day, SiteRollupDay.views)
+                           .filter(*in_window(SiteRollupDay)).all()):
+            agg['days'][day] += views
+
+        cols = [getattr(SiteVisitDaily, d) for d in DIMS]
+        for row in (db.session.query(*cols, func.sum(SiteVisitDaily.views))
+                    .filter(*in_window(SiteVisitDaily)).group_by(*cols).all()):
+            agg['dims'][tuple(row[:-1])] += row[-1]
+
+        for hour, views in (db.session.query(SiteVisitHourly.hour, func.sum(SiteVisitHourly.views))
+                            .filter(*in_window(SiteVisitHourly))
+                            .group_by(SiteVisitHourly.hour).all()):
+            agg['hours'][hour] += views
+
+        for key, views, first, last_ts, saw_i, saw_r in (
+                db.session.query(SiteSessionDaily.session_key,
+                                 func.sum(SiteSessionDaily.views),
+                                 func.min(SiteSessionDaily.first_ts),
+                                 func.max(SiteSessionDaily.last_ts),
+                                 func.max(cast(SiteSessionDaily.saw_index, Integer)),
+                                 func.max(cast(SiteSessionDaily.saw_register, Integer)))
+                .filter(*in_window(SiteSessionDaily))
+                .group_by(SiteSessionDaily.session_key).all()):
+            _merge_session(agg['sessions'], key, views, first, last_ts, saw_i, saw_r)
+
+    # Nouvelles sessions : 1re apparition dans les rollups ≥ since_day, ou jamais agrégées
+    new_sessions = 0
+    if last is not None:
+        first_seen = (db.session.query(SiteSessionDaily.session_key)
+                      .group_by(SiteSessionDaily.session_key)
+                      .having(func.min(SiteSessionDaily.day) >= since_day).subquery())
+        new_sessions = db.session.query(func.count()).select_from(first_seen).scalar() or 0
+        keys = list(raw_sessions)
+        for i in range(0, len(keys), 500):
+            seen = (db.session.query(SiteSessionDaily.session_key)
+                    .filter(SiteSessionDaily.session_key.in_(keys[i:i + 500])).distinct().all())
+            raw_sessions -= {r[0] for r in seen}
+    agg['new_sessions'] = new_sessions + len(raw_sessions)
+    return agg
+
+
+@app.cli.command('analytics-rollup')
+@click.option('--no-purge', is_flag=True, help="Ne pas supprimer les visites brutes hors rétention.")
+def analytics_rollup_command(no_purge):
+    """Agrège les jours clos de site_visit et applique la rétention des lignes brutes."""
+    n = rollup_closed_days(purge=False)
+    click.echo(f"{n} jour(s) agrégé(s).")
+    if not no_purge:
+        click.echo(f"{purge_raw_visits()} visite(s) brute(s) supprimée(s) "
+                   f"(rétention {app.config['ANALYTICS_RAW_RETENTION_DAYS']} j).")
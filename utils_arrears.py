@@ -0,0 +1,262 @@
+"""
+Registre incrémental des impayés par appartement (table apartment_arrears).
+
+Chaque appartement a une ligne contenant un bitmap des mois payés depuis sa
+création (bit i = mois start_ym + i), le premier mois impayé et le nombre
+d'impayés. Les encaissements (saisie admin, Konnect, Flouci, virements) mettent
+la ligne à jour au moment où ils sont enregistrés : la lecture des impayés d'une
+organisation devient une seule requête indexée, quelle que soit la profondeur
+de l'historique.
+
+Commandes :
+  flask arrears-check [--org ID] [--fix]   — compare au recalcul complet
+"""
+from datetime import date, datetime
+
+import click
+
+from core import app, db
+from models import Apartment, ApartmentArrears, Payment
+
+
+# ─── Arithmétique des mois (entiers year*12+month) ────────────────────────────
+
+def _ym(d):
+    return d.year * 12 + d.month
+
+
+def _ym_to_str(ym):
+    y, mo = divmod(ym - 1, 12)
+    return f"{y}-{mo + 1:02d}"
+
+
+def _parse_ym(month_str):
+    """'YYYY-MM' → entier year*12+month, None si format invalide."""
+    try:
+        y, m = int(month_str[:4]), int(month_str[5:7])
+    except (TypeError, ValueError):
+        return None
+    if not 1 <= m <= 12:
+        return None
+    return y * 12 + m
+
+
+def _today_ym():
+    return _ym(date.today())
+
+
+def _start_ym(apt):
+    """Mois de départ du calcul des impayés : création de l'appartement (ou mois courant)."""
+    return _ym(apt.created_at) if apt.created_at else _today_ym()
+
+
+def _first_zero(bits):
+    """Index du premier bit à 0."""
+    return (~bits & (bits + 1)).bit_length() - 1
+
+
+def _unpaid_at(bits, start_ym, ym):
+    """Nombre de mois impayés entre start_ym et ym inclus."""
+    span = ym - start_ym + 1
+    if span <= 0:
+        return 0
+    return span - (bits & ((1 << span) - 1)).bit_count()
+
+
+# ─── Écriture ────────────────────────────────────────────────────────────────
+
+def _apply(row, bits, today_ym=None):
+    """Recalcule les colonnes dérivées d'une ligne à partir du bitmap."""
+    today_ym = today_ym or _today_ym()
+    row.paid_bitmap     = format(bits, 'x')
+    row.first_unpaid_ym = row.start_ym + _first_zero(bits)
+    row.unpaid_count    = _unpaid_at(bits, row.start_ym, today_ym)
+    row.computed_ym     = today_ym
+    return row
+
+
+def _bits_from_months(months, start_ym):
+    bits = 0
+    for m in months:
+        ym = _parse_ym(m)
+        if ym is not None and ym >= start_ym:
+            bits |= 1 << (ym - start_ym)
+    return bits
+
+
+def rebuild_arrears(apartments):
+    """Reconstruit les lignes du registre depuis la table payment — 1 requête pour le lot.
+    Retourne {apartment_id: ApartmentArrears}. Ne commit pas."""
+    apartments = [a for a in apartments if a is not None]
+    if not apartments:
+        return {}
+    ids = [a.id for a in apartments]
+    paid = {}
+    for apt_id, mp in (db.session.query(Payment.apartment_id, Payment.month_paid)
+                       .filter(Payment.apartment_id.in_(ids)).all()):
+        if mp:
+            paid.setdefault(apt_id, set()).add(mp)
+    existing = {r.apartment_id: r for r in
+                ApartmentArrears.query.filter(ApartmentArrears.apartment_id.in_(ids)).all()}
+    today_ym = _today_ym()
+    rows = {}
+    for apt in apartments:
+        row = existing.get(apt.id)
+        if row is None:
+            row = ApartmentArrears(apartment_id=apt.id)
+            db.session.add(row)
+        row.organization_id = apt.organization_id
+        row.start_ym = _start_ym(apt)
+        rows[apt.id] = _apply(row, _bits_from_months(paid.get(apt.id, ()), row.start_ym), today_ym)
+    return rows
+
+
+def refresh_arrears(*apartment_ids):
+    """Reconstruit le registre des appartements donnés (après modification/suppression d'un paiement)."""
+    ids = {i for i in apartment_ids if i}
+    if not ids:
+        return
+    db.session.flush()
+    rebuild_arrears(Apartment.query.filter(Apartment.id.in_(ids)).all())
+
+
+def record_paid_months(apt, months):
+    """Marque des mois comme payés dans le registre — appelé à chaque création de Payment.
+    Incrémental : aucun relecture de l'historique si la ligne existe déjà. Ne commit pas."""
+    row = ApartmentArrears.query.get(apt.id)
+    if row is None or row.start_ym != _start_ym(apt):
+        db.session.flush()
+        rebuild_arrears([apt])
+        return
+    bits = int(row.paid_bitmap or '0', 16) | _bits_from_months(months, row.start_ym)
+    _apply(row, bits)
+
+
+def backfill_arrears():
+    """Crée / recale les lignes manquantes ou périmées de toutes les organisations
+    (1 commit par organisation). Retourne le nombre de lignes reconstruites."""
+    total = 0
+    for (org_id,) in db.session.query(Apartment.organization_id).distinct().all():
+        apartments = Apartment.query.filter_by(organization_id=org_id).all()
+        rows = {r.apartment_id: r.start_ym for r in
+                ApartmentArrears.query.filter_by(organization_id=org_id)}
+        stale = [a for a in apartments if rows.get(a.id) != _start_ym(a)]
+        if stale:
+            rebuild_arrears(stale)
+            db.session.commit()
+            total += len(stale)
+    return total
+
+
+def delete_arrears(apartment_id):
+    """Supprime la ligne du registre (suppression d'un appartement)."""
+    ApartmentArrears.query.filter_by(apartment_id=apartment_id).delete()
+
+
+# ─── Lecture ─────────────────────────────────────────────────────────────────
+
+def get_arrears_map(org_id, apartments):
+    """{apartment_id: ApartmentArrears} — 1 requête indexée sur organization_id.
+    Toute ligne est créée avec l'appartement et les bases existantes sont remplies par
+    la migration 15 (backfill_arrears) : la reconstruction ci-dessous n'est qu'un
+    filet, dans un savepoint — la transaction de l'appelant n'est ni validée ni
+    annulée, et les lignes sont enregistrées avec son prochain commit."""
+    rows = {r.apartment_id: r for r in
+            ApartmentArrears.query.filter_by(organization_id=org_id).all()}
+    stale = [a for a in apartments
+             if a.id not in rows or rows[a.id].start_ym != _start_ym(a)]
+    if stale:
+        try:
+            with db.session.begin_nested():
+                rebuilt = rebuild_arrears(stale)
+        except Exception as e:
+            app.logger.error("Registre impayés : reconstruction échouée : %s", e)
+        else:
+            rows.update(rebuilt)
+    return rows
+
+
+def row_unpaid_count(row, today_ym=None):
+    """Impayés au mois courant — valeur stockée si calculée ce mois-ci, sinon dérivée du bitmap."""
+    today_ym = today_ym or _today_ym()
+    if row.computed_ym == today_ym:
+        return row.unpaid_count
+    return _unpaid_at(int(row.paid_bitmap or '0', 16), row.start_ym, today_ym)
+
+
+def row_next_unpaid(row, horizon=3, today_ym=None):
+    """Premier mois impayé (YYYY-MM), borné à `horizon` mois dans le futur."""
+    end_next_ym = (today_ym or _today_ym()) + horizon
+    return _ym_to_str(min(row.first_unpaid_ym, end_next_ym + 1))
+
+
+def get_apartment_arrears(apartment_id):
+    """Ligne du registre d'un appartement (reconstruite si absente), None si apt inconnu."""
+    row = ApartmentArrears.query.get(apartment_id)
+    if row is not None:
+        return row
+    apt = Apartment.query.get(apartment_id)
+    if not apt:
+        return None
+    return get_arrears_map(apt.organization_id, [apt]).get(apt.id)
+
+
+# ─── Contrôle de cohérence ───────────────────────────────────────────────────
+
+def _rescan(apt, paid_set, today_ym, horizon=3):
+    """Calcul historique mois par mois (référence) → (unpaid_count, next_unpaid)."""
+    start_ym = _start_ym(apt)
+    end_next_ym = today_ym + horizon
+    unpaid, next_u = 0, None
+    for ym in range(start_ym, end_next_ym + 1):
+        if _ym_to_str(ym) not in paid_set:
+            if ym <= today_ym:
+                unpaid += 1
+            if next_u is None:
+                next_u = _ym_to_str(ym)
+    return unpaid, next_u or _ym_to_str(end_next_ym + 1)
+
+
+def check_arrears(org_id=None, fix=False):
+    """Compare le registre au recalcul complet. Retourne la liste des écarts
+    [(apartment_id, attendu, registre)] ; `fix=True` reconstruit les lignes fautives."""
+    q = Apartment.query
+    if org_id:
+        q = q.filter_by(organization_id=org_id)
+    apartments = q.all()
+    ids = [a.id for a in apartments]
+    paid = {}
+    for apt_id, mp in (db.session.query(Payment.apartment_id, Payment.month_paid)
+                       .filter(Payment.apartment_id.in_(ids)).all()):
+        if mp:
+            paid.setdefault(apt_id, set()).add(mp)
+    rows = {r.apartment_id: r for r in
+            ApartmentArrears.query.filter(ApartmentArrears.apartment_id.in_(ids)).all()}
+    today_ym = _today_ym()
+    mismatches = []
+    for apt in apartments:
+        expected = _rescan(apt, paid.get(apt.id, set()), today_ym)
+        row = rows.get(apt.id)
+        got = ((row_unpaid_count(row, today_ym), row_next_unpaid(row, today_ym=today_ym))
+               if row is not None and row.start_ym == _start_ym(apt) else None)
+        if got != expected:
+            mismatches.append((apt.id, expected, got))
+    if fix and mismatches:
+        bad = {m[0] for m in mismatches}
+        rebuild_arrears([a for a in apartments if a.id in bad])
+        db.session.commit()
+    return mismatches
+
+
+@app.cli.command('arrears-check')
+@click.option('--org', 'org_id', type=int, default=None, help="Limiter à une organisation.")
+@click.option('--fix', is_flag=True, help="Reconstruire les lignes incohérentes.")
+def arrears_check_command(org_id, fix):
+    """Vérifie le registre des impayés contre un recalcul complet depuis les paiements."""
+    started = datetime.utcnow()
+    mismatches = check_arrears(org_id, fix=fix)
+    for apt_id, expected, got in mismatches:
+        click.echo(f"apt {apt_id} : attendu {expected}, registre {got}")
+    elapsed = (datetime.utcnow() - started).total_seconds()
+    status = 'corrigé(s)' if fix else 'détecté(s)'
+    click.echo(f"Registre impayés : {len(mismatches)} écart(s) {status} en {elapsed:.2f}s.")
@@ -0,0 +1,230 @@
+"""
+Décision d'accès des lecteurs de badges (POST /api/badges/access) sans aller-retour
+base de données à chaque passage.
+
+  • Clés API : seule l'empreinte SHA-256 est stockée (organization.badges_api_key_hash,
+    index unique) ; la clé en clair n'est montrée qu'une fois, à la génération.
+  • Index des badges par organisation : badge_number → (id, statut, résident,
+    appartement), construit en 1 requête et gardé en mémoire du process, au plus
+    INDEX_TTL secondes. Il est valide tant que organization.badges_version n'a pas
+    changé : le compteur est incrémenté dans la transaction de tout changement de
+    badge ou de nom / appartement d'un résident, et relu avec la clé API à chaque
+    passage (1 requête sur l'index unique de l'empreinte). Un badge bloqué ou une
+    clé regénérée dans un worker gunicorn est donc refusé immédiatement par tous
+    les autres, quel que soit le backend de cache.
+  • Journal : la ligne BadgeAccessLog est mise en tampon et insérée par un thread
+    de fond (INSERT multi-lignes), comme les visites (utils_analytics). La réponse
+    au lecteur n'attend pas l'écriture.
+  • Synchronisation hors ligne (POST /api/badges/sync) : le lecteur garde une liste
+    d'accès locale et la met à jour par delta — badges modifiés depuis son curseur
+    (badge.updated_at), ou liste complète après une suppression de badge
+    (organization.badges_deleted_at).
+"""
+import atexit
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, inspect, update
+from sqlalchemy.orm import Session
+
+from core import app, db
+from models import Apartment, Badge, Block, Organization, User
+
+INDEX_TTL      = 300     # reconstruction de l'index au plus tard après N secondes
+FLUSH_SIZE     = 50      # vidage immédiat du journal au-delà de N passages en attente
+FLUSH_INTERVAL = 1.0     # sinon toutes les N secondes
+BUFFER_MAX     = 10000   # plafond mémoire : au-delà, les passages les plus anciens sont perdus
+SYNC_OVERLAP   = timedelta(seconds=5)   # marge du delta (transactions validées après le curseur)
+
+app.config.setdefault('BADGE_LOG_BACKGROUND_FLUSH', True)
+
+_indexes = {}    # organization_id → (badges_version, expiration, {badge_number: BadgeEntry})
+_lock = threading.Lock()
+
+_buffer = []
+_buffer_lock = threading.Lock()
+_flush_event = threading.Event()
+_flusher_pid = None
+
+
+def hash_api_key(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+# ─── Invalidation ────────────────────────────────────────────────────────────
+
+def _changes_index(session, obj):
+    """Le commit de `obj` modifie-t-il l'index des badges de son organisation ?"""
+    if isinstance(obj, Badge):
+        return obj in session.new or obj in session.deleted or session.is_modified(obj)
+    if isinstance(obj, User):
+        state = inspect(obj)
+        return obj in session.new or obj in session.deleted or any(
+            state.attrs[k].history.has_changes() for k in ('name', 'apartment_id', 'organization_id'))
+    return False
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_badges_changed(session, flush_context):
+    """Incrémente organization.badges_version dans la transaction du changement (relu à
+    chaque passage : invalide l'index de tous les process). Un badge supprimé
+    n'apparaît dans aucun delta : les lecteurs synchronisés avant cette date repartent
+    d'une liste complète."""
+    objs = list(session.new) + list(session.dirty) + list(session.deleted)
+    changed = {obj.organization_id for obj in objs if _changes_index(session, obj)} - {None}
+    deleted = {obj.organization_id for obj in session.deleted if isinstance(obj, Badge)} - {None}
+    t = Organization.__table__
+    for org_id in changed | deleted:
+        values = {'badges_version': func.coalesce(t.c.badges_version, 0) + 1}
+        if org_id in deleted:
+            values['badges_deleted_at'] = datetime.utcnow()
+        session.connection().execute(update(t).where(t.c.id == org_id).values(**values))
+
+
+# ─── Résolution de la clé API ────────────────────────────────────────────────
+
+def resolve_api_key(api_key):
+    """(organization_id, badges_version) de la clé, ou (None, None) — 1 requête."""
+    row = (db.session.query(Organization.id, Organization.badges_version)
+           .filter(Organization.badges_api_key_hash == hash_api_key(api_key)).first())
+    return (row[0], row[1] or 0) if row else (None, None)
+
+
+def set_api_key(org, api_key):
+    """Enregistre l'empreinte d'une nouvelle clé (la clé en clair n'est pas conservée)."""
+    org.badges_api_key_hash = hash_api_key(api_key)
+    org.badges_api_key_hint = api_key[-4:]
+    org.badges_api_key = None
+
+
+# ─── Index des badges ────────────────────────────────────────────────────────
+
+def _build_index(org_id):
+    rows = (db.session.query(Badge.id, Badge.badge_number, Badge.status,
+                             User.name, Block.name, Apartment.number)
+            .outerjoin(User, User.id == Badge.resident_id)
+            .outerjoin(Apartment, Apartment.id == User.apartment_id)
+            .outerjoin(Block, Block.id == Apartment.block_id)
+            .filter(Badge.organization_id == org_id))
+    return {number: {'id': badge_id, 'status': status, 'resident': resident,
+                     'apartment': f"{block}-{apt}" if block is not None and apt is not None else None}
+            for badge_id, number, status, resident, block, apt in rows}
+
+
+def badge_index(org_id, version):
+    """{badge_number: {'id', 'status', 'resident', 'apartment'}} de l'organisation, pour
+    `version` (organization.badges_version relu par resolve_api_key)."""
+    now = time.monotonic()
+    entry = _indexes.get(org_id)
+    if entry and entry[0] == version and entry[1] > now:
+        return entry[2]
+    index = _build_index(org_id)
+    with _lock:
+        _indexes[org_id] = (version, now + INDEX_TTL, index)
+    return index
+
+
+def decide(org_id, version, badge_number):
+    """(accordé, badge ou None, motif de refus ou None)."""
+    badge = badge_index(org_id, version).get(badge_number)
+    if badge is None:
+        return False, None, 'Badge inconnu'
+    if badge['status'] != 'actif':
+        return False, badge, f"Badge {badge['status']}"
+    return True, badge, None
+
+
+def access_list(org_id, since=None):
+    """Liste d'accès à pousser au lecteur : {'cursor', 'full', 'entries': [{badge_number,
+    allow}]}. Delta des badges modifiés depuis `since` (curseur renvoyé par la synchro
+    précédente), ou liste complète (premier appel, badge supprimé depuis)."""
+    cursor = datetime.utcnow()
+    full = since is None
+    if not full:
+        deleted_at = db.session.query(Organization.badges_deleted_at).filter_by(id=org_id).scalar()
+        full = deleted_at is not None and deleted_at >= since - SYNC_OVERLAP
+    q = db.session.query(Badge.badge_number, Badge.status).filter(Badge.organization_id == org_id)
+    if not full:
+        q = q.filter(Badge.updated_at >= since - SYNC_OVERLAP)
+    return {'cursor': cursor.isoformat() + 'Z', 'full': full,
+            'entries': [{'badge_number': number, 'allow': status == 'actif'}
+                        for number, status in q.order_by(Badge.badge_number)]}
+
+
+# ─── Journal en tampon ───────────────────────────────────────────────────────
+
+def flush_access_logs():
+    """Insère les passages en attente (1 INSERT multi-lignes). Nécessite un contexte
+    d'application. Retourne le nombre de lignes écrites."""
+    global _buffer
+    with _buffer_lock:
+        rows, _buffer = _buffer, []
+    if not rows:
+        return 0
+    from models import BadgeAccessLog
+    try:
+        db.session.execute(BadgeAccessLog.__table__.insert(), rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f'[Badges] Échec écriture de {len(rows)} passage(s) : {e}')
+        return 0
+    return len(rows)
+
+
+def _flusher_loop():
+    while True:
+        _flush_event.wait(FLUSH_INTERVAL)
+        _flush_event.clear()
+        with app.app_context():
+            try:
+                flush_access_logs()
+            finally:
+                db.session.remove()
+
+
+def _ensure_flusher():
+    """Démarre le thread de vidage une fois par process (gunicorn fork → nouveau pid)."""
+    global _flusher_pid, _buffer
+    if _flusher_pid == os.getpid():
+        return
+    with _buffer_lock:
+        if _flusher_pid == os.getpid():
+            return
+        if _flusher_pid is not None:
+            _buffer = []    # tampon hérité du process parent : écrit par le parent
+        threading.Thread(target=_flusher_loop, name='badge-log-flush', daemon=True).start()
+        _flusher_pid = os.getpid()
+
+
+def _flush_at_exit():
+    if _flusher_pid == os.getpid() and _buffer:
+        try:
+            with app.app_context():
+                flush_access_logs()
+        except Exception:
+            pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def log_access(org_id, badge, badge_number, access_point, direction, granted):
+    """Ajoute le passage au tampon du journal (écrit en arrière-plan)."""
+    row = {'organization_id': org_id, 'badge_id': badge['id'] if badge else None,
+           'badge_number': badge_number[:50], 'access_point': access_point[:100],
+           'direction': direction[:10], 'access_granted': granted,
+           'timestamp': datetime.utcnow()}
+    with _buffer_lock:
+        _buffer.append(row)
+        if len(_buffer) > BUFFER_MAX:
+            del _buffer[:len(_buffer) - BUFFER_MAX]
+        size = len(_buffer)
+    if not app.config.get('BADGE_LOG_BACKGROUND_FLUSH'):
+        return
+    _ensure_flusher()
+    if size >= FLUSH_SIZE:
+        _flush_event.set()
@@ -0,0 +1,174 @@
+"""
+Pièces jointes : service HTTP (send_attachment, utilisé par toutes les routes de
+téléchargement) et sortie des colonnes base64 « legacy » (*_data) de la base.
+
+  flask blobs-migrate [--batch 50] [--dry-run]
+      Parcourt chaque colonne base64 par lots (id croissant, un lot en mémoire à
+      la fois, commit par lot) : le fichier est décodé, envoyé au stockage actif
+      (storage_helper.upload_file) et la ligne réécrite (*_url = référence,
+      *_data = NULL). Relançable à tout moment, sans arrêt de l'application.
+
+  flask blobs-gc [--dry-run]
+      Supprime les blobs locaux qu'aucune ligne ne référence plus.
+"""
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import time
+from collections import namedtuple
+
+import click
+from flask import abort, redirect, request, send_file
+from sqlalchemy import func, update
+
+from core import app, db
+from models import (Ticket, Expense, AppelFonds, AppelFondsDepense, Litige, LitigeDocument,
+                    PaymentRequest, SubscriptionPaymentRequest, Payment, AssemblyGeneral,
+                    ReportArtifact, AccessLogArchive)
+from storage_helper import upload_file, local_store, BLOB_PREFIX, is_blob_ref, blob_name, blob_file
+
+# data / mime / url : noms d'attributs du modèle ; folder : dossier Supabase
+Attachment = namedtuple('Attachment', 'model data mime url folder')
+
+ATTACHMENTS = [
+    Attachment(Ticket, 'photo_data', 'photo_mime', 'photo_url', 'tickets'),
+    Attachment(Expense, 'facture_data', 'facture_mime', 'facture_url', 'factures'),
+    Attachment(AppelFonds, 'devis_data', 'devis_mime', 'devis_url', 'appels_fonds'),
+    Attachment(AppelFondsDepense, 'facture_data', 'facture_mime', 'facture_url', 'appels_fonds'),
+    Attachment(Litige, 'accuse_data', 'accuse_mime', 'accuse_url', 'litiges'),
+    Attachment(Litige, 'decharge_data', 'decharge_mime', 'decharge_url', 'litiges'),
+    Attachment(LitigeDocument, 'data', 'mime', 'url', 'litiges'),
+    Attachment(PaymentRequest, 'photo_data', 'photo_mime', 'photo_url', 'virements'),
+    Attachment(SubscriptionPaymentRequest, 'photo_data', 'photo_mime', 'photo_url', 'abonnements'),
+]
+
+# Colonnes pouvant contenir une référence blob (pour le ramasse-miettes)
+BLOB_REF_COLUMNS = [getattr(a.model, a.url) for a in ATTACHMENTS] + [
+    Payment.cheque_url, AssemblyGeneral.pv_scan_url, ReportArtifact.file_url, AccessLogArchive.file_url,
+    Ticket.photo_thumb_url, Payment.cheque_thumb_url, PaymentRequest.photo_thumb_url,
+    Expense.facture_thumb_url, AppelFonds.devis_thumb_url, AppelFondsDepense.facture_thumb_url]
+
+GC_GRACE_SECONDS = 3600   # blob écrit mais ligne pas encore commitée
+REDIRECT_MAX_AGE = 86400  # URL Supabase : chemin aléatoire, contenu jamais réécrit
+
+
+def send_attachment(url, data=None, mime=None, download_name=None, as_attachment=None):
+    """Réponse HTTP d'une pièce jointe (colonnes *_url / *_data / *_mime) :
+      blob local      → lu par morceaux depuis le disque
+      base64 (legacy) → décodé en mémoire
+      URL externe     → redirection, mise en cache par le navigateur
+    ETag fort = SHA-256 du contenu (le même avant et après blobs-migrate) :
+    If-None-Match → 304, Range → 206 (consultation progressive des gros PDF)."""
+    if url and not is_blob_ref(url):
+        resp = redirect(url)
+        resp.headers['Cache-Control'] = f'private, max-age={REDIRECT_MAX_AGE}'
+        return resp
+    if url:
+        path, guessed = blob_file(blob_name(url))
+        if path is None:
+            abort(404)
+        digest, body, mime = blob_name(url).partition('.')[0], path, mime or guessed
+    elif data:
+        raw = base64.b64decode(data)
+        digest, body = hashlib.sha256(raw).hexdigest(), io.BytesIO(raw)
+    else:
+        abort(404)
+    mime = mime or 'application/octet-stream'
+    resp = send_file(body, mimetype=mime, etag=digest, conditional=True,
+                     as_attachment=request.args.get('dl') == '1' if as_attachment is None else as_attachment,
+                     download_name=download_name or digest + (mimetypes.guess_extension(mime) or ''))
+    # Contenu désigné par son empreinte : immuable
+    resp.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return resp
+
+
+def _label(a):
+    return f"{a.model.__tablename__}.{a.data}"
+
+
+def pending(a):
+    """(lignes, octets base64) restant en base pour une colonne."""
+    col = getattr(a.model, a.data)
+    n, size = db.session.query(func.count(a.model.id), func.sum(func.length(col))) \
+                        .filter(col.isnot(None)).one()
+    return n, size or 0
+
+
+def migrate_attachment(a, batch=50):
+    """Migre une colonne base64. Retourne (lignes migrées, échecs d'upload)."""
+    model = a.model
+    data_col, mime_col, url_col = (getattr(model, c) for c in (a.data, a.mime, a.url))
+    done = failed = 0
+    last_id = 0
+    while True:
+        rows = (db.session.query(model.id, data_col, mime_col, url_col)
+                .filter(model.id > last_id, data_col.isnot(None))
+                .order_by(model.id).limit(batch).all())
+        if not rows:
+            return done, failed
+        for row_id, data, mime, url in rows:
+            last_id = row_id
+            if not url:
+                try:
+                    raw = base64.b64decode(data)
+                except (ValueError, TypeError):
+                    print(f"[Blobs] {_label(a)} #{row_id} : base64 invalide, ignoré")
+                    failed += 1
+                    continue
+                url = upload_file(raw, mime or 'application/octet-stream', folder=a.folder)
+                if not url:
+                    failed += 1
+                    continue
+            # WHERE data IS NOT NULL : une ligne modifiée entre-temps n'est pas écrasée
+            db.session.execute(update(model)
+                               .where(model.id == row_id, data_col.isnot(None))
+                               .values({a.url: url, a.data: None}))
+            done += 1
+        db.session.commit()
+
+
+def referenced_digests():
+    refs = set()
+    for col in BLOB_REF_COLUMNS:
+        for (ref,) in db.session.query(col).filter(col.like(f'{BLOB_PREFIX}%')).distinct():
+            refs.add(ref[len(BLOB_PREFIX):].partition('.')[0])
+    return refs
+
+
+def collect_garbage(dry_run=False):
+    """Supprime les blobs locaux non référencés. Retourne (nombre, octets)."""
+    keep = referenced_digests()
+    now = time.time()
+    n = size = 0
+    for digest, path in local_store.digests().items():
+        if digest in keep or now - os.path.getmtime(path) < GC_GRACE_SECONDS:
+            continue
+        n += 1
+        size += os.path.getsize(path)
+        if not dry_run:
+            os.remove(path)
+    return n, size
+
+
+@app.cli.command('blobs-migrate')
+@click.option('--batch', default=50, show_default=True, help="Lignes par lot (un commit par lot).")
+@click.option('--dry-run', is_flag=True, help="Affiche ce qui reste à migrer, sans rien modifier.")
+def blobs_migrate_command(batch, dry_run):
+    """Déplace les pièces jointes base64 vers le stockage de fichiers."""
+    for a in ATTACHMENTS:
+        n, size = pending(a)
+        if dry_run or not n:
+            click.echo(f"{_label(a):<45} {n:>6} ligne(s), {size / 1_048_576:.1f} Mo base64")
+            continue
+        done, failed = migrate_attachment(a, batch=batch)
+        click.echo(f"{_label(a):<45} {done:>6} migrée(s), {failed} échec(s)")
+
+
+@app.cli.command('blobs-gc')
+@click.option('--dry-run', is_flag=True)
+def blobs_gc_command(dry_run):
+    """Supprime les blobs locaux qui ne sont plus référencés."""
+    n, size = collect_garbage(dry_run)
+    click.echo(f"{n} blob(s) {'à supprimer' if dry_run else 'supprimé(s)'} ({size / 1_048_576:.1f} Mo).")
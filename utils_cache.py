@@ -0,0 +1,341 @@
+"""
+Cache applicatif avec invalidation par tags (org:<id>, user:<id>).
+
+Backends (variable d'environnement CACHE_BACKEND) :
+  sqlite    — fichier SQLite partagé par tous les workers gunicorn d'une même
+              machine (CACHE_SQLITE_PATH, défaut database/cache.sqlite3) — défaut
+  memory    — LRU + TTL en mémoire, propre à chaque process : une invalidation
+              n'atteint pas les autres workers (cache.shared False, les
+              appelants réduisent alors leur TTL)
+  redis     — serveur compatible Redis (REDIS_URL) ; paquet `redis` requis,
+              sinon repli sur memory
+  fakeredis — FakeRedis en mémoire (tests, développement sans serveur)
+
+Invalidation : chaque tag a un numéro de version stocké dans le backend. Une
+entrée mémorise les versions de ses tags au moment de l'écriture ; invalider un
+tag incrémente sa version, et toutes les entrées qui le portent deviennent
+périmées — dans tous les process qui partagent le backend.
+
+Les commits SQLAlchemy qui touchent un modèle enregistré via invalidate_on_commit()
+invalident automatiquement le tag de l'organisation concernée.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from core import BASE_DIR
+
+
+def org_tag(org_id):
+    return f'org:{org_id}'
+
+
+def user_tag(user_id):
+    return f'user:{user_id}'
+
+
+class BaseCache:
+    """Logique commune : versions de tags, compteurs hit/miss par préfixe de clé.
+    Les sous-classes implémentent _get / _get_many / _set / _delete / _incr."""
+
+    shared = True    # versions de tags visibles de tous les process
+
+    def __init__(self):
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    # ── Primitives du backend ──
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _get_many(self, keys):
+        return [self._get(k) for k in keys]
+
+    def _set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+    def _incr(self, key):
+        raise NotImplementedError
+
+    # ── API publique ──
+    def _count(self, key, outcome):
+        ns = key.split(':', 1)[0]
+        with self._stats_lock:
+            s = self._stats.setdefault(ns, {'hits': 0, 'misses': 0})
+            s[outcome] += 1
+
+    def _tag_versions(self, tags):
+        return tuple(int(v or 0) for v in self._get_many([f'tag:{t}' for t in tags])) if tags else ()
+
+    def get(self, key, default=None):
+        raw = self._get(f'val:{key}')
+        if raw is not None:
+            tags, versions, value = pickle.loads(raw)
+            if self._tag_versions(tags) == versions:
+                self._count(key, 'hits')
+                return value
+        self._count(key, 'misses')
+        return default
+
+    def set(self, key, value, ttl=300, tags=()):
+        tags = tuple(tags)
+        raw = pickle.dumps((tags, self._tag_versions(tags), value), pickle.HIGHEST_PROTOCOL)
+        self._set(f'val:{key}', raw, ttl)
+
+    def delete(self, key):
+        self._delete(f'val:{key}')
+
+    def get_or_set(self, key, fn, ttl=300, tags=()):
+        # Versions lues AVANT le calcul : une invalidation pendant fn() rend l'entrée périmée
+        tags = tuple(tags)
+        versions = self._tag_versions(tags)
+        raw = self._get(f'val:{key}')
+        if raw is not None:
+            stored_tags, stored_versions, value = pickle.loads(raw)
+            if stored_tags == tags and stored_versions == versions:
+                self._count(key, 'hits')
+                return value
+        self._count(key, 'misses')
+        value = fn()
+        self._set(f'val:{key}', pickle.dumps((tags, versions, value), pickle.HIGHEST_PROTOCOL), ttl)
+        return value
+
+    def tag_version(self, tag):
+        """Version courante d'un tag (change à chaque invalidation) — pour les caches
+        locaux à un process qui suivent un tag partagé."""
+        return self._tag_versions((tag,))[0]
+
+    def invalidate_tags(self, *tags):
+        for t in tags:
+            self._incr(f'tag:{t}')
+
+    def stats(self):
+        """{préfixe: {'hits', 'misses', 'hit_rate'}} depuis le démarrage du process."""
+        with self._stats_lock:
+            return {ns: dict(s, hit_rate=round(s['hits'] / max(s['hits'] + s['misses'], 1), 3))
+                    for ns, s in self._stats.items()}
+
+
+class MemoryCache(BaseCache):
+    """LRU + TTL en mémoire (un par process)."""
+
+    shared = False
+
+    def __init__(self, max_entries=2000):
+        super().__init__()
+        self.max_entries = max_entries
+        self._data = OrderedDict()   # key → (expires_at, value)
+        self._tags = {}              # versions de tags, hors LRU (une éviction les remettrait à 0)
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        if key.startswith('tag:'):
+            return self._tags.get(key)
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] is not None and item[0] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def _set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def _delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _incr(self, key):
+        with self._lock:
+            self._tags[key] = self._tags.get(key, 0) + 1
+            return self._tags[key]
+
+
+class SQLiteCache(BaseCache):
+    """Cache partagé entre process via un fichier SQLite (mode WAL)."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute('CREATE TABLE IF NOT EXISTS cache '
+                             '(key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _get_many(self, keys):
+        if not keys:
+            return []
+        rows = self._conn().execute(
+            f'SELECT key, value FROM cache WHERE key IN ({",".join("?" * len(keys))}) '
+            f'AND (expires IS NULL OR expires > ?)', (*keys, time.time())).fetchall()
+        found = dict(rows)
+        return [found.get(k) for k in keys]
+
+    def _get(self, key):
+        return self._get_many([key])[0]
+
+    def _set(self, key, value, ttl):
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                     (key, value, time.time() + ttl if ttl else None))
+        # Purge occasionnelle des entrées expirées
+        if hash(key) % 100 == 0:
+            conn.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?', (time.time(),))
+
+    def _delete(self, key):
+        self._conn().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def _incr(self, key):
+        conn = self._conn()
+        conn.execute('INSERT INTO cache (key, value, expires) VALUES (?, 1, NULL) '
+                     'ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1', (key,))
+
+
+class RedisCache(BaseCache):
+    """Backend compatible Redis (redis-py ou FakeRedis) : get / mget / set(ex=) / delete / incr."""
+
+    def __init__(self, client, prefix='syndicpro:'):
+        super().__init__()
+        self.client = client
+        self.prefix = prefix
+
+    def _get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def _get_many(self, keys):
+        return self.client.mget([self.prefix + k for k in keys]) if keys else []
+
+    def _set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=ttl or None)
+
+    def _delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def _incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+
+class FakeRedis:
+    """Sous-ensemble de l'API redis-py, en mémoire — remplace un serveur Redis en local."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key):
+        item = self._data.get(key)
+        if item and item[1] is not None and item[1] < time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._alive(key)
+            return item[0] if item else None
+
+    def mget(self, keys):
+        with self._lock:
+            return [(item[0] if item else None) for item in map(self._alive, keys)]
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for k in keys if self._data.pop(k, None) is not None)
+
+    def incr(self, key):
+        with self._lock:
+            item = self._alive(key)
+            value = int(item[0]) + 1 if item else 1
+            self._data[key] = (str(value).encode(), item[1] if item else None)
+            return value
+
+
+def _make_cache():
+    backend = os.environ.get('CACHE_BACKEND', 'sqlite').lower()
+    if backend == 'sqlite':
+        path = os.environ.get('CACHE_SQLITE_PATH', os.path.join(BASE_DIR, 'database', 'cache.sqlite3'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SQLiteCache(path)
+    if backend == 'redis':
+        try:
+            import redis
+            return RedisCache(redis.Redis.from_url(os.environ.get('REDIS_URL', 'redis://localhost:6379/0')))
+        except ImportError:
+            print('[Cache] Paquet redis absent — repli sur le cache mémoire')
+    if backend == 'fakeredis':
+        return RedisCache(FakeRedis())
+    return MemoryCache()
+
+
+cache = _make_cache()
+
+
+# ─── Invalidation automatique au commit ──────────────────────────────────────
+
+_tracked = {}   # classe de modèle → fonction(instance) -> iterable de tags
+
+
+def invalidate_on_commit(*models, tags=lambda obj: [org_tag(obj.organization_id)]):
+    """Invalide `tags(obj)` après tout commit qui ajoute / modifie / supprime une
+    instance de l'un de ces modèles."""
+    for m in models:
+        _tracked[m] = tags
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_tags(session, flush_context):
+    if not _tracked:
+        return
+    pending = session.info.setdefault('cache_tags', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        fn = _tracked.get(type(obj))
+        if fn is not None:
+            try:
+                pending.update(t for t in fn(obj) if t and not t.endswith(':None'))
+            except Exception:
+                pass
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_collected(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        try:
+            cache.invalidate_tags(*tags)
+        except Exception as e:
+            print(f'[Cache] Invalidation {tags} échouée : {e}')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_collected(session):
+    session.info.pop('cache_tags', None)
@@ -0,0 +1,272 @@
+"""
+Clôture des exercices (table fiscal_year_closing).
+
+Un exercice terminé ne change plus : sa clôture enregistre une fois pour toutes
+les cumuls d'ouverture (encaissements, divers, dépenses, immobilisations au 31/12
+de l'année précédente), les totaux de l'année (par catégorie, par compte SCE,
+par mois) et les créances par appartement au 31/12. Les états financiers partent
+ensuite de la dernière clôture à jour et n'agrègent que les opérations
+postérieures, au lieu de tout l'historique ; pour un exercice clôturé, les comptes
+SCE et l'annexe des créances au 31/12 sont lus dans la clôture.
+
+La trésorerie (12 derniers mois, par appartement et par mois) et l'export Excel
+(lignes d'un exercice) n'en ont pas besoin : leur lecture est déjà bornée à une
+fenêtre d'au plus un an, et ils affichent un détail que la clôture ne conserve pas.
+
+Une écriture ORM sur un paiement, une dépense ou un encaissement divers daté
+d'un exercice clôturé (ou antérieur) marque les clôtures concernées `stale` :
+elles sont ignorées jusqu'à ce que l'exercice soit clôturé à nouveau. Les
+créances au 31/12 retiennent les paiements datés de l'exercice ou avant, à la
+redevance en vigueur lors de la clôture.
+
+Commandes :
+  flask exercices-cloture [--org ID] [--year AAAA]   — clôture (ou re-clôture) des
+                                                      exercices terminés
+"""
+import json
+from collections import namedtuple
+from datetime import date, datetime
+
+import click
+from sqlalchemy import event, func, inspect, update
+from sqlalchemy.orm import Session
+
+from core import app, db
+from models import Apartment, Expense, FiscalYearClosing, MiscReceipt, Organization, Payment
+
+IMMO = 'Immobilisation'
+
+# Totaux d'un exercice ; categories : [(catégorie, montant)] dans l'ordre de première
+# apparition, monthly : 12 × (encaissé, dépensé)
+YearFigures = namedtuple('YearFigures', 'payments misc categories monthly')
+
+
+# ─── Agrégats SQL ────────────────────────────────────────────────────────────
+
+def _between(q, date_col, after=None, upto=None):
+    """Restreint aux années ]after, upto] (bornes de dates : index (org, date) utilisable)."""
+    if after is not None:
+        q = q.filter(date_col >= date(after + 1, 1, 1))
+    if upto is not None:
+        q = q.filter(date_col < date(upto + 1, 1, 1))
+    return q
+
+
+def sums_by_year(model, date_col, org_id, *group, after=None, upto=None):
+    """Sommes SQL (GROUP BY année [, colonnes]) : {(année, *clés): total}, dans l'ordre
+    de première apparition des groupes (même ordre qu'un parcours par id)."""
+    year_col = func.extract('year', date_col)
+    rows = (_between(db.session.query(year_col, *group, func.sum(model.amount))
+                     .filter(model.organization_id == org_id), date_col, after, upto)
+            .group_by(year_col, *group).order_by(func.min(model.id)).all())
+    return {(int(r[0]), *r[1:-1]): float(r[-1] or 0) for r in rows}
+
+
+def sums_by_month(model, date_col, org_id, year):
+    """{mois: total} de l'exercice — GROUP BY mois, 12 lignes au plus."""
+    month_col = func.extract('month', date_col)
+    rows = (_between(db.session.query(month_col, func.sum(model.amount))
+                     .filter(model.organization_id == org_id), date_col, year - 1, year)
+            .group_by(month_col).all())
+    return {int(m): float(total or 0) for m, total in rows}
+
+
+def _sql_year_figures(org_id, year):
+    encaisse = sums_by_month(Payment, Payment.payment_date, org_id, year)
+    depense = sums_by_month(Expense, Expense.expense_date, org_id, year)
+    misc = sums_by_year(MiscReceipt, MiscReceipt.payment_date, org_id, after=year - 1, upto=year)
+    cats = sums_by_year(Expense, Expense.expense_date, org_id, Expense.category,
+                        after=year - 1, upto=year)
+    return YearFigures(
+        payments=sum(encaisse.values()),
+        misc=misc.get((year,), 0.0),
+        categories=[(cat, v) for (_, cat), v in cats.items()],
+        monthly=[(encaisse.get(m, 0.0), depense.get(m, 0.0)) for m in range(1, 13)],
+    )
+
+
+# ─── Lecture des clôtures ────────────────────────────────────────────────────
+
+def fresh_closings(org_id):
+    """{année: FiscalYearClosing} des clôtures à jour — 1 requête."""
+    return {c.year: c for c in FiscalYearClosing.query.filter_by(organization_id=org_id, stale=False)}
+
+
+def closing_cumuls(closing):
+    """Cumuls au 31/12 de l'exercice clôturé."""
+    categories = json.loads(closing.expenses_by_category)
+    return {
+        'payments': closing.opening_payments + closing.payments_total,
+        'misc':     closing.opening_misc + closing.misc_total,
+        'expenses': closing.opening_expenses + sum(v for _, v in categories),
+        'immos':    closing.opening_immos + sum(v for c, v in categories if c == IMMO),
+        'exercices': set(json.loads(closing.exercices)),
+    }
+
+
+def closing_sce_accounts(closing):
+    """Charges d'exploitation par compte SCE figées à la clôture."""
+    return [{'compte': c, 'libelle': l, 'montant': m} for c, l, m in json.loads(closing.sce_accounts)]
+
+
+def closing_receivables(closing):
+    """{apartment_id: (mois impayés, montant)} au 31/12 de l'exercice clôturé."""
+    return {int(k): tuple(v) for k, v in json.loads(closing.receivables).items()}
+
+
+def base_cumuls(closings, before=None):
+    """(année, cumuls) de la dernière clôture à jour (antérieure à `before`),
+    ou (None, cumuls nuls) : les agrégats SQL partent de l'année suivante."""
+    years = [y for y in closings if before is None or y < before]
+    if not years:
+        return None, {'payments': 0.0, 'misc': 0.0, 'expenses': 0.0, 'immos': 0.0,
+                      'exercices': set()}
+    last = max(years)
+    return last, closing_cumuls(closings[last])
+
+
+def year_figures(org_id, year, closings):
+    """Totaux de l'exercice : depuis sa clôture si elle est à jour, sinon en SQL."""
+    c = closings.get(year)
+    if c is None:
+        return _sql_year_figures(org_id, year)
+    return YearFigures(c.payments_total, c.misc_total,
+                       [tuple(x) for x in json.loads(c.expenses_by_category)],
+                       [tuple(x) for x in json.loads(c.monthly)])
+
+
+# ─── Clôture ─────────────────────────────────────────────────────────────────
+
+def _receivables_at(org_id, year):
+    """{apt_id: [mois impayés, montant]} au 31/12/year — paiements datés de l'exercice
+    ou avant, pour les mois de la création de l'appartement à décembre."""
+    from utils import ym_str
+    end_ym = year * 12 + 12
+    paid = {}
+    for apt_id, month in (db.session.query(Payment.apartment_id, Payment.month_paid)
+                          .filter(Payment.organization_id == org_id,
+                                  Payment.payment_date < date(year + 1, 1, 1),
+                                  Payment.month_paid <= f"{year}-12").distinct()):
+        paid.setdefault(apt_id, set()).add(month)
+    result = {}
+    for apt_id, created_at, fee in (db.session.query(Apartment.id, Apartment.created_at,
+                                                     Apartment.monthly_fee)
+                                    .filter(Apartment.organization_id == org_id)):
+        if created_at is None:
+            continue
+        apt_paid = paid.get(apt_id, set())
+        unpaid = sum(1 for ym in range(created_at.year * 12 + created_at.month, end_ym + 1)
+                     if ym_str(ym) not in apt_paid)
+        if unpaid:
+            result[str(apt_id)] = [unpaid, round(unpaid * (fee or 0.0), 3)]
+    return result
+
+
+def close_year(org, year, user=None):
+    """Clôture (ou re-clôture) l'exercice `year` de l'organisation. L'ouverture part
+    de la dernière clôture antérieure à jour ; seuls les exercices intermédiaires
+    sont agrégés en SQL. Valide la transaction."""
+    from routes.financial_statements import sce_accounts
+    if year >= date.today().year:
+        raise ValueError("Seul un exercice terminé peut être clôturé.")
+    closings = fresh_closings(org.id)
+    closings.pop(year, None)
+    prev, opening = base_cumuls(closings, before=year)
+
+    # Exercices non clôturés entre la clôture précédente et celui-ci (inclus)
+    pay = sums_by_year(Payment, Payment.payment_date, org.id, after=prev, upto=year)
+    misc = sums_by_year(MiscReceipt, MiscReceipt.payment_date, org.id, after=prev, upto=year - 1)
+    exp = sums_by_year(Expense, Expense.expense_date, org.id, Expense.category,
+                       after=prev, upto=year)
+    figures = _sql_year_figures(org.id, year)
+    receivables = _receivables_at(org.id, year)
+    exercices = opening['exercices'] | {y for (y,) in pay} | {y for y, _ in exp}
+    pay = {k: v for k, v in pay.items() if k[0] < year}
+    exp = {k: v for k, v in exp.items() if k[0] < year}
+
+    closing = (FiscalYearClosing.query.filter_by(organization_id=org.id, year=year).first()
+               or FiscalYearClosing(organization_id=org.id, year=year))
+    closing.opening_payments = opening['payments'] + sum(pay.values())
+    closing.opening_misc     = opening['misc'] + sum(misc.values())
+    closing.opening_expenses = opening['expenses'] + sum(exp.values())
+    closing.opening_immos    = opening['immos'] + sum(v for (_, c), v in exp.items() if c == IMMO)
+    closing.payments_total   = figures.payments
+    closing.misc_total       = figures.misc
+    closing.expenses_by_category = json.dumps(figures.categories)
+    closing.sce_accounts     = json.dumps([[a['compte'], a['libelle'], a['montant']]
+                                           for a in sce_accounts(figures.categories)])
+    closing.monthly          = json.dumps(figures.monthly)
+    closing.receivables      = json.dumps(receivables)
+    closing.receivables_total = round(sum(m for _, m in receivables.values()), 3)
+    closing.exercices        = json.dumps(sorted(exercices))
+    closing.closed_at, closing.closed_by_id = datetime.utcnow(), user.id if user else None
+    closing.stale, closing.stale_since = False, None
+    db.session.add(closing)
+    db.session.commit()
+    print(f"[Clôture] org {org.id} exercice {year} clôturé")
+    return closing
+
+
+# ─── Détection des écritures sur un exercice clôturé ─────────────────────────
+
+# modèle → (colonne date, colonnes qui entrent dans une clôture)
+_DATED = {
+    Payment:     ('payment_date', {'amount', 'payment_date', 'month_paid', 'apartment_id'}),
+    Expense:     ('expense_date', {'amount', 'expense_date', 'category'}),
+    MiscReceipt: ('payment_date', {'amount', 'payment_date'}),
+}
+
+
+def _touched_years(obj, date_attr, columns, dirty):
+    state = inspect(obj)
+    if dirty:
+        if not any(state.attrs[c].history.has_changes() for c in columns):
+            return []
+        return [d for d in (getattr(obj, date_attr), *state.attrs[date_attr].history.deleted) if d]
+    d = getattr(obj, date_attr)
+    return [d] if d else []
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_stale(session, flush_context):
+    current = date.today().year
+    earliest = {}   # organization_id → plus ancien exercice touché
+    for objects, dirty in ((session.new, False), (session.dirty, True), (session.deleted, False)):
+        for obj in objects:
+            spec = _DATED.get(type(obj))
+            if spec is None:
+                continue
+            for d in _touched_years(obj, *spec, dirty):
+                # Exercice en cours : aucune clôture possible, pas de requête
+                if d.year < current and obj.organization_id is not None:
+                    earliest[obj.organization_id] = min(d.year, earliest.get(obj.organization_id, d.year))
+    t = FiscalYearClosing.__table__
+    for org_id, year in earliest.items():
+        session.connection().execute(
+            update(t).where(t.c.organization_id == org_id, t.c.year >= year, t.c.stale.is_(False))
+            .values(stale=True, stale_since=datetime.utcnow()))
+
+
+# ─── CLI ─────────────────────────────────────────────────────────────────────
+
+@app.cli.command('exercices-cloture')
+@click.option('--org', 'org_id', type=int, default=None, help="Limiter à une organisation.")
+@click.option('--year', type=int, default=None, help="Exercice (défaut : tous les exercices terminés "
+                                                    "non clôturés ou à re-clôturer).")
+def closing_command(org_id, year):
+    """Clôture les exercices terminés (à lancer en janvier, ou après une correction)."""
+    orgs = Organization.query.filter_by(id=org_id).all() if org_id else Organization.query.all()
+    done = 0
+    for org in orgs:
+        if year:
+            years = [year]
+        else:
+            first = db.session.query(func.min(Payment.payment_date)).filter_by(organization_id=org.id).scalar()
+            first_exp = db.session.query(func.min(Expense.expense_date)).filter_by(organization_id=org.id).scalar()
+            starts = [d.year for d in (first, first_exp) if d]
+            fresh = fresh_closings(org.id)
+            years = [y for y in range(min(starts), date.today().year) if y not in fresh] if starts else []
+        for y in years:
+            close_year(org, y)
+            done += 1
+    click.echo(f"{done} exercice(s) clôturé(s).")
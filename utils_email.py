@@ -14,7 +14,8 @@ Usage :
   from utils_email import send_welcome_admin, send_resident_credentials
 """
 
-import os, requests as _requests
+import os
+import utils_http as http
 
 RESEND_API_KEY = os.environ.get('RESEND_API_KEY', '')
 FROM_EMAIL     = 'SyndicPro <contact@syndicpro.tn>'
@@ -36,8 +37,8 @@ def send_email(to: str, subject: str, html: str) -> tuple:
         return False, msg
     try:
         print(f"[Email] Envoi via Resend API a {to}...")
-        resp = _requests.post(
-            'https://api.resend.com/emails',
+        resp = http.post(
+            'resend', 'https://api.resend.com/emails',
             headers={
                 'Authorization': f'Bearer {RESEND_API_KEY}',
                 'Content-Type': 'application/json',
@@ -49,7 +50,6 @@ def send_email(to: str, subject: str, html: str) -> tuple:
                 'html':     html,
                 'reply_to': REPLY_TO,
             },
-            timeout=15,
         )
         if resp.status_code in (200, 201):
             print(f"[Email] OK envoye a {to} — {subject}")
@@ -63,6 +63,22 @@ def send_email(to: str, subject: str, html: str) -> tuple:
         return False, str(e)
 
 
+def queue_email(to: str, subject: str, html: str) -> bool:
+    """
+    Met l'email en file d'envoi (worker utils_jobs) au lieu d'appeler Resend
+    dans la requête. Retourne True si le job a été enregistré.
+    """
+    if not to:
+        return False
+    try:
+        from utils_jobs import enqueue
+        enqueue('email', {'to': to, 'subject': subject, 'html': html})
+        return True
+    except Exception as e:
+        print(f"[Email] Mise en file impossible : {e}")
+        return False
+
+
 # ─── Templates HTML ───────────────────────────────────────────────────────────
 
 def _base_html(content: str, footer_note: str = '') -> str:
@@ -170,7 +186,7 @@ def send_welcome_admin(org_name: str, email: str, days_trial: int = 30) -> bool:
   Nous répondons en moins de 24h.
 </p>"""
 
-    return send_email(
+    return queue_email(
         to=email,
         subject=subject,
         html=_base_html(content,
@@ -226,7 +242,7 @@ def send_resident_credentials(org_name: str, resident_name: str, email: str,
   <a href="mailto:contact@syndicpro.tn" style="color:#1D4ED8;">contact@syndicpro.tn</a>.
 </p>"""
 
-    return send_email(
+    return queue_email(
         to=email,
         subject=subject,
         html=_base_html(content,
@@ -265,4 +281,4 @@ def send_subscription_reminder(org_name: str, email: str, days_left: int) -> boo
   <a href="mailto:contact@syndicpro.tn" style="color:#1D4ED8;">contact@syndicpro.tn</a>.
 </p>"""
 
-    return send_email(to=email, subject=subject, html=_base_html(content))
+    return queue_email(to=email, subject=subject, html=_base_html(content))
@@ -0,0 +1,206 @@
+"""
+Contrôle des plans d'exécution des requêtes « chaudes » (EXPLAIN).
+
+Chaque requête fréquente du multi-tenant est enregistrée ici avec @hot_query ;
+explain_all() exécute EXPLAIN sur chacune et signale les balayages séquentiels
+(table lue en entier au lieu d'un index) :
+
+  SQLite      EXPLAIN QUERY PLAN → lignes « SCAN <table> » sans index
+  PostgreSQL  EXPLAIN (FORMAT JSON) avec enable_seqscan = off → nœuds « Seq Scan »
+              (sans ce réglage, le planificateur préfère un Seq Scan sur une
+              petite table même quand l'index existe)
+
+  flask explain-hot-queries [--strict]    (--strict : code retour 1 si balayage)
+
+Les paramètres sont fictifs : seul le plan compte, pas le résultat.
+"""
+import json
+from datetime import date, datetime, timedelta
+
+import click
+from sqlalchemy import select, func
+
+from core import app, db
+from models import (Payment, Expense, Ticket, DirectMessage, UnpaidAlert, AccessLog,
+                    BadgeAccessLog, PaymentRequest, MiscReceipt, PushSubscription)
+
+HOT_QUERIES = {}   # nom → fonction(params) -> instruction SELECT
+
+
+def hot_query(name):
+    """Enregistre une requête fréquente à contrôler par explain_all()."""
+    def decorator(fn):
+        HOT_QUERIES[name] = fn
+        return fn
+    return decorator
+
+
+# ─── Requêtes chaudes ────────────────────────────────────────────────────────
+
+@hot_query('payments_org_month')
+def _payments_org_month(p):
+    return select(Payment).where(Payment.organization_id == p['org_id'],
+                                 Payment.month_paid == p['month'])
+
+
+@hot_query('payments_apartment_month')
+def _payments_apartment_month(p):
+    return select(Payment.id).where(Payment.apartment_id == p['apt_id'],
+                                    Payment.month_paid == p['month'])
+
+
+@hot_query('payments_org_period')
+def _payments_org_period(p):
+    return select(func.sum(Payment.amount)).where(Payment.organization_id == p['org_id'],
+                                                  Payment.payment_date >= p['since'])
+
+
+@hot_query('expenses_org_period')
+def _expenses_org_period(p):
+    return (select(Expense).where(Expense.organization_id == p['org_id'],
+                                  Expense.expense_date >= p['since'])
+            .order_by(Expense.expense_date.desc()))
+
+
+@hot_query('misc_receipts_org_period')
+def _misc_receipts_org_period(p):
+    return select(func.sum(MiscReceipt.amount)).where(MiscReceipt.organization_id == p['org_id'],
+                                                      MiscReceipt.payment_date >= p['since'])
+
+
+@hot_query('tickets_open')
+def _tickets_open(p):
+    return (select(Ticket.id).where(Ticket.organization_id == p['org_id'],
+                                    Ticket.status == 'ouvert',
+                                    Ticket.created_at >= p['since_ts'])
+            .order_by(Ticket.created_at.desc()))
+
+
+@hot_query('direct_messages_unread')
+def _direct_messages_unread(p):
+    return select(func.count(DirectMessage.id)).where(
+        DirectMessage.organization_id == p['org_id'],
+        DirectMessage.apartment_id == p['apt_id'],
+        DirectMessage.read_at.is_(None))
+
+
+@hot_query('direct_messages_thread')
+def _direct_messages_thread(p):
+    return (select(DirectMessage).where(DirectMessage.apartment_id == p['apt_id'])
+            .order_by(DirectMessage.created_at))
+
+
+@hot_query('unpaid_alerts_apartment')
+def _unpaid_alerts_apartment(p):
+    return (select(UnpaidAlert).where(UnpaidAlert.apartment_id == p['apt_id'])
+            .order_by(UnpaidAlert.alert_date.desc()).limit(1))
+
+
+@hot_query('access_log_recent')
+def _access_log_recent(p):
+    return (select(AccessLog).where(AccessLog.organization_id == p['org_id'],
+                                    AccessLog.logged_at >= p['since_ts'])
+            .order_by(AccessLog.logged_at.desc()))
+
+
+@hot_query('badge_access_log_recent')
+def _badge_access_log_recent(p):
+    return (select(BadgeAccessLog).where(BadgeAccessLog.organization_id == p['org_id'],
+                                         BadgeAccessLog.timestamp >= p['since_ts'])
+            .order_by(BadgeAccessLog.timestamp.desc()))
+
+
+@hot_query('payment_requests_pending')
+def _payment_requests_pending(p):
+    return select(func.count(PaymentRequest.id)).where(PaymentRequest.organization_id == p['org_id'],
+                                                       PaymentRequest.status == 'en_attente')
+
+
+@hot_query('push_subscriptions_user')
+def _push_subscriptions_user(p):
+    return select(PushSubscription).where(PushSubscription.user_id == p['user_id'])
+
+
+# ─── EXPLAIN ────────────────────────────────────────────────────────────────
+
+def _default_params():
+    now = datetime.utcnow()
+    return {'org_id': 1, 'apt_id': 1, 'user_id': 1, 'month': now.strftime('%Y-%m'),
+            'since': date.today() - timedelta(days=365), 'since_ts': now - timedelta(days=30)}
+
+
+def _run(conn, stmt, prefix):
+    compiled = stmt.compile(dialect=conn.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[k] for k in compiled.positiontup)
+    return conn.exec_driver_sql(prefix + str(compiled), params).fetchall()
+
+
+def _sqlite_plan(conn, stmt):
+    """(lignes du plan, tables balayées) — « SCAN t » sans index = balayage séquentiel."""
+    # EXPLAIN n'ouvre pas de transaction de lecture : sans cette lecture, une connexion
+    # du pool garde le schéma d'avant un CREATE / DROP INDEX fait ailleurs.
+    conn.exec_driver_sql('SELECT count(*) FROM sqlite_master').fetchall()
+    lines = [r[-1] for r in _run(conn, stmt, 'EXPLAIN QUERY PLAN ')]
+    scans = [l.split()[1] for l in lines
+             if l.startswith('SCAN ') and ' USING ' not in l]
+    return lines, scans
+
+
+def _pg_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from _pg_nodes(child)
+
+
+def _pg_plan(conn, stmt):
+    conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    raw = _run(conn, stmt, 'EXPLAIN (FORMAT JSON) ')[0][0]
+    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+    nodes = list(_pg_nodes(plan))
+    lines = [f"{n['Node Type']} {n.get('Relation Name', '')} {n.get('Index Name', '')}".strip()
+             for n in nodes]
+    scans = [n['Relation Name'] for n in nodes if n['Node Type'] == 'Seq Scan']
+    return lines, scans
+
+
+def explain_all(params=None, names=None):
+    """Plan de chaque requête chaude : [{'name', 'plan', 'seq_scans'}]."""
+    params = dict(_default_params(), **(params or {}))
+    explain = _pg_plan if db.engine.dialect.name == 'postgresql' else _sqlite_plan
+    report = []
+    with db.engine.connect() as conn:
+        for name, fn in HOT_QUERIES.items():
+            if names and name not in names:
+                continue
+            trans = conn.begin()
+            try:
+                plan, scans = explain(conn, fn(params))
+            finally:
+                trans.rollback()        # EXPLAIN ne modifie rien ; annule le SET LOCAL
+            report.append({'name': name, 'plan': plan, 'seq_scans': scans})
+        if db.engine.dialect.name == 'sqlite':
+            # Le cache d'instructions de sqlite3 resservirait ces plans tels quels
+            # après un CREATE / DROP INDEX : connexion jetée au lieu d'être rendue au pool.
+            conn.invalidate()
+    return report
+
+
+@app.cli.command('explain-hot-queries')
+@click.option('--strict', is_flag=True, help="Code retour 1 si une requête balaie une table.")
+@click.option('--verbose', '-v', is_flag=True, help="Affiche le plan complet de chaque requête.")
+def explain_hot_queries_command(strict, verbose):
+    """EXPLAIN des requêtes chaudes : signale les balayages séquentiels."""
+    report = explain_all()
+    bad = [r for r in report if r['seq_scans']]
+    for r in report:
+        status = f"BALAYAGE {', '.join(r['seq_scans'])}" if r['seq_scans'] else 'OK'
+        click.echo(f"{r['name']:<28} {status}")
+        if verbose or r['seq_scans']:
+            for line in r['plan']:
+                click.echo(f"    {line}")
+    click.echo(f"{len(report) - len(bad)}/{len(report)} requête(s) indexée(s) "
+               f"({db.engine.dialect.name}).")
+    if strict and bad:
+        raise SystemExit(1)
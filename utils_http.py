@@ -0,0 +1,209 @@
+"""
+Client HTTP commun aux intégrations sortantes (Konnect, Flouci, fonnte, Resend,
+Supabase Storage).
+
+  • une requests.Session par fournisseur (pool de connexions, keep-alive) : plus
+    de poignée de main TCP + TLS à chaque appel
+  • délais (connexion, lecture) définis par fournisseur dans PROVIDERS
+  • nouvelles tentatives avec backoff aléatoire, uniquement pour les appels
+    idempotents (GET / HEAD / PUT / DELETE, ou idempotent=True) sur erreur
+    réseau, 429 ou 502-504
+  • budget total par appel (`deadline`, tentatives et attentes comprises) : les
+    délais de chaque tentative sont réduits au temps restant et aucune tentative
+    n'est lancée au-delà — un appel fait depuis une requête web reste sous le
+    timeout des workers gunicorn (60 s)
+  • disjoncteur : après `failures` échecs consécutifs, le fournisseur est
+    considéré en panne pendant `cooldown` secondes — les appels échouent
+    immédiatement (ProviderUnavailable) au lieu d'attendre le délai
+  • statistiques par fournisseur (appels, erreurs, latence) : provider_stats(),
+    affichées sur /superadmin/perf
+
+Usage — mêmes arguments que requests, le fournisseur en premier :
+
+    import utils_http as http
+    resp = http.get('konnect', url, headers=...)
+"""
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# timeout : (connexion, lecture) en secondes ; retries : tentatives supplémentaires ;
+# deadline : durée maximale d'un appel, toutes tentatives comprises (secondes)
+Provider = namedtuple('Provider', 'timeout retries deadline failures cooldown pool')
+
+PROVIDERS = {
+    'konnect':  Provider(timeout=(3.05, 10), retries=2, deadline=15, failures=5, cooldown=30, pool=10),
+    'flouci':   Provider(timeout=(3.05, 10), retries=2, deadline=15, failures=5, cooldown=30, pool=10),
+    'fonnte':   Provider(timeout=(3.05, 10), retries=1, deadline=12, failures=5, cooldown=60, pool=4),
+    'resend':   Provider(timeout=(3.05, 10), retries=1, deadline=12, failures=5, cooldown=60, pool=4),
+    'supabase': Provider(timeout=(3.05, 20), retries=1, deadline=25, failures=5, cooldown=30, pool=10),
+}
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+RETRY_STATUSES     = {429, 502, 503, 504}
+BACKOFF_BASE       = 0.2       # secondes ; doublé à chaque tentative, ±50 %
+MIN_ATTEMPT        = 1.0       # pas de nouvelle tentative s'il reste moins de N secondes
+
+
+class ProviderUnavailable(requests.ConnectionError):
+    """Disjoncteur ouvert : le fournisseur a échoué trop souvent, appel non tenté."""
+
+
+class _Breaker:
+    """Disjoncteur + statistiques d'un fournisseur (partagé par les threads du process)."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.lock = threading.Lock()
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False          # demi-ouvert : une seule requête d'essai à la fois
+        self.calls = self.errors = self.retries = self.rejected = 0
+        self.total_ms = self.max_ms = 0.0
+        self.last_error = None
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.spec.cooldown or self.trial:
+                self.rejected += 1
+                return False
+            self.trial = True
+            return True
+
+    def record(self, ms, error=None):
+        with self.lock:
+            self.calls += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+            self.trial = False
+            if error is None:
+                self.consecutive = 0
+                self.opened_at = None
+                return
+            self.errors += 1
+            self.consecutive += 1
+            self.last_error = error[:200]
+            if self.opened_at is not None or self.consecutive >= self.spec.failures:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'fermé'
+        return 'ouvert' if time.monotonic() - self.opened_at < self.spec.cooldown else 'demi-ouvert'
+
+
+_lock = threading.Lock()
+_sessions = {}
+_breakers = {name: _Breaker(spec) for name, spec in PROVIDERS.items()}
+_pid = os.getpid()
+
+
+def session(provider):
+    """Session du fournisseur, recréée après un fork (workers gunicorn)."""
+    global _pid
+    spec = PROVIDERS[provider]
+    with _lock:
+        if _pid != os.getpid():
+            _sessions.clear()
+            _pid = os.getpid()
+        s = _sessions.get(provider)
+        if s is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=spec.pool)
+            s.mount('https://', adapter)
+            s.mount('http://', adapter)
+            _sessions[provider] = s
+    return s
+
+
+def _failure(resp=None, exc=None):
+    """Message d'échec à compter dans le disjoncteur, ou None (succès / erreur client)."""
+    if exc is not None:
+        return f"{type(exc).__name__}: {exc}"
+    if resp.status_code >= 500 or resp.status_code == 429:
+        return f"HTTP {resp.status_code}"
+    return None
+
+
+def _clamp(timeout, remaining):
+    """Délai(s) requests réduit(s) au budget restant."""
+    if isinstance(timeout, tuple):
+        return tuple(min(t, remaining) for t in timeout)
+    return min(timeout, remaining)
+
+
+def request(provider, method, url, idempotent=None, deadline=None, **kwargs):
+    """requests.request() via la session du fournisseur, en `deadline` secondes au plus
+    (défaut : celui du fournisseur). Lève ProviderUnavailable si le disjoncteur est
+    ouvert ; sinon mêmes exceptions / réponses que requests."""
+    spec, breaker = PROVIDERS[provider], _breakers[provider]
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    timeout = kwargs.pop('timeout', spec.timeout)
+    end = time.monotonic() + (spec.deadline if deadline is None else deadline)
+    attempts = 1 + (spec.retries if idempotent else 0)
+    for attempt in range(attempts):
+        if not breaker.allow():
+            raise ProviderUnavailable(f"{provider} indisponible (disjoncteur ouvert)")
+        t0 = time.perf_counter()
+        resp = exc = None
+        try:
+            resp = session(provider).request(method, url, timeout=_clamp(timeout, end - time.monotonic()),
+                                             **kwargs)
+        except requests.RequestException as e:
+            exc = e
+        error = _failure(resp, exc)
+        breaker.record((time.perf_counter() - t0) * 1000, error)
+        retryable = exc is not None or resp.status_code in RETRY_STATUSES
+        if not retryable or attempt == attempts - 1:
+            break
+        pause = BACKOFF_BASE * 2 ** attempt * random.uniform(0.5, 1.5)
+        if time.monotonic() + pause + MIN_ATTEMPT > end:
+            break               # budget épuisé : pas de tentative vouée au timeout
+        with breaker.lock:
+            breaker.retries += 1
+        time.sleep(pause)
+    if exc is not None:
+        print(f"[HTTP] {provider} {method} échec : {error}")
+        raise exc
+    return resp
+
+
+def get(provider, url, **kwargs):
+    return request(provider, 'GET', url, **kwargs)
+
+
+def post(provider, url, **kwargs):
+    return request(provider, 'POST', url, **kwargs)
+
+
+def delete(provider, url, **kwargs):
+    return request(provider, 'DELETE', url, **kwargs)
+
+
+def provider_stats():
+    """Statistiques du process courant, une ligne par fournisseur."""
+    rows = []
+    for name, b in _breakers.items():
+        with b.lock:
+            rows.append({
+                'provider': name, 'state': b.state, 'calls': b.calls, 'errors': b.errors,
+                'retries': b.retries, 'rejected': b.rejected,
+                'avg_ms': b.total_ms / b.calls if b.calls else 0.0, 'max_ms': b.max_ms,
+                'last_error': b.last_error,
+            })
+    return rows
+
+
+def reset_stats():
+    for name, spec in PROVIDERS.items():
+        _breakers[name] = _Breaker(spec)
@@ -0,0 +1,116 @@
+"""
+Ingestion par lots des appareils (lecteurs de badges, capteurs d'ascenseur).
+
+Un appareil resté hors ligne, ou qui remonte une mesure toutes les quelques
+secondes, envoie ses événements en un seul POST :
+
+    {"events": [{"seq": 41, "ts": "2026-03-02T07:58:12Z", ...}, ...]}
+
+  • seq : numéro de séquence propre à l'appareil (entier croissant) — un lot
+    rejoué après une coupure réseau ne crée pas de doublons ;
+  • ts  : horodatage de l'événement côté appareil (ISO 8601 ou secondes epoch,
+    UTC), pas l'heure de réception.
+
+Les événements sont validés en bloc (les invalides sont renvoyés dans
+`rejected`, les autres acceptés) puis insérés en un INSERT multi-lignes
+(insert_ignore : ON CONFLICT DO NOTHING sur la clé d'idempotence ; upsert_add :
+compteurs incrémentés, pour les agrégats mis à jour à l'ingestion).
+"""
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from core import db
+
+MAX_BATCH = 500                      # événements par requête
+MAX_CLOCK_SKEW = timedelta(minutes=5)  # horloge appareil en avance tolérée
+MAX_AGE = timedelta(days=30)         # au-delà : événement trop ancien pour être rejoué
+
+
+class BatchError(ValueError):
+    """Corps de requête inutilisable (pas de liste d'événements, lot trop gros)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_ts(value):
+    """datetime UTC naïf depuis ISO 8601 ('Z' accepté) ou secondes epoch."""
+    if isinstance(value, bool) or value is None:
+        raise ValueError('ts manquant')
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+    dt = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def batch_events(body):
+    """Liste brute des événements du corps JSON (lève BatchError)."""
+    events = (body or {}).get('events')
+    if not isinstance(events, list):
+        raise BatchError('events doit être une liste')
+    if len(events) > MAX_BATCH:
+        raise BatchError(f'{MAX_BATCH} événements au plus par lot', status=413)
+    return events
+
+
+def validate(events, check):
+    """Validation en bloc : `check(event)` renvoie les champs normalisés ou lève
+    ValueError. Retourne (valides triés par (ts, seq), rejetés [{'seq', 'error'}]).
+    seq et ts sont contrôlés ici ; un seq répété dans le lot n'est gardé qu'une fois."""
+    now = datetime.utcnow()
+    valid, rejected, seen = [], [], set()
+    for raw in events:
+        seq = raw.get('seq') if isinstance(raw, dict) else None
+        try:
+            if not isinstance(raw, dict):
+                raise ValueError('événement invalide')
+            if isinstance(seq, bool) or not isinstance(seq, int) or seq < 0:
+                raise ValueError('seq doit être un entier positif')
+            ts = parse_ts(raw.get('ts'))
+            if ts > now + MAX_CLOCK_SKEW or ts < now - MAX_AGE:
+                raise ValueError('ts hors de la fenêtre acceptée')
+            if seq in seen:
+                continue
+            fields = check(raw)
+        except (ValueError, TypeError, OverflowError) as e:
+            rejected.append({'seq': seq, 'error': str(e)})
+            continue
+        seen.add(seq)
+        valid.append(dict(fields, seq=seq, ts=ts))
+    valid.sort(key=lambda e: (e['ts'], e['seq']))
+    return valid, rejected
+
+
+def _insert(table):
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table)
+    if dialect == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError(f'insert ON CONFLICT : dialecte {dialect} non pris en charge')
+
+
+def insert_ignore(table, rows, conflict_columns):
+    """INSERT multi-lignes ; les lignes déjà présentes (même clé `conflict_columns`,
+    index unique) sont ignorées. Retourne le nombre de lignes insérées."""
+    if not rows:
+        return 0
+    stmt = _insert(table).on_conflict_do_nothing(index_elements=conflict_columns)
+    result = db.session.execute(stmt.values(rows))
+    return max(result.rowcount, 0)
+
+
+def upsert_add(table, rows, conflict_columns, add_columns):
+    """INSERT multi-lignes de compteurs ; une ligne déjà présente (même clé
+    `conflict_columns`) voit ses colonnes `add_columns` incrémentées."""
+    if not rows:
+        return
+    stmt = _insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=conflict_columns,
+        set_={c: table.c[c] + stmt.excluded[c] for c in add_columns})
+    db.session.execute(stmt)
@@ -0,0 +1,319 @@
+"""
+File d'attente persistante des notifications sortantes (table notification_job).
+
+Les routes n'appellent plus les API externes (fonnte, Web Push, Resend) dans le
+thread de la requête : elles enregistrent un job via enqueue() et rendent la main.
+Le worker réclame les jobs dus, les exécute avec une limite de concurrence par
+fournisseur et reprogramme les échecs avec un backoff exponentiel.
+
+Lancement :
+  python worker.py              — worker dédié (Procfile : worker)
+  flask jobs-worker [--once]    — idem via la CLI Flask
+Sans worker dédié (JOBS_WORKER != 'external'), chaque process web démarre un
+thread qui vide la file — la réclamation d'un job est atomique, plusieurs
+workers peuvent tourner en parallèle sans double envoi.
+
+JOBS_STUB_PROVIDERS=1 remplace les fournisseurs externes par un stub local (tests,
+développement hors ligne) : les messages sont conservés dans STUB_OUTBOX.
+
+Le fournisseur « media » (réencodage des images envoyées, cf. utils_media) passe
+par la même file : le travail CPU quitte le chemin de la requête. De même pour
+« report » (PDF et classeurs Excel, cf. utils_reports) et « archive » (archivage
+mensuel des journaux d'accès, cf. utils_access_archive).
+"""
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+
+from core import app, db
+from models import NotificationJob
+
+# Nombre maximal d'envois simultanés par fournisseur (par process worker)
+PROVIDER_CONCURRENCY = {'whatsapp': 2, 'push': 8, 'email': 4, 'media': 2, 'report': 1, 'archive': 1,
+                        'stub': 4}
+BACKOFF_BASE  = 30            # secondes avant la 1re nouvelle tentative
+BACKOFF_MAX   = 3600          # plafond du backoff
+STALE_AFTER   = timedelta(minutes=10)   # job 'running' abandonné (worker tué) → repris
+POLL_INTERVAL = 2.0
+
+app.config.setdefault('JOBS_STUB_PROVIDERS', os.environ.get('JOBS_STUB_PROVIDERS') == '1')
+app.config.setdefault('JOBS_EMBEDDED_WORKER', os.environ.get('JOBS_WORKER', 'embedded') != 'external')
+
+STUB_OUTBOX = []   # [{'provider': ..., **payload}] — rempli par le fournisseur stub
+
+
+class JobError(Exception):
+    """Échec d'envoi temporaire — le job sera retenté."""
+
+
+class PermanentJobError(JobError):
+    """Échec définitif — inutile de retenter (destinataire introuvable...)."""
+
+
+# ─── Enregistrement ──────────────────────────────────────────────────────────
+
+def enqueue(provider, payload, organization_id=None, max_attempts=5, commit=True):
+    """Ajoute un job à la file. `commit=False` pour grouper plusieurs jobs en une transaction."""
+    if provider not in PROVIDER_CONCURRENCY:
+        raise ValueError(f"Fournisseur inconnu : {provider}")
+    job = NotificationJob(
+        organization_id=organization_id,
+        provider=provider,
+        payload=json.dumps(payload, ensure_ascii=False),
+        max_attempts=max_attempts,
+        run_after=datetime.utcnow(),
+    )
+    db.session.add(job)
+    if commit:
+        db.session.commit()
+        _ensure_embedded_worker()
+    return job
+
+
+def commit_enqueued():
+    """Valide les jobs ajoutés avec commit=False et réveille le worker embarqué."""
+    db.session.commit()
+    _ensure_embedded_worker()
+
+
+# ─── Fournisseurs ────────────────────────────────────────────────────────────
+
+def _run_whatsapp(p):
+    from models import Organization
+    from utils_whatsapp import send_whatsapp
+    org = Organization.query.get(p.get('org_id'))
+    if not org:
+        raise PermanentJobError("Organisation introuvable")
+    if not send_whatsapp(org, p['phone'], p['message']):
+        raise JobError("fonnte : envoi refusé")
+
+
+def _run_push(p):
+    from utils_push import deliver_to_users
+    deliver_to_users(p['user_ids'], p['title'], p['body'],
+                     p.get('url', '/dashboard'), p.get('tag', 'syndicpro'))
+
+
+def _run_email(p):
+    from utils_email import send_email
+    ok, err = send_email(p['to'], p['subject'], p['html'])
+    if not ok:
+        raise JobError(err)
+
+
+def _run_media(p):
+    from utils_media import process
+    process(p['field'], p['ref'])
+
+
+def _run_report(p):
+    from utils_reports import render
+    render(p['artifact_id'])
+
+
+def _run_archive(p):
+    from utils_access_archive import archive_old_months
+    archive_old_months()
+
+
+def _run_stub(p):
+    STUB_OUTBOX.append(p)
+    if p.get('fail'):
+        raise JobError("stub : échec simulé")
+
+
+_PROVIDERS = {
+    'whatsapp': _run_whatsapp,
+    'push':     _run_push,
+    'email':    _run_email,
+    'media':    _run_media,
+    'report':   _run_report,
+    'archive':  _run_archive,
+    'stub':     _run_stub,
+}
+
+LOCAL_PROVIDERS = {'media', 'report', 'archive'}   # traitement local, jamais remplacé par le stub
+
+
+def _handler(provider):
+    if app.config.get('JOBS_STUB_PROVIDERS') and provider not in LOCAL_PROVIDERS:
+        return lambda p: _run_stub(dict(p, provider=provider))
+    return _PROVIDERS[provider]
+
+
+# ─── Exécution ───────────────────────────────────────────────────────────────
+
+def _backoff(attempts):
+    delay = min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def _claim(provider, limit):
+    """Réclame jusqu'à `limit` jobs dus. L'UPDATE conditionnel sur status='pending'
+    garantit qu'un job n'est pris que par un seul worker."""
+    if limit <= 0:
+        return []
+    now = datetime.utcnow()
+    candidates = [r[0] for r in (db.session.query(NotificationJob.id)
+                                 .filter(NotificationJob.status == 'pending',
+                                         NotificationJob.provider == provider,
+                                         NotificationJob.run_after <= now)
+                                 .order_by(NotificationJob.id).limit(limit * 2).all())]
+    claimed = []
+    for job_id in candidates:
+        n = (NotificationJob.query
+             .filter_by(id=job_id, status='pending')
+             .update({'status': 'running', 'locked_at': now,
+                      'attempts': NotificationJob.attempts + 1},
+                     synchronize_session=False))
+        if n:
+            claimed.append(job_id)
+            if len(claimed) >= limit:
+                break
+    db.session.commit()
+    return claimed
+
+
+def _execute(job_id):
+    """Exécute un job réclamé et enregistre le résultat (done / retry / failed)."""
+    job = NotificationJob.query.get(job_id)
+    if job is None:
+        return
+    try:
+        _handler(job.provider)(json.loads(job.payload))
+    except Exception as e:
+        job.last_error = str(e)[:1000]
+        retry = not isinstance(e, PermanentJobError) and job.attempts < job.max_attempts
+        if retry:
+            job.status = 'pending'
+            job.run_after = datetime.utcnow() + _backoff(job.attempts)
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        print(f"[Jobs] {job.provider} #{job.id} échec ({job.attempts}/{job.max_attempts}) : {e}")
+    else:
+        job.status = 'done'
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+    job.locked_at = None
+    db.session.commit()
+
+
+def _execute_in_context(job_id):
+    with app.app_context():
+        try:
+            _execute(job_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[Jobs] #{job_id} erreur worker : {e}")
+        finally:
+            db.session.remove()
+
+
+def requeue_stale():
+    """Remet en file les jobs 'running' dont le worker a disparu."""
+    cutoff = datetime.utcnow() - STALE_AFTER
+    n = (NotificationJob.query
+         .filter(NotificationJob.status == 'running', NotificationJob.locked_at < cutoff)
+         .update({'status': 'pending', 'locked_at': None}, synchronize_session=False))
+    db.session.commit()
+    return n
+
+
+def run_pending():
+    """Vide la file de manière synchrone dans le contexte courant (tests, --once).
+    Retourne le nombre de jobs exécutés."""
+    done = 0
+    while True:
+        batch = []
+        for provider, limit in PROVIDER_CONCURRENCY.items():
+            batch += _claim(provider, limit)
+        if not batch:
+            break
+        for job_id in batch:
+            _execute(job_id)
+            done += 1
+    return done
+
+
+def run_worker(stop_event=None, poll_interval=POLL_INTERVAL):
+    """Boucle du worker : un pool de threads par fournisseur, borné par PROVIDER_CONCURRENCY."""
+    pools = {p: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f'jobs-{p}')
+             for p, n in PROVIDER_CONCURRENCY.items()}
+    in_flight = {p: set() for p in PROVIDER_CONCURRENCY}
+    last_stale_check = 0.0
+    print(f"[Jobs] Worker démarré (pid {os.getpid()})")
+    try:
+        while not (stop_event and stop_event.is_set()):
+            claimed_any = False
+            with app.app_context():
+                try:
+                    if time.monotonic() - last_stale_check > 60:
+                        requeue_stale()
+                        last_stale_check = time.monotonic()
+                    for provider, limit in PROVIDER_CONCURRENCY.items():
+                        in_flight[provider] = {f for f in in_flight[provider] if not f.done()}
+                        for job_id in _claim(provider, limit - len(in_flight[provider])):
+                            in_flight[provider].add(pools[provider].submit(_execute_in_context, job_id))
+                            claimed_any = True
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[Jobs] Erreur boucle worker : {e}")
+                finally:
+                    db.session.remove()
+            if not claimed_any:
+                if stop_event:
+                    stop_event.wait(poll_interval)
+                else:
+                    time.sleep(poll_interval)
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+
+# ─── Worker embarqué (process web sans worker dédié) ────────────────────────
+
+_embedded_lock = threading.Lock()
+_embedded_pid = None
+
+
+def _ensure_embedded_worker():
+    """Démarre (une fois par process) le thread worker embarqué, si activé."""
+    global _embedded_pid
+    if not app.config.get('JOBS_EMBEDDED_WORKER') or _embedded_pid == os.getpid():
+        return
+    with _embedded_lock:
+        if _embedded_pid == os.getpid():
+            return
+        threading.Thread(target=run_worker, name='jobs-embedded', daemon=True).start()
+        _embedded_pid = os.getpid()
+
+
+# ─── Statistiques (page superadmin) ─────────────────────────────────────────
+
+def queue_stats():
+    """{provider: {status: count}} — 1 requête GROUP BY."""
+    from sqlalchemy import func
+    stats = {p: {'pending': 0, 'running': 0, 'done': 0, 'failed': 0} for p in PROVIDER_CONCURRENCY}
+    for provider, status, n in (db.session.query(NotificationJob.provider, NotificationJob.status,
+                                                 func.count(NotificationJob.id))
+                                .group_by(NotificationJob.provider, NotificationJob.status).all()):
+        stats.setdefault(provider, {})[status] = n
+    return stats
+
+
+@app.cli.command('jobs-worker')
+@click.option('--once', is_flag=True, help="Vider la file puis quitter.")
+def jobs_worker_command(once):
+    """Lance le worker de jobs (WhatsApp, Push, email, images, rapports)."""
+    if once:
+        requeue_stale()
+        click.echo(f"{run_pending()} job(s) exécuté(s).")
+        return
+    run_worker()
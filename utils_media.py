@@ -0,0 +1,139 @@
+"""
+Traitement des images envoyées (photos de tickets, scans de chèques, décharges
+de virement, factures photographiées).
+
+La requête enregistre le fichier tel quel puis appelle schedule() : un job
+« media » (cf. utils_jobs, pool de threads du worker) le réencode hors du
+chemin de la requête :
+  - rotation EXIF appliquée puis métadonnées supprimées (GPS, appareil…)
+  - plus grand côté ramené à MAX_SIDE, WebP (JPEG si Pillow sans WebP)
+  - miniature THUMB_SIDE pour les listes (colonne *_thumb_url)
+Toutes les lignes qui pointent sur le fichier d'origine sont mises à jour (un
+même scan de chèque est partagé par les mois d'un paiement groupé). Les PDF ne
+sont pas modifiés.
+"""
+import io
+from collections import namedtuple
+
+from PIL import Image, ImageOps, features
+from sqlalchemy import update
+
+from core import db
+from models import Ticket, Payment, PaymentRequest, Expense, AppelFonds, AppelFondsDepense
+
+MAX_SIDE      = 1600      # px — largement suffisant pour lire un chèque ou une facture
+QUALITY       = 80
+THUMB_SIDE    = 320
+THUMB_QUALITY = 70
+IMAGE_MIMES   = {'image/jpeg', 'image/png', 'image/webp'}   # GIF : animations conservées
+
+_WEBP = features.check('webp')
+OUTPUT_MIME = 'image/webp' if _WEBP else 'image/jpeg'
+
+# url / mime / thumb : noms d'attributs du modèle (mime=None : pas de colonne)
+MediaField = namedtuple('MediaField', 'model url mime thumb folder')
+
+MEDIA_FIELDS = {
+    'ticket_photo':    MediaField(Ticket, 'photo_url', 'photo_mime', 'photo_thumb_url', 'tickets'),
+    'payment_cheque':  MediaField(Payment, 'cheque_url', None, 'cheque_thumb_url', 'cheques'),
+    'virement_photo':  MediaField(PaymentRequest, 'photo_url', 'photo_mime', 'photo_thumb_url', 'virements'),
+    'expense_facture': MediaField(Expense, 'facture_url', 'facture_mime', 'facture_thumb_url', 'factures'),
+    'appel_devis':     MediaField(AppelFonds, 'devis_url', 'devis_mime', 'devis_thumb_url', 'appels_fonds'),
+    'appel_facture':   MediaField(AppelFondsDepense, 'facture_url', 'facture_mime', 'facture_thumb_url',
+                                  'appels_fonds'),
+}
+
+
+def _encode(img, side, quality):
+    img = img.copy()
+    img.thumbnail((side, side), Image.LANCZOS)
+    buf = io.BytesIO()
+    if _WEBP:
+        img.save(buf, 'WEBP', quality=quality, method=4)
+    else:
+        if img.mode != 'RGB':
+            bg = Image.new('RGB', img.size, 'white')
+            bg.paste(img, mask=img.getchannel('A') if 'A' in img.getbands() else None)
+            img = bg
+        img.save(buf, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def compress_image(raw):
+    """(image, mime, miniature) en octets, ou None si `raw` n'est pas une image lisible.
+    mime None : image d'origine conservée telle quelle, si le réencodage ne la réduit pas
+    et qu'elle ne contient ni métadonnées EXIF ni dimensions hors plafond."""
+    try:
+        img = Image.open(io.BytesIO(raw))
+        has_exif = bool(img.getexif())
+        oversized = max(img.size) > MAX_SIDE
+        img.draft('RGB', (MAX_SIDE, MAX_SIDE))      # JPEG : décodage directement réduit
+        img.load()
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'transparency' in img.info or 'A' in img.getbands() else 'RGB')
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    main = _encode(img, MAX_SIDE, QUALITY)
+    thumb = _encode(img, THUMB_SIDE, THUMB_QUALITY)
+    if len(main) >= len(raw) and not has_exif and not oversized:
+        return raw, None, thumb
+    return main, OUTPUT_MIME, thumb
+
+
+def schedule(field, ref, mime, organization_id=None):
+    """À appeler après le commit de la ligne : programme le traitement du fichier `ref`."""
+    if not ref or mime not in IMAGE_MIMES:
+        return
+    from utils_jobs import enqueue
+    try:
+        enqueue('media', {'field': field, 'ref': ref}, organization_id=organization_id, max_attempts=3)
+    except Exception as e:
+        db.session.rollback()
+        print(f"[Media] Programmation impossible ({field}) : {e}")
+
+
+def _read(ref):
+    from storage_helper import is_blob_ref, blob_name, blob_file
+    if is_blob_ref(ref):
+        path, _ = blob_file(blob_name(ref))
+        if path is None:
+            return None
+        with open(path, 'rb') as fh:
+            return fh.read()
+    import utils_http as http
+    resp = http.get('supabase', ref)
+    resp.raise_for_status()
+    return resp.content
+
+
+def process(field, ref):
+    """Traite un fichier déjà enregistré. Retourne le nombre de lignes mises à jour."""
+    from storage_helper import upload_file, delete_file
+    from utils_jobs import JobError, PermanentJobError
+    spec = MEDIA_FIELDS[field]
+    url_col = getattr(spec.model, spec.url)
+    if not db.session.query(url_col).filter(url_col == ref).first():
+        return 0      # remplacé / supprimé entre-temps
+    raw = _read(ref)
+    if raw is None:
+        raise PermanentJobError(f"{ref} introuvable")
+    out = compress_image(raw)
+    if out is None:
+        return 0
+    main, mime, thumb = out
+    new_ref = ref if mime is None else upload_file(main, mime, folder=spec.folder)
+    thumb_ref = upload_file(thumb, OUTPUT_MIME, folder=spec.folder)
+    if not new_ref or not thumb_ref:
+        raise JobError("stockage indisponible")
+    values = {spec.url: new_ref, spec.thumb: thumb_ref}
+    if spec.mime and mime:
+        values[spec.mime] = mime
+    # WHERE url = ref : une ligne dont le fichier a changé entre-temps n'est pas écrasée
+    n = db.session.execute(update(spec.model).where(url_col == ref).values(values)).rowcount
+    db.session.commit()
+    if new_ref != ref:
+        delete_file(ref)      # Supabase ; blob local → blobs-gc
+    print(f"[Media] {field} : {len(raw) // 1024} Ko → {len(main) // 1024} Ko "
+          f"(+ miniature {len(thumb) // 1024} Ko), {n} ligne(s)")
+    return n
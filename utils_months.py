@@ -0,0 +1,174 @@
+"""
+Matrice appartements × mois (NumPy) partagée par le tableau comptable, la
+trésorerie et l'export Excel.
+
+Les paiements d'une organisation sont chargés en une requête GROUP BY dans deux
+tableaux alignés : `amounts` (float, montant par appartement et par mois) et
+`paid` (bool). Les colonnes sont des index de mois entiers (année*12 + mois,
+même convention que utils.ym_str) : plus de clés 'YYYY-MM' ni de recherches dans
+des sets par cellule. Grilles, mois impayés, taux de recouvrement et totaux sont
+des tranches de tableaux.
+
+    m = paid_matrix(org.id, apartments, start_ym, end_ym)   # mois couverts (month_paid)
+    m.unpaid_counts(created, today_ym)                      # array, 1 valeur par apt
+    m.row_dict(apt.id, m.paid)                              # {'YYYY-MM': bool} pour un template
+
+    c = cash_matrix(org.id, apartments, start_ym, end_ym)   # encaissements (payment_date)
+    c.column_totals()                                       # total encaissé par mois
+"""
+from datetime import date
+
+import numpy as np
+from sqlalchemy import func
+
+from core import db
+from models import Payment
+
+
+def ym_of(d):
+    """Index de mois (année*12 + mois) d'une date."""
+    return d.year * 12 + d.month
+
+
+def month_index(month_str):
+    """'YYYY-MM' → année*12 + mois ; None si la chaîne n'est pas un mois valide."""
+    if not month_str or len(month_str) != 7 or month_str[4] != '-':
+        return None
+    y, m = month_str[:4], month_str[5:]
+    if not (y.isdigit() and m.isdigit()) or not 1 <= int(m) <= 12:
+        return None
+    return int(y) * 12 + int(m)
+
+
+class MonthMatrix:
+    """Tableaux appartements × mois [start_ym, end_ym], lignes dans l'ordre de `apt_ids`."""
+
+    def __init__(self, apt_ids, start_ym, end_ym):
+        self.apt_ids = list(apt_ids)
+        self.rows = {apt_id: i for i, apt_id in enumerate(self.apt_ids)}
+        self.start_ym, self.end_ym = start_ym, end_ym
+        shape = (len(self.apt_ids), max(0, end_ym - start_ym + 1))
+        self.amounts = np.zeros(shape)
+        self.paid = np.zeros(shape, dtype=bool)
+
+    @classmethod
+    def from_rows(cls, apt_ids, start_ym, end_ym, rows):
+        """rows : lignes (apt_id, année, mois, montant) telles que renvoyées par SQL ;
+        conversion en colonnes NumPy, sans boucle Python par ligne. Lignes hors
+        fenêtre, d'un autre appartement ou de mois invalide : ignorées."""
+        m = cls(apt_ids, start_ym, end_ym)
+        data = np.array(list(rows), dtype=float).reshape(-1, 4)
+        if not len(data) or not m.apt_ids:
+            return m
+        apt, month, amount = data[:, 0].astype(np.int64), data[:, 2].astype(np.int64), data[:, 3]
+        ym = data[:, 1].astype(np.int64) * 12 + month
+        ids = np.asarray(m.apt_ids)
+        order = np.argsort(ids)
+        pos = np.clip(np.searchsorted(ids[order], apt), 0, len(ids) - 1)
+        keep = ((ids[order][pos] == apt) & (month >= 1) & (month <= 12)
+                & (ym >= start_ym) & (ym <= end_ym))
+        r, c = order[pos[keep]], ym[keep] - start_ym
+        np.add.at(m.amounts, (r, c), amount[keep])
+        m.paid[r, c] = True
+        return m
+
+    # ── Colonnes ──────────────────────────────────────────────────────────────
+
+    @property
+    def months(self):
+        """[(année, mois)] des colonnes."""
+        return [divmod(ym - 1, 12) for ym in range(self.start_ym, self.end_ym + 1)]
+
+    @property
+    def keys(self):
+        """['YYYY-MM'] des colonnes (clés des templates)."""
+        return [f"{y}-{mo + 1:02d}" for y, mo in self.months]
+
+    def cols(self, start_ym, end_ym):
+        """Tranche de colonnes pour [start_ym, end_ym] (bornée à la fenêtre)."""
+        return slice(max(0, start_ym - self.start_ym), max(0, end_ym - self.start_ym + 1))
+
+    # ── Agrégats ──────────────────────────────────────────────────────────────
+
+    def column_totals(self, values=None):
+        """Somme par mois (montants par défaut)."""
+        return (self.amounts if values is None else values).sum(axis=0)
+
+    def paid_counts(self):
+        """Nombre d'appartements à jour par mois."""
+        return self.paid.sum(axis=0)
+
+    def unpaid_counts(self, first_ym, upto_ym):
+        """Mois impayés par appartement entre first_ym (array, 1 valeur par ligne —
+        mois de création) et upto_ym inclus."""
+        col_ym = np.arange(self.start_ym, self.end_ym + 1)
+        due = (col_ym >= np.asarray(first_ym)[:, None]) & (col_ym <= upto_ym)
+        return (due & ~self.paid).sum(axis=1)
+
+    def recovery_rate(self, first_ym, upto_ym):
+        """% des mois dus (création → upto_ym) effectivement couverts."""
+        col_ym = np.arange(self.start_ym, self.end_ym + 1)
+        due = (col_ym >= np.asarray(first_ym)[:, None]) & (col_ym <= upto_ym)
+        total = due.sum()
+        return float((due & self.paid).sum() / total * 100) if total else 0.0
+
+    # ── Rendu ─────────────────────────────────────────────────────────────────
+
+    def row_dict(self, apt_id, values):
+        """{'YYYY-MM': valeur} d'une ligne (types Python, pour Jinja)."""
+        return dict(zip(self.keys, values[self.rows[apt_id]].tolist()))
+
+    def totals_dict(self, values):
+        return dict(zip(self.keys, np.asarray(values).tolist()))
+
+
+def created_ym(apartments, default=None):
+    """Index du mois de création de chaque appartement (mois courant si inconnu)."""
+    default = default or ym_of(date.today())
+    return np.array([ym_of(a.created_at) if a.created_at else default for a in apartments],
+                    dtype=np.int64)
+
+
+def paid_matrix(org_id, apartments, start_ym, end_ym):
+    """Mois couverts (Payment.month_paid) : paid + montant cumulé — 1 requête.
+    Année et mois extraits en SQL : pas d'analyse de chaîne 'YYYY-MM' en Python."""
+    from sqlalchemy import Integer, cast
+    y = cast(func.substr(Payment.month_paid, 1, 4), Integer)
+    m = cast(func.substr(Payment.month_paid, 6, 2), Integer)
+    lo, hi = divmod(start_ym - 1, 12), divmod(end_ym - 1, 12)
+    rows = (db.session.query(Payment.apartment_id, y, m, func.sum(Payment.amount))
+            .filter(Payment.organization_id == org_id,
+                    func.length(Payment.month_paid) == 7,
+                    Payment.month_paid >= f"{lo[0]}-{lo[1] + 1:02d}",
+                    Payment.month_paid <= f"{hi[0]}-{hi[1] + 1:02d}")
+            .group_by(Payment.apartment_id, Payment.month_paid).all())
+    return MonthMatrix.from_rows([a.id for a in apartments], start_ym, end_ym,
+                                 ((a, yy, mm, total or 0) for a, yy, mm, total in rows))
+
+
+def cash_matrix(org_id, apartments, start_ym, end_ym):
+    """Encaissements par mois de paiement réel (Payment.payment_date) — 1 requête."""
+    y, m = func.extract('year', Payment.payment_date), func.extract('month', Payment.payment_date)
+    lo, hi = divmod(start_ym - 1, 12), divmod(end_ym, 12)
+    rows = (db.session.query(Payment.apartment_id, y, m, func.sum(Payment.amount))
+            .filter(Payment.organization_id == org_id,
+                    Payment.payment_date >= date(lo[0], lo[1] + 1, 1),
+                    Payment.payment_date < date(hi[0], hi[1] + 1, 1))
+            .group_by(Payment.apartment_id, y, m).all())
+    return MonthMatrix.from_rows([a.id for a in apartments], start_ym, end_ym,
+                                 ((a, int(yy), int(mm), total or 0) for a, yy, mm, total in rows))
+
+
+def month_totals(model, date_col, org_id, start_ym, end_ym):
+    """Totaux mensuels d'un modèle (dépenses, encaissements divers) : array aligné
+    sur les colonnes d'une matrice [start_ym, end_ym]."""
+    y, m = func.extract('year', date_col), func.extract('month', date_col)
+    lo, hi = divmod(start_ym - 1, 12), divmod(end_ym, 12)
+    out = np.zeros(max(0, end_ym - start_ym + 1))
+    for yy, mm, total in (db.session.query(y, m, func.sum(model.amount))
+                          .filter(model.organization_id == org_id,
+                                  date_col >= date(lo[0], lo[1] + 1, 1),
+                                  date_col < date(hi[0], hi[1] + 1, 1))
+                          .group_by(y, m)):
+        out[int(yy) * 12 + int(mm) - start_ym] += float(total or 0)
+    return out
@@ -0,0 +1,175 @@
+"""
+Fil de notifications (cloche admin, annonces de la sidebar résident).
+
+Admin : 1 requête UNION ALL pour les éléments récents (paiements, lectures
+d'annonces, tickets ouverts) + 1 requête de compteurs (impayés, virements en
+attente, messages non lus) — au lieu de 7 requêtes séparées.
+Les résultats sont mis en cache par utils.inject_notifications et par
+l'endpoint JSON /api/notif/feed (chargement différé de la cloche).
+"""
+from datetime import datetime, date, timedelta
+
+from flask import url_for
+from sqlalchemy import select, union_all, func, cast, null, literal_column, type_coerce, and_
+from sqlalchemy import String, Float, DateTime
+
+from core import db
+from models import (Apartment, Block, Payment, Ticket, Announcement, AnnouncementRead,
+                    UnpaidAlert, PaymentRequest, DirectMessage)
+
+FEED_WINDOW = timedelta(hours=24)
+FEED_PER_KIND = 5
+FEED_MAX = 8
+
+_KINDS = {
+    'payment': {'icon': 'cash-coin',      'color': '#00C896', 'endpoint': 'payments'},
+    'read':    {'icon': 'eye',            'color': '#60A5FA', 'endpoint': 'announcements'},
+    'ticket':  {'icon': 'chat-left-dots', 'color': '#F59E0B', 'endpoint': 'tickets'},
+}
+
+
+def _seen_at(user):
+    # Seuil "non vu" : dernière ouverture de la cloche (ou 24h si jamais ouverte)
+    return user.notif_seen_at or (datetime.utcnow() - FEED_WINDOW)
+
+
+def _ts(col):
+    """Colonne date/horodatage homogène pour l'UNION (date des paiements vs datetime)."""
+    if 'postgresql' in str(db.engine.url):
+        return cast(col, DateTime)
+    return type_coerce(col, String)     # SQLite : texte ISO, converti en Python
+
+
+def _as_datetime(v):
+    if isinstance(v, str):
+        return datetime.fromisoformat(v)
+    if isinstance(v, date) and not isinstance(v, datetime):
+        return datetime.combine(v, datetime.min.time())
+    return v
+
+
+def _recent_items(org_id, since):
+    """Éléments récents des 3 sources, 5 max chacune — 1 seule requête UNION ALL."""
+    def branch(kind, ts_col, label_col, amount_col, base, *where):
+        return (select(literal_column(f"'{kind}'").label('kind'),
+                       _ts(ts_col).label('ts'),
+                       Block.name.label('block'),
+                       Apartment.number.label('apt'),
+                       label_col.label('label'),
+                       amount_col.label('amount'))
+                .select_from(base)
+                .outerjoin(Block, Block.id == Apartment.block_id)
+                .where(*where)
+                .order_by(ts_col.desc())
+                .limit(FEED_PER_KIND)
+                .subquery())
+
+    payments = branch('payment', Payment.payment_date, Payment.month_paid, Payment.amount,
+                      Payment.__table__.outerjoin(Apartment, Apartment.id == Payment.apartment_id),
+                      Payment.organization_id == org_id,
+                      Payment.payment_date >= since.date())
+    reads = branch('read', AnnouncementRead.read_at, func.substr(Announcement.title, 1, 40),
+                   cast(null(), Float),
+                   AnnouncementRead.__table__
+                   .join(Announcement, Announcement.id == AnnouncementRead.announcement_id)
+                   .outerjoin(Apartment, Apartment.id == AnnouncementRead.apartment_id),
+                   Announcement.organization_id == org_id,
+                   AnnouncementRead.read_at >= since)
+    tickets = branch('ticket', Ticket.created_at, func.substr(Ticket.subject, 1, 40),
+                     cast(null(), Float),
+                     Ticket.__table__.outerjoin(Apartment, Apartment.id == Ticket.apartment_id),
+                     Ticket.organization_id == org_id,
+                     Ticket.status == 'ouvert',
+                     Ticket.created_at >= since)
+    stmt = union_all(*(select(*sq.c) for sq in (payments, reads, tickets)))
+    return db.session.execute(stmt).all()
+
+
+def admin_counts(user):
+    """Compteurs de la cloche et de la sidebar admin — 1 requête (sous-requêtes scalaires)."""
+    org_id = user.organization_id
+    unpaid = select(func.count(UnpaidAlert.id)).where(UnpaidAlert.organization_id == org_id,
+                                                      UnpaidAlert.email_sent == False)  # noqa: E712
+    row = db.session.execute(select(
+        unpaid.where(UnpaidAlert.alert_date > _seen_at(user)).scalar_subquery(),
+        unpaid.scalar_subquery(),
+        select(func.count(PaymentRequest.id))
+        .where(PaymentRequest.organization_id == org_id,
+               PaymentRequest.status == 'en_attente').scalar_subquery(),
+        select(func.count(DirectMessage.id))
+        .where(DirectMessage.organization_id == org_id,
+               DirectMessage.read_at.is_(None),
+               DirectMessage.sender_id != user.id).scalar_subquery(),
+    )).one()
+    return {
+        'unpaid_critical_new': row[0] or 0,
+        'unpaid_critical': row[1] or 0,
+        'pending_virements_count': row[2] or 0,
+        'unread_messages_count': row[3] or 0,
+    }
+
+
+def admin_feed(user, counts=None):
+    """Contenu complet de la cloche admin (même structure que l'ancien inject_notifications)."""
+    seen_at = _seen_at(user)
+    counts = counts if counts is not None else admin_counts(user)
+    notifs = []
+    for r in _recent_items(user.organization_id, datetime.utcnow() - FEED_WINDOW):
+        kind = _KINDS[r.kind]
+        ts = _as_datetime(r.ts)
+        apt_label = f"{r.block}-{r.apt}" if r.block and r.apt else "?"
+        if r.kind == 'payment':
+            text, sub = f"Paiement reçu — {apt_label}", f"{r.amount:.0f} DT · {r.label}"
+        elif r.kind == 'read':
+            text, sub = f"{apt_label} a lu une annonce", r.label or ""
+        else:
+            text, sub = f"Nouveau ticket — {apt_label}", r.label or ""
+        notifs.append({
+            'icon': kind['icon'], 'color': kind['color'],
+            'text': text, 'sub': sub,
+            'ts': ts,
+            'new': ts > seen_at,
+            'url': url_for(kind['endpoint']),
+        })
+    notifs.sort(key=lambda x: x['ts'], reverse=True)
+    return {
+        'notif_list': notifs[:FEED_MAX],
+        # Badge = seulement les éléments non vus
+        'notif_count': sum(1 for n in notifs if n['new']) + (1 if counts['unpaid_critical_new'] > 0 else 0),
+        'unpaid_critical': counts['unpaid_critical'],
+        'pending_virements_count': counts['pending_virements_count'],
+        'unread_messages_count': counts['unread_messages_count'],
+    }
+
+
+def feed_json(feed):
+    """Sérialisation JSON du fil admin (endpoint /api/notif/feed)."""
+    return {
+        'count': feed.get('notif_count', 0),
+        'unpaid_critical': feed.get('unpaid_critical', 0),
+        'items': [dict(n, ts=n['ts'].isoformat(), time=n['ts'].strftime('%H:%M'))
+                  for n in feed.get('notif_list', [])],
+    }
+
+
+def resident_feed(user):
+    """Annonces de la sidebar + messages non lus du résident — 2 requêtes."""
+    rows = (db.session.query(Announcement.id, Announcement.title, AnnouncementRead.id)
+            .outerjoin(AnnouncementRead, and_(AnnouncementRead.announcement_id == Announcement.id,
+                                              AnnouncementRead.user_id == user.id))
+            .filter(Announcement.organization_id == user.organization_id)
+            .order_by(Announcement.pinned.desc(), Announcement.created_at.desc())
+            .limit(5).all())
+    # dicts (et non objets ORM) : le résultat est mis en cache, éventuellement hors process
+    sidebar_anns = [({'id': ann_id, 'title': title}, read_id is None) for ann_id, title, read_id in rows]
+
+    # Messages non lus pour le résident (envoyés par l'admin)
+    unread_msgs_res = (DirectMessage.query
+                       .filter_by(organization_id=user.organization_id, apartment_id=user.apartment_id)
+                       .filter(DirectMessage.read_at.is_(None))
+                       .filter(DirectMessage.sender_id != user.id).count())
+    return {
+        'sidebar_announcements': sidebar_anns,
+        'sidebar_unread_count': sum(1 for _, unread in sidebar_anns if unread),
+        'unread_messages_count': unread_msgs_res,
+    }
@@ -0,0 +1,194 @@
+"""
+Profilage SQL par requête HTTP (moteur core.db).
+
+Pour chaque requête : nombre de requêtes SQL, temps DB cumulé, requêtes les plus
+lentes et empreintes dupliquées (même SQL exécuté plusieurs fois → boucle N+1).
+
+  • en-têtes de réponse  X-DB-Queries, X-DB-Time-ms, X-DB-Duplicates
+  • ligne de log [SQL] si la requête dépasse son budget ou SQL_PROFILER_SLOW_MS
+  • page /superadmin/perf : endpoints les plus coûteux (statistiques du process)
+
+Budget par route :
+
+    @app.route('/messagerie')
+    @login_required
+    @query_budget(12)
+    def messagerie(): ...
+
+Avec SQL_QUERY_BUDGET_STRICT (tests), un dépassement lève QueryBudgetExceeded.
+"""
+import re
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from core import app
+
+app.config.setdefault('SQL_PROFILER', True)
+app.config.setdefault('SQL_PROFILER_SLOW_MS', 500)
+app.config.setdefault('SQL_QUERY_BUDGET_STRICT', False)
+
+SLOWEST_KEPT = 5
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Une route a exécuté plus de requêtes SQL que son budget."""
+
+
+def query_budget(n):
+    """Déclare le nombre maximal de requêtes SQL d'une route (placé sous @app.route).
+    L'attribut est recopié par functools.wraps des autres décorateurs."""
+    def decorator(f):
+        f._query_budget = n
+        return f
+    return decorator
+
+
+_NUM = re.compile(r"\b\d+\b")
+_STR = re.compile(r"'(?:[^']|'')*'")
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\([^)]*\)s|%s|__\[POSTCOMPILE_\w+\])(?:\s*,\s*(?:\?|%\([^)]*\)s|%s))*\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """Forme normalisée d'une requête : littéraux et listes IN remplacés par ?."""
+    s = _STR.sub('?', statement)
+    s = _NUM.sub('?', s)
+    s = _IN_LIST.sub('(?)', s)
+    return _SPACES.sub(' ', s).strip()
+
+
+class RequestProfile:
+    __slots__ = ('count', 'total_ms', 'fingerprints', 'slowest')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.fingerprints = {}   # empreinte → nb d'exécutions
+        self.slowest = []        # [(ms, sql)] trié décroissant
+
+    def record(self, statement, ms):
+        self.count += 1
+        self.total_ms += ms
+        fp = fingerprint(statement)
+        self.fingerprints[fp] = self.fingerprints.get(fp, 0) + 1
+        if len(self.slowest) < SLOWEST_KEPT or ms > self.slowest[-1][0]:
+            self.slowest.append((ms, statement))
+            self.slowest.sort(key=lambda x: -x[0])
+            del self.slowest[SLOWEST_KEPT:]
+
+    @property
+    def duplicates(self):
+        """{empreinte: nb} des requêtes exécutées plus d'une fois."""
+        return {fp: n for fp, n in self.fingerprints.items() if n > 1}
+
+
+def current_profile():
+    return g.get('_sql_profile') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('_sql_profile') is not None:
+        conn.info.setdefault('_prof_t0', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get('_prof_t0')
+    if not stack:
+        return
+    ms = (time.perf_counter() - stack.pop()) * 1000
+    prof = current_profile()
+    if prof is not None:
+        prof.record(statement, ms)
+
+
+# ─── Statistiques par endpoint (mémoire du process) ─────────────────────────
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record_endpoint(endpoint, prof, budget):
+    with _stats_lock:
+        s = _stats.setdefault(endpoint, {
+            'endpoint': endpoint, 'requests': 0, 'queries': 0, 'max_queries': 0,
+            'db_ms': 0.0, 'max_db_ms': 0.0, 'over_budget': 0, 'budget': budget,
+            'duplicates': {}, 'slowest': [],
+        })
+        s['requests'] += 1
+        s['queries'] += prof.count
+        s['max_queries'] = max(s['max_queries'], prof.count)
+        s['db_ms'] += prof.total_ms
+        s['max_db_ms'] = max(s['max_db_ms'], prof.total_ms)
+        s['budget'] = budget
+        if budget is not None and prof.count > budget:
+            s['over_budget'] += 1
+        for fp, n in prof.duplicates.items():
+            s['duplicates'][fp] = max(s['duplicates'].get(fp, 0), n)
+        s['slowest'] = sorted(s['slowest'] + prof.slowest, key=lambda x: -x[0])[:SLOWEST_KEPT]
+
+
+def endpoint_stats(order_by='avg_queries', limit=50):
+    """Endpoints les plus coûteux : liste de dicts avec moyennes calculées."""
+    with _stats_lock:
+        rows = []
+        for s in _stats.values():
+            r = dict(s, duplicates=sorted(s['duplicates'].items(), key=lambda x: -x[1])[:5],
+                     slowest=list(s['slowest']))
+            r['avg_queries'] = s['queries'] / s['requests']
+            r['avg_db_ms'] = s['db_ms'] / s['requests']
+            rows.append(r)
+    rows.sort(key=lambda r: -r[order_by])
+    return rows[:limit]
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+# ─── Hooks de requête ────────────────────────────────────────────────────────
+
+def _start_profile():
+    if app.config.get('SQL_PROFILER'):
+        g._sql_profile = RequestProfile()
+
+
+def _finish_profile(response):
+    prof = g.pop('_sql_profile', None)
+    if prof is None or request.endpoint in (None, 'static'):
+        return response
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, '_query_budget', None)
+    dup = sum(n - 1 for n in prof.duplicates.values())
+
+    response.headers['X-DB-Queries'] = str(prof.count)
+    response.headers['X-DB-Time-ms'] = f'{prof.total_ms:.1f}'
+    response.headers['X-DB-Duplicates'] = str(dup)
+    if budget is not None:
+        response.headers['X-DB-Budget'] = str(budget)
+    _record_endpoint(request.endpoint, prof, budget)
+
+    over = budget is not None and prof.count > budget
+    if over or prof.total_ms > app.config['SQL_PROFILER_SLOW_MS']:
+        worst = max(prof.duplicates.items(), key=lambda x: x[1], default=None)
+        print(f"[SQL] {request.method} {request.path} ({request.endpoint}) → "
+              f"{prof.count} requêtes{f' / budget {budget}' if budget is not None else ''}, "
+              f"{prof.total_ms:.1f} ms, {dup} doublon(s)"
+              + (f" | ×{worst[1]} {worst[0][:120]}" if worst else ''))
+    if over and app.config.get('SQL_QUERY_BUDGET_STRICT'):
+        raise QueryBudgetExceeded(
+            f"{request.endpoint} : {prof.count} requêtes SQL > budget {budget}\n"
+            + '\n'.join(f'  ×{n} {fp[:200]}' for fp, n in prof.duplicates.items()))
+    return response
+
+
+# Enregistrés en tête de liste : le profil couvre tous les autres hooks before_request
+# (exécutés dans l'ordre) et after_request (exécutés dans l'ordre inverse).
+app.before_request_funcs.setdefault(None, []).insert(0, _start_profile)
+app.after_request_funcs.setdefault(None, []).insert(0, _finish_profile)
@@ -5,68 +5,198 @@ Variables d'environnement requises sur Render :
   VAPID_PUBLIC_KEY   — clé publique VAPID (base64url)
   VAPID_PRIVATE_KEY  — clé privée VAPID (format PEM, \\n pour les sauts de ligne)
 """
-import os, json
+import os, json, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 VAPID_PUBLIC_KEY  = os.environ.get('VAPID_PUBLIC_KEY', '')
 VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY', '')   # base64url raw (43 chars, sans PEM)
 VAPID_CLAIMS      = {'sub': 'mailto:contact@syndicpro.tn'}
 
 
-def _send_one(sub, title: str, body: str, url: str = '/dashboard', tag: str = 'syndicpro'):
-    """Envoie une notification push à un seul abonnement."""
+# Envoi groupé : nombre d'envois simultanés et délai réseau par endpoint
+PUSH_CONCURRENCY = 8
+PUSH_TIMEOUT     = 10
+PUSH_TTL         = 86400
+# Codes indiquant un abonnement expiré/révoqué côté navigateur → suppression.
+# (401/403 = problème de clé VAPID côté serveur : on ne supprime pas les abonnements.)
+EXPIRED_STATUSES = (404, 410)
+
+_session = None
+_session_lock = threading.Lock()
+_vapid_key = None
+
+
+def _http_session():
+    """Session HTTP partagée (keep-alive) — une connexion TLS réutilisée par service push."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=PUSH_CONCURRENCY)
+                s.mount('https://', adapter)
+                s.mount('http://', adapter)
+                _session = s
+    return _session
+
+
+def _vapid():
+    """Clé VAPID chargée une seule fois par process."""
+    global _vapid_key
+    if _vapid_key is None:
+        from py_vapid import Vapid
+        _vapid_key = Vapid.from_string(private_key=VAPID_PRIVATE_KEY)
+    return _vapid_key
+
+
+def _payload(title, body, url, tag):
+    return json.dumps({
+        'title': title,
+        'body':  body,
+        'url':   url,
+        'icon':  '/static/icons/icon-192.png',
+        'badge': '/static/icons/icon-192.png',
+        'tag':   tag,
+    }, ensure_ascii=False)
+
+
+def _vapid_headers(endpoints):
+    """En-têtes VAPID signés une fois par service push (audience), pas par abonnement."""
+    headers = {}
+    exp = int(time.time()) + 12 * 3600
+    for endpoint in endpoints:
+        u = urlparse(endpoint)
+        aud = f'{u.scheme}://{u.netloc}'
+        if aud not in headers:
+            headers[aud] = _vapid().sign(dict(VAPID_CLAIMS, aud=aud, exp=exp))
+    return headers
+
+
+def _post(sub, data, headers, session):
+    """Chiffre et envoie un message à un abonnement. Retourne le résultat (dict)."""
+    from pywebpush import WebPusher
+    t0 = time.perf_counter()
+    result = {'id': sub['id'], 'user_id': sub['user_id'], 'endpoint': sub['endpoint'],
+              'status': None, 'outcome': 'error', 'error': None}
+    try:
+        resp = WebPusher({'endpoint': sub['endpoint'],
+                          'keys': {'p256dh': sub['p256dh'], 'auth': sub['auth']}},
+                         requests_session=session).send(
+            data, dict(headers), ttl=PUSH_TTL, timeout=PUSH_TIMEOUT)
+        result['status'] = resp.status_code
+        if resp.status_code <= 202:
+            result['outcome'] = 'ok'
+        elif resp.status_code in EXPIRED_STATUSES:
+            result['outcome'] = 'expired'
+        else:
+            result['error'] = f'{resp.status_code} {(resp.text or "")[:200]}'
+    except Exception as e:
+        result['error'] = str(e)[:300]
+    result['latency_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+    return result
+
+
+def send_bulk(subs, title: str, body: str, url: str = '/dashboard', tag: str = 'syndicpro'):
+    """Envoie une notification à une liste d'abonnements en parallèle (pool borné,
+    connexions HTTP réutilisées) puis supprime en un seul DELETE les abonnements
+    expirés (404/410).
+
+    Retourne une liste de résultats par endpoint :
+      {'id', 'user_id', 'endpoint', 'status', 'outcome': ok|expired|error,
+       'error', 'latency_ms'}
+    """
+    if not subs:
+        return []
     if not VAPID_PRIVATE_KEY or not VAPID_PUBLIC_KEY:
         print('[Push] VAPID keys manquantes — notifications désactivées')
-        return
+        return []
+    # Copie des colonnes utiles : les threads ne touchent pas à la session SQLAlchemy
+    subs = [{'id': s.id, 'user_id': s.user_id, 'endpoint': s.endpoint,
+             'p256dh': s.p256dh, 'auth': s.auth} for s in subs]
+    data = _payload(title, body, url, tag)
     try:
-        from pywebpush import webpush, WebPushException
-        payload = json.dumps({
-            'title': title,
-            'body':  body,
-            'url':   url,
-            'icon':  '/static/icons/icon-192.png',
-            'badge': '/static/icons/icon-192.png',
-            'tag':   tag,
-        }, ensure_ascii=False)
-        webpush(
-            subscription_info={
-                'endpoint': sub.endpoint,
-                'keys': {'p256dh': sub.p256dh, 'auth': sub.auth},
-            },
-            data=payload,
-            vapid_private_key=VAPID_PRIVATE_KEY,
-            vapid_claims=VAPID_CLAIMS,
-        )
-        print(f'[Push] OK → user_id={sub.user_id} | {title}')
+        vapid = _vapid_headers([s['endpoint'] for s in subs])
     except Exception as e:
-        err = str(e)
-        print(f'[Push] ERREUR : {err}')
-        # Abonnement expiré ou révoqué → supprimer silencieusement
-        if '410' in err or '404' in err or '401' in err:
-            try:
-                from core import db
-                from models import PushSubscription
-                PushSubscription.query.filter_by(id=sub.id).delete()
-                db.session.commit()
-            except Exception:
-                pass
+        print(f'[Push] ERREUR clé VAPID : {e}')
+        return []
+    session = _http_session()
 
+    def _aud(endpoint):
+        u = urlparse(endpoint)
+        return f'{u.scheme}://{u.netloc}'
 
-def push_to_user(user_id: int, title: str, body: str, url: str = '/dashboard', tag: str = 'syndicpro'):
-    """Envoie une push notification à tous les appareils d'un utilisateur."""
+    workers = min(PUSH_CONCURRENCY, len(subs))
+    if workers == 1:
+        results = [_post(s, data, vapid[_aud(s['endpoint'])], session) for s in subs]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='push') as pool:
+            results = list(pool.map(lambda s: _post(s, data, vapid[_aud(s['endpoint'])], session), subs))
+
+    expired = [r['id'] for r in results if r['outcome'] == 'expired']
+    if expired:
+        try:
+            from core import db
+            from models import PushSubscription
+            (PushSubscription.query.filter(PushSubscription.id.in_(expired))
+             .delete(synchronize_session=False))
+            db.session.commit()
+        except Exception as e:
+            print(f'[Push] Nettoyage abonnements expirés : {e}')
+
+    ok = sum(1 for r in results if r['outcome'] == 'ok')
+    errors = [r for r in results if r['outcome'] == 'error']
+    latencies = sorted(r['latency_ms'] for r in results)
+    print(f'[Push] {title} → {ok}/{len(results)} OK, {len(expired)} expiré(s) supprimé(s), '
+          f'{len(errors)} erreur(s) | latence médiane {latencies[len(latencies) // 2]} ms, '
+          f'max {latencies[-1]} ms')
+    for r in errors:
+        print(f'[Push] ERREUR user_id={r["user_id"]} : {r["error"]}')
+    return results
+
+
+def _send_one(sub, title: str, body: str, url: str = '/dashboard', tag: str = 'syndicpro'):
+    """Envoie une notification push à un seul abonnement."""
+    results = send_bulk([sub], title, body, url, tag)
+    return results[0] if results else None
+
+
+def deliver_to_users(user_ids, title: str, body: str, url: str = '/dashboard', tag: str = 'syndicpro'):
+    """Envoi synchrone aux appareils des utilisateurs donnés — exécuté par le worker (utils_jobs).
+    Tous les abonnements sont chargés en une requête puis envoyés via send_bulk()."""
+    from models import PushSubscription
+    if not user_ids:
+        return []
+    subs = PushSubscription.query.filter(PushSubscription.user_id.in_(list(user_ids))).all()
+    return send_bulk(subs, title, body, url, tag)
+
+
+def push_to_users(user_ids, title: str, body: str, url: str = '/dashboard', tag: str = 'syndicpro'):
+    """Met en file une push notification pour plusieurs utilisateurs (1 seul job)."""
+    user_ids = [uid for uid in user_ids if uid]
+    if not user_ids:
+        return
     try:
-        from models import PushSubscription
-        subs = PushSubscription.query.filter_by(user_id=user_id).all()
-        for sub in subs:
-            _send_one(sub, title, body, url, tag)
+        from utils_jobs import enqueue
+        enqueue('push', {'user_ids': user_ids, 'title': title, 'body': body, 'url': url, 'tag': tag})
     except Exception as e:
-        print(f'[Push] push_to_user error : {e}')
+        print(f'[Push] push_to_users error : {e}')
+
+
+def push_to_user(user_id: int, title: str, body: str, url: str = '/dashboard', tag: str = 'syndicpro'):
+    """Envoie une push notification à tous les appareils d'un utilisateur (via la file)."""
+    push_to_users([user_id], title, body, url, tag)
 
 
 def push_to_admins(org_id: int, title: str, body: str, url: str = '/dashboard', tag: str = 'syndicpro'):
-    """Envoie une push notification à tous les admins d'une organisation."""
+    """Envoie une push notification à tous les admins d'une organisation (via la file)."""
     try:
+        from core import db
         from models import User
-        for admin in User.query.filter_by(organization_id=org_id, role='admin').all():
-            push_to_user(admin.id, title, body, url, tag)
+        admin_ids = [r[0] for r in db.session.query(User.id)
+                     .filter_by(organization_id=org_id, role='admin').all()]
+        push_to_users(admin_ids, title, body, url, tag)
     except Exception as e:
         print(f'[Push] push_to_admins error : {e}')
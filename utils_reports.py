@@ -0,0 +1,232 @@
+"""
+Rapports générés en arrière-plan (PDF fpdf2, classeurs openpyxl).
+
+Les routes de téléchargement ne rendent plus le document dans la requête (délai
+gunicorn de 60 s) : serve_report() cherche un artefact déjà produit pour la
+même clé — organisation, type de rapport, paramètres, version des données — et
+le sert immédiatement. Sinon un job « report » est mis en file (utils_jobs) et
+l'utilisateur voit une page d'attente qui interroge /rapports/<id>/etat jusqu'à
+ce que le fichier soit prêt.
+
+Version des données : Organization.data_version, incrémentée dans la même
+transaction que toute écriture ORM sur un modèle source (track_data_version) —
+paiements, dépenses, appartements, AG… Un artefact produit avant la
+modification n'est donc plus jamais servi, quel que soit le process qui le lit.
+Les UPDATE en masse (query.update) ne passent pas par le hook.
+
+Déclarer un rapport :
+
+    @report('monthly_pdf', admin_only=True)
+    def _render_monthly_report(org, month):
+        ...
+        return pdf_bytes, filename
+
+    return serve_report('monthly_pdf', org, {'month': month})
+"""
+import hashlib
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from flask import render_template, url_for
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from core import db
+from models import ReportArtifact, Organization
+
+MIMES = {'pdf': 'application/pdf',
+         'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'}
+
+# render(org, **params) → (octets, nom de fichier) ; version(org, params) : composante
+# de version supplémentaire (données hors organisation, date du jour…) ou None
+Report = namedtuple('Report', 'render mime admin_only version')
+
+REPORTS = {}
+
+
+def report(kind, fmt='pdf', admin_only=False, version=None):
+    """Enregistre la fonction de rendu d'un type de rapport."""
+    def decorator(fn):
+        REPORTS[kind] = Report(fn, MIMES[fmt], admin_only, version)
+        return fn
+    return decorator
+
+
+# ─── Version des données ─────────────────────────────────────────────────────
+
+_tracked = {}   # classe de modèle → (fonction(instance) -> organization_id, colonnes ignorées)
+
+
+def track_data_version(*models, org=lambda obj: obj.organization_id, ignore=()):
+    """Toute écriture ORM sur ces modèles invalide les rapports de l'organisation
+    (sauf si seules les colonnes `ignore` ont changé)."""
+    for m in models:
+        _tracked[m] = (org, frozenset(ignore))
+
+
+def _changed(obj, ignore):
+    state = inspect(obj)
+    return any(state.attrs[key].history.has_changes()
+               for key in state.mapper.column_attrs.keys() if key not in ignore)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_data_version(session, flush_context):
+    if not _tracked:
+        return
+    org_ids = set()
+    for objects, dirty in ((session.new, False), (session.dirty, True), (session.deleted, False)):
+        for obj in objects:
+            spec = _tracked.get(type(obj))
+            if spec is None or (dirty and not _changed(obj, spec[1])):
+                continue
+            try:
+                org_ids.add(spec[0](obj))
+            except Exception:
+                pass
+    org_ids.discard(None)
+    if org_ids:
+        session.connection().execute(
+            update(Organization.__table__)
+            .where(Organization.__table__.c.id.in_(org_ids))
+            .values(data_version=db.func.coalesce(Organization.__table__.c.data_version, 0) + 1))
+
+
+def data_version(org_id):
+    return db.session.query(Organization.data_version).filter_by(id=org_id).scalar() or 0
+
+
+# ─── Artefacts ───────────────────────────────────────────────────────────────
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def request_report(kind, org, params, user=None):
+    """Artefact à jour pour (org, kind, params) : existant, en cours, ou mis en file
+    (à valider par l'appelant : utils_jobs.commit_enqueued)."""
+    from utils_jobs import enqueue
+    spec = REPORTS[kind]
+    params_key = _digest(kind, org.id, params)
+    extra = spec.version(org, params) if spec.version else None
+    cache_key = _digest(params_key, data_version(org.id), extra)
+
+    artifact = ReportArtifact.query.filter_by(cache_key=cache_key).first()
+    if artifact is not None and artifact.status != 'failed':
+        return artifact
+    if artifact is None:
+        artifact = ReportArtifact(organization_id=org.id, kind=kind, params=json.dumps(params),
+                                  params_key=params_key, cache_key=cache_key, mime=spec.mime,
+                                  requested_by_id=user.id if user else None)
+        db.session.add(artifact)
+        try:
+            db.session.flush()
+        except IntegrityError:       # même demande dans un autre process
+            db.session.rollback()
+            return ReportArtifact.query.filter_by(cache_key=cache_key).one()
+    artifact.status, artifact.error = 'pending', None
+    artifact.created_at = datetime.utcnow()
+    # Une seule tentative : en cas d'échec, l'utilisateur relance depuis la page d'attente
+    enqueue('report', {'artifact_id': artifact.id}, organization_id=org.id,
+            max_attempts=1, commit=False)
+    return artifact
+
+
+def render(artifact_id):
+    """Exécuté par le worker : produit le fichier et l'enregistre dans le stockage."""
+    from storage_helper import upload_file, delete_file
+    from utils_jobs import PermanentJobError
+    artifact = ReportArtifact.query.get(artifact_id)
+    if artifact is None or artifact.status == 'done':
+        return
+    spec = REPORTS.get(artifact.kind)
+    org = Organization.query.get(artifact.organization_id)
+    if spec is None or org is None:
+        artifact.status, artifact.error = 'failed', 'Rapport ou organisation introuvable'
+        db.session.commit()
+        raise PermanentJobError(artifact.error)
+    artifact.status, artifact.started_at = 'running', datetime.utcnow()
+    db.session.commit()
+    try:
+        raw, filename = spec.render(org, **json.loads(artifact.params))
+        url = upload_file(bytes(raw), artifact.mime, 'rapports')
+        if not url:
+            raise RuntimeError("Échec de l'enregistrement du fichier")
+    except Exception as e:
+        db.session.rollback()
+        artifact.status, artifact.error = 'failed', str(e)[:1000]
+        db.session.commit()
+        raise
+    artifact.file_url, artifact.filename, artifact.size = url, filename, len(raw)
+    artifact.status, artifact.finished_at = 'done', datetime.utcnow()
+    # Versions précédentes du même rapport : périmées
+    old = (ReportArtifact.query
+           .filter(ReportArtifact.params_key == artifact.params_key,
+                   ReportArtifact.id != artifact.id,
+                   ReportArtifact.status.in_(['done', 'failed'])).all())
+    for a in old:
+        if a.file_url and a.file_url != url:
+            delete_file(a.file_url)
+        db.session.delete(a)
+    db.session.commit()
+    print(f"[Rapports] {artifact.kind} #{artifact.id} ({len(raw)} octets) généré")
+
+
+def queue_position(artifact):
+    """Rapports en attente avant celui-ci (tous process confondus)."""
+    return (ReportArtifact.query
+            .filter(ReportArtifact.status == 'pending', ReportArtifact.id < artifact.id).count())
+
+
+def status_payload(artifact):
+    payload = {'id': artifact.id, 'status': artifact.status}
+    if artifact.status == 'pending':
+        payload['position'] = queue_position(artifact)
+    elif artifact.status == 'running' and artifact.started_at:
+        payload['elapsed'] = int((datetime.utcnow() - artifact.started_at).total_seconds())
+    elif artifact.status == 'done':
+        payload['url'] = url_for('report_download', artifact_id=artifact.id)
+    elif artifact.status == 'failed':
+        payload['error'] = artifact.error
+    return payload
+
+
+def serve_report(kind, org, params, user=None, title=None):
+    """Réponse d'une route de téléchargement : le fichier s'il est prêt, sinon la
+    page d'attente (le rendu part dans le worker)."""
+    from utils_blobs import send_attachment
+    from utils_jobs import commit_enqueued
+    artifact = request_report(kind, org, params, user)
+    commit_enqueued()
+    if artifact.status == 'done':
+        return send_attachment(artifact.file_url, mime=artifact.mime,
+                               download_name=artifact.filename, as_attachment=True)
+    return render_template('report_pending.html', artifact=artifact, title=title,
+                           status=status_payload(artifact), user=user)
+
+
+# ─── Modèles sources ─────────────────────────────────────────────────────────
+
+def _register_sources():
+    from models import (Payment, Expense, MiscReceipt, Apartment, Block, User, AssemblyGeneral,
+                        AGItem, AGVote, SubscriptionPaymentRequest)
+    track_data_version(Payment, Expense, MiscReceipt, Apartment, Block, AssemblyGeneral,
+                       SubscriptionPaymentRequest)
+    track_data_version(User, ignore=('last_login_at', 'notif_seen_at', 'password_hash'))
+    track_data_version(Organization, org=lambda o: o.id,
+                       ignore=('data_version', 'setup_dismissed', 'superadmin_notes'))
+
+    # Points et votes d'AG : pas d'organization_id, résolu en SQL (relations pas
+    # forcément chargées pendant le flush)
+    def assembly_org(assembly_id):
+        return db.session.connection().execute(
+            select(AssemblyGeneral.organization_id).where(AssemblyGeneral.id == assembly_id)).scalar()
+
+    track_data_version(AGItem, org=lambda item: assembly_org(item.assembly_id))
+    track_data_version(AGVote, org=lambda vote: assembly_org(
+        select(AGItem.assembly_id).where(AGItem.id == vote.item_id).scalar_subquery()))
+
+
+_register_sources()
@@ -0,0 +1,179 @@
+"""
+Télémétrie des ascenseurs : mesures brutes + agrégats minute / heure / jour.
+
+Chaque mesure reçue (POST /api/v1/iot/telemetry, /telemetry/batch) est :
+  • insérée dans lift_telemetry (lift_id, ts, status, metrics JSON) — INSERT
+    multi-lignes, conservée LIFT_TELEMETRY_RAW_RETENTION_DAYS jours ;
+  • ajoutée aux agrégats lift_telemetry_rollup à l'ingestion (1 upsert
+    multi-lignes par lot) : nombre de mesures, secondes ok / warning / down,
+    pannes (passage à down) et remises en service.
+
+Les durées sont pondérées par le temps : l'intervalle entre deux mesures est
+attribué au statut de la première (lift.telemetry_last_at / _status), découpé sur
+les créneaux qu'il traverse. Un silence de plus de LIFT_TELEMETRY_MAX_GAP
+secondes n'est attribué à aucun statut (capteur muet = durée inconnue). Une mesure
+plus ancienne que la dernière agrégée est conservée en brut mais ne modifie pas
+les durées.
+
+Disponibilité, MTBF et MTTR (page lift_detail) sont lus dans les agrégats —
+24 lignes horaires ou 30 lignes journalières au plus, quel que soit le nombre de
+mesures envoyées. Les agrégats minute sont gardés
+LIFT_TELEMETRY_MINUTE_RETENTION_DAYS jours ; heure et jour sans limite.
+
+  flask lifts-telemetry-purge    — applique les rétentions
+"""
+import json
+import os
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import func
+
+from core import app, db
+from models import LiftTelemetry, LiftTelemetryRollup
+from utils_ingest import upsert_add
+
+app.config.setdefault('LIFT_TELEMETRY_RAW_RETENTION_DAYS',
+                      int(os.environ.get('LIFT_TELEMETRY_RAW_RETENTION_DAYS', 30)))
+app.config.setdefault('LIFT_TELEMETRY_MINUTE_RETENTION_DAYS',
+                      int(os.environ.get('LIFT_TELEMETRY_MINUTE_RETENTION_DAYS', 7)))
+app.config.setdefault('LIFT_TELEMETRY_MAX_GAP',
+                      int(os.environ.get('LIFT_TELEMETRY_MAX_GAP', 3600)))
+
+BUCKETS = (('minute', 60), ('hour', 3600), ('day', 86400))
+_EPOCH = datetime(1970, 1, 1)
+_COUNTERS = ('samples', 'ok_seconds', 'warning_seconds', 'down_seconds', 'failures', 'repairs')
+
+
+def bucket_start(ts, seconds):
+    """Début du créneau de `seconds` secondes contenant ts (UTC)."""
+    return _EPOCH + timedelta(seconds=int((ts - _EPOCH).total_seconds()) // seconds * seconds)
+
+
+def _spread(acc, start, end, column):
+    """Ajoute la durée [start, end) à `column`, découpée par créneau, à chaque niveau."""
+    for name, seconds in BUCKETS:
+        b = bucket_start(start, seconds)
+        while b < end:
+            nxt = b + timedelta(seconds=seconds)
+            acc[(name, b)][column] += (min(end, nxt) - max(start, b)).total_seconds()
+            b = nxt
+
+
+def _count(acc, ts, column):
+    for name, seconds in BUCKETS:
+        acc[(name, bucket_start(ts, seconds))][column] += 1
+
+
+def parse_metrics(value):
+    """Métriques optionnelles d'une mesure : dict JSON-sérialisable → texte (ou None)."""
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise ValueError('metrics doit être un objet')
+    text = json.dumps(value, separators=(',', ':'))
+    if len(text) > 2000:
+        raise ValueError('metrics trop volumineux')
+    return text
+
+
+def record_samples(lift, samples):
+    """Enregistre des mesures [(ts, statut, metrics texte ou None)] triées par ts :
+    1 INSERT brut + 1 upsert des agrégats. Met à jour lift.telemetry_last_*. Sans commit.
+
+    `lift` doit être verrouillé jusqu'au commit (chargé avec with_for_update()) : les
+    durées partent de telemetry_last_* — deux ingestions concurrentes du même
+    ascenseur compteraient sinon deux fois le même intervalle."""
+    if not samples:
+        return
+    db.session.execute(LiftTelemetry.__table__.insert(), [
+        {'lift_id': lift.id, 'ts': ts, 'status': status, 'metrics': metrics}
+        for ts, status, metrics in samples])
+
+    max_gap = timedelta(seconds=app.config['LIFT_TELEMETRY_MAX_GAP'])
+    acc = defaultdict(Counter)
+    prev_ts, prev_status = lift.telemetry_last_at, lift.telemetry_last_status
+    for ts, status, _ in samples:
+        _count(acc, ts, 'samples')
+        if prev_ts is not None and ts < prev_ts:
+            continue            # mesure en retard : brute seulement
+        if prev_ts is not None:
+            if ts - prev_ts <= max_gap:
+                _spread(acc, prev_ts, ts, f'{prev_status}_seconds')
+            if status == 'down' and prev_status != 'down':
+                _count(acc, ts, 'failures')
+            elif prev_status == 'down' and status != 'down':
+                _count(acc, ts, 'repairs')
+        prev_ts, prev_status = ts, status
+    lift.telemetry_last_at, lift.telemetry_last_status = prev_ts, prev_status
+
+    upsert_add(LiftTelemetryRollup.__table__,
+               [dict({c: counters[c] for c in _COUNTERS}, lift_id=lift.id, bucket=name, start=start)
+                for (name, start), counters in acc.items()],
+               ['lift_id', 'bucket', 'start'], _COUNTERS)
+
+
+# ─── Lecture ─────────────────────────────────────────────────────────────────
+
+def availability(lift_id, since, bucket='day'):
+    """Disponibilité depuis `since` (créneau de `since` inclus), en 1 requête sur les
+    agrégats : {'samples', 'covered_seconds', 'down_seconds', 'uptime' (%),
+    'failures', 'repairs', 'mtbf_hours', 'mttr_minutes'} — None si inconnu."""
+    seconds = dict(BUCKETS)[bucket]
+    R = LiftTelemetryRollup
+    row = (db.session.query(*(func.coalesce(func.sum(getattr(R, c)), 0) for c in _COUNTERS))
+           .filter(R.lift_id == lift_id, R.bucket == bucket,
+                   R.start >= bucket_start(since, seconds)).one())
+    samples, ok, warning, down, failures, repairs = row
+    up = float(ok) + float(warning)      # warning : en service, dégradé
+    covered = up + float(down)
+    return {
+        'samples': int(samples),
+        'covered_seconds': covered,
+        'down_seconds': float(down),
+        'uptime': round(up / covered * 100, 2) if covered else None,
+        'failures': int(failures),
+        'repairs': int(repairs),
+        'mtbf_hours': round(up / failures / 3600, 1) if failures else None,
+        'mttr_minutes': round(float(down) / repairs / 60, 1) if repairs else None,
+    }
+
+
+def lift_availability(lift_id, now=None):
+    """Fenêtres affichées sur lift_detail : 24 h (agrégats horaires), 30 jours (journaliers)."""
+    now = now or datetime.utcnow()
+    return {'24h': availability(lift_id, now - timedelta(hours=23), 'hour'),
+            '30j': availability(lift_id, now - timedelta(days=29), 'day')}
+
+
+# ─── Rétention ───────────────────────────────────────────────────────────────
+
+def delete_lift_telemetry(lift_id):
+    """Suppression en masse (ascenseur supprimé). Sans commit."""
+    for model in (LiftTelemetry, LiftTelemetryRollup):
+        model.query.filter_by(lift_id=lift_id).delete(synchronize_session=False)
+
+
+def purge_telemetry(now=None):
+    """Supprime les mesures brutes et les agrégats minute hors rétention.
+    Retourne (mesures, agrégats) supprimés."""
+    now = now or datetime.utcnow()
+    raw_cutoff = now - timedelta(days=app.config['LIFT_TELEMETRY_RAW_RETENTION_DAYS'])
+    minute_cutoff = now - timedelta(days=app.config['LIFT_TELEMETRY_MINUTE_RETENTION_DAYS'])
+    raw = LiftTelemetry.query.filter(LiftTelemetry.ts < raw_cutoff).delete(synchronize_session=False)
+    minutes = (LiftTelemetryRollup.query
+               .filter(LiftTelemetryRollup.bucket == 'minute', LiftTelemetryRollup.start < minute_cutoff)
+               .delete(synchronize_session=False))
+    db.session.commit()
+    return raw, minutes
+
+
+@app.cli.command('lifts-telemetry-purge')
+def lifts_telemetry_purge_command():
+    """Applique la rétention des mesures brutes et des agrégats minute."""
+    raw, minutes = purge_telemetry()
+    click.echo(f"{raw} mesure(s) brute(s) supprimée(s) "
+               f"(rétention {app.config['LIFT_TELEMETRY_RAW_RETENTION_DAYS']} j), "
+               f"{minutes} agrégat(s) minute supprimé(s) "
+               f"(rétention {app.config['LIFT_TELEMETRY_MINUTE_RETENTION_DAYS']} j).")
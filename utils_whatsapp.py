@@ -7,7 +7,8 @@ Pour configurer :
 2. Connecter votre numéro WhatsApp
 3. Copier le token dans Paramètres > WhatsApp
 """
-import requests as http
+import requests
+import utils_http as http
 
 
 def _normalize_phone(phone: str) -> str:
@@ -36,14 +37,13 @@ def send_whatsapp(org, phone: str, message: str) -> bool:
 
     try:
         resp = http.post(
-            'https://api.fonnte.com/send',
+            'fonnte', 'https://api.fonnte.com/send',
             headers={'Authorization': org.whatsapp_token},
             data={
                 'target': target,
                 'message': message,
                 'countryCode': '216',
             },
-            timeout=10
         )
         # Fonnte retourne toujours HTTP 200, même en cas d'erreur.
         # Le vrai résultat est dans le JSON : {"status": true/false}
@@ -56,6 +56,25 @@ def send_whatsapp(org, phone: str, message: str) -> bool:
         return False
 
 
+def queue_whatsapp(org, phone: str, message: str, commit: bool = True) -> bool:
+    """
+    Met en file un message WhatsApp (envoyé par le worker, cf. utils_jobs).
+    Retourne True si le message a été mis en file, False si WhatsApp n'est pas
+    configuré pour l'organisation ou si le numéro est vide.
+    """
+    if not org.whatsapp_enabled or not org.whatsapp_token or not phone:
+        return False
+    if not _normalize_phone(phone):
+        return False
+    try:
+        from utils_jobs import enqueue
+        enqueue('whatsapp', {'org_id': org.id, 'phone': phone, 'message': message},
+                organization_id=org.id, commit=commit)
+        return True
+    except Exception:
+        return False
+
+
 def send_whatsapp_debug(org, phone: str, message: str) -> dict:
     """
     Identique à send_whatsapp() mais retourne le détail complet pour diagnostic.
@@ -71,14 +90,13 @@ def send_whatsapp_debug(org, phone: str, message: str) -> dict:
     target = _normalize_phone(phone)
     try:
         resp = http.post(
-            'https://api.fonnte.com/send',
+            'fonnte', 'https://api.fonnte.com/send',
             headers={'Authorization': org.whatsapp_token},
             data={
                 'target': target,
                 'message': message,
                 'countryCode': '216',
             },
-            timeout=10
         )
         try:
             body = resp.json()
@@ -88,9 +106,11 @@ def send_whatsapp_debug(org, phone: str, message: str) -> dict:
         ok = bool(body.get('status', False))
         reason = body.get('message') or body.get('reason') or body.get('detail') or str(body)
         return {'ok': ok, 'reason': reason, 'target': target, 'http_status': resp.status_code, 'body': body}
-    except http.exceptions.ConnectionError:
+    except http.ProviderUnavailable:
+        return {'ok': False, 'reason': 'api.fonnte.com en échec répété — nouvel essai possible dans une minute.'}
+    except requests.exceptions.ConnectionError:
         return {'ok': False, 'reason': 'Impossible de joindre api.fonnte.com — vérifiez la connexion internet du serveur.'}
-    except http.exceptions.Timeout:
+    except requests.exceptions.Timeout:
         return {'ok': False, 'reason': 'Timeout — api.fonnte.com ne répond pas (> 10s).'}
     except Exception as e:
         return {'ok': False, 'reason': str(e)}
@@ -109,7 +129,7 @@ def notify_payment(org, apt, month_paid: str, amount: float, resident=None):
         msg_admin += f"\nRésident : {resident.name or resident.email}"
 
     if org.whatsapp_admin_phone:
-        send_whatsapp(org, org.whatsapp_admin_phone, msg_admin)
+        queue_whatsapp(org, org.whatsapp_admin_phone, msg_admin)
 
     if resident and resident.phone:
         msg_resident = (
@@ -117,7 +137,7 @@ def notify_payment(org, apt, month_paid: str, amount: float, resident=None):
             f"Votre paiement de *{amount:.3f} DT* pour le mois *{month_paid}* "
             f"a bien été enregistré.\nMerci !"
         )
-        send_whatsapp(org, resident.phone, msg_resident)
+        queue_whatsapp(org, resident.phone, msg_resident)
 
 
 def notify_ticket_created(org, ticket, resident=None):
@@ -134,11 +154,12 @@ def notify_ticket_created(org, ticket, resident=None):
     if resident:
         msg += f"\nRésident : {resident.name or resident.email}"
     if org.whatsapp_admin_phone:
-        send_whatsapp(org, org.whatsapp_admin_phone, msg)
+        queue_whatsapp(org, org.whatsapp_admin_phone, msg)
 
 
 def notify_announcement(org, announcement, residents):
-    """Notification nouvelle annonce → tous les résidents avec un numéro WhatsApp."""
+    """Notification nouvelle annonce → tous les résidents avec un numéro WhatsApp.
+    Retourne le nombre de messages mis en file (1 seule transaction)."""
     sent = 0
     for resident in residents:
         if resident.phone:
@@ -148,8 +169,11 @@ def notify_announcement(org, announcement, residents):
                 f"{announcement.body[:300]}{'...' if len(announcement.body) > 300 else ''}\n\n"
                 f"Connectez-vous sur SyndicPro pour lire l'annonce complète."
             )
-            if send_whatsapp(org, resident.phone, msg):
+            if queue_whatsapp(org, resident.phone, msg, commit=False):
                 sent += 1
+    if sent:
+        from utils_jobs import commit_enqueued
+        commit_enqueued()
     return sent
 
 
@@ -164,7 +188,7 @@ def notify_announcement_read(org, announcement, apartment, resident):
         f"*{announcement.title}*\n"
         f"Résident : {resident.name or resident.email}"
     )
-    return send_whatsapp(org, org.whatsapp_admin_phone, msg)
+    return queue_whatsapp(org, org.whatsapp_admin_phone, msg)
 
 
 def notify_ticket_response(org, ticket, resident=None):
@@ -177,4 +201,4 @@ def notify_ticket_response(org, ticket, resident=None):
         f"Statut : {ticket.status}\n\n"
         f"{ticket.admin_response or ''}"
     )
-    send_whatsapp(org, resident.phone, msg)
+    queue_whatsapp(org, resident.phone, msg)
@@ -0,0 +1,92 @@
+"""
+Export Excel en flux (openpyxl, mode write-only).
+
+Chaque feuille est écrite ligne par ligne dans un fichier temporaire : la
+mémoire ne dépend pas du nombre de lignes. Les lignes viennent directement de
+requêtes par colonnes (tuples, pas d'objets ORM) parcourues avec yield_per.
+
+En write-only, les largeurs de colonnes doivent être connues avant la première
+ligne : elles sont fixées par la colonne (dates, montants…) ou mesurées en SQL
+(MAX(LENGTH(col))) pour les textes libres, cf. sql_widths(). Les styles sont
+appliqués au moment où chaque cellule est écrite (style_row).
+"""
+import tempfile
+from collections import namedtuple
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+from sqlalchemy import func
+
+from core import db
+
+MIN_WIDTH, MAX_WIDTH, PADDING = 8, 32, 3
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# width : nombre de caractères (int), ou None → plus long libellé de la colonne
+Column = namedtuple('Column', 'header width', defaults=(None,))
+
+HEADER_FONT = Font(bold=True)
+PAID_FILL, PAID_FONT = PatternFill('solid', start_color='C6EFCE', end_color='C6EFCE'), Font(color='276221')
+UNPAID_FILL, UNPAID_FONT = PatternFill('solid', start_color='FFC7CE', end_color='FFC7CE'), Font(color='9C0006')
+
+
+def _width(chars):
+    return min(max(chars or 0, MIN_WIDTH - PADDING) + PADDING, MAX_WIDTH)
+
+
+def sql_widths(query_filter, *columns):
+    """Longueur maximale de chaque colonne texte, en une requête agrégée."""
+    stmt = db.session.query(*(func.max(func.length(c)) for c in columns))
+    return [w or 0 for w in query_filter(stmt).one()]
+
+
+def data_widths(rows):
+    """Largeurs mesurées sur des lignes déjà en mémoire (feuilles bornées)."""
+    widths = []
+    for row in rows:
+        for i, v in enumerate(row):
+            n = len(str(v)) if v not in (None, '') else 0
+            if i == len(widths):
+                widths.append(n)
+            elif n > widths[i]:
+                widths[i] = n
+    return widths
+
+
+def write_sheet(wb, title, columns, rows, freeze=None, style_row=None):
+    """Crée la feuille `title` et y écrit `rows` (itérable de tuples) au fil de l'eau.
+    `style_row(ws, row)` peut renvoyer la ligne avec des WriteOnlyCell stylées."""
+    ws = wb.create_sheet(title)
+    for i, col in enumerate(columns, 1):
+        ws.column_dimensions[get_column_letter(i)].width = _width(max(col.width or 0, len(col.header)))
+    if freeze:
+        ws.freeze_panes = freeze
+    header = []
+    for col in columns:
+        cell = WriteOnlyCell(ws, value=col.header)
+        cell.font = HEADER_FONT
+        header.append(cell)
+    ws.append(header)
+    for row in rows:
+        ws.append(style_row(ws, row) if style_row else row)
+    return ws
+
+
+def styled(ws, value, fill, font):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.fill, cell.font = fill, font
+    return cell
+
+
+def new_workbook():
+    return Workbook(write_only=True)
+
+
+def save(wb):
+    """Classeur → fichier temporaire (sur disque) prêt pour send_file."""
+    fh = tempfile.TemporaryFile()
+    wb.save(fh)
+    fh.seek(0)
+    return fh
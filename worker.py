@@ -0,0 +1,10 @@
+"""
+Worker des notifications sortantes (WhatsApp, Web Push, emails).
+Lancer : python worker.py   (Procfile : worker)
+Le process web doit alors tourner avec JOBS_WORKER=external.
+"""
+from app import app
+from utils_jobs import run_worker
+
+if __name__ == '__main__':
+    run_worker()